@@ -91,6 +91,11 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # WAL: القراءة لا تنتظر الكتابة (استقبال POS وعامل الترحيل مع الشاشات)
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL',
+            'timeout': 20,  # ثانية انتظار قفل الكتابة بدل "database is locked"
+        },
     }
 }
 
@@ -146,3 +151,41 @@ DATA_UPLOAD_MAX_NUMBER_FIELDS = 20000
 
 # السماح بعرض صفحات المشروع داخل iframe من نفس الدومين
 X_FRAME_OPTIONS = 'SAMEORIGIN'
+
+# كاش تكاليف المنتجات والمواد الخام (costing/cache.py)
+COSTING_CACHE_ENABLED = True
+COSTING_CACHE_MAX_ENTRIES = 10000
+COSTING_CACHE_TTL = 300  # ثانية
+
+# فهرس رسم الوصفات للتحقق من الدوران (costing/validation.py)
+COSTING_GRAPH_TTL = 300  # ثانية
+
+# توليد استهلاك المواد في الخلفية (sales/jobs.py)
+# True (افتراضي): حفظ المبيعات (الشبكة، استيراد Excel، الأدمن) يسجّل مهمة ويعود فورًا،
+#   ولا يتحدث الاستهلاك إلا بعامل يعمل دائمًا:
+#   python manage.py run_consumption_worker   (كخدمة systemd/supervisor بجانب الموقع)
+#   بدون العامل تبقى المهام منتظرة والتقارير تعرض "قيد إعادة الحساب".
+# False: الحفظ يحدّث الاستهلاك مباشرة داخل الطلب (للتطوير أو البيانات الصغيرة فقط).
+SALES_CONSUMPTION_ASYNC = True
+# العامل يحدّث heartbeat_at للمهمة قيد التنفيذ كل SALES_CONSUMPTION_JOB_HEARTBEAT ثانية؛
+# مهمة بدون نبضة منذ SALES_CONSUMPTION_JOB_TIMEOUT ثانية (عامل توقف) تعود للانتظار.
+# نفس القيم لمهام مطابقة دفتر المخزون.
+SALES_CONSUMPTION_JOB_HEARTBEAT = 30  # ثانية
+SALES_CONSUMPTION_JOB_TIMEOUT = 180  # ثانية (أكبر من النبضة بهامش كافٍ)
+
+# مطابقة دفتر حركة المخزون بعد تعديل المشتريات/الصرف/الجرد (inventory/jobs.py)
+# True (افتراضي): الحفظ يسجّل مهمة فقط وينفّذها العامل run_consumption_worker.
+# False: المطابقة مباشرة بعد الـ commit داخل الطلب، وتعيد تسوية وتقييم كل الفترات
+#   التالية للفترة المعدّلة (للتطوير أو البيانات الصغيرة فقط).
+INVENTORY_LEDGER_ASYNC = True
+
+# استقبال مبيعات نقاط البيع (sales/pos.py)
+# POST /sales/api/pos/ingest/ بـ Authorization: Bearer <token>؛ فارغ = الواجهة مغلقة
+# الترحيل إلى ملخص المبيعات: python manage.py fold_pos_sales
+SALES_POS_INGEST_TOKEN = ""
+SALES_POS_MAX_LINES = 100000  # سطر لكل طلب
+SALES_POS_FOLD_BATCH = 20000  # سطر لكل معاملة ترحيل
+
+# تقييم مخزون المواد الخام (inventory/valuation.py)
+# "wac" متوسط مرجّح دوري أو "fifo"؛ الطريقتان تُحسبان دائمًا، هذه المعتمدة في التقارير
+INVENTORY_VALUATION_METHOD = "wac"
@@ -28,6 +28,7 @@ urlpatterns = [
     path('reports/', include('reports.urls')),
     path("purchases/", include("purchases.urls")),
     path("pricing/", include("pricing.urls")),
+    path("sales/", include("sales.urls")),
     
     path("portal/", include("portal.urls")),
     
@@ -8,6 +8,9 @@ from django.db.models import Q
 from django.http import HttpResponse
 from decimal import Decimal
 from .forms import BOMImportForm
+from .graph import recost_boms
+from .validation import validate_component
+from django.core.exceptions import ValidationError
 
 from django.urls import reverse
 from django.utils.html import format_html
@@ -222,6 +225,13 @@ class BillOfMaterialAdmin(admin.ModelAdmin):
 
     display_total_recipe_cost.short_description = "إجمالي تكلفة الوصفة"
 
+    @admin.action(description="🔄 إعادة تكلفة الوصفات المحددة (وما يعتمد عليها)")
+    def recost_selected(self, request, queryset):
+        updated = recost_boms(bom_ids=list(queryset.values_list("id", flat=True)))
+        self.message_user(request, f"تم تحديث تكلفة {updated} وصفة.", level=messages.SUCCESS)
+
+    actions = [recost_selected]
+
 
     # -------------------- URLs مخصصة --------------------
     def get_urls(self):
@@ -312,6 +322,7 @@ class BillOfMaterialAdmin(admin.ModelAdmin):
 
                     bom_cache = {}
                     cleared_boms = set()
+                    rejected = []
 
                     current_product = None
                     current_bom = None
@@ -455,7 +466,15 @@ class BillOfMaterialAdmin(admin.ModelAdmin):
                         if quantity <= 0:
                             continue
 
-                        # ---------------- 5) إنشاء بند الوصفة ----------------
+                        # ---------------- 5) منع الدوران ----------------
+                        if component_product:
+                            try:
+                                validate_component(bom.product_id, component_product.pk)
+                            except ValidationError as exc:
+                                rejected.append(f"{product.code} ← {component_product.code}: {' '.join(exc.messages)}")
+                                continue
+
+                        # ---------------- 6) إنشاء بند الوصفة ----------------
                         BOMItem.objects.create(
                             bom=bom,
                             raw_material=raw,
@@ -464,6 +483,11 @@ class BillOfMaterialAdmin(admin.ModelAdmin):
                         )
 
                     messages.success(request, "✅ تم استيراد الوصفات (BOM) من ملف الإكسل، مع إنشاء المنتجات الجديدة تلقائيًا.")
+                    if rejected:
+                        messages.warning(
+                            request,
+                            f"تم تجاهل {len(rejected)} بند لأنها تصنع دورانًا في الوصفات: " + " | ".join(rejected[:10]),
+                        )
                     return redirect("admin:costing_billofmaterial_changelist")
 
                 except Exception as e:
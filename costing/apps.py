@@ -7,3 +7,7 @@ class CostingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'costing'
     verbose_name = '📦 التكلفة و المواد الخام'
+
+    def ready(self):
+        # إبطال كاش التكاليف عند تعديل المشتريات/الوصفات/المواد الخام
+        from . import signals  # noqa: F401
@@ -0,0 +1,255 @@
+# costing/cache.py
+"""
+كاش تكاليف المنتجات والمواد الخام داخل العملية (in-process).
+
+- المفتاح: (النوع, id, period_id) والنوع واحد من:
+    "product"  → Product.compute_unit_cost
+    "raw"      → RawMaterial.get_cost_per_ingredient_unit
+    "purchase" → RawMaterial.get_cost_from_purchases
+- حجم محدود مع إخراج الأقدم استخدامًا (LRU).
+- الإبطال يتم من costing/signals.py عند تعديل المشتريات أو الوصفات أو المواد الخام.
+- عدادات hits / misses / evictions متاحة عبر cost_cache.stats().
+
+الكاش خاص بكل عملية (worker)؛ الإبطال بالإشارات يصل للعملية التي حصل فيها
+التعديل فقط، لذلك لكل قيمة عمر أقصى (TTL) يحدّ من بقاء قيمة قديمة في
+العمليات الأخرى (للعرض فقط).
+
+أي تكلفة تُحفظ في قاعدة البيانات (BillOfMaterial.unit_cost_final، تكاليف بنود الجرد)
+تُحسب داخل cost_cache.bypass(): القراءة من الكاش معطلة في هذا الـ thread
+والقيم المحسوبة من جديد تحدّث كاش العملية.
+
+الإعدادات (اختيارية في settings):
+    COSTING_CACHE_ENABLED = True
+    COSTING_CACHE_MAX_ENTRIES = 10000
+    COSTING_CACHE_TTL = 300   # ثانية، None = بدون انتهاء
+"""
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+PRODUCT = "product"
+RAW = "raw"
+PURCHASE = "purchase"
+
+RAW_KINDS = (RAW, PURCHASE)
+
+MISSING = object()
+
+
+def period_key(period):
+    """id الفترة المستخدم في المفتاح (None = بدون فترة)."""
+    if period is None:
+        return None
+    return getattr(period, "pk", None)
+
+
+class CostCache:
+    def __init__(self, max_entries=None):
+        self._max_entries = max_entries
+        self._data = OrderedDict()
+        self._by_object = {}        # (kind, id) -> set(period_id)
+        self._period_dates = {}     # period_id -> start_date
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    # ---------- الإعدادات ----------
+    @property
+    def enabled(self):
+        return getattr(settings, "COSTING_CACHE_ENABLED", True)
+
+    @property
+    def max_entries(self):
+        if self._max_entries is not None:
+            return self._max_entries
+        return getattr(settings, "COSTING_CACHE_MAX_ENTRIES", 10000)
+
+    @property
+    def ttl(self):
+        return getattr(settings, "COSTING_CACHE_TTL", 300)
+
+    # ---------- تجاوز الكاش ----------
+    @contextmanager
+    def bypass(self):
+        """قراءة بدون كاش داخل الكتلة (للقيم التي ستُحفظ)؛ تدعم التداخل."""
+        self._local.depth = getattr(self._local, "depth", 0) + 1
+        try:
+            yield
+        finally:
+            self._local.depth -= 1
+
+    @property
+    def bypassed(self):
+        return getattr(self._local, "depth", 0) > 0
+
+    # ---------- القراءة / الكتابة ----------
+    def get(self, kind, obj_id, period):
+        """ترجع القيمة المخزنة أو MISSING (القيمة نفسها قد تكون None)."""
+        if not self.enabled or self.bypassed:
+            return MISSING
+
+        key = (kind, obj_id, period_key(period))
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] is not None and entry[1] < time.monotonic():
+                del self._data[key]
+                self._forget(key)
+                self.expirations += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return MISSING
+
+            self.hits += 1
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def set(self, kind, obj_id, period, value):
+        if not self.enabled or obj_id is None:
+            return
+
+        pid = period_key(period)
+        key = (kind, obj_id, pid)
+        ttl = self.ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            self._by_object.setdefault((kind, obj_id), set()).add(pid)
+            if pid is not None:
+                self._period_dates[pid] = getattr(period, "start_date", None)
+
+            while len(self._data) > self.max_entries:
+                old_key, _ = self._data.popitem(last=False)
+                self._forget(old_key)
+                self.evictions += 1
+
+    def _forget(self, key):
+        kind, obj_id, pid = key
+        pids = self._by_object.get((kind, obj_id))
+        if pids is not None:
+            pids.discard(pid)
+            if not pids:
+                del self._by_object[(kind, obj_id)]
+
+    # ---------- الإبطال ----------
+    def _invalidate_object(self, kind, obj_id, from_date=None):
+        """
+        from_date (اختياري): نبطل فقط الفترات التي تبدأ من هذا التاريخ أو بعده
+        + المفتاح بدون فترة (لأنه يعتمد على آخر مشتريات).
+        """
+        pids = self._by_object.get((kind, obj_id))
+        if not pids:
+            return
+        for pid in list(pids):
+            if from_date is not None and pid is not None:
+                start = self._period_dates.get(pid)
+                if start is not None and start < from_date:
+                    continue
+            if self._data.pop((kind, obj_id, pid), None) is not None:
+                self.invalidations += 1
+            pids.discard(pid)
+        if not pids:
+            self._by_object.pop((kind, obj_id), None)
+
+    def invalidate_raw_materials(self, raw_ids, from_date=None):
+        with self._lock:
+            for raw_id in raw_ids:
+                for kind in RAW_KINDS:
+                    self._invalidate_object(kind, raw_id, from_date)
+
+    def invalidate_products(self, product_ids, from_date=None):
+        with self._lock:
+            for product_id in product_ids:
+                self._invalidate_object(PRODUCT, product_id, from_date)
+
+    def has_products(self):
+        with self._lock:
+            return any(kind == PRODUCT for (kind, _) in self._by_object)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._by_object.clear()
+            self._period_dates.clear()
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._data),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+cost_cache = CostCache()
+
+
+# --------------------------------------------------------
+# الإبطال مع التوابع (المنتجات التي تستخدم العنصر بأي مستوى)
+# --------------------------------------------------------
+def dependent_product_ids(product_ids=(), raw_ids=()):
+    """
+    كل المنتجات التي تتأثر تكلفتها بتغيير المنتجات/المواد الخام المعطاة
+    (صعودًا في شجرة الوصفات)، بما فيها product_ids نفسها.
+    """
+    from .models import BOMItem
+
+    affected = set(product_ids)
+    frontier = set(product_ids)
+
+    if raw_ids:
+        users = set(
+            BOMItem.objects.filter(raw_material_id__in=list(raw_ids))
+            .values_list("bom__product_id", flat=True)
+        )
+        frontier |= users - affected
+        affected |= users
+
+    while frontier:
+        parents = set(
+            BOMItem.objects.filter(component_product_id__in=list(frontier))
+            .values_list("bom__product_id", flat=True)
+        )
+        frontier = parents - affected
+        affected |= parents
+
+    return affected
+
+
+def invalidate_raw_materials(raw_ids, from_date=None):
+    raw_ids = [r for r in raw_ids if r is not None]
+    if not raw_ids:
+        return
+    cost_cache.invalidate_raw_materials(raw_ids, from_date=from_date)
+    if cost_cache.has_products():
+        cost_cache.invalidate_products(dependent_product_ids(raw_ids=raw_ids), from_date=from_date)
+
+
+def invalidate_products(product_ids):
+    product_ids = [p for p in product_ids if p is not None]
+    if not product_ids or not cost_cache.has_products():
+        return
+    cost_cache.invalidate_products(dependent_product_ids(product_ids=product_ids))
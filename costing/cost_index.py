@@ -0,0 +1,157 @@
+# costing/cost_index.py
+"""
+فهرس تكلفة المواد الخام لفترة معيّنة (Raw Cost Index).
+
+RawMaterial.get_cost_from_purchases تنفّذ استعلامًا مرتبًا مع join على الفترة
+في كل استدعاء. هنا نبني مرة واحدة لكل فترة:
+
+- أحدث سطر مشتريات لكل مادة حتى بداية الفترة (استعلام Window واحد).
+- بيانات المواد الخام اللازمة للتحويل والبدائل (استعلام واحد).
+
+ثم كل طلب تكلفة يكون بحث في قاموس O(1) بنفس سلسلة البدائل الحالية:
+أحدث مشتريات حتى بداية الفترة ← القيمة المخزنة ← سعر وحدة التخزين ÷ المعامل.
+
+الاستخدام:
+    index = RawCostIndex(period)
+    cost = index.per_ingredient_unit(raw.id)
+    raw.get_cost_per_ingredient_unit(period, cost_index=index)
+"""
+import copy
+
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .models import RawMaterial, round3
+
+
+class RawCostIndex:
+    """
+    period=None يعني آخر مشتريات بدون قيد تاريخ (نفس سلوك الدوال الحالية).
+
+    الفترة المقفلة التي لها لقطة تكلفة (costing/snapshots.py) تُقرأ من اللقطة
+    مباشرة؛ use_snapshot=False يجبر الحساب الحي (عند كتابة اللقطة نفسها).
+
+    raw_ids (اختياري): تحميل هذه المواد فقط بدل كل المواد الخام.
+    """
+
+    def __init__(self, period=None, use_snapshot=True, raw_ids=None):
+        self.period = period
+        self._only = set(raw_ids) if raw_ids is not None else None
+        self._purchase_costs = {}   # raw_id -> unit_cost لوحدة التخزين من أحدث سطر
+        self._raws = {}             # raw_id -> (factor, stored_cost, price)
+        self._frozen = None         # raw_id -> (from_purchases, per_ingredient, latest) من اللقطة
+        self._unfiltered = None
+
+        if use_snapshot:
+            from .snapshots import get_snapshot
+
+            snapshot = get_snapshot(period)
+            if snapshot is not None:
+                self._frozen = snapshot.raw_costs
+        self._load()
+
+    def _load(self):
+        from purchases.models import PurchaseSummaryLine
+
+        if self._frozen is not None:
+            # لا حاجة لأي استعلام؛ معاملات التحويل تُحمّل عند الحاجة فقط
+            return
+
+        qs = PurchaseSummaryLine.objects.all()
+        raws = RawMaterial.objects.all()
+        if self._only is not None:
+            qs = qs.filter(raw_material_id__in=list(self._only))
+            raws = raws.filter(id__in=list(self._only))
+        if self.period is not None and getattr(self.period, "start_date", None):
+            qs = qs.filter(summary__period__start_date__lte=self.period.start_date)
+
+        # نفس ترتيب get_cost_from_purchases: -start_date ثم -id
+        latest = (
+            qs.annotate(
+                rn=Window(
+                    expression=RowNumber(),
+                    partition_by=[F("raw_material_id")],
+                    order_by=[F("summary__period__start_date").desc(), F("id").desc()],
+                )
+            )
+            .filter(rn=1)
+            .values_list("raw_material_id", "unit_cost")
+        )
+        self._purchase_costs = dict(latest)
+
+        for raw_id, factor, stored, price in raws.values_list(
+            "id",
+            "storage_to_ingredient_factor",
+            "cost_per_ingredient_unit",
+            "purchase_price_per_storage_unit",
+        ):
+            self._raws[raw_id] = (factor, stored, price)
+
+    # --------------------------------------------------------
+    # نفس RawMaterial.get_cost_from_purchases
+    # --------------------------------------------------------
+    def from_purchases(self, raw_id):
+        if self._frozen is not None:
+            return self._frozen.get(raw_id, (None, None, None))[0]
+
+        cost_per_storage_unit = self._purchase_costs.get(raw_id)
+        if cost_per_storage_unit is None:
+            return None
+        return self.from_storage_price(raw_id, cost_per_storage_unit)
+
+    # --------------------------------------------------------
+    # نفس RawMaterial.get_cost_per_ingredient_unit
+    # --------------------------------------------------------
+    def per_ingredient_unit(self, raw_id):
+        if self._frozen is not None:
+            return self._frozen.get(raw_id, (None, None, None))[1]
+
+        cost = self.from_purchases(raw_id)
+        if cost is not None:
+            return cost
+
+        factor, stored, price = self._raws.get(raw_id, (None, None, None))
+        if stored is not None:
+            return round3(stored)
+
+        if factor and price:
+            return round3(price / factor)
+
+        return None
+
+    def from_storage_price(self, raw_id, price):
+        """تحويل سعر وحدة التخزين إلى تكلفة وحدة الاستخدام (نفس تحويل المشتريات)."""
+        if self._frozen is not None and not self._raws:
+            self._raws = {
+                rid: (factor, None, None)
+                for rid, factor in RawMaterial.objects.values_list("id", "storage_to_ingredient_factor")
+            }
+        factor = self._raws.get(raw_id, (None, None, None))[0]
+        if not factor or factor == 0:
+            return round3(price)
+        return round3(price / factor)
+
+    def raw_ids(self):
+        return list(self._frozen if self._frozen is not None else self._raws)
+
+    def as_dict(self):
+        """{raw_id: تكلفة وحدة الاستخدام} لكل المواد الخام."""
+        return {raw_id: self.per_ingredient_unit(raw_id) for raw_id in self.raw_ids()}
+
+    def unfiltered(self):
+        """
+        فهرس بدون قيد فترة (مثل get_cost_per_ingredient_unit(period=None))
+        يُبنى عند الحاجة فقط.
+        """
+        if self.period is None:
+            return self
+        if self._unfiltered is None:
+            if self._frozen is not None:
+                # "آخر تكلفة" كما كانت وقت الإقفال
+                self._unfiltered = copy.copy(self)
+                self._unfiltered._frozen = {
+                    raw_id: (None, latest, latest) for raw_id, (_, _, latest) in self._frozen.items()
+                }
+            else:
+                self._unfiltered = RawCostIndex(period=None, raw_ids=self._only)
+        return self._unfiltered
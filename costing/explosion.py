@@ -0,0 +1,270 @@
+# costing/explosion.py
+"""
+بناء جدول تفكيك الوصفات المحفوظ (BOMExplosion) وتحديثه.
+
+- explode_products: تفكيك منتجات معيّنة في الذاكرة (بدون قاعدة بيانات بعد التحميل).
+- rebuild_explosion: إعادة بناء كل الجدول أو منتجات معيّنة فقط.
+- schedule_explosion_rebuild: تجميع المنتجات المتأثرة داخل المعاملة
+  وإعادة بنائها مرة واحدة بعد الـ commit (تُستدعى من costing/signals.py)؛
+  تُحمّل وصفات المنتجات المتأثرة ومكوّناتها فقط، لا كل الكتالوج.
+- exploded_requirements: {(product_id, raw_id): الكمية لكل وحدة} باستعلام واحد
+  (تقرير raw_material_usage_by_product).
+- consumption_paths: مسارات نطاق استهلاك المبيعات من الجدول
+  (sales.models.build_consumption_rows: ضرب في الكمية المباعة بدل التفكيك).
+- intern_paths: مسارات نصف المصنع المشتركة (BOMPath) لتتبع مصدر الاستهلاك.
+
+التفكيك يمر عبر الوصفة الفعّالة لكل منتج (نفس get_active_bom)،
+ويقسم على batch_output_quantity في كل مستوى (الفارغ أو الصفر = 1)
+مثل generate_sales_consumption.
+"""
+import threading
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum
+
+from .graph import affected_boms
+from .models import BillOfMaterial, BOMExplosion, BOMPath, Product
+from .rollup import BOMStructure
+
+
+PATH_SEP = "/"
+
+
+class Exploder:
+    """
+    يفكك المنتجات باستخدام BOMStructure محمّل مسبقًا، مع حفظ نتيجة كل منتج
+    (المنتج نصف المصنع المشترك يُفكك مرة واحدة فقط).
+    """
+
+    def __init__(self, structure=None):
+        self.structure = structure or BOMStructure()
+        self.semi_ids = set(
+            Product.objects.filter(is_semi_finished=True).values_list("id", flat=True)
+        )
+        self._memo = {}
+
+    def explode(self, product_id):
+        """
+        ترجع قائمة (raw_id, qty_per_unit, level, path_tuple, source_product_id, only_semi)
+        نسبةً لوحدة واحدة من product_id. path_tuple يبدأ بالمنتج نفسه.
+        """
+        rows, _ = self._explode(product_id, set())
+        return rows
+
+    def _explode(self, product_id, visiting):
+        """ترجع (rows, clean)؛ clean=False لو قُطع دوران داخل هذا الفرع."""
+        if product_id in self._memo:
+            return self._memo[product_id], True
+
+        if product_id in visiting:
+            # دوران في الوصفات: نتوقف كما يفعل generate_sales_consumption
+            return [], False
+
+        bom_id = self.structure.active_bom.get(product_id)
+        if bom_id is None:
+            self._memo[product_id] = []
+            return [], True
+
+        visiting.add(product_id)
+        batch = self.structure.boms[bom_id]["batch_output_quantity"] or Decimal("1")
+
+        rows = []
+        clean = True
+        for raw_id, component_id, qty in self.structure.items[bom_id]:
+            per_unit = (qty or Decimal("0")) / batch
+
+            if raw_id is not None:
+                rows.append((raw_id, per_unit, 1, (product_id,), product_id, True))
+
+            elif component_id is not None:
+                is_semi = component_id in self.semi_ids
+                c_rows, c_clean = self._explode(component_id, visiting)
+                clean = clean and c_clean
+                for c_raw, c_qty, c_level, c_path, c_source, c_semi in c_rows:
+                    rows.append((
+                        c_raw,
+                        per_unit * c_qty,
+                        c_level + 1,
+                        (product_id,) + c_path,
+                        c_source,
+                        c_semi and is_semi,
+                    ))
+
+        visiting.discard(product_id)
+        # لا نحفظ نتيجة ناقصة بسبب دوران
+        if clean:
+            self._memo[product_id] = rows
+        return rows, clean
+
+
+def path_key(semis):
+    """مفتاح BOMPath لسلسلة منتجات نصف مصنعة."""
+    return PATH_SEP.join(str(pid) for pid in semis)
+
+
+def intern_paths(chains):
+    """
+    {سلسلة نصف المصنع (tuple): BOMPath.id}؛ المسارات الجديدة تُضاف مرة واحدة
+    (استعلامان مهما كان العدد). البحث بالبصمة key_hash فلا حد لطول السلسلة.
+    """
+    keys = {BOMPath.hash_key(path_key(chain)): chain for chain in set(chains)}
+    if not keys:
+        return {}
+
+    existing = dict(BOMPath.objects.filter(key_hash__in=list(keys)).values_list("key_hash", "id"))
+    missing = [key_hash for key_hash in keys if key_hash not in existing]
+    if missing:
+        BOMPath.objects.bulk_create(
+            [
+                BOMPath(
+                    key=path_key(keys[key_hash]),
+                    key_hash=key_hash,
+                    level=len(keys[key_hash]) + 1,
+                    source_product_id=keys[key_hash][-1] if keys[key_hash] else None,
+                )
+                for key_hash in missing
+            ],
+            ignore_conflicts=True,
+        )
+        existing.update(BOMPath.objects.filter(key_hash__in=missing).values_list("key_hash", "id"))
+
+    return {chain: existing[key_hash] for key_hash, chain in keys.items()}
+
+
+def _to_model_rows(product_id, rows):
+    # bulk_create لا يستدعي save: البصمة تُحسب هنا
+    objs = []
+    for raw_id, qty, level, path, source_id, only_semi in rows:
+        key = PATH_SEP.join(str(p) for p in path)
+        objs.append(BOMExplosion(
+            product_id=product_id,
+            raw_material_id=raw_id,
+            quantity_per_unit=qty,
+            level=level,
+            path=key,
+            path_hash=BOMPath.hash_key(key),
+            source_product_id=source_id,
+            only_semi_path=only_semi,
+        ))
+    return objs
+
+
+def explode_products(product_ids=None, structure=None):
+    """
+    {product_id: [rows]} في الذاكرة (الكل لو product_ids=None).
+    بدون structure: وصفات product_ids ومكوّناتها فقط (BOMStructure(product_ids)).
+    """
+    if structure is None:
+        structure = BOMStructure(product_ids=product_ids)
+    exploder = Exploder(structure)
+    if product_ids is None:
+        product_ids = list(exploder.structure.active_bom)
+    return {pid: exploder.explode(pid) for pid in product_ids}
+
+
+@transaction.atomic
+def rebuild_explosion(product_ids=None):
+    """
+    product_ids=None → إعادة بناء كامل؛ وإلا المنتجات المحددة فقط.
+    ترجع عدد الأسطر المكتوبة.
+    """
+    exploded = explode_products(product_ids)
+
+    qs = BOMExplosion.objects.all()
+    if product_ids is not None:
+        qs = qs.filter(product_id__in=list(product_ids))
+    qs.delete()
+
+    objs = []
+    for product_id, rows in exploded.items():
+        objs.extend(_to_model_rows(product_id, rows))
+    BOMExplosion.objects.bulk_create(objs, batch_size=2000)
+    return len(objs)
+
+
+def rebuild_for_changed_products(product_ids=(), bom_ids=()):
+    """
+    المنتجات التي تغيّرت وصفتها (أو تغيّرت بنود إحدى وصفاتها)
+    + كل المنتجات التي تستخدمها بأي مستوى: بالاستعلام صعودًا من العناصر المتغيّرة
+    (costing.graph.affected_boms) بدل تحميل كل الوصفات.
+    """
+    boms = affected_boms(product_ids=product_ids, bom_ids=bom_ids)
+    affected = set(product_ids)
+    if boms:
+        affected |= set(BillOfMaterial.objects.filter(pk__in=list(boms)).values_list("product_id", flat=True))
+    if not affected:
+        return 0
+    return rebuild_explosion(affected)
+
+
+# --------------------------------------------------------
+# تجميع التغييرات داخل المعاملة
+# --------------------------------------------------------
+_pending = threading.local()
+
+
+def _flush_pending():
+    state = getattr(_pending, "state", None)
+    _pending.state = None
+    if state and any(state.values()):
+        rebuild_for_changed_products(**state)
+
+
+def schedule_explosion_rebuild(product_ids=(), bom_ids=()):
+    """
+    تسجيل تغيير؛ إعادة البناء تتم مرة واحدة بعد commit المعاملة
+    (أو فورًا لو لا توجد معاملة مفتوحة).
+    """
+    state = getattr(_pending, "state", None)
+    if state is None:
+        state = _pending.state = {"product_ids": set(), "bom_ids": set()}
+    state["product_ids"].update(p for p in product_ids if p is not None)
+    state["bom_ids"].update(b for b in bom_ids if b is not None)
+    transaction.on_commit(_flush_pending)
+
+
+# --------------------------------------------------------
+# الاستعلام
+# --------------------------------------------------------
+def consumption_paths(product_ids):
+    """
+    مسارات نطاق استهلاك المبيعات (only_semi_path) للمنتجات product_ids باستعلام واحد:
+    [(product_id, raw_id, سلسلة نصف المصنع, الكمية لكل وحدة)] بترتيب التفكيك؛
+    السلسلة بدون المنتج نفسه (مفتاح BOMPath).
+    """
+    return [
+        (product_id, raw_id, tuple(int(pid) for pid in path.split(PATH_SEP)[1:]), qty)
+        for product_id, raw_id, path, qty in BOMExplosion.objects.filter(
+            product_id__in=list(product_ids), only_semi_path=True
+        ).order_by("id").values_list("product_id", "raw_material_id", "path", "quantity_per_unit")
+    ]
+
+
+def exploded_requirements(product_ids=None, only_semi_path=False, period=None, raw_ids=None):
+    """
+    {(product_id, raw_material_id): الكمية لكل وحدة منتج} مجمّعة على كل المسارات.
+
+    only_semi_path=True: نفس نطاق generate_sales_consumption
+    (لا يفك إلا المكوّنات نصف المصنعة).
+    period (اختياري): الفترة المقفلة تُقرأ من لقطة الإقفال (costing/snapshots.py).
+    raw_ids (اختياري): مواد خام معيّنة فقط.
+    """
+    from .snapshots import get_snapshot
+
+    snapshot = get_snapshot(period)
+    if snapshot is not None:
+        return snapshot.requirements(product_ids=product_ids, only_semi_path=only_semi_path, raw_ids=raw_ids)
+
+    qs = BOMExplosion.objects.all()
+    if product_ids is not None:
+        qs = qs.filter(product_id__in=list(product_ids))
+    if raw_ids is not None:
+        qs = qs.filter(raw_material_id__in=list(raw_ids))
+    if only_semi_path:
+        qs = qs.filter(only_semi_path=True)
+
+    return {
+        (row["product_id"], row["raw_material_id"]): row["qty"]
+        for row in qs.values("product_id", "raw_material_id").annotate(qty=Sum("quantity_per_unit"))
+    }
@@ -0,0 +1,97 @@
+# costing/fixedpoint.py
+"""
+أرقام ثابتة الفاصلة (Fixed-Point) للحلقات الكثيفة في حساب التكلفة.
+
+القيم داخل المحركات المجمّعة تُحفظ كأعداد صحيحة مضروبة في مقياس ثابت:
+    MILLI = 1000        → round3 (تكلفة الوحدة / الإجمالي بثلاث منازل)
+    CENTI = 100         → money  (منزلتان)
+    QTY   = 10**4       → كميات الوصفات (BOMItem.quantity / batch_output_quantity: 4 منازل)
+    MICRO = 10**6       → حقول الاستهلاك (SalesConsumption: 6 منازل)
+    QTY12 = 10**12      → تجميع كميات الاستهلاك عبر المستويات (دقة أعلى من الحقل)
+
+الضرب والقسمة بأعداد صحيحة مع تقريب ROUND_HALF_UP (بعيدًا عن الصفر)
+مطابق تمامًا لـ Decimal.quantize المستخدم في round3 و money.
+التحويل إلى Decimal يتم فقط عند الحفظ أو الإخراج (to_decimal).
+
+round3 / money هنا هي النسخة الموحّدة؛ costing.models و inventory.models
+و sales.models و sales.admin تستوردها بدل تكرارها.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+MILLI = 1000
+CENTI = 100
+QTY = 10 ** 4
+MICRO = 10 ** 6
+QTY12 = 10 ** 12
+
+Q3 = Decimal("0.000")
+Q2 = Decimal("0.00")
+
+_PLACES = {1: 0, 10: 1, CENTI: 2, MILLI: 3, QTY: 4, MICRO: 6, 10 ** 9: 9, QTY12: 12}
+
+
+# --------------------------------------------------------
+# التقريب (Decimal)
+# --------------------------------------------------------
+def _as_decimal(value):
+    if isinstance(value, Decimal):
+        return value
+    if isinstance(value, int):
+        return Decimal(value)
+    return Decimal(str(value))
+
+
+def round3(value):
+    """تقريب إلى 3 منازل عشرية (ROUND_HALF_UP) مع دعم None."""
+    if value is None:
+        return None
+    return _as_decimal(value).quantize(Q3, rounding=ROUND_HALF_UP)
+
+
+def money(value):
+    """تقريب إلى منزلتين (ROUND_HALF_UP)؛ None = 0."""
+    return _as_decimal(value or 0).quantize(Q2, rounding=ROUND_HALF_UP)
+
+
+# --------------------------------------------------------
+# التحويل
+# --------------------------------------------------------
+def to_scaled(value, scale=MILLI):
+    """Decimal / int / str → عدد صحيح مضروب في scale (تقريب ROUND_HALF_UP)؛ None يبقى None."""
+    if value is None:
+        return None
+    if isinstance(value, int):
+        return value * scale
+    d = _as_decimal(value) * scale
+    return int(d.to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def to_decimal(scaled, scale=MILLI):
+    """عدد صحيح مضروب في scale → Decimal بنفس عدد المنازل (مثل ناتج quantize)."""
+    if scaled is None:
+        return None
+    return Decimal(scaled).scaleb(-_PLACES[scale])
+
+
+def div_round(numerator, denominator):
+    """قسمة أعداد صحيحة مع تقريب ROUND_HALF_UP (بعيدًا عن الصفر)."""
+    negative = (numerator < 0) != (denominator < 0)
+    q, r = divmod(abs(numerator), abs(denominator))
+    if 2 * r >= abs(denominator):
+        q += 1
+    return -q if negative else q
+
+
+def mul(a, a_scale, b, b_scale, out_scale=MILLI):
+    """
+    (a / a_scale) × (b / b_scale) مقرّبًا إلى out_scale.
+    مثال round3(unit_cost × qty): mul(cost_milli, MILLI, qty_4, QTY)
+    """
+    return div_round(a * b * out_scale, a_scale * b_scale)
+
+
+def div(a, a_scale, b, b_scale, out_scale=MILLI):
+    """(a / a_scale) ÷ (b / b_scale) مقرّبًا إلى out_scale؛ b = 0 → None."""
+    if not b:
+        return None
+    return div_round(a * b_scale * out_scale, a_scale * b)
@@ -0,0 +1,212 @@
+# costing/graph.py
+"""
+فهرس "أين يُستخدم" (Where-Used) + إعادة تكلفة الوصفات المتأثرة فقط.
+
+الفهرس يُبنى من BOMItem.raw_material / BOMItem.component_product:
+    مادة خام / منتج نصف مصنع  →  كل الوصفات التي تحتويه (مباشرة أو عبر مستويات).
+
+الانتقال للمستوى الأعلى يتم فقط عبر الوصفة الفعّالة للمنتج، لأن
+Product.compute_unit_cost تعتمد على get_active_bom (أول وصفة فعّالة).
+
+recost_boms يحدّث unit_cost / unit_cost_final للوصفات المتأثرة فقط
+(من الأسفل للأعلى) بـ bulk_update، ويكتب فقط الصفوف التي تغيّرت قيمتها؛
+الوصفات المتأثرة تُعرف بالاستعلام صعودًا (affected_boms) ويُحمّل نطاقها فقط.
+
+schedule_recost تجمع التغييرات داخل المعاملة وتنفذ إعادة التكلفة مرة واحدة
+بعد الـ commit (تُستدعى من costing/signals.py).
+"""
+import threading
+from collections import defaultdict
+
+from django.db import transaction
+
+from .models import BillOfMaterial
+from .rollup import BOMStructure, CostRollup
+
+
+# --------------------------------------------------------
+# الفهرس
+# --------------------------------------------------------
+class WhereUsedIndex:
+    """
+    structure: BOMStructure / CostRollup محمّل مسبقًا (اختياري)،
+    وإلا يُحمّل هيكل الوصفات من قاعدة البيانات.
+    """
+
+    def __init__(self, structure=None):
+        if structure is None:
+            structure = BOMStructure()
+        self.structure = structure
+
+        self.raw_to_boms = defaultdict(set)         # raw_id -> {bom_id} مباشرة
+        self.product_to_boms = defaultdict(set)     # product_id -> {bom_id} مباشرة
+        self.bom_product = {}                       # bom_id -> product_id
+
+        for bom_id, bom in structure.boms.items():
+            self.bom_product[bom_id] = bom["product_id"]
+        for bom_id, rows in structure.items.items():
+            for raw_id, component_id, _ in rows:
+                if raw_id is not None:
+                    self.raw_to_boms[raw_id].add(bom_id)
+                if component_id is not None:
+                    self.product_to_boms[component_id].add(bom_id)
+
+    def _is_active_bom(self, bom_id):
+        return self.structure.active_bom.get(self.bom_product.get(bom_id)) == bom_id
+
+    def _expand(self, bom_ids):
+        """نضيف الوصفات الأعلى: منتج الوصفة الفعّالة المتأثرة مستخدم في وصفات أخرى."""
+        result = set()
+        stack = list(bom_ids)
+        while stack:
+            bom_id = stack.pop()
+            if bom_id in result:
+                continue
+            result.add(bom_id)
+            if self._is_active_bom(bom_id):
+                stack.extend(self.product_to_boms.get(self.bom_product[bom_id], ()))
+        return result
+
+    def boms_using_raw(self, raw_ids):
+        direct = set()
+        for raw_id in raw_ids:
+            direct |= self.raw_to_boms.get(raw_id, set())
+        return self._expand(direct)
+
+    def boms_using_product(self, product_ids):
+        direct = set()
+        for product_id in product_ids:
+            direct |= self.product_to_boms.get(product_id, set())
+        return self._expand(direct)
+
+    def products_using(self, product_ids):
+        """
+        المنتجات التي تستخدم product_ids بأي مستوى عبر وصفاتها الفعّالة
+        (بدون product_ids نفسها).
+        """
+        direct = set()
+        for product_id in product_ids:
+            direct |= self.product_to_boms.get(product_id, set())
+        return {
+            self.bom_product[b] for b in self._expand(direct) if self._is_active_bom(b)
+        }
+
+    def affected_boms(self, raw_ids=(), product_ids=(), bom_ids=()):
+        """
+        bom_ids: وصفات تغيّرت بنودها نفسها (تُعاد هي + ما فوقها).
+        """
+        result = self.boms_using_raw(raw_ids) | self.boms_using_product(product_ids)
+        result |= self._expand({b for b in bom_ids if b in self.bom_product})
+        return result
+
+
+# --------------------------------------------------------
+# إعادة التكلفة
+# --------------------------------------------------------
+def affected_boms(raw_ids=(), product_ids=(), bom_ids=()):
+    """
+    نفس WhereUsedIndex.affected_boms لكن بالاستعلام صعودًا من العناصر المتغيّرة فقط
+    (استعلامان لكل مستوى) بدل تحميل كل الوصفات.
+    """
+    from .models import BOMItem
+
+    frontier = set()
+    if bom_ids:
+        frontier |= set(BillOfMaterial.objects.filter(pk__in=list(bom_ids)).values_list("id", flat=True))
+    if raw_ids:
+        frontier |= set(BOMItem.objects.filter(raw_material_id__in=list(raw_ids)).values_list("bom_id", flat=True))
+    if product_ids:
+        frontier |= set(
+            BOMItem.objects.filter(component_product_id__in=list(product_ids)).values_list("bom_id", flat=True)
+        )
+
+    affected = set()
+    while frontier:
+        affected |= frontier
+        # الوصفة الفعّالة (أقل id فعّال) فقط تنقل التغيير لمن يستخدم منتجها
+        active = {}
+        for bom_id, product_id in (
+            BillOfMaterial.objects.filter(
+                is_active=True,
+                product_id__in=BillOfMaterial.objects.filter(pk__in=list(frontier)).values("product_id"),
+            ).order_by("id").values_list("id", "product_id")
+        ):
+            active.setdefault(product_id, bom_id)
+        used = [product_id for product_id, bom_id in active.items() if bom_id in frontier]
+        if not used:
+            break
+        frontier = set(
+            BOMItem.objects.filter(component_product_id__in=used).values_list("bom_id", flat=True)
+        ) - affected
+    return affected
+
+
+def recost_boms(raw_ids=(), product_ids=(), bom_ids=()):
+    """
+    إعادة حساب unit_cost / unit_cost_final للوصفات المتأثرة فقط.
+    نفس منطق BillOfMaterial.save (بدون فترة) لكن مجمّع.
+    يُحمّل فقط الوصفات المتأثرة ومكوّناتها وتكاليف موادها الخام، لا كل الكتالوج.
+    ترجع عدد الصفوف التي تم تحديثها.
+    """
+    affected = affected_boms(raw_ids=raw_ids, product_ids=product_ids, bom_ids=bom_ids)
+    if not affected:
+        return 0
+
+    products = set(BillOfMaterial.objects.filter(pk__in=list(affected)).values_list("product_id", flat=True))
+    rollup = CostRollup(period=None, product_ids=products)
+
+    # المنتجات اللازمة: منتجات الوصفات المتأثرة + مكوّناتها (الترتيب من الأسفل للأعلى داخل rollup)
+    needed = set(products)
+    for bom_id in affected:
+        needed |= {c for (_, c, _) in rollup.items[bom_id] if c is not None}
+    rollup.compute(product_ids=needed)
+
+    to_update = []
+    for bom in BillOfMaterial.objects.filter(pk__in=affected).only(
+        "id", "batch_output_quantity", "unit_cost", "unit_cost_final"
+    ):
+        if bom.batch_output_quantity and bom.batch_output_quantity > 0:
+            new_cost = rollup.bom_unit_cost(bom.id)
+        else:
+            new_cost = None
+
+        if bom.unit_cost != new_cost or bom.unit_cost_final != new_cost:
+            bom.unit_cost = new_cost
+            bom.unit_cost_final = new_cost
+            to_update.append(bom)
+
+    if to_update:
+        BillOfMaterial.objects.bulk_update(to_update, ["unit_cost", "unit_cost_final"], batch_size=500)
+    return len(to_update)
+
+
+# --------------------------------------------------------
+# تجميع التغييرات داخل المعاملة
+# --------------------------------------------------------
+_pending = threading.local()
+
+
+def _pending_state():
+    state = getattr(_pending, "state", None)
+    if state is None:
+        state = _pending.state = {"raw_ids": set(), "product_ids": set(), "bom_ids": set()}
+    return state
+
+
+def _flush_pending():
+    state = getattr(_pending, "state", None)
+    _pending.state = None
+    if state and any(state.values()):
+        recost_boms(**state)
+
+
+def schedule_recost(raw_ids=(), product_ids=(), bom_ids=()):
+    """
+    تسجيل تغيير؛ إعادة التكلفة تتم مرة واحدة بعد commit المعاملة
+    (أو فورًا لو لا توجد معاملة مفتوحة).
+    """
+    state = _pending_state()
+    state["raw_ids"].update(r for r in raw_ids if r is not None)
+    state["product_ids"].update(p for p in product_ids if p is not None)
+    state["bom_ids"].update(b for b in bom_ids if b is not None)
+    transaction.on_commit(_flush_pending)
@@ -0,0 +1,128 @@
+import time
+from decimal import ROUND_HALF_UP, Decimal, localcontext
+
+from django.core.management.base import BaseCommand, CommandError
+
+from costing.explosion import consumption_paths
+from costing.fixedpoint import QTY12, div_round, round3, to_decimal, to_scaled
+from costing.models import Product
+from costing.rollup import CostRollup
+from expenses.models import Period
+
+Q12 = Decimal("1e-12")
+
+
+def _decimal_rollup(rollup):
+    """المسار العشري القديم (round3 بـ Decimal في كل خطوة) على نفس البيانات المحمّلة."""
+    raw_costs = {raw_id: round3(cost) for raw_id, cost in rollup.raw_costs.items()}
+    unit_costs = {}
+    for pid in rollup.topological_order():
+        bom_id = rollup.active_bom[pid]
+        total = Decimal("0")
+        for raw_id, component_id, qty in rollup.items[bom_id]:
+            if raw_id is not None:
+                unit_cost = raw_costs.get(raw_id)
+            elif component_id is not None:
+                unit_cost = unit_costs.get(component_id)
+            else:
+                unit_cost = None
+            if unit_cost is None:
+                continue
+            total += round3(unit_cost * (qty or 0))
+        batch = rollup.boms[bom_id]["batch_output_quantity"] or 0
+        unit_costs[pid] = round3(round3(total) / batch) if batch else None
+    return {pid: unit_costs.get(pid) for pid in rollup.active_bom}
+
+
+def _decimal_consumption(paths, sold):
+    """
+    نفس حساب build_consumption_rows بـ Decimal: الكمية المباعة × الكمية لكل وحدة
+    لكل مسار في جدول التفكيك مقرّبة لـ 12 منزلة.
+    ترجع {(المنتج، المادة الخام، سلسلة نصف المصنع): الكمية}.
+    """
+    acc = {}
+    with localcontext() as ctx:
+        ctx.prec = 60
+        for product_id, raw_id, semis, per_unit in paths:
+            key = (product_id, raw_id, semis)
+            qty = (Decimal(sold[product_id]).quantize(Q12, rounding=ROUND_HALF_UP) * per_unit).quantize(
+                Q12, rounding=ROUND_HALF_UP
+            )
+            acc[key] = acc.get(key, Decimal("0")) + qty
+    return acc
+
+
+def _fixed_consumption(paths, sold):
+    """نفس حلقة build_consumption_rows بأعداد صحيحة."""
+    required = {product_id: to_scaled(qty, QTY12) for product_id, qty in sold.items()}
+    acc = {}
+    for product_id, raw_id, semis, per_unit in paths:
+        key = (product_id, raw_id, semis)
+        acc[key] = acc.get(key, 0) + div_round(required[product_id] * to_scaled(per_unit, QTY12), QTY12)
+    return acc
+
+
+class Command(BaseCommand):
+    help = (
+        "قياس زمن حساب التكلفة وتفكيك استهلاك المبيعات بالأعداد الصحيحة (fixed-point) "
+        "مقابل Decimal مع التأكد من تطابق النتائج."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--period", type=int, help="رقم الفترة (افتراضي: بدون فترة).")
+        parser.add_argument("--repeat", type=int, default=5, help="عدد مرات التكرار لكل مسار.")
+
+    def _timed(self, func, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            result = func()
+        return result, (time.perf_counter() - started) / repeat
+
+    def _report(self, label, count, decimal_time, fixed_time):
+        self.stdout.write(
+            f"{label}: {count} | Decimal: {decimal_time * 1000:.2f} مللي ث | "
+            f"fixed-point: {fixed_time * 1000:.2f} مللي ث | "
+            f"التسريع: {decimal_time / fixed_time if fixed_time else 0:.2f}x"
+        )
+
+    def handle(self, *args, **options):
+        period = None
+        if options["period"]:
+            period = Period.objects.filter(pk=options["period"]).first()
+            if period is None:
+                raise CommandError("الفترة غير موجودة.")
+
+        # تحميل الهيكل والتكاليف مرة واحدة؛ القياس للحساب فقط
+        base = CostRollup(period=period, use_snapshot=False)
+        repeat = max(options["repeat"], 1)
+
+        # 1) تكلفة الوصفات
+        expected, decimal_time = self._timed(lambda: _decimal_rollup(base), repeat)
+        got, fixed_time = self._timed(lambda: base.with_raw_costs({}).compute(), repeat)
+        self._report("المنتجات", len(base.active_bom), decimal_time, fixed_time)
+        mismatches = [pid for pid in expected if expected[pid] != got.get(pid)]
+        if mismatches:
+            raise CommandError(f"{len(mismatches)} منتج بنتيجة مختلفة: {mismatches[:10]}")
+
+        # 2) استهلاك المبيعات من جدول التفكيك: كميات الفترة المباعة، أو وحدة واحدة لكل منتج قابل للبيع
+        from sales.models import get_quantities_sold
+
+        sellable = Product.objects.filter(is_sellable=True).values_list("id", flat=True)
+        if period is not None:
+            sold = get_quantities_sold(period, sellable)
+        else:
+            sold = {pid: Decimal("1") for pid in sellable}
+        sold = {pid: qty for pid, qty in sold.items() if qty > 0}
+        paths = consumption_paths(sold)
+
+        expected, decimal_time = self._timed(lambda: _decimal_consumption(paths, sold), repeat)
+        got, fixed_time = self._timed(lambda: _fixed_consumption(paths, sold), repeat)
+        self._report("سطور التفكيك", len(expected), decimal_time, fixed_time)
+        mismatches = [
+            key for key in set(expected) | set(got)
+            if expected.get(key) != to_decimal(got.get(key), QTY12)
+        ]
+        if mismatches:
+            raise CommandError(f"{len(mismatches)} سطر تفكيك بكمية مختلفة: {sorted(mismatches)[:10]}")
+
+        self.stdout.write(self.style.SUCCESS("النتائج متطابقة."))
@@ -0,0 +1,32 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from costing.validation import graph_stats
+
+
+class Command(BaseCommand):
+    help = "إحصائيات رسم الوصفات: العمق، التفرّع، الدوران، المنتجات غير المستخدمة."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--json", action="store_true", help="إخراج النتيجة بصيغة JSON.")
+
+    def handle(self, *args, **options):
+        stats = graph_stats()
+
+        if options["json"]:
+            self.stdout.write(json.dumps(stats, ensure_ascii=False, indent=2))
+            return
+
+        self.stdout.write(f"عدد المنتجات: {stats['products']}")
+        self.stdout.write(f"عدد الحواف (منتج ← مكوّن): {stats['edges']}")
+        self.stdout.write(f"أقصى عمق: {stats['max_depth']}")
+        self.stdout.write(f"أقصى تفرّع (مكوّنات في وصفة): {stats['max_fan_out']} | المتوسط: {stats['avg_fan_out']}")
+        self.stdout.write(f"أقصى استخدام لمكوّن واحد: {stats['max_fan_in']}")
+        self.stdout.write(f"منتجات بدون وصفة فعّالة: {len(stats['products_without_bom'])}")
+        self.stdout.write(f"منتجات نصف مصنعة غير مستخدمة في أي منتج نهائي: {stats['unreachable_products']}")
+
+        if stats["cyclic_products"]:
+            self.stdout.write(self.style.ERROR(f"منتجات في دوران: {stats['cyclic_products']}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("لا يوجد دوران في الوصفات."))
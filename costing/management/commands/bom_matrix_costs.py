@@ -0,0 +1,64 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from costing.matrix import BOMCycleError, BOMMatrix, numpy_available, reconcile
+from costing.cost_index import RawCostIndex
+from expenses.models import Period
+
+
+class Command(BaseCommand):
+    help = "حساب تكلفة كل المنتجات لعدة فترات بالمحرك المصفوفي (NumPy)، مع مطابقة اختيارية بالمسار العشري."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--period", type=int, action="append", dest="periods",
+            help="رقم فترة (يمكن تكراره). بدون هذا الخيار: كل الفترات.",
+        )
+        parser.add_argument("--reconcile", action="store_true", help="مقارنة النتائج بالمسار العشري.")
+        parser.add_argument("--tolerance", type=Decimal, default=Decimal("0.01"), help="الفرق المسموح عند المطابقة.")
+        parser.add_argument("--strict", action="store_true", help="إيقاف التنفيذ لو يوجد دوران في الوصفات.")
+
+    def handle(self, *args, **options):
+        if not numpy_available():
+            raise CommandError("NumPy غير مثبت.")
+
+        periods = Period.objects.all()
+        if options["periods"]:
+            periods = periods.filter(pk__in=options["periods"])
+        periods = list(periods)
+
+        started = time.perf_counter()
+        try:
+            matrix = BOMMatrix(strict=options["strict"])
+        except BOMCycleError as exc:
+            raise CommandError(str(exc))
+
+        results = matrix.unit_costs({p.pk: RawCostIndex(p).as_dict() for p in periods})
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f"المنتجات: {len(matrix.product_ids)} | المستويات: {matrix.depth} | "
+            f"الفترات: {len(results)} | الزمن: {elapsed:.3f} ث"
+        )
+        if matrix.cyclic_products:
+            self.stdout.write(self.style.WARNING(
+                f"منتجات داخلة في دوران (مستبعدة): {sorted(matrix.cyclic_products)}"
+            ))
+
+        if not options["reconcile"]:
+            return
+
+        failed = 0
+        for period in periods:
+            mismatches = reconcile(period, tolerance=options["tolerance"])
+            failed += len(mismatches)
+            for row in mismatches:
+                self.stdout.write(self.style.ERROR(
+                    f"[{period}] منتج {row['product_id']}: عشري={row['decimal']} مصفوفي={row['matrix']}"
+                ))
+
+        if failed:
+            raise CommandError(f"{failed} فرق يتجاوز {options['tolerance']}.")
+        self.stdout.write(self.style.SUCCESS("المطابقة مع المسار العشري ناجحة."))
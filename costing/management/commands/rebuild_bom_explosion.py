@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from costing.explosion import rebuild_explosion
+
+
+class Command(BaseCommand):
+    help = "إعادة بناء جدول تفكيك الوصفات (BOMExplosion) بالكامل أو لمنتجات محددة."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--product", type=int, action="append", dest="products",
+            help="رقم منتج (يمكن تكراره). بدون هذا الخيار يتم بناء الجدول بالكامل.",
+        )
+
+    def handle(self, *args, **options):
+        product_ids = options.get("products")
+        count = rebuild_explosion(product_ids)
+        self.stdout.write(self.style.SUCCESS(f"تم بناء {count} سطر تفكيك."))
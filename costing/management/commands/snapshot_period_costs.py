@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from costing.snapshots import take_snapshot
+from expenses.models import Period
+
+
+class Command(BaseCommand):
+    help = "كتابة لقطات التكلفة للفترات المقفلة التي ليس لها لقطة (أو إعادة كتابتها بـ --force)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--period", type=int, action="append", dest="periods",
+            help="رقم فترة مقفلة (يمكن تكراره). بدون هذا الخيار: كل الفترات المقفلة.",
+        )
+        parser.add_argument("--force", action="store_true", help="إعادة كتابة اللقطة من البيانات الحالية.")
+
+    def handle(self, *args, **options):
+        periods = Period.objects.filter(is_closed=True)
+        if options["periods"]:
+            periods = periods.filter(pk__in=options["periods"])
+
+        for period in periods.order_by("start_date"):
+            had_snapshot = hasattr(period, "cost_snapshot")
+            take_snapshot(period, force=options["force"])
+            if had_snapshot and not options["force"]:
+                self.stdout.write(f"{period}: اللقطة موجودة مسبقًا.")
+            else:
+                self.stdout.write(self.style.SUCCESS(f"{period}: تم حفظ لقطة التكلفة."))
@@ -0,0 +1,257 @@
+# costing/matrix.py
+"""
+محرك مصفوفي (NumPy) لتكلفة الوصفات متعددة المستويات واحتياجات المواد الخام.
+
+شجرة الوصفات تُمثَّل كمصفوفات متناثرة (COO):
+    A[p, q] = BOMItem.quantity / batch_output_quantity   (منتج p يستخدم المكوّن q)
+    B[p, r] = BOMItem.quantity / batch_output_quantity   (منتج p يستخدم المادة الخام r)
+
+- تكلفة الوحدة:       c = B·v + A·c    (v = تكلفة المواد الخام للفترة)
+- الاحتياج الكلي:      x = s + Aᵀ·x     (s = كميات المبيعات)
+  واحتياج الخام:      Bᵀ·x
+
+لأن الشجرة بدون دوران (DAG) يكفي تكرار الضرب بعدد مستويات الشجرة
+للحصول على الحل الدقيق (بدون عكس مصفوفة).
+
+يمكن حل عدة فترات مرة واحدة (عمود لكل فترة في v).
+
+الفروق عن المسار العشري (CostRollup / Product.compute_unit_cost):
+- الحساب بـ float بدون round3 في كل خطوة؛ لذلك reconcile تقارن النتيجة
+  بالمسار العشري ضمن هامش مسموح.
+- المنتجات الداخلة في دوران (وما يعتمد عليها) تُستبعد وتظهر في cyclic_products
+  (CostRollup يرجع لها None أيضًا).
+
+NumPy اختياري: لو غير مثبت ترفع BOMMatrix خطأ واضح عند الإنشاء،
+وباقي النظام يعمل بالمسار العشري كالمعتاد.
+"""
+from decimal import Decimal
+
+from .cost_index import RawCostIndex
+from .models import Product, round3
+from .rollup import BOMStructure, CostRollup
+
+# ========= NumPy (اختياري) =========
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+
+class BOMCycleError(ValueError):
+    """وصفات تعتمد على بعضها (دوران) عند طلب الحل الصارم."""
+
+    def __init__(self, product_ids):
+        self.product_ids = sorted(product_ids)
+        super().__init__(f"دوران في الوصفات للمنتجات: {self.product_ids}")
+
+
+def numpy_available():
+    return np is not None
+
+
+def _segment_sum(index, values, size):
+    """مجموع values حسب index (ضرب مصفوفة متناثرة)؛ values متجه أو مصفوفة (عمود لكل فترة)."""
+    if values.ndim == 1:
+        return np.bincount(index, weights=values, minlength=size)
+    out = np.zeros((size, values.shape[1]))
+    np.add.at(out, index, values)
+    return out
+
+
+def _to_decimal(value):
+    return round3(Decimal(repr(float(value))))
+
+
+# --------------------------------------------------------
+# المصفوفة
+# --------------------------------------------------------
+class BOMMatrix:
+    """
+    structure: BOMStructure / CostRollup محمّل مسبقًا (اختياري).
+    strict=True: رفع BOMCycleError لو يوجد دوران في الوصفات.
+    """
+
+    def __init__(self, structure=None, strict=False):
+        if np is None:
+            raise RuntimeError("محرك المصفوفات يحتاج NumPy (pip install numpy).")
+
+        self.structure = structure or BOMStructure()
+
+        order = self.structure.topological_order()
+        self.cyclic_products = set(self.structure.active_bom) - set(order)
+        if strict and self.cyclic_products:
+            raise BOMCycleError(self.cyclic_products)
+
+        self.product_ids = order
+        self.product_pos = {pid: i for i, pid in enumerate(order)}
+
+        semi_ids = set(
+            Product.objects.filter(is_semi_finished=True).values_list("id", flat=True)
+        )
+
+        self.raw_ids = []
+        self.raw_pos = {}
+
+        comp_rows, comp_cols, comp_qty, comp_semi = [], [], [], []
+        raw_rows, raw_cols, raw_qty = [], [], []
+        batch = np.zeros(len(order))
+        levels = np.zeros(len(order), dtype=int)
+
+        for p_pos, pid in enumerate(order):
+            bom_id = self.structure.active_bom[pid]
+            batch[p_pos] = float(self.structure.boms[bom_id]["batch_output_quantity"] or 0)
+
+            for raw_id, component_id, qty in self.structure.items[bom_id]:
+                qty = float(qty or 0)
+                if raw_id is not None:
+                    if raw_id not in self.raw_pos:
+                        self.raw_pos[raw_id] = len(self.raw_ids)
+                        self.raw_ids.append(raw_id)
+                    raw_rows.append(p_pos)
+                    raw_cols.append(self.raw_pos[raw_id])
+                    raw_qty.append(qty)
+                elif component_id in self.product_pos:
+                    # المكوّن بدون وصفة فعّالة ليس له تكلفة ولا احتياج → يُتجاهل
+                    q_pos = self.product_pos[component_id]
+                    comp_rows.append(p_pos)
+                    comp_cols.append(q_pos)
+                    comp_qty.append(qty)
+                    comp_semi.append(component_id in semi_ids)
+                    # الترتيب الطوبولوجي يضمن أن المكوّن قبل المنتج
+                    levels[p_pos] = max(levels[p_pos], levels[q_pos] + 1)
+
+        self.comp_rows = np.asarray(comp_rows, dtype=int)
+        self.comp_cols = np.asarray(comp_cols, dtype=int)
+        self.comp_qty = np.asarray(comp_qty, dtype=float)
+        self.comp_semi = np.asarray(comp_semi, dtype=bool)
+        self.raw_rows = np.asarray(raw_rows, dtype=int)
+        self.raw_cols = np.asarray(raw_cols, dtype=int)
+        self.raw_qty = np.asarray(raw_qty, dtype=float)
+
+        self.batch = batch
+        self.depth = int(levels.max()) + 1 if len(order) else 0
+
+    # ---------- التكلفة ----------
+    def raw_cost_vector(self, *raw_cost_dicts):
+        """تكلفة المواد الخام بترتيب raw_ids؛ عمود لكل قاموس (None = 0 مثل المسار العشري)."""
+        data = np.zeros((len(self.raw_ids), len(raw_cost_dicts)))
+        for col, costs in enumerate(raw_cost_dicts):
+            for raw_id, pos in self.raw_pos.items():
+                cost = costs.get(raw_id)
+                if cost is not None:
+                    data[pos, col] = float(cost)
+        return data
+
+    def solve_costs(self, raw_costs):
+        """
+        raw_costs: مصفوفة (عدد المواد × عدد الفترات) من raw_cost_vector.
+        ترجع مصفوفة (عدد المنتجات × عدد الفترات) بترتيب product_ids؛
+        المنتج بكمية إنتاج صفر/فارغة قيمته NaN (None في المسار العشري).
+        """
+        n = len(self.product_ids)
+        valid = self.batch > 0
+        scale = np.where(valid, 1.0 / np.where(valid, self.batch, 1.0), 0.0)[:, None]
+
+        direct = _segment_sum(
+            self.raw_rows, self.raw_qty[:, None] * raw_costs[self.raw_cols], n
+        ) * scale
+
+        costs = direct
+        for _ in range(self.depth):
+            costs = direct + _segment_sum(
+                self.comp_rows, self.comp_qty[:, None] * costs[self.comp_cols], n
+            ) * scale
+
+        costs[~valid] = np.nan
+        return costs
+
+    def unit_costs(self, raw_costs_by_key):
+        """
+        raw_costs_by_key: {مفتاح (مثل period_id): {raw_id: cost}}
+        ترجع {مفتاح: {product_id: Decimal أو None}} بحل واحد لكل المفاتيح.
+        """
+        keys = list(raw_costs_by_key)
+        if not keys:
+            return {}
+        solved = self.solve_costs(self.raw_cost_vector(*(raw_costs_by_key[k] for k in keys)))
+
+        result = {}
+        for col, key in enumerate(keys):
+            column = solved[:, col]
+            result[key] = {
+                pid: None if np.isnan(column[pos]) else _to_decimal(column[pos])
+                for pid, pos in self.product_pos.items()
+            }
+            for pid in self.cyclic_products:
+                result[key][pid] = None
+        return result
+
+    # ---------- الاحتياجات ----------
+    def raw_requirements(self, sales, only_semi=True):
+        """
+        sales: {product_id: الكمية المباعة}
+        ترجع {raw_id: الكمية (float)} عبر كل المستويات.
+
+        الكمية الفارغة/الصفر للإنتاج = 1 (مثل generate_sales_consumption).
+        only_semi=True: لا يفك إلا المكوّنات نصف المصنعة (نفس نطاق استهلاك المبيعات).
+        """
+        n = len(self.product_ids)
+        demand = np.zeros(n)
+        for pid, qty in sales.items():
+            pos = self.product_pos.get(pid)
+            if pos is not None and qty:
+                demand[pos] += float(qty)
+
+        scale = 1.0 / np.where(self.batch > 0, self.batch, 1.0)
+
+        mask = self.comp_semi if only_semi else np.ones(len(self.comp_rows), dtype=bool)
+        rows, cols = self.comp_rows[mask], self.comp_cols[mask]
+        coef = self.comp_qty[mask] * scale[rows]
+
+        total = demand
+        for _ in range(self.depth):
+            total = demand + _segment_sum(cols, coef * total[rows], n)
+
+        raw = _segment_sum(self.raw_cols, self.raw_qty * scale[self.raw_rows] * total[self.raw_rows], len(self.raw_ids))
+        return {raw_id: float(raw[pos]) for raw_id, pos in self.raw_pos.items() if raw[pos]}
+
+
+# --------------------------------------------------------
+# واجهات مختصرة
+# --------------------------------------------------------
+def matrix_unit_costs(periods, structure=None):
+    """
+    تكلفة الوحدة لكل المنتجات لعدة فترات بحل واحد:
+    {period_id أو None: {product_id: Decimal أو None}}.
+    """
+    matrix = BOMMatrix(structure)
+    return matrix.unit_costs({
+        getattr(period, "pk", None): RawCostIndex(period).as_dict() for period in periods
+    })
+
+
+def reconcile(period=None, tolerance=Decimal("0.01")):
+    """
+    مقارنة المحرك المصفوفي بالمسار العشري (CostRollup) لنفس الفترة.
+    ترجع قائمة المنتجات التي يتجاوز فرقها tolerance (أو None في طرف واحد فقط).
+    """
+    # المقارنة على البيانات الحية (بدون لقطة الفترة المقفلة) حتى يكون المدخل واحدًا
+    cost_index = RawCostIndex(period, use_snapshot=False)
+    rollup = CostRollup(period=period, cost_index=cost_index, use_snapshot=False)
+    expected = rollup.compute()
+
+    solved = BOMMatrix(rollup).unit_costs({"x": cost_index.as_dict()})["x"]
+
+    mismatches = []
+    for pid in sorted(set(expected) | set(solved)):
+        dec, mat = expected.get(pid), solved.get(pid)
+        if dec is None and mat is None:
+            continue
+        if dec is None or mat is None or abs(dec - mat) > tolerance:
+            mismatches.append({
+                "product_id": pid,
+                "decimal": dec,
+                "matrix": mat,
+                "diff": None if dec is None or mat is None else mat - dec,
+            })
+    return mismatches
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.9 on 2026-10-18 01:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('costing', '0010_billofmaterial_unit_cost_final'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BOMExplosion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity_per_unit', models.DecimalField(decimal_places=12, max_digits=28, verbose_name='الكمية لكل وحدة منتج (وحدة الاستخدام)')),
+                ('level', models.PositiveIntegerField(default=1, verbose_name='المستوى')),
+                ('path', models.CharField(blank=True, help_text='أرقام المنتجات من المنتج الرئيسي حتى الوصفة التي تحتوي المادة، مفصولة بـ /', max_length=255, verbose_name='المسار')),
+                ('only_semi_path', models.BooleanField(default=True, verbose_name='كل المستويات الوسيطة نصف مصنعة')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='explosion_rows', to='costing.product', verbose_name='المنتج')),
+                ('raw_material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='explosion_rows', to='costing.rawmaterial', verbose_name='المادة الخام')),
+                ('source_product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='explosion_source_rows', to='costing.product', verbose_name='الوصفة المصدر (المنتج)')),
+            ],
+            options={
+                'verbose_name': 'تفكيك وصفة',
+                'verbose_name_plural': 'تفكيك الوصفات',
+                'indexes': [models.Index(fields=['product', 'raw_material'], name='costing_bom_product_8dbd80_idx'), models.Index(fields=['raw_material'], name='costing_bom_raw_mat_122a7d_idx')],
+            },
+        ),
+    ]
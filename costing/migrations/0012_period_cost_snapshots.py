@@ -0,0 +1,74 @@
+# Generated by Django 5.2.9 on 2026-10-18 01:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('costing', '0011_bomexplosion'),
+        ('expenses', '0008_period_allow_opening_stock_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PeriodCostSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاريخ اللقطة')),
+                ('period', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='cost_snapshot', to='expenses.period', verbose_name='الفترة')),
+            ],
+            options={
+                'verbose_name': 'لقطة تكلفة فترة',
+                'verbose_name_plural': 'لقطات تكلفة الفترات',
+            },
+        ),
+        migrations.CreateModel(
+            name='ExplosionSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('only_semi_path', models.BooleanField(default=True, verbose_name='كل المستويات الوسيطة نصف مصنعة')),
+                ('quantity_per_unit', models.DecimalField(decimal_places=12, max_digits=28, verbose_name='الكمية لكل وحدة منتج (وحدة الاستخدام)')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='explosion_snapshots', to='costing.product', verbose_name='المنتج')),
+                ('raw_material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='explosion_snapshots', to='costing.rawmaterial', verbose_name='المادة الخام')),
+                ('snapshot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='explosion_rows', to='costing.periodcostsnapshot', verbose_name='اللقطة')),
+            ],
+            options={
+                'verbose_name': 'تفكيك وصفة في لقطة',
+                'verbose_name_plural': 'تفكيك الوصفات في اللقطات',
+                'indexes': [models.Index(fields=['snapshot', 'product'], name='costing_exp_snapsho_82a864_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductCostSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unit_cost', models.DecimalField(blank=True, decimal_places=3, max_digits=18, null=True, verbose_name='تكلفة الوحدة')),
+                ('unit_cost_final', models.DecimalField(blank=True, decimal_places=3, max_digits=18, null=True, verbose_name='تكلفة الوحدة المحفوظة (الوصفة الفعّالة)')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cost_snapshots', to='costing.product', verbose_name='المنتج')),
+                ('snapshot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='products', to='costing.periodcostsnapshot', verbose_name='اللقطة')),
+            ],
+            options={
+                'verbose_name': 'تكلفة منتج في لقطة',
+                'verbose_name_plural': 'تكاليف المنتجات في اللقطات',
+                'unique_together': {('snapshot', 'product')},
+            },
+        ),
+        migrations.CreateModel(
+            name='RawCostSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cost_from_purchases', models.DecimalField(blank=True, decimal_places=3, max_digits=18, null=True, verbose_name='التكلفة من المشتريات')),
+                ('cost_per_ingredient_unit', models.DecimalField(blank=True, decimal_places=3, max_digits=18, null=True, verbose_name='تكلفة وحدة الاستخدام')),
+                ('latest_cost', models.DecimalField(blank=True, decimal_places=3, max_digits=18, null=True, verbose_name='آخر تكلفة بدون قيد فترة')),
+                ('raw_material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cost_snapshots', to='costing.rawmaterial', verbose_name='المادة الخام')),
+                ('snapshot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='raw_materials', to='costing.periodcostsnapshot', verbose_name='اللقطة')),
+            ],
+            options={
+                'verbose_name': 'تكلفة مادة خام في لقطة',
+                'verbose_name_plural': 'تكاليف المواد الخام في اللقطات',
+                'unique_together': {('snapshot', 'raw_material')},
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.9 on 2026-10-18 02:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('costing', '0012_period_cost_snapshots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BOMPath',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(blank=True, help_text='أرقام المنتجات نصف المصنعة من الأعلى للأسفل مفصولة بـ / (فارغ = مباشرة)', max_length=255, unique=True, verbose_name='المسار')),
+                ('level', models.PositiveIntegerField(default=1, verbose_name='المستوى')),
+                ('source_product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='costing.product', verbose_name='الوصفة المصدر (نصف مصنع)')),
+            ],
+            options={
+                'verbose_name': 'مسار وصفة',
+                'verbose_name_plural': 'مسارات الوصفات',
+                'indexes': [models.Index(fields=['source_product', 'level'], name='costing_bom_source__1486a5_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+import hashlib
+
+from django.db import migrations, models
+
+
+def fill_key_hash(apps, schema_editor):
+    BOMPath = apps.get_model("costing", "BOMPath")
+    paths = list(BOMPath.objects.only("id", "key"))
+    for path in paths:
+        path.key_hash = hashlib.sha1(path.key.encode()).hexdigest()
+    BOMPath.objects.bulk_update(paths, ["key_hash"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('costing', '0013_bom_paths'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bompath',
+            name='key_hash',
+            field=models.CharField(editable=False, max_length=40, null=True, verbose_name='بصمة المسار'),
+        ),
+        migrations.RunPython(fill_key_hash, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='bompath',
+            name='key_hash',
+            field=models.CharField(editable=False, max_length=40, unique=True, verbose_name='بصمة المسار'),
+        ),
+        migrations.AlterField(
+            model_name='bompath',
+            name='key',
+            field=models.TextField(blank=True, help_text='أرقام المنتجات نصف المصنعة من الأعلى للأسفل مفصولة بـ / (فارغ = مباشرة)', verbose_name='المسار'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.9 on 2026-10-18 03:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('costing', '0014_bom_path_key_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BOMItemSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=4, max_digits=12, verbose_name='الكمية المطلوبة لإنتاج 1 وحدة من المنتج')),
+                ('batch_output_quantity', models.DecimalField(blank=True, decimal_places=4, max_digits=12, null=True, verbose_name='كمية الإنتاج الإجمالية')),
+                ('component_product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='costing.product', verbose_name='منتج مكوَّن')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bom_item_snapshots', to='costing.product', verbose_name='المنتج')),
+                ('raw_material', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='costing.rawmaterial', verbose_name='مادة خام')),
+                ('snapshot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bom_items', to='costing.periodcostsnapshot', verbose_name='اللقطة')),
+            ],
+            options={
+                'verbose_name': 'بند وصفة في لقطة',
+                'verbose_name_plural': 'بنود الوصفات في اللقطات',
+                'indexes': [models.Index(fields=['snapshot', 'product'], name='costing_bom_snapsho_8ef93c_idx')],
+            },
+        ),
+    ]
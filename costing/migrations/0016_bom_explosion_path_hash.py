@@ -0,0 +1,36 @@
+import hashlib
+
+from django.db import migrations, models
+
+
+def fill_path_hash(apps, schema_editor):
+    BOMExplosion = apps.get_model("costing", "BOMExplosion")
+    rows = list(BOMExplosion.objects.only("id", "path"))
+    for row in rows:
+        row.path_hash = hashlib.sha1(row.path.encode()).hexdigest()
+    BOMExplosion.objects.bulk_update(rows, ["path_hash"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('costing', '0015_bom_item_snapshots'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bomexplosion',
+            name='path',
+            field=models.TextField(blank=True, help_text='أرقام المنتجات من المنتج الرئيسي حتى الوصفة التي تحتوي المادة، مفصولة بـ /', verbose_name='المسار'),
+        ),
+        migrations.AddField(
+            model_name='bomexplosion',
+            name='path_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=40, verbose_name='بصمة المسار'),
+        ),
+        migrations.RunPython(fill_path_hash, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='bomexplosion',
+            index=models.Index(fields=['product', 'path_hash'], name='costing_bom_product_141898_idx'),
+        ),
+    ]
@@ -1,13 +1,14 @@
+import hashlib
+
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models import DEFERRED
 from decimal import Decimal
 
 
-from decimal import Decimal, ROUND_HALF_UP
+from decimal import Decimal
 
-def round3(value):
-    if value is None:
-        return None
-    return value.quantize(Decimal("0.000"), rounding=ROUND_HALF_UP)
+from .fixedpoint import round3  # noqa: F401 (يُستورد من هنا في باقي التطبيقات)
 
 
 class TimeStampedModel(models.Model):
@@ -80,7 +81,7 @@ class RawMaterial(TimeStampedModel):
     # --------------------------------------------------------
     # حساب التكلفة من ملخصات المشتريات (الوحدة الكبيرة)
     # --------------------------------------------------------
-    def get_cost_from_purchases(self, period=None):
+    def get_cost_from_purchases(self, period=None, cost_index=None):
         """
         إرجاع *أحدث تكلفة* لأصغر وحدة (ingredient_unit) محسوبة من ملخصات المشتريات.
 
@@ -88,8 +89,28 @@ class RawMaterial(TimeStampedModel):
         - نختار آخر سطر مشتريات لهذه المادة الخام (بناءً على تاريخ الفترة).
         - نأخذ منه unit_cost (سعر وحدة التخزين).
         - نحوله إلى تكلفة وحدة الاستخدام إذا كان هناك storage_to_ingredient_factor.
+
+        cost_index (اختياري): RawCostIndex مبني لنفس الفترة → بدون استعلامات.
         """
+        if cost_index is not None:
+            return cost_index.from_purchases(self.id)
+
+        from .snapshots import get_snapshot
+        snapshot = get_snapshot(period)
+        if snapshot is not None and self.pk in snapshot.raw_costs:
+            return snapshot.raw_costs[self.pk][0]
+
+        from .cache import PURCHASE, MISSING, cost_cache
+
+        cached = cost_cache.get(PURCHASE, self.pk, period)
+        if cached is not MISSING:
+            return cached
 
+        value = self._get_cost_from_purchases(period)
+        cost_cache.set(PURCHASE, self.pk, period, value)
+        return value
+
+    def _get_cost_from_purchases(self, period=None):
         from purchases.models import PurchaseSummaryLine
 
         qs = PurchaseSummaryLine.objects.filter(raw_material=self)
@@ -115,7 +136,26 @@ class RawMaterial(TimeStampedModel):
     # --------------------------------------------------------
     # المصدر النهائي لتكلفة الوحدة الصغيرة
     # --------------------------------------------------------
-    def get_cost_per_ingredient_unit(self, period=None):
+    def get_cost_per_ingredient_unit(self, period=None, cost_index=None):
+        if cost_index is not None:
+            return cost_index.per_ingredient_unit(self.id)
+
+        from .snapshots import get_snapshot
+        snapshot = get_snapshot(period)
+        if snapshot is not None and self.pk in snapshot.raw_costs:
+            return snapshot.raw_costs[self.pk][1]
+
+        from .cache import RAW, MISSING, cost_cache
+
+        cached = cost_cache.get(RAW, self.pk, period)
+        if cached is not MISSING:
+            return cached
+
+        value = self._get_cost_per_ingredient_unit(period)
+        cost_cache.set(RAW, self.pk, period, value)
+        return value
+
+    def _get_cost_per_ingredient_unit(self, period=None):
         # 1) نحاول أولاً من أحدث مشتريات
         cost = self.get_cost_from_purchases(period=period)
         if cost is not None:
@@ -217,10 +257,40 @@ class Product(TimeStampedModel):
         # نعرض الاسم العربي في القوائم
         return f"{self.code} - {self.name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # تفكيك الوصفات يتغيّر فقط مع "نصف مصنع" (costing/signals.py)
+        instance._loaded_is_semi_finished = instance.__dict__.get("is_semi_finished", DEFERRED)
+        return instance
+
     def get_active_bom(self):
         return self.boms.filter(is_active=True).first()
 
-    def compute_unit_cost(self, period=None, visited=None):
+    def compute_unit_cost(self, period=None, visited=None, cost_index=None):
+        from decimal import Decimal
+        from .cache import PRODUCT, MISSING, cost_cache
+        from .snapshots import get_snapshot
+
+        # ✅ الفترة المقفلة: التكلفة الثابتة من لقطة الإقفال
+        snapshot = get_snapshot(period)
+        if snapshot is not None and self.pk in snapshot.product_costs:
+            return snapshot.unit_cost(self.pk)
+
+        # ✅ الكاش للمسار العادي فقط (المسار المجمّع له فهرس خاص به)
+        use_cache = cost_index is None and visited is None
+        if use_cache:
+            cached = cost_cache.get(PRODUCT, self.pk, period)
+            if cached is not MISSING:
+                return cached
+
+        value = self._compute_unit_cost(period=period, visited=visited, cost_index=cost_index)
+
+        if use_cache:
+            cost_cache.set(PRODUCT, self.pk, period, value)
+        return value
+
+    def _compute_unit_cost(self, period=None, visited=None, cost_index=None):
         from decimal import Decimal
 
         if visited is None:
@@ -236,7 +306,7 @@ class Product(TimeStampedModel):
             return None
 
         # 1) إجمالي تكلفة الوصفة
-        total_cost = bom.total_recipe_cost(period=period)
+        total_cost = bom.total_recipe_cost(period=period, cost_index=cost_index)
 
         # 2) كمية الإنتاج الإجمالية
         qty = bom.batch_output_quantity or Decimal("0")
@@ -297,11 +367,13 @@ class BillOfMaterial(TimeStampedModel):
         عند إنشاء BOM لأول مرة لا يكون له pk ولا بنود،
         لذلك لا نحاول حساب التكاليف إلا لو له pk فعليًا.
         """
-        from decimal import Decimal
+        from .cache import cost_cache
 
         # في حالة التعديل على سجل موجود
         if self.pk and self.batch_output_quantity and self.batch_output_quantity > 0:
-            total = self.total_recipe_cost()
+            # القيمة المحفوظة لا تُقرأ من كاش العملية (قد يكون قديمًا في عملية أخرى)
+            with cost_cache.bypass():
+                total = self.total_recipe_cost()
             if total is not None:
                 self.unit_cost = round3(total / self.batch_output_quantity)
                 self.unit_cost_final = self.unit_cost
@@ -318,7 +390,7 @@ class BillOfMaterial(TimeStampedModel):
     def __str__(self):
         return self.name or f"الوصفة للمنتج {self.product}"
 
-    def total_recipe_cost(self, period=None):
+    def total_recipe_cost(self, period=None, cost_index=None):
         """
         مجموع تكلفة كل بنود الوصفة.
         لو الـ BOM جديد (بدون pk) نرجع 0 بدل ما نلمس self.items.
@@ -330,7 +402,7 @@ class BillOfMaterial(TimeStampedModel):
 
         total = Decimal("0")
         for item in self.items.all():
-            line = item.line_total_cost(period=period)
+            line = item.line_total_cost(period=period, cost_index=cost_index)
             if line:
                 total += line
         return round3(total)
@@ -371,6 +443,19 @@ class BOMItem(TimeStampedModel):
         item_name = self.raw_material or self.component_product
         return f"{self.bom} -> {item_name} ({self.quantity})"
 
+    def clean(self):
+        super().clean()
+        if self.component_product_id:
+            from .validation import validate_component
+            try:
+                product_id = self.bom.product_id
+            except BillOfMaterial.DoesNotExist:
+                return
+            try:
+                validate_component(product_id, self.component_product_id)
+            except ValidationError as exc:
+                raise ValidationError({"component_product": exc.messages})
+
     # المادة المستخدمة (مادة خام أو منتج)
     def material(self):
         return self.raw_material or self.component_product
@@ -383,11 +468,14 @@ class BOMItem(TimeStampedModel):
             return self.component_product.base_unit
         return None
 
-    def unit_cost(self, period=None):
-        if self.raw_material:
+    def unit_cost(self, period=None, cost_index=None):
+        if self.raw_material_id and cost_index is not None:
+            # من الفهرس مباشرة بدون تحميل المادة الخام
+            cost = cost_index.per_ingredient_unit(self.raw_material_id)
+        elif self.raw_material:
             cost = self.raw_material.get_cost_per_ingredient_unit(period=period)
         elif self.component_product:
-            cost = self.component_product.compute_unit_cost(period=period)
+            cost = self.component_product.compute_unit_cost(period=period, cost_index=cost_index)
         else:
             cost = None
 
@@ -395,9 +483,9 @@ class BOMItem(TimeStampedModel):
 
 
 
-    def line_total_cost(self, period=None):
+    def line_total_cost(self, period=None, cost_index=None):
         from decimal import Decimal
-        unit_cost = self.unit_cost(period=period)
+        unit_cost = self.unit_cost(period=period, cost_index=cost_index)
         if unit_cost is None:
             return None
 
@@ -409,3 +497,222 @@ class BOMItem(TimeStampedModel):
     class Meta:
         verbose_name = "عنصر في الوصفة"
         verbose_name_plural = "عناصر الوصفة"
+
+
+class BOMExplosion(models.Model):
+    """
+    تفكيك الوصفات المحفوظ (Exploded Requirements):
+    كمية المادة الخام اللازمة لإنتاج وحدة واحدة من المنتج عبر كل المستويات.
+
+    - الكمية مقسومة على batch_output_quantity في كل مستوى (القيمة الفارغة = 1).
+    - سطر لكل مسار داخل الشجرة (path / level) لاستخدامه في التفصيل.
+    - only_semi_path: كل المكوّنات الوسيطة في المسار منتجات نصف مصنعة.
+    - يُعاد بناؤه تلقائيًا عند تعديل الوصفات (costing/explosion.py).
+    """
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="explosion_rows",
+        verbose_name="المنتج"
+    )
+    raw_material = models.ForeignKey(
+        RawMaterial, on_delete=models.CASCADE, related_name="explosion_rows",
+        verbose_name="المادة الخام"
+    )
+    quantity_per_unit = models.DecimalField(
+        "الكمية لكل وحدة منتج (وحدة الاستخدام)",
+        max_digits=28, decimal_places=12,
+    )
+    level = models.PositiveIntegerField("المستوى", default=1)
+    # مثل BOMPath: المسار كامل بلا حد للطول، والبحث على بصمته
+    path = models.TextField(
+        "المسار", blank=True,
+        help_text="أرقام المنتجات من المنتج الرئيسي حتى الوصفة التي تحتوي المادة، مفصولة بـ /"
+    )
+    path_hash = models.CharField("بصمة المسار", max_length=40, blank=True, default="", editable=False)
+    source_product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="explosion_source_rows",
+        verbose_name="الوصفة المصدر (المنتج)"
+    )
+    only_semi_path = models.BooleanField("كل المستويات الوسيطة نصف مصنعة", default=True)
+
+    class Meta:
+        verbose_name = "تفكيك وصفة"
+        verbose_name_plural = "تفكيك الوصفات"
+        indexes = [
+            models.Index(fields=["product", "raw_material"]),
+            models.Index(fields=["raw_material"]),
+            models.Index(fields=["product", "path_hash"]),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} → {self.raw_material_id} ({self.quantity_per_unit})"
+
+    def save(self, *args, **kwargs):
+        self.path_hash = BOMPath.hash_key(self.path)
+        super().save(*args, **kwargs)
+
+    def product_ids(self):
+        return [int(pid) for pid in self.path.split("/") if pid]
+
+
+class BOMPath(models.Model):
+    """
+    مسار داخل شجرة الوصفات مُخزّن مرة واحدة (interned) ويُشارك بين المنتجات والفترات:
+    سلسلة المنتجات نصف المصنعة بين المنتج النهائي والوصفة التي تحتوي المادة الخام.
+
+    - key فارغ: المادة مباشرة في وصفة المنتج النهائي (المستوى 1).
+    - "12/45": عبر نصف المصنع 12 ثم 45 (المستوى 3، المصدر 45).
+    يُستخدم في تتبع مصدر استهلاك المبيعات (sales.SalesConsumptionPath).
+    """
+    # السلاسل العميقة قد تتجاوز أي طول ثابت: النص كامل في key، والتفرد على بصمته
+    key = models.TextField(
+        "المسار", blank=True,
+        help_text="أرقام المنتجات نصف المصنعة من الأعلى للأسفل مفصولة بـ / (فارغ = مباشرة)"
+    )
+    key_hash = models.CharField("بصمة المسار", max_length=40, unique=True, editable=False)
+    level = models.PositiveIntegerField("المستوى", default=1)
+    source_product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="+", null=True, blank=True,
+        verbose_name="الوصفة المصدر (نصف مصنع)"
+    )
+
+    class Meta:
+        verbose_name = "مسار وصفة"
+        verbose_name_plural = "مسارات الوصفات"
+        indexes = [models.Index(fields=["source_product", "level"])]
+
+    def __str__(self):
+        return self.key or "مباشر"
+
+    @staticmethod
+    def hash_key(key):
+        """SHA-1 للمسار (key_hash)."""
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def save(self, *args, **kwargs):
+        self.key_hash = self.hash_key(self.key)
+        super().save(*args, **kwargs)
+
+    def product_ids(self):
+        return [int(pid) for pid in self.key.split("/") if pid]
+
+
+# =========================
+# لقطات التكلفة للفترات المقفلة
+# =========================
+class PeriodCostSnapshot(models.Model):
+    """
+    لقطة تكلفة ثابتة لفترة مقفلة (تُكتب مرة واحدة عند الإقفال).
+    كل مسارات التكلفة تقرأ منها للفترات المقفلة بدل إعادة الحساب (costing/snapshots.py).
+    """
+    period = models.OneToOneField(
+        "expenses.Period", on_delete=models.CASCADE, related_name="cost_snapshot",
+        verbose_name="الفترة"
+    )
+    created_at = models.DateTimeField("تاريخ اللقطة", auto_now_add=True)
+
+    class Meta:
+        verbose_name = "لقطة تكلفة فترة"
+        verbose_name_plural = "لقطات تكلفة الفترات"
+
+    def __str__(self):
+        return f"لقطة تكلفة {self.period}"
+
+
+class ProductCostSnapshot(models.Model):
+    snapshot = models.ForeignKey(
+        PeriodCostSnapshot, on_delete=models.CASCADE, related_name="products",
+        verbose_name="اللقطة"
+    )
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="cost_snapshots",
+        verbose_name="المنتج"
+    )
+    unit_cost = models.DecimalField("تكلفة الوحدة", max_digits=18, decimal_places=3, null=True, blank=True)
+    unit_cost_final = models.DecimalField(
+        "تكلفة الوحدة المحفوظة (الوصفة الفعّالة)", max_digits=18, decimal_places=3, null=True, blank=True
+    )
+
+    class Meta:
+        verbose_name = "تكلفة منتج في لقطة"
+        verbose_name_plural = "تكاليف المنتجات في اللقطات"
+        unique_together = ("snapshot", "product")
+
+
+class RawCostSnapshot(models.Model):
+    snapshot = models.ForeignKey(
+        PeriodCostSnapshot, on_delete=models.CASCADE, related_name="raw_materials",
+        verbose_name="اللقطة"
+    )
+    raw_material = models.ForeignKey(
+        RawMaterial, on_delete=models.CASCADE, related_name="cost_snapshots",
+        verbose_name="المادة الخام"
+    )
+    cost_from_purchases = models.DecimalField(
+        "التكلفة من المشتريات", max_digits=18, decimal_places=3, null=True, blank=True
+    )
+    cost_per_ingredient_unit = models.DecimalField(
+        "تكلفة وحدة الاستخدام", max_digits=18, decimal_places=3, null=True, blank=True
+    )
+    latest_cost = models.DecimalField(
+        "آخر تكلفة بدون قيد فترة", max_digits=18, decimal_places=3, null=True, blank=True
+    )
+
+    class Meta:
+        verbose_name = "تكلفة مادة خام في لقطة"
+        verbose_name_plural = "تكاليف المواد الخام في اللقطات"
+        unique_together = ("snapshot", "raw_material")
+
+
+class ExplosionSnapshot(models.Model):
+    """BOMExplosion مجمّع (منتج × مادة خام) كما كان وقت الإقفال."""
+    snapshot = models.ForeignKey(
+        PeriodCostSnapshot, on_delete=models.CASCADE, related_name="explosion_rows",
+        verbose_name="اللقطة"
+    )
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="explosion_snapshots",
+        verbose_name="المنتج"
+    )
+    raw_material = models.ForeignKey(
+        RawMaterial, on_delete=models.CASCADE, related_name="explosion_snapshots",
+        verbose_name="المادة الخام"
+    )
+    only_semi_path = models.BooleanField("كل المستويات الوسيطة نصف مصنعة", default=True)
+    quantity_per_unit = models.DecimalField(
+        "الكمية لكل وحدة منتج (وحدة الاستخدام)",
+        max_digits=28, decimal_places=12,
+    )
+
+    class Meta:
+        verbose_name = "تفكيك وصفة في لقطة"
+        verbose_name_plural = "تفكيك الوصفات في اللقطات"
+        indexes = [models.Index(fields=["snapshot", "product"])]
+
+
+class BOMItemSnapshot(models.Model):
+    """بنود الوصفة الفعّالة لكل منتج كما كانت وقت الإقفال (هيكل شجرة التقارير)."""
+    snapshot = models.ForeignKey(
+        PeriodCostSnapshot, on_delete=models.CASCADE, related_name="bom_items",
+        verbose_name="اللقطة"
+    )
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="bom_item_snapshots",
+        verbose_name="المنتج"
+    )
+    raw_material = models.ForeignKey(
+        RawMaterial, on_delete=models.CASCADE, null=True, blank=True, related_name="+",
+        verbose_name="مادة خام"
+    )
+    component_product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, null=True, blank=True, related_name="+",
+        verbose_name="منتج مكوَّن"
+    )
+    quantity = models.DecimalField("الكمية المطلوبة لإنتاج 1 وحدة من المنتج", max_digits=12, decimal_places=4)
+    batch_output_quantity = models.DecimalField(
+        "كمية الإنتاج الإجمالية", max_digits=12, decimal_places=4, null=True, blank=True
+    )
+
+    class Meta:
+        verbose_name = "بند وصفة في لقطة"
+        verbose_name_plural = "بنود الوصفات في اللقطات"
+        indexes = [models.Index(fields=["snapshot", "product"])]
@@ -0,0 +1,287 @@
+# costing/rollup.py
+"""
+محرك تجميع تكلفة الوصفات لكل الكتالوج (Cost Rollup).
+
+بدل أن يستدعي كل منتج compute_unit_cost بشكل منفصل (مع استعلامات لكل
+عقدة في الشجرة وتكرار حساب المنتجات نصف المصنعة المشتركة)، هنا:
+
+1) نحمّل كل الوصفات + كل بنود الوصفات + تكلفة المواد الخام للفترة
+   في عدد ثابت من الاستعلامات.
+2) نرتب المنتجات ترتيبًا طوبولوجيًا (المكوّن قبل المنتج الذي يستخدمه).
+3) نحسب تكلفة وحدة كل منتج مرة واحدة فقط.
+
+النتيجة مطابقة لـ Product.compute_unit_cost (نفس التقريب round3 في كل خطوة)؛
+الحساب الداخلي بأعداد صحيحة بالملّي (costing/fixedpoint.py) والتحويل إلى
+Decimal عند الإخراج فقط.
+المنتجات الداخلة في دوران (وصفات تعتمد على بعضها) ترجع None.
+"""
+import copy
+from collections import defaultdict, deque
+
+from .cost_index import RawCostIndex
+from .fixedpoint import QTY, div_round, to_decimal, to_scaled
+from .models import BillOfMaterial, BOMItem
+
+
+# --------------------------------------------------------
+# هيكل الوصفات (بدون تكاليف)
+# --------------------------------------------------------
+class BOMStructure:
+    """
+    كل الوصفات وبنودها في استعلامين؛ يُستخدم للترتيب والتفكيك وفهرس الاستخدام.
+
+    product_ids (اختياري): فقط وصفات هذه المنتجات ومكوّناتها بكل المستويات
+    (استعلامان لكل مستوى) بدل كل الكتالوج.
+    """
+
+    def __init__(self, product_ids=None):
+        self.boms = {}                      # bom_id -> dict
+        self.active_bom = {}                # product_id -> bom_id (أول وصفة فعّالة)
+        self.items = defaultdict(list)      # bom_id -> [(raw_id, component_id, qty)]
+
+        self._load(product_ids)
+
+    def _load(self, product_ids=None):
+        if product_ids is None:
+            self._load_boms(BillOfMaterial.objects.all())
+            self._load_items(BOMItem.objects.all())
+            return
+
+        seen = set()
+        frontier = set(product_ids)
+        while frontier:
+            seen |= frontier
+            bom_ids = self._load_boms(BillOfMaterial.objects.filter(product_id__in=list(frontier)))
+            components = self._load_items(BOMItem.objects.filter(bom_id__in=bom_ids))
+            frontier = components - seen
+
+    def _load_boms(self, qs):
+        bom_ids = []
+        for row in qs.order_by("id").values(
+            "id", "product_id", "is_active", "batch_output_quantity", "unit_cost_final"
+        ):
+            self.boms[row["id"]] = row
+            bom_ids.append(row["id"])
+            # نفس get_active_bom: filter(is_active=True).first() → أقل id
+            if row["is_active"] and row["product_id"] not in self.active_bom:
+                self.active_bom[row["product_id"]] = row["id"]
+        return bom_ids
+
+    def _load_items(self, qs):
+        components = set()
+        for bom_id, raw_id, component_id, qty in qs.order_by("id").values_list(
+            "bom_id", "raw_material_id", "component_product_id", "quantity"
+        ):
+            self.items[bom_id].append((raw_id, component_id, qty))
+            if component_id is not None:
+                components.add(component_id)
+        return components
+
+    def raw_ids(self):
+        """كل المواد الخام في الوصفات المحمّلة."""
+        return {raw_id for rows in self.items.values() for raw_id, _, _ in rows if raw_id is not None}
+
+    # ---------- ترتيب المنتجات ----------
+    def _components(self, product_id):
+        bom_id = self.active_bom.get(product_id)
+        if bom_id is None:
+            return []
+        return [c for (_, c, _) in self.items[bom_id] if c is not None]
+
+    def _closure(self, product_ids):
+        """كل المنتجات المطلوبة لحساب product_ids (هي + مكوّناتها بكل المستويات)."""
+        seen = set()
+        stack = list(product_ids)
+        while stack:
+            pid = stack.pop()
+            if pid in seen:
+                continue
+            seen.add(pid)
+            stack.extend(self._components(pid))
+        return seen
+
+    def topological_order(self, product_ids=None):
+        """
+        ترتيب Kahn: المكوّن قبل المنتج الذي يستخدمه.
+        المنتجات الداخلة في دوران لا تظهر في الترتيب.
+        """
+        nodes = self._closure(product_ids) if product_ids is not None else set(self.active_bom)
+
+        pending = {}                    # product -> عدد المكوّنات التي لم تُحسب بعد
+        parents = defaultdict(list)     # component -> [products using it]
+        for pid in nodes:
+            # المكوّن بدون وصفة فعّالة تكلفته None ولا يحتاج انتظار
+            comps = {c for c in self._components(pid) if c in nodes}
+            pending[pid] = len(comps)
+            for c in comps:
+                parents[c].append(pid)
+
+        queue = deque(pid for pid, n in pending.items() if n == 0)
+        order = []
+        while queue:
+            pid = queue.popleft()
+            order.append(pid)
+            for parent in parents[pid]:
+                pending[parent] -= 1
+                if pending[parent] == 0:
+                    queue.append(parent)
+        return order
+
+
+# --------------------------------------------------------
+# المحرك
+# --------------------------------------------------------
+class CostRollup(BOMStructure):
+    """
+    يحمّل بيانات الوصفات مرة واحدة ويحسب تكلفة الوحدة لكل منتج.
+
+    cost_index: RawCostIndex مبني لنفس الفترة (اختياري)،
+    وإلا يُبنى من المشتريات حسب الفترة.
+
+    الفترة المقفلة التي لها لقطة تكلفة: تكاليف المنتجات تُؤخذ من اللقطة كما هي
+    (use_snapshot=False يجبر الحساب الحي).
+
+    product_ids (اختياري): تحميل هذه المنتجات ومكوّناتها فقط (وتكاليف موادها الخام)؛
+    compute يجب أن يُطلب لمنتجات داخل هذا النطاق.
+    """
+
+    def __init__(self, period=None, cost_index=None, use_snapshot=True, product_ids=None):
+        self.period = period
+        super().__init__(product_ids)
+
+        if cost_index is None:
+            cost_index = RawCostIndex(
+                period, use_snapshot=use_snapshot,
+                raw_ids=self.raw_ids() if product_ids is not None else None,
+            )
+        self.raw_costs = cost_index.as_dict()
+        self._raw_milli = None
+        self._unit_costs = {}       # product_id -> تكلفة الوحدة بالملّي (int) أو None
+
+        self.snapshot = None
+        if use_snapshot:
+            from .snapshots import get_snapshot
+
+            self.snapshot = get_snapshot(period)
+            if self.snapshot is not None:
+                self._unit_costs = {
+                    pid: to_scaled(unit_cost) for pid, (unit_cost, _) in self.snapshot.product_costs.items()
+                }
+
+        # الكميات كأعداد صحيحة (4 منازل) مرة واحدة لكل الوصفات
+        self._fx_items = {
+            bom_id: [(raw_id, component_id, to_scaled(qty or 0, QTY)) for raw_id, component_id, qty in rows]
+            for bom_id, rows in self.items.items()
+        }
+        self._fx_batch = {
+            bom_id: to_scaled(bom["batch_output_quantity"] or 0, QTY) for bom_id, bom in self.boms.items()
+        }
+
+    # ---------- الحساب (أعداد صحيحة بالملّي) ----------
+    def _raw_costs_milli(self):
+        # round3(cost) = تقريب ROUND_HALF_UP إلى الملّي
+        if self._raw_milli is None:
+            self._raw_milli = {raw_id: to_scaled(cost) for raw_id, cost in self.raw_costs.items()}
+        return self._raw_milli
+
+    def _bom_total_milli(self, bom_id):
+        raw_costs = self._raw_costs_milli()
+        unit_costs = self._unit_costs
+        total = 0
+        for raw_id, component_id, qty in self._fx_items.get(bom_id, ()):
+            if raw_id is not None:
+                unit_cost = raw_costs.get(raw_id)
+            elif component_id is not None:
+                unit_cost = unit_costs.get(component_id)
+            else:
+                unit_cost = None
+            if unit_cost is None:
+                continue
+            # round3(unit_cost × qty)
+            total += div_round(unit_cost * qty, QTY)
+        return total
+
+    def _bom_unit_milli(self, bom_id):
+        batch = self._fx_batch[bom_id]
+        if not batch:
+            return None
+        # round3(total ÷ batch)
+        return div_round(self._bom_total_milli(bom_id) * QTY, batch)
+
+    def bom_total_cost(self, bom_id):
+        """نفس BillOfMaterial.total_recipe_cost (يفترض أن المكوّنات محسوبة)."""
+        return to_decimal(self._bom_total_milli(bom_id))
+
+    def bom_unit_cost(self, bom_id):
+        """تكلفة الوحدة لوصفة معيّنة (فعّالة أو لا) = الإجمالي ÷ كمية الإنتاج."""
+        return to_decimal(self._bom_unit_milli(bom_id))
+
+    def compute(self, product_ids=None):
+        """
+        ترجع {product_id: unit_cost} لكل منتج له وصفة فعّالة
+        (أو للمنتجات المطلوبة فقط + مكوّناتها).
+        """
+        nodes = self._closure(product_ids) if product_ids is not None else set(self.active_bom)
+
+        for pid in self.topological_order(product_ids):
+            if pid in self._unit_costs:
+                continue
+            bom_id = self.active_bom.get(pid)
+            self._unit_costs[pid] = self._bom_unit_milli(bom_id) if bom_id is not None else None
+
+        if self.snapshot is not None:
+            # الفترة المقفلة: ما كان له تكلفة وقت الإقفال يبقى كما هو
+            if product_ids is None:
+                nodes |= {pid for pid, cost in self._unit_costs.items() if cost is not None}
+            nodes = {
+                pid for pid in nodes
+                if pid in self.active_bom or self._unit_costs.get(pid) is not None
+            }
+        else:
+            nodes = {pid for pid in nodes if pid in self.active_bom}
+
+        # التحويل إلى Decimal عند الإخراج فقط
+        return {pid: to_decimal(self._unit_costs.get(pid)) for pid in nodes}
+
+    def with_raw_costs(self, overrides):
+        """
+        نسخة تشترك في هيكل الوصفات المحمّل مع تكاليف مواد خام معدّلة
+        {raw_id: cost}؛ لا شيء يُحفظ (محاكاة ماذا لو).
+        """
+        clone = copy.copy(self)
+        clone.raw_costs = {**self.raw_costs, **overrides}
+        clone._raw_milli = None
+        clone._unit_costs = {}
+        clone.snapshot = None
+        return clone
+
+    def stored_final_cost(self, product_id):
+        """unit_cost_final المحفوظة في الوصفة الفعّالة (إن وجدت)، أو من اللقطة للفترة المقفلة."""
+        if self.snapshot is not None and product_id in self.snapshot.product_costs:
+            return self.snapshot.unit_cost_final(product_id)
+        bom_id = self.active_bom.get(product_id)
+        if bom_id is None:
+            return None
+        return self.boms[bom_id]["unit_cost_final"]
+
+
+# --------------------------------------------------------
+# واجهات مختصرة
+# --------------------------------------------------------
+def compute_unit_costs(period=None, product_ids=None, cost_index=None):
+    """
+    تكلفة الوحدة لكل المنتجات في استدعاء واحد: {product_id: unit_cost}.
+    product_ids (اختياري) يحدد المنتجات المطلوبة فقط.
+    """
+    return CostRollup(period=period, cost_index=cost_index).compute(product_ids=product_ids)
+
+
+def effective_unit_costs(period=None, product_ids=None, cost_index=None):
+    """
+    نفس منطق شاشات التسعير:
+    BOM.unit_cost_final إن وجدت، وإلا التكلفة المحسوبة حسب الفترة.
+    """
+    rollup = CostRollup(period=period, cost_index=cost_index)
+    computed = rollup.compute(product_ids=product_ids)
+    ids = product_ids if product_ids is not None else computed.keys()
+    return {pid: rollup.stored_final_cost(pid) or computed.get(pid) for pid in ids}
@@ -0,0 +1,133 @@
+# costing/signals.py
+"""
+إبطال كاش التكاليف (costing/cache.py) عند أي تعديل يؤثر على التكلفة.
+
+- سطر مشتريات      → المادة الخام (من فترة السطر وما بعدها) + المنتجات التي تستخدمها.
+- مادة خام          → المادة الخام + المنتجات التي تستخدمها.
+- وصفة / بند وصفة  → المنتج + كل المنتجات التي تستخدمه كمكوّن (بكل المستويات).
+
+الإبطال يتم فورًا وبعد الـ commit أيضًا، حتى لا تُخزَّن قيمة قديمة قرأها
+طلب آخر قبل اعتماد المعاملة.
+
+وبنفس الإشارات نجدول إعادة تكلفة الوصفات المتأثرة فقط (costing/graph.py)
+لتبقى unit_cost / unit_cost_final المحفوظة محدّثة، وإعادة بناء جدول تفكيك
+الوصفات BOMExplosion للمنتجات المتأثرة (costing/explosion.py)؛ حفظ المنتج
+يعيد البناء فقط لو تغيّر "نصف مصنع".
+
+فهرس رسم الوصفات (costing/validation.py، للإحصائيات) يُحدَّث بعد الـ commit
+فقط؛ التراجع عن المعاملة لا يترك فيه حواف لم تُحفظ. التحقق من الدوران
+نفسه يقرأ قاعدة البيانات.
+
+إقفال فترة يكتب لقطة التكلفة الخاصة بها بعد الـ commit، وإعادة فتحها
+تحذف اللقطة (costing/snapshots.py).
+
+ملاحظة: bulk_create و QuerySet.update لا يرسلان إشارات؛ في هذه الحالات
+نستدعي invalidate_raw_materials / invalidate_products مباشرة.
+"""
+from django.db import transaction
+from django.db.models import DEFERRED
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from expenses.models import Period
+from purchases.models import PurchaseSummaryLine
+
+from .cache import cost_cache, invalidate_products, invalidate_raw_materials
+from .explosion import schedule_explosion_rebuild
+from .graph import schedule_recost
+from .models import BillOfMaterial, BOMItem, Product, RawMaterial
+from .snapshots import drop_snapshot, take_snapshot
+from .validation import bom_graph
+
+
+def _now_and_on_commit(func, *args, **kwargs):
+    func(*args, **kwargs)
+    transaction.on_commit(lambda: func(*args, **kwargs))
+
+
+@receiver(post_save, sender=PurchaseSummaryLine)
+@receiver(post_delete, sender=PurchaseSummaryLine)
+def purchase_line_changed(sender, instance, **kwargs):
+    if kwargs.get("raw"):
+        return
+    period = getattr(getattr(instance, "summary", None), "period", None)
+    from_date = getattr(period, "start_date", None)
+    _now_and_on_commit(invalidate_raw_materials, [instance.raw_material_id], from_date=from_date)
+    schedule_recost(raw_ids=[instance.raw_material_id])
+
+
+@receiver(post_save, sender=RawMaterial)
+@receiver(post_delete, sender=RawMaterial)
+def raw_material_changed(sender, instance, **kwargs):
+    if kwargs.get("raw"):
+        return
+    _now_and_on_commit(invalidate_raw_materials, [instance.pk])
+    schedule_recost(raw_ids=[instance.pk])
+
+
+@receiver(post_save, sender=BillOfMaterial)
+@receiver(post_delete, sender=BillOfMaterial)
+def bom_changed(sender, instance, **kwargs):
+    if kwargs.get("raw"):
+        return
+    if kwargs.get("signal") is post_delete:
+        transaction.on_commit(bom_graph.invalidate)
+    else:
+        bom_id, product_id = instance.pk, instance.product_id
+        transaction.on_commit(lambda: bom_graph.bom_saved(bom_id, product_id))
+
+    _now_and_on_commit(invalidate_products, [instance.product_id])
+    # الوصفة نفسها + الوصفات التي تستخدم المنتج (قد تتغير الوصفة الفعّالة)
+    schedule_recost(product_ids=[instance.product_id], bom_ids=[instance.pk])
+    schedule_explosion_rebuild(product_ids=[instance.product_id])
+
+
+@receiver(post_save, sender=BOMItem)
+@receiver(post_delete, sender=BOMItem)
+def bom_item_changed(sender, instance, **kwargs):
+    if kwargs.get("raw"):
+        return
+    item_id, bom_id, component_id = instance.pk, instance.bom_id, instance.component_product_id
+    if kwargs.get("signal") is post_delete:
+        transaction.on_commit(lambda: bom_graph.item_deleted(item_id))
+    else:
+        transaction.on_commit(lambda: bom_graph.item_saved(item_id, bom_id, component_id))
+
+    schedule_recost(bom_ids=[instance.bom_id])
+    schedule_explosion_rebuild(bom_ids=[instance.bom_id])
+
+    # بنود الوصفة تؤثر على كاش تكلفة المنتجات فقط
+    if not cost_cache.has_products():
+        return
+    product_id = (
+        BillOfMaterial.objects.filter(pk=instance.bom_id)
+        .values_list("product_id", flat=True)
+        .first()
+    )
+    _now_and_on_commit(invalidate_products, [product_id])
+
+
+@receiver(post_save, sender=Product)
+def product_changed(sender, instance, created, **kwargs):
+    # تغيير "نصف مصنع" يغيّر only_semi_path في تفكيك المنتجات التي تستخدمه؛
+    # باقي الحقول (الاسم، السعر...) لا تمس التفكيك
+    if kwargs.get("raw"):
+        return
+    current = instance.__dict__.get("is_semi_finished", DEFERRED)
+    if current is DEFERRED:
+        return
+    loaded = getattr(instance, "_loaded_is_semi_finished", DEFERRED)
+    instance._loaded_is_semi_finished = current
+    if not created and current != loaded:
+        schedule_explosion_rebuild(product_ids=[instance.pk])
+
+
+@receiver(post_save, sender=Period)
+def period_changed(sender, instance, **kwargs):
+    if kwargs.get("raw"):
+        return
+    if instance.is_closed:
+        # مرة واحدة فقط: take_snapshot لا تعيد الكتابة لو اللقطة موجودة
+        transaction.on_commit(lambda: take_snapshot(instance))
+    else:
+        drop_snapshot(instance)
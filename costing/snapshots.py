@@ -0,0 +1,254 @@
+# costing/snapshots.py
+"""
+لقطات التكلفة للفترات المقفلة (Period Cost Snapshots).
+
+عند إقفال الفترة (Period.is_closed) تُكتب لقطة واحدة فيها:
+- تكلفة وحدة كل منتج (+ unit_cost_final للوصفة الفعّالة وقتها).
+- تكلفة وحدة الاستخدام لكل مادة خام (من المشتريات / النهائية / بدون قيد فترة).
+- جدول تفكيك الوصفات BOMExplosion مجمّعًا.
+- بنود الوصفة الفعّالة لكل منتج (هيكل الشجرة في التقارير التفصيلية).
+
+بعدها كل مسارات التكلفة للفترة المقفلة تقرأ من اللقطة:
+    RawCostIndex / CostRollup / Product.compute_unit_cost /
+    RawMaterial.get_cost_* / StockCountLine.unit_cost / exploded_requirements
+فتبقى التقارير التاريخية ثابتة حتى لو عُدّلت الوصفات بعد الإقفال.
+
+إعادة فتح الفترة تحذف اللقطة؛ والإقفال التالي يكتب لقطة جديدة.
+اللقطة المحمّلة تُحفظ في الذاكرة لكل عملية (مع TTL مثل كاش التكاليف).
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+
+
+class CostSnapshot:
+    """بيانات لقطة محمّلة في الذاكرة."""
+
+    def __init__(self, snapshot):
+        from .models import ProductCostSnapshot, RawCostSnapshot
+
+        self.pk = snapshot.pk
+        self.period_id = snapshot.period_id
+        self._cost_index = None
+        self._bom_items = None
+
+        self.product_costs = {
+            product_id: (unit_cost, unit_cost_final)
+            for product_id, unit_cost, unit_cost_final in ProductCostSnapshot.objects.filter(
+                snapshot_id=snapshot.pk
+            ).values_list("product_id", "unit_cost", "unit_cost_final")
+        }
+        self.raw_costs = {
+            raw_id: (from_purchases, per_ingredient, latest)
+            for raw_id, from_purchases, per_ingredient, latest in RawCostSnapshot.objects.filter(
+                snapshot_id=snapshot.pk
+            ).values_list("raw_material_id", "cost_from_purchases", "cost_per_ingredient_unit", "latest_cost")
+        }
+
+    def cost_index(self, period):
+        """RawCostIndex من اللقطة (يُبنى مرة واحدة)."""
+        if self._cost_index is None:
+            from .cost_index import RawCostIndex
+            self._cost_index = RawCostIndex(period)
+        return self._cost_index
+
+    def unit_cost(self, product_id):
+        return self.product_costs.get(product_id, (None, None))[0]
+
+    def unit_cost_final(self, product_id):
+        return self.product_costs.get(product_id, (None, None))[1]
+
+    def bom_items(self, product_id):
+        """
+        (batch_output_quantity, [(raw_id, component_id, qty)]) للوصفة الفعّالة وقت الإقفال،
+        أو None لو المنتج بلا وصفة فعّالة وقتها. كل البنود تُحمّل مرة واحدة.
+        """
+        if self._bom_items is None:
+            from .models import BOMItemSnapshot
+
+            items = {}
+            for product_id_, raw_id, component_id, qty, batch in BOMItemSnapshot.objects.filter(
+                snapshot_id=self.pk
+            ).order_by("id").values_list(
+                "product_id", "raw_material_id", "component_product_id", "quantity", "batch_output_quantity"
+            ):
+                items.setdefault(product_id_, (batch, []))[1].append((raw_id, component_id, qty))
+            self._bom_items = items
+        return self._bom_items.get(product_id)
+
+    def has_bom_items(self):
+        """لقطات قديمة (قبل حفظ البنود) لا تحتوي هيكل الوصفات."""
+        self.bom_items(None)
+        return bool(self._bom_items)
+
+    def requirements(self, product_ids=None, only_semi_path=False, raw_ids=None):
+        """نفس exploded_requirements لكن من جدول اللقطة."""
+        from .models import ExplosionSnapshot
+
+        qs = ExplosionSnapshot.objects.filter(snapshot_id=self.pk)
+        if product_ids is not None:
+            qs = qs.filter(product_id__in=list(product_ids))
+        if raw_ids is not None:
+            qs = qs.filter(raw_material_id__in=list(raw_ids))
+        if only_semi_path:
+            qs = qs.filter(only_semi_path=True)
+
+        return {
+            (row["product_id"], row["raw_material_id"]): row["qty"]
+            for row in qs.values("product_id", "raw_material_id").annotate(qty=Sum("quantity_per_unit"))
+        }
+
+
+# --------------------------------------------------------
+# القراءة (مع ذاكرة لكل عملية)
+# --------------------------------------------------------
+_loaded = {}        # period_id -> (CostSnapshot أو None, loaded_at)
+_lock = threading.RLock()
+
+
+def _ttl():
+    return getattr(settings, "COSTING_CACHE_TTL", 300)
+
+
+def forget(period_id=None):
+    with _lock:
+        if period_id is None:
+            _loaded.clear()
+        else:
+            _loaded.pop(period_id, None)
+
+
+def get_snapshot(period):
+    """
+    CostSnapshot للفترة لو كانت مقفلة ولها لقطة، وإلا None.
+    الفترة المفتوحة لا تحتاج أي استعلام.
+    """
+    if period is None or not getattr(period, "is_closed", False):
+        return None
+
+    from .models import PeriodCostSnapshot
+
+    ttl = _ttl()
+    with _lock:
+        entry = _loaded.get(period.pk)
+        if entry is not None and (not ttl or time.monotonic() - entry[1] <= ttl):
+            return entry[0]
+
+    snapshot = PeriodCostSnapshot.objects.filter(period_id=period.pk).first()
+    data = CostSnapshot(snapshot) if snapshot else None
+    with _lock:
+        _loaded[period.pk] = (data, time.monotonic())
+    return data
+
+
+def frozen_cost_index(period):
+    """RawCostIndex من اللقطة لو الفترة مقفلة، وإلا None."""
+    snapshot = get_snapshot(period)
+    if snapshot is None:
+        return None
+    return snapshot.cost_index(period)
+
+
+# --------------------------------------------------------
+# الكتابة
+# --------------------------------------------------------
+@transaction.atomic
+def take_snapshot(period, force=False):
+    """
+    كتابة لقطة الفترة (مرة واحدة). force=True يعيد كتابتها من البيانات الحالية.
+    ترجع PeriodCostSnapshot.
+    """
+    from .cost_index import RawCostIndex
+    from .models import (
+        BOMExplosion, BOMItemSnapshot, ExplosionSnapshot, PeriodCostSnapshot, Product,
+        ProductCostSnapshot, RawCostSnapshot,
+    )
+    from .rollup import CostRollup
+
+    existing = PeriodCostSnapshot.objects.filter(period=period).first()
+    if existing is not None:
+        if not force:
+            return existing
+        existing.delete()
+
+    # الحساب الحي (بدون قراءة لقطة قديمة)
+    cost_index = RawCostIndex(period, use_snapshot=False)
+    latest_index = cost_index.unfiltered()
+    rollup = CostRollup(period=period, cost_index=cost_index, use_snapshot=False)
+    unit_costs = rollup.compute()
+
+    snapshot = PeriodCostSnapshot.objects.create(period=period)
+
+    ProductCostSnapshot.objects.bulk_create(
+        [
+            ProductCostSnapshot(
+                snapshot=snapshot,
+                product_id=product_id,
+                unit_cost=unit_costs.get(product_id),
+                unit_cost_final=rollup.stored_final_cost(product_id),
+            )
+            for product_id in Product.objects.values_list("id", flat=True)
+        ],
+        batch_size=2000,
+    )
+
+    RawCostSnapshot.objects.bulk_create(
+        [
+            RawCostSnapshot(
+                snapshot=snapshot,
+                raw_material_id=raw_id,
+                cost_from_purchases=cost_index.from_purchases(raw_id),
+                cost_per_ingredient_unit=cost_index.per_ingredient_unit(raw_id),
+                latest_cost=latest_index.per_ingredient_unit(raw_id),
+            )
+            for raw_id in cost_index.raw_ids()
+        ],
+        batch_size=2000,
+    )
+
+    ExplosionSnapshot.objects.bulk_create(
+        [
+            ExplosionSnapshot(
+                snapshot=snapshot,
+                product_id=row["product_id"],
+                raw_material_id=row["raw_material_id"],
+                only_semi_path=row["only_semi_path"],
+                quantity_per_unit=row["qty"],
+            )
+            for row in BOMExplosion.objects.values(
+                "product_id", "raw_material_id", "only_semi_path"
+            ).annotate(qty=Sum("quantity_per_unit"))
+        ],
+        batch_size=2000,
+    )
+
+    # rollup هو BOMStructure محمّل بالفعل: هيكل الوصفات الفعّالة الآن
+    BOMItemSnapshot.objects.bulk_create(
+        [
+            BOMItemSnapshot(
+                snapshot=snapshot,
+                product_id=product_id,
+                raw_material_id=raw_id,
+                component_product_id=component_id,
+                quantity=qty,
+                batch_output_quantity=rollup.boms[bom_id]["batch_output_quantity"],
+            )
+            for product_id, bom_id in rollup.active_bom.items()
+            for raw_id, component_id, qty in rollup.items[bom_id]
+        ],
+        batch_size=2000,
+    )
+
+    transaction.on_commit(lambda: forget(period.pk))
+    forget(period.pk)
+    return snapshot
+
+
+def drop_snapshot(period):
+    from .models import PeriodCostSnapshot
+
+    PeriodCostSnapshot.objects.filter(period=period).delete()
+    forget(period.pk)
@@ -1,3 +1,355 @@
+import datetime
+import random
+from decimal import ROUND_HALF_UP, Decimal as D
+from io import StringIO
+
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
 from django.test import TestCase
 
-# Create your tests here.
+from expenses.models import Period
+from purchases.models import PurchaseSummary, PurchaseSummaryLine
+
+from .cache import MISSING, PRODUCT, RAW, cost_cache
+from .explosion import consumption_paths, exploded_requirements, rebuild_explosion
+from .fixedpoint import MILLI, QTY12, div_round, to_decimal, to_scaled
+from .graph import recost_boms
+from .models import BillOfMaterial, BOMExplosion, BOMItem, Product, RawMaterial, Unit
+from .rollup import CostRollup
+from .validation import bom_graph, find_cycle, graph_stats
+
+
+class CatalogMixin:
+    """
+    كتالوج صغير ثابت للاختبارات: فترتان بمشتريات مختلفة، مواد خام بمعاملات تحويل
+    مختلفة، ووصفات متعددة المستويات بكميات إنتاج (batch_output_quantity) مختلفة.
+
+        عجينة (نصف مصنع، 8000)  ← دقيق، زيت، ملح
+        صوص (نصف مصنع، 30)      ← زيت، سكر، عجينة
+        بيتزا (نهائي، 1)         ← عجينة، صوص، ملح
+        فطيرة (نهائي، 2)         ← صوص، دقيق (+ وصفة غير فعّالة)
+        مشروب (نهائي، بدون وصفة)
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cost_cache.clear()
+        # on_commit ينفّذ كما بعد اعتماد المعاملة (إعادة التكلفة، جدول التفكيك، عدادات المراجعات):
+        # لا يبقى تسجيل منتظر يدخل في معاملات الاختبارات
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.g = Unit.objects.create(name="جرام", abbreviation="g")
+            cls.kg = Unit.objects.create(name="كيلو", abbreviation="kg")
+
+            cls.jan, cls.feb = [
+                Period.objects.create(
+                    year=2025, month=month, name=f"P{month}",
+                    start_date=datetime.date(2025, month, 1), end_date=datetime.date(2025, month, 28),
+                )
+                for month in (1, 2)
+            ]
+
+            def raw(sku, factor, price):
+                return RawMaterial.objects.create(
+                    sku=sku, name=sku, storage_unit=cls.kg, ingredient_unit=cls.g,
+                    storage_to_ingredient_factor=factor, purchase_price_per_storage_unit=price,
+                )
+
+            cls.flour = raw("flour", D("1000"), D("20"))
+            cls.oil = raw("oil", D("12"), D("55"))
+            cls.salt = raw("salt", None, D("3"))
+            cls.sugar = raw("sugar", D("0"), D("7"))
+
+            for period, prices in (
+                (cls.jan, {cls.flour: "18.75", cls.oil: "49.99", cls.salt: "2.5"}),
+                (cls.feb, {cls.flour: "21.333", cls.sugar: "6.125"}),
+            ):
+                summary = PurchaseSummary.objects.create(period=period)
+                for material, price in prices.items():
+                    PurchaseSummaryLine.objects.create(
+                        summary=summary, raw_material=material, purchase_unit=cls.kg,
+                        quantity=D("10"), unit_cost=D(price),
+                    )
+
+            def product(code, semi=False, sellable=True):
+                return Product.objects.create(
+                    code=code, name=code, base_unit=cls.g,
+                    is_semi_finished=semi, is_sellable=sellable, selling_price_per_unit=D("10"),
+                )
+
+            def bom(owner, batch, lines, active=True):
+                recipe = BillOfMaterial.objects.create(product=owner, is_active=active, batch_output_quantity=batch)
+                for material, qty in lines:
+                    field = "raw_material" if isinstance(material, RawMaterial) else "component_product"
+                    BOMItem.objects.create(bom=recipe, quantity=D(qty), **{field: material})
+                recipe.save()
+                return recipe
+
+            cls.dough = product("dough", semi=True, sellable=False)
+            cls.sauce = product("sauce", semi=True, sellable=False)
+            cls.pizza = product("pizza")
+            cls.pie = product("pie")
+            cls.drink = product("drink")
+
+            bom(cls.dough, D("8000"), [(cls.flour, "5000"), (cls.oil, "250"), (cls.salt, "30")])
+            bom(cls.sauce, D("30"), [(cls.oil, "3"), (cls.sugar, "1.5"), (cls.dough, "100")])
+            bom(cls.pizza, D("1"), [(cls.dough, "350"), (cls.sauce, "0.75"), (cls.salt, "0.2")])
+            bom(cls.pie, D("2"), [(cls.sauce, "1.25"), (cls.flour, "3.333")])
+            bom(cls.pie, D("1"), [(cls.flour, "999")], active=False)
+
+    def setUp(self):
+        cost_cache.clear()
+
+
+class CostRollupTests(CatalogMixin, TestCase):
+    def test_matches_compute_unit_cost(self):
+        for period in (None, self.jan, self.feb):
+            with self.subTest(period=period):
+                costs = CostRollup(period=period).compute()
+                self.assertEqual(set(costs), {self.dough.pk, self.sauce.pk, self.pizza.pk, self.pie.pk})
+                self.assertNotIn(None, costs.values())
+                for product in Product.objects.all():
+                    if product.pk in costs:
+                        self.assertEqual(costs[product.pk], product.compute_unit_cost(period=period))
+
+    def test_subset_matches_full_catalog(self):
+        full = CostRollup(period=self.jan).compute()
+        subset = CostRollup(period=self.jan).compute(product_ids=[self.pizza.pk])
+        self.assertEqual(subset[self.pizza.pk], full[self.pizza.pk])
+
+    def test_cycle_returns_none(self):
+        loop = Product.objects.create(code="loop", name="loop", base_unit=self.g, is_semi_finished=True)
+        recipe = BillOfMaterial.objects.create(product=loop, batch_output_quantity=D("1"))
+        # بدون clean: دوران محفوظ مباشرة
+        BOMItem.objects.create(bom=recipe, component_product=self.pizza, quantity=D("1"))
+        BOMItem.objects.create(bom=self.pizza.get_active_bom(), component_product=loop, quantity=D("1"))
+
+        costs = CostRollup().compute()
+        self.assertIsNone(costs[loop.pk])
+        self.assertIsNone(costs[self.pizza.pk])
+        self.assertIsNotNone(costs[self.pie.pk])
+
+
+class CostCacheTests(CatalogMixin, TestCase):
+    def warm(self):
+        for period in (self.jan, self.feb):
+            self.pizza.compute_unit_cost(period=period)
+            self.flour.get_cost_per_ingredient_unit(period=period)
+            self.oil.get_cost_per_ingredient_unit(period=period)
+
+    def cached(self, kind, obj, period):
+        return cost_cache.get(kind, obj.pk, period) is not MISSING
+
+    def test_purchase_line_save_invalidates_material_and_dependents(self):
+        self.warm()
+        before = self.pizza.compute_unit_cost(period=self.feb)
+        line = PurchaseSummaryLine.objects.get(summary__period=self.feb, raw_material=self.flour)
+        affected = ((RAW, self.flour), (PRODUCT, self.dough), (PRODUCT, self.sauce), (PRODUCT, self.pizza))
+        for kind, obj in affected:
+            self.assertTrue(self.cached(kind, obj, self.feb), obj)
+
+        line.unit_cost = D("40")
+        with self.captureOnCommitCallbacks(execute=True):
+            line.save()
+
+        # الدقيق وكل ما يستخدمه (عجينة ← صوص ← بيتزا) لفبراير فقط
+        for kind, obj in affected:
+            self.assertFalse(self.cached(kind, obj, self.feb), obj)
+        # يناير قبل تاريخ التعديل، والزيت لم يتغيّر
+        self.assertTrue(self.cached(RAW, self.flour, self.jan))
+        self.assertTrue(self.cached(PRODUCT, self.pizza, self.jan))
+        self.assertTrue(self.cached(RAW, self.oil, self.feb))
+
+        after = self.pizza.compute_unit_cost(period=self.feb)
+        self.assertNotEqual(after, before)
+        self.assertEqual(after, CostRollup(period=self.feb, use_snapshot=False).compute()[self.pizza.pk])
+
+    def test_stats_count_hits_and_misses(self):
+        cost_cache.reset_stats()
+        self.flour.get_cost_per_ingredient_unit(period=self.feb)
+        misses = cost_cache.stats()["misses"]
+        self.assertGreater(misses, 0)
+
+        self.flour.get_cost_per_ingredient_unit(period=self.feb)
+        stats = cost_cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, misses))
+
+
+class RecostBOMsTests(CatalogMixin, TestCase):
+    def stored(self):
+        return dict(BillOfMaterial.objects.values_list("id", "unit_cost"))
+
+    def test_matches_full_rollup(self):
+        before = self.stored()
+        # تغيير سعر الزيت بدون إشارات: الوصفات المحفوظة أصبحت قديمة
+        PurchaseSummaryLine.objects.filter(raw_material=self.oil).update(unit_cost=D("80"))
+
+        # عجينة، صوص، بيتزا، فطيرة (الفعّالة)؛ وصفة الفطيرة غير الفعّالة لا تستخدم الزيت
+        self.assertEqual(recost_boms(raw_ids=[self.oil.pk]), 4)
+
+        rollup = CostRollup(use_snapshot=False)
+        rollup.compute()
+        stored = self.stored()
+        for bom_id, unit_cost in stored.items():
+            self.assertEqual(unit_cost, rollup.bom_unit_cost(bom_id), bom_id)
+            self.assertEqual(BillOfMaterial.objects.get(pk=bom_id).unit_cost_final, unit_cost)
+        inactive = BillOfMaterial.objects.get(product=self.pie, is_active=False).pk
+        self.assertEqual(stored[inactive], before[inactive])
+        self.assertEqual(recost_boms(raw_ids=[self.oil.pk]), 0)
+
+
+class BOMCycleTests(CatalogMixin, TestCase):
+    def item(self, owner, component):
+        return BOMItem(bom=owner.get_active_bom(), component_product=component, quantity=D("1"))
+
+    def test_self_reference_rejected(self):
+        self.assertEqual(find_cycle(self.dough.pk, self.dough.pk), [self.dough.pk])
+        with self.assertRaises(ValidationError) as ctx:
+            self.item(self.dough, self.dough).full_clean()
+        self.assertIn("component_product", ctx.exception.message_dict)
+
+    def test_indirect_cycle_rejected(self):
+        # فطيرة ← صوص ← عجينة: إضافة الفطيرة لوصفة العجينة تقفل الدائرة
+        self.assertEqual(find_cycle(self.dough.pk, self.pie.pk), [self.dough.pk, self.sauce.pk, self.pie.pk])
+        with self.assertRaises(ValidationError) as ctx:
+            self.item(self.dough, self.pie).full_clean()
+        self.assertIn("dough → sauce → pie → dough", ctx.exception.message_dict["component_product"][0])
+
+        # الاتجاه الصحيح مسموح
+        self.assertIsNone(find_cycle(self.pie.pk, self.dough.pk))
+        self.item(self.pie, self.dough).full_clean()
+
+    def test_inactive_bom_counts(self):
+        # تفعيل وصفة لا يمر على بنودها: الوصفة غير الفعّالة جزء من الرسم
+        inactive = BillOfMaterial.objects.get(product=self.pie, is_active=False)
+        BOMItem.objects.create(bom=inactive, component_product=self.sauce, quantity=D("1"))
+        self.assertIsNotNone(find_cycle(self.sauce.pk, self.pie.pk))
+
+
+class BOMGraphStatsTests(CatalogMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        bom_graph.invalidate()
+        self.addCleanup(bom_graph.invalidate)
+
+    def test_stats(self):
+        glaze = Product.objects.create(code="glaze", name="glaze", base_unit=self.g, is_semi_finished=True)
+        stats = graph_stats()
+        self.assertEqual(stats, {
+            "products": 6,
+            # عجينة → صوص، عجينة → بيتزا، صوص → بيتزا، صوص → فطيرة
+            "edges": 4,
+            "max_depth": 3,
+            "max_fan_out": 2,
+            "avg_fan_out": 1.33,
+            "max_fan_in": 2,
+            "cyclic_products": [],
+            "unreachable_products": [glaze.pk],
+            "products_without_bom": sorted([self.drink.pk, glaze.pk]),
+        })
+
+    def test_cycle_saved_without_clean_updates_loaded_graph(self):
+        graph_stats()
+        with self.captureOnCommitCallbacks(execute=True):
+            item = BOMItem.objects.create(bom=self.dough.get_active_bom(), component_product=self.pie, quantity=D("1"))
+        stats = graph_stats()
+        self.assertEqual(stats["edges"], 5)
+        # عجينة ← صوص ← فطيرة ← عجينة، والبيتزا تعتمد على الدوران
+        self.assertEqual(
+            stats["cyclic_products"], sorted([self.dough.pk, self.sauce.pk, self.pizza.pk, self.pie.pk])
+        )
+
+        # نفس النتيجة بعد إعادة التحميل من قاعدة البيانات
+        bom_graph.invalidate()
+        self.assertEqual(graph_stats(), stats)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            item.delete()
+        self.assertEqual(graph_stats()["cyclic_products"], [])
+
+
+class BOMExplosionTests(CatalogMixin, TestCase):
+    def table(self):
+        return sorted(
+            BOMExplosion.objects.values_list(
+                "product_id", "raw_material_id", "path", "path_hash", "quantity_per_unit", "only_semi_path"
+            )
+        )
+
+    def test_incremental_rebuild_matches_full(self):
+        item = BOMItem.objects.get(bom__product=self.dough, raw_material=self.flour)
+        item.quantity = D("4321.5")
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+        incremental = self.table()
+
+        rebuild_explosion()
+        self.assertEqual(incremental, self.table())
+        pizza_flour = exploded_requirements([self.pizza.pk], raw_ids=[self.flour.pk])[(self.pizza.pk, self.flour.pk)]
+        # 350 عجينة + 0.75 صوص × 100 ÷ 30 عجينة، كل وحدة عجينة 4321.5 ÷ 8000 دقيق
+        self.assertEqual(pizza_flour, D("4321.5") / 8000 * (350 + D("0.75") * 100 / 30))
+
+    def test_product_save_rebuilds_only_on_semi_change(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.sauce.name = "sauce 2"
+            self.sauce.save()
+        self.assertEqual(callbacks, [])
+
+        sauce = Product.objects.get(pk=self.sauce.pk)
+        sauce.is_semi_finished = False
+        with self.captureOnCommitCallbacks(execute=True):
+            sauce.save()
+        # الصوص لم يعد نصف مصنع: خارج نطاق استهلاك المبيعات للبيتزا
+        chains = {semis for _, _, semis, _ in consumption_paths([self.pizza.pk])}
+        self.assertIn((self.dough.pk,), chains)
+        self.assertFalse(any(self.sauce.pk in chain for chain in chains))
+
+
+class FixedPointTests(CatalogMixin, TestCase):
+    def test_div_round_matches_decimal_half_up(self):
+        rng = random.Random(10)
+        for _ in range(2000):
+            numerator = rng.randint(-10 ** 12, 10 ** 12)
+            denominator = rng.choice([2, 4, 8, 10, 1000, rng.randint(1, 10 ** 6)]) * rng.choice([1, -1])
+            expected = (D(numerator) / D(denominator)).quantize(D("1"), rounding=ROUND_HALF_UP)
+            self.assertEqual(div_round(numerator, denominator), int(expected), (numerator, denominator))
+
+    def test_scaled_round_trip(self):
+        for value in ("0.0005", "-0.0005", "12.3454", "12.3455", "7"):
+            self.assertEqual(
+                to_decimal(to_scaled(D(value), MILLI), MILLI),
+                D(value).quantize(D("0.001"), rounding=ROUND_HALF_UP),
+            )
+        self.assertEqual(to_decimal(to_scaled(D("1.000000000001"), QTY12), QTY12), D("1.000000000001"))
+
+    def test_rollup_matches_decimal_path(self):
+        from .management.commands.bench_fixedpoint import _decimal_rollup
+
+        for period in (None, self.jan, self.feb):
+            rollup = CostRollup(period=period, use_snapshot=False)
+            self.assertEqual(rollup.with_raw_costs({}).compute(), _decimal_rollup(rollup))
+
+    def test_consumption_explosion_matches_decimal_path(self):
+        from .management.commands.bench_fixedpoint import _decimal_consumption, _fixed_consumption
+
+        sold = {self.pizza.pk: D("1234.5678") / 7, self.pie.pk: D("3")}
+        paths = consumption_paths(sold)
+
+        expected = _decimal_consumption(paths, sold)
+        got = _fixed_consumption(paths, sold)
+        self.assertEqual(set(got), set(expected))
+        self.assertIn((self.pizza.pk, self.flour.pk, (self.sauce.pk, self.dough.pk)), got)
+        for key, qty in got.items():
+            self.assertEqual(to_decimal(qty, QTY12), expected[key], key)
+
+    def test_bench_command_reports_parity(self):
+        from sales.models import SalesSummary, SalesSummaryLine
+
+        summary = SalesSummary.objects.create(period=self.jan)
+        for product, qty in ((self.pizza, "17.3333"), (self.pie, "5")):
+            SalesSummaryLine.objects.create(
+                summary=summary, product=product, unit=self.g, quantity=D(qty), unit_price=D("10"),
+            )
+
+        out = StringIO()
+        call_command("bench_fixedpoint", period=self.jan.pk, repeat=1, stdout=out)
+        self.assertIn("النتائج متطابقة", out.getvalue())
@@ -0,0 +1,341 @@
+# costing/validation.py
+"""
+التحقق من رسم الوصفات (منع الدوران) + إحصائيات الرسم.
+
+الرسم على مستوى المنتجات: حافة component → product لكل BOMItem.component_product
+(كل الوصفات، الفعّالة وغير الفعّالة، لأن تفعيل وصفة لا يمر على بنودها).
+
+التحقق من الدوران يقرأ قاعدة البيانات مباشرة (find_cycle): نزول مستوى
+بمستوى من المكوّن عبر مكوّناته حتى نصل للمنتج أو تنتهي الشجرة (استعلام لكل
+مستوى). بذلك يرى تعديلات العمليات الأخرى المعتمدة وتعديلات المعاملة الحالية.
+
+الفهرس في الذاكرة (BOMGraph) للإحصائيات فقط؛ يحتفظ بترتيب طوبولوجي ويُحدَّث
+من costing/signals.py بعد الـ commit (Pearce–Kelly):
+- إضافة مكوّن ترتيبه أصغر من المنتج: O(1) بدون أي بحث.
+- غير ذلك: بحث محدود بين ترتيب المنتج وترتيب المكوّن فقط، ثم إعادة ترتيب
+  هذا الجزء.
+الفهرس خاص بكل عملية، لذلك يُعاد تحميله بعد COSTING_GRAPH_TTL ثانية
+حتى تصل تعديلات العمليات الأخرى.
+
+الاستخدام:
+    validate_component(product_id, component_id)   # ValidationError عند الدوران
+    graph_stats()                                   # العمق / التفرّع / المنتجات غير المستخدمة
+"""
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+
+
+class BOMGraph:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded_at = None
+
+    # --------------------------------------------------------
+    # التحميل
+    # --------------------------------------------------------
+    @property
+    def ttl(self):
+        return getattr(settings, "COSTING_GRAPH_TTL", 300)
+
+    def _ensure_loaded(self):
+        ttl = self.ttl
+        if self._loaded_at is None or (ttl and time.monotonic() - self._loaded_at > ttl):
+            self.reload()
+
+    def reload(self):
+        from .models import BillOfMaterial, BOMItem
+
+        with self._lock:
+            self.edges = Counter()              # (component, product) -> عدد البنود
+            self.users = defaultdict(set)       # component -> {product}
+            self.components = defaultdict(set)  # product -> {component}
+            self.bom_product = dict(BillOfMaterial.objects.values_list("id", "product_id"))
+            self.item_edge = {}                 # item_id -> (component, product)
+            self.cyclic = set()                 # منتجات في دوران موجود فعلًا (أو تعتمد عليه)
+
+            for item_id, bom_id, component_id in BOMItem.objects.filter(
+                component_product__isnull=False
+            ).values_list("id", "bom_id", "component_product_id"):
+                edge = (component_id, self.bom_product.get(bom_id))
+                self.item_edge[item_id] = edge
+                self._link(*edge)
+
+            self._build_order()
+            self._loaded_at = time.monotonic()
+
+    def _build_order(self):
+        """ترتيب Kahn: المكوّن قبل المنتج؛ المنتجات في دوران توضع في النهاية."""
+        nodes = set(self.users) | set(self.components)
+        pending = {n: len(self.components.get(n, ())) for n in nodes}
+        ready = [n for n, count in pending.items() if count == 0]
+        order = []
+        while ready:
+            node = ready.pop()
+            order.append(node)
+            for user in self.users.get(node, ()):
+                pending[user] -= 1
+                if pending[user] == 0:
+                    ready.append(user)
+
+        self.cyclic = nodes - set(order)
+        order.extend(sorted(self.cyclic))
+        self.ord = {n: i for i, n in enumerate(order)}
+        self._next_ord = len(order)
+
+    def _position(self, node):
+        if node not in self.ord:
+            self.ord[node] = self._next_ord
+            self._next_ord += 1
+        return self.ord[node]
+
+    def _link(self, component_id, product_id):
+        self.edges[(component_id, product_id)] += 1
+        self.users[component_id].add(product_id)
+        self.components[product_id].add(component_id)
+
+    def _unlink(self, component_id, product_id):
+        edge = (component_id, product_id)
+        if edge not in self.edges:
+            return
+        self.edges[edge] -= 1
+        if self.edges[edge] <= 0:
+            del self.edges[edge]
+            self.users[component_id].discard(product_id)
+            self.components[product_id].discard(component_id)
+
+    # --------------------------------------------------------
+    # البحث
+    # --------------------------------------------------------
+    def _forward(self, start, target, upper):
+        """
+        مسار من start إلى target عبر "من يستخدم" مع ord <= upper.
+        ترجع (path أو None, العقد التي تمت زيارتها).
+        """
+        parent = {start: None}
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            if node == target:
+                path = []
+                while node is not None:
+                    path.append(node)
+                    node = parent[node]
+                return path[::-1], set(parent)
+            for user in self.users.get(node, ()):
+                if user not in parent and self.ord.get(user, -1) <= upper:
+                    parent[user] = node
+                    stack.append(user)
+        return None, set(parent)
+
+    def _backward(self, start, lower):
+        seen = {start}
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            for comp in self.components.get(node, ()):
+                if comp not in seen and self.ord.get(comp, -1) > lower:
+                    seen.add(comp)
+                    stack.append(comp)
+        return seen
+
+    # --------------------------------------------------------
+    # تحديث الحواف (من الإشارات)
+    # --------------------------------------------------------
+    def add_edge(self, component_id, product_id):
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            is_new = (component_id, product_id) not in self.edges
+            self._link(component_id, product_id)
+            if not is_new:
+                return
+            if self.cyclic:
+                # الترتيب غير صالح مع وجود دوران: إعادة بنائه من الحواف في الذاكرة
+                self._build_order()
+                return
+
+            lower, upper = self._position(product_id), self._position(component_id)
+            if upper < lower:
+                return
+
+            path, forward = self._forward(product_id, component_id, upper)
+            if path is not None:
+                # حافة حُفظت بدون validate_component: نفس نتيجة reload
+                # (منتجات الدوران + ما يعتمد عليها)
+                self._build_order()
+                return
+
+            backward = self._backward(component_id, lower)
+            nodes = sorted(backward, key=self.ord.get) + sorted(forward, key=self.ord.get)
+            slots = sorted(self.ord[n] for n in nodes)
+            for node, slot in zip(nodes, slots):
+                self.ord[node] = slot
+
+    def remove_edge(self, component_id, product_id):
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            self._unlink(component_id, product_id)
+            if self.cyclic and (component_id, product_id) not in self.edges:
+                # قد تكون الحافة المحذوفة هي التي تصنع الدوران
+                self._build_order()
+
+    def item_saved(self, item_id, bom_id, component_id, product_id=None):
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            if product_id is None:
+                product_id = self.bom_product.get(bom_id)
+            else:
+                self.bom_product[bom_id] = product_id
+
+            old = self.item_edge.pop(item_id, None)
+            if old is not None:
+                self.remove_edge(*old)
+            if component_id is not None and product_id is not None:
+                self.item_edge[item_id] = (component_id, product_id)
+                self.add_edge(component_id, product_id)
+
+    def item_deleted(self, item_id):
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            old = self.item_edge.pop(item_id, None)
+            if old is not None:
+                self.remove_edge(*old)
+
+    def bom_saved(self, bom_id, product_id):
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            if self.bom_product.get(bom_id, product_id) != product_id:
+                # تغيّر منتج الوصفة → الأبسط إعادة التحميل
+                self.invalidate()
+                return
+            self.bom_product[bom_id] = product_id
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    # --------------------------------------------------------
+    # الإحصائيات
+    # --------------------------------------------------------
+    def stats(self):
+        from .models import BillOfMaterial, Product
+
+        with self._lock:
+            self._ensure_loaded()
+
+            products = dict(Product.objects.values_list("id", "is_semi_finished"))
+            with_bom = set(
+                BillOfMaterial.objects.filter(is_active=True).values_list("product_id", flat=True)
+            )
+
+            # العمق: أطول سلسلة مكوّنات (بالترتيب الطوبولوجي)
+            depth = {}
+            for node in sorted(self.ord, key=self.ord.get):
+                if node in self.cyclic:
+                    continue
+                depth[node] = 1 + max(
+                    (depth.get(c, 0) for c in self.components.get(node, ())), default=0
+                )
+
+            fan_out = [len(c) for c in self.components.values() if c]
+            fan_in = [len(u) for u in self.users.values() if u]
+
+            # منتجات نصف مصنعة لا يصل إليها أي منتج نهائي
+            reachable = set()
+            stack = [p for p, semi in products.items() if not semi]
+            while stack:
+                node = stack.pop()
+                if node in reachable:
+                    continue
+                reachable.add(node)
+                stack.extend(self.components.get(node, ()))
+            unreachable = sorted(p for p, semi in products.items() if semi and p not in reachable)
+
+            return {
+                "products": len(products),
+                "edges": len(self.edges),
+                "max_depth": max(depth.values(), default=0),
+                "max_fan_out": max(fan_out, default=0),
+                "avg_fan_out": round(sum(fan_out) / len(fan_out), 2) if fan_out else 0,
+                "max_fan_in": max(fan_in, default=0),
+                "cyclic_products": sorted(self.cyclic),
+                "unreachable_products": unreachable,
+                "products_without_bom": sorted(set(products) - with_bom),
+            }
+
+
+bom_graph = BOMGraph()
+
+
+# --------------------------------------------------------
+# واجهات مختصرة
+# --------------------------------------------------------
+def find_cycle(product_id, component_id):
+    """
+    لو إضافة component_id لوصفة product_id تصنع دورانًا ترجع المسار
+    [product_id, ..., component_id] (كل منتج يدخل في وصفة التالي)، وإلا None.
+
+    من قاعدة البيانات: كل وصفات المكوّن (الفعّالة وغير الفعّالة) مستوى بمستوى.
+    """
+    from .models import BOMItem
+
+    if product_id == component_id:
+        return [product_id]
+
+    used_by = {component_id: None}      # منتج -> المنتج الذي يستخدمه (في الشجرة)
+    frontier = {component_id}
+    while frontier:
+        rows = (
+            BOMItem.objects.filter(bom__product_id__in=frontier, component_product__isnull=False)
+            .values_list("bom__product_id", "component_product_id")
+            .distinct()
+        )
+        frontier = set()
+        for owner_id, child_id in rows:
+            if child_id in used_by:
+                continue
+            used_by[child_id] = owner_id
+            if child_id == product_id:
+                path = []
+                node = product_id
+                while node is not None:
+                    path.append(node)
+                    node = used_by[node]
+                return path
+            frontier.add(child_id)
+    return None
+
+
+def validate_component(product_id, component_id):
+    """ValidationError لو استخدام component_id في وصفة product_id يصنع دورانًا."""
+    if product_id is None or component_id is None:
+        return
+    path = find_cycle(product_id, component_id)
+    if path is None:
+        return
+
+    from .models import Product
+
+    codes = dict(Product.objects.filter(pk__in=path).values_list("id", "code"))
+    chain = " → ".join(str(codes.get(p, p)) for p in path + [product_id])
+    raise ValidationError(
+        f"لا يمكن استخدام هذا المكوّن: يصنع دورانًا في الوصفات ({chain}).",
+        code="bom_cycle",
+    )
+
+
+def validate_components(product_id, component_ids):
+    for component_id in component_ids:
+        validate_component(product_id, component_id)
+
+
+def graph_stats():
+    return bom_graph.stats()
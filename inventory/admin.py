@@ -16,7 +16,7 @@ from .models import (
     InventoryIssueLine,
 )
 from .forms import StockCountImportForm
-from costing.models import RawMaterial, Product, Unit
+from costing.models import RawMaterial, Product, Unit, round3
 
 
 class StockCountLineInline(admin.TabularInline):
@@ -52,6 +52,7 @@ class StockCountLineInline(admin.TabularInline):
 class StockCountAdmin(admin.ModelAdmin):
     list_display = ("period", "count_type", "total_quantity_display", "total_cost_display")
     list_filter = ["type"]
+    list_select_related = ("period",)
     inlines = [StockCountLineInline]
     readonly_fields = ("total_cost_display",)
     fields = ("period", "count_type", "count_date", "notes", "total_cost_display")
@@ -59,21 +60,20 @@ class StockCountAdmin(admin.ModelAdmin):
 
     
 
+    # الإجماليات المخزنة على الرأس: بدون استعلام لكل صف في القائمة
     def total_quantity_display(self, obj):
-        return obj.total_quantity()
+        return round3(obj.lines_total_quantity)
     total_quantity_display.short_description = "إجمالي الكمية"
 
     def total_cost_display(self, obj):
-        return obj.total_cost()
+        return round3(obj.lines_total_cost)
     total_cost_display.short_description = "إجمالي تكلفة الجرد"
 
     @admin.action(description="🔄 تحديث التكاليف المحفوظة")
     def update_costs(self, request, queryset):
         updated = 0
-        for stock_count in queryset:
-            for line in stock_count.lines.all():
-                line.save()  # يحفظ التكلفة الجديدة
-                updated += 1
+        for stock_count in queryset.select_related("period"):
+            updated += stock_count.recost_lines()  # يحفظ التكلفة الجديدة دفعة واحدة
         self.message_user(request, f"تم تحديث التكاليف لـ {updated} بند.", level=messages.SUCCESS)
 
     actions = [update_costs]
@@ -220,3 +220,94 @@ class BomTreeReportAdmin(admin.ModelAdmin):
     def changelist_view(self, request, extra_context=None):
         url = reverse("inventory:bom_tree_report")  # نفس اسم الـ URL الذي استخدمناه
         return redirect(url)
+
+
+from .models import StockCheckpoint, StockMovement
+
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    """دفتر الحركة إضافة فقط: للعرض (يكتبه inventory/ledger.py)."""
+    list_display = ("movement_date", "period", "raw_material", "source", "source_id", "quantity", "balance_after")
+    list_filter = ("source", "period")
+    search_fields = ("raw_material__name", "raw_material__sku")
+    list_select_related = ("period", "raw_material")
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(StockCheckpoint)
+class StockCheckpointAdmin(admin.ModelAdmin):
+    list_display = (
+        "period", "raw_material", "opening_qty", "purchases_qty", "sales_qty",
+        "issues_qty", "closing_adjustment_qty", "closing_qty",
+    )
+    list_filter = ("period",)
+    search_fields = ("raw_material__name", "raw_material__sku")
+    list_select_related = ("period", "raw_material")
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+from .models import StockCostLayer, StockValuation
+
+
+@admin.register(StockValuation)
+class StockValuationAdmin(admin.ModelAdmin):
+    list_display = (
+        "period", "raw_material", "method", "opening_value", "purchases_value",
+        "sales_value", "issues_value", "adjustment_value", "closing_qty", "closing_value",
+    )
+    list_filter = ("method", "period")
+    search_fields = ("raw_material__name", "raw_material__sku")
+    list_select_related = ("period", "raw_material")
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(StockCostLayer)
+class StockCostLayerAdmin(admin.ModelAdmin):
+    list_display = ("period", "raw_material", "method", "position", "quantity", "unit_cost")
+    list_filter = ("method", "period")
+    search_fields = ("raw_material__name", "raw_material__sku")
+    list_select_related = ("period", "raw_material")
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+from .models import StockLedgerJob
+
+
+@admin.register(StockLedgerJob)
+class StockLedgerJobAdmin(admin.ModelAdmin):
+    list_display = (
+        "id", "period", "status", "requests_count", "movements_added",
+        "requested_at", "started_at", "finished_at",
+    )
+    list_filter = ("status", "period")
+    readonly_fields = (
+        "period", "status", "requests_count", "movements_added", "error",
+        "requested_at", "started_at", "heartbeat_at", "finished_at",
+    )
+
+    def has_add_permission(self, request):
+        return False
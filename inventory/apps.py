@@ -3,4 +3,8 @@ from django.apps import AppConfig
 class InventoryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'inventory'
-    verbose_name = 'المستودعات'
\ No newline at end of file
+    verbose_name = 'المستودعات'
+
+    def ready(self):
+        # مطابقة دفتر حركة المخزون عند تعديل المشتريات/الصرف/الجرد
+        from . import signals  # noqa: F401
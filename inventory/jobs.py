@@ -0,0 +1,132 @@
+# inventory/jobs.py
+"""
+طابور مطابقة دفتر حركة المخزون (نفس أسلوب sales/jobs.py، بدون وسيط خارجي).
+
+- schedule_ledger_sync (inventory/ledger.py) يستدعي enqueue_ledger_sync بعد الـ commit
+  عند INVENTORY_LEDGER_ASYNC=True (الافتراضي)، وإلا يطابق مباشرة.
+- enqueue_ledger_sync: الطلبات المتكررة لنفس الفترة تُدمج في مهمة منتظرة واحدة.
+- claim_ledger_jobs / run_ledger_jobs / run_pending_ledger: يستخدمها أمر run_consumption_worker؛
+  كل الفترات المنتظرة تُطابق معًا (المطابقة تعيد تسوية كل الفترات التالية لأقدمها أصلًا).
+- requeue_stuck_ledger_jobs: مثل مهام الاستهلاك، بالنبضة (heartbeat_at) لا بمدة التنفيذ.
+- ledger_status: هل توجد مطابقة منتظرة / فاشلة للفترة (للتقارير).
+"""
+import traceback
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from sales.jobs import heartbeat, stuck_filter
+
+from .models import StockLedgerJob
+
+
+def ledger_async_enabled():
+    # الافتراضي الطابور: المطابقة المباشرة تقفل وتعيد تقييم كل الفترات التالية داخل طلب HTTP
+    return getattr(settings, "INVENTORY_LEDGER_ASYNC", True)
+
+
+# --------------------------------------------------------
+# التسجيل
+# --------------------------------------------------------
+@transaction.atomic
+def enqueue_ledger_sync(period_ids):
+    """مهمة منتظرة واحدة لكل فترة: لو موجودة يزيد عدد الطلبات فقط."""
+    period_ids = set(period_ids)
+    pending = set(
+        StockLedgerJob.objects.select_for_update()
+        .filter(period_id__in=period_ids, status=StockLedgerJob.STATUS_PENDING)
+        .values_list("period_id", flat=True)
+    )
+    if pending:
+        StockLedgerJob.objects.filter(
+            period_id__in=pending, status=StockLedgerJob.STATUS_PENDING
+        ).update(requests_count=F("requests_count") + 1, requested_at=timezone.now())
+    StockLedgerJob.objects.bulk_create(
+        [StockLedgerJob(period_id=period_id) for period_id in period_ids - pending]
+    )
+
+
+# --------------------------------------------------------
+# التنفيذ
+# --------------------------------------------------------
+@transaction.atomic
+def claim_ledger_jobs():
+    """
+    كل المهام المنتظرة دفعة واحدة، ما لم تكن هناك مطابقة قيد التنفيذ (عامل واحد في المرة).
+    الاستلام UPDATE مشروط بالحالة: من يخسر السباق لا يستلم المهمة نفسها مرتين.
+    """
+    if StockLedgerJob.objects.filter(status=StockLedgerJob.STATUS_RUNNING).exists():
+        return []
+    ids = list(
+        StockLedgerJob.objects.filter(status=StockLedgerJob.STATUS_PENDING).values_list("pk", flat=True)
+    )
+    if not ids:
+        return []
+    now = timezone.now()
+    StockLedgerJob.objects.filter(pk__in=ids, status=StockLedgerJob.STATUS_PENDING).update(
+        status=StockLedgerJob.STATUS_RUNNING, started_at=now, heartbeat_at=now
+    )
+    return list(
+        StockLedgerJob.objects.select_related("period")
+        .filter(pk__in=ids, status=StockLedgerJob.STATUS_RUNNING, started_at=now)
+    )
+
+
+def run_ledger_jobs(jobs):
+    """
+    مطابقة واحدة لكل فترات المهام المستلمة؛ الخطأ يُحفظ في المهام ولا يوقف العامل.
+    النتيجة تُكتب فقط للمهام التي ما زالت مستلمة من هذا العامل (نفس started_at).
+    """
+    from .ledger import sync_stock_ledger
+
+    if not jobs:
+        return jobs
+    claimed = StockLedgerJob.objects.filter(
+        pk__in=[job.pk for job in jobs], status=StockLedgerJob.STATUS_RUNNING, started_at=jobs[0].started_at
+    )
+    with heartbeat(claimed):
+        try:
+            added = sync_stock_ledger({job.period_id for job in jobs})
+            fields = {"status": StockLedgerJob.STATUS_DONE, "error": "", "movements_added": added}
+        except Exception:
+            fields = {"status": StockLedgerJob.STATUS_FAILED, "error": traceback.format_exc(), "movements_added": None}
+
+    fields["finished_at"] = timezone.now()
+    claimed.update(**fields)
+    for job in jobs:
+        for name, value in fields.items():
+            setattr(job, name, value)
+    return jobs
+
+
+def run_pending_ledger():
+    """تنفيذ المطابقات المنتظرة حتى يفرغ الطابور؛ ترجع المهام المنفّذة."""
+    done = []
+    while True:
+        jobs = claim_ledger_jobs()
+        if not jobs:
+            return done
+        done.extend(run_ledger_jobs(jobs))
+
+
+def requeue_stuck_ledger_jobs(timeout=None):
+    """مهام "قيد التنفيذ" توقفت نبضتها (عامل توقف فجأة) تعود للانتظار؛ ترجع عددها."""
+    return StockLedgerJob.objects.filter(stuck_filter(timeout), status=StockLedgerJob.STATUS_RUNNING).update(
+        status=StockLedgerJob.STATUS_PENDING, started_at=None, heartbeat_at=None,
+    )
+
+
+# --------------------------------------------------------
+# الحالة
+# --------------------------------------------------------
+def ledger_status(period):
+    """{"stale": مطابقة منتظرة/قيد التنفيذ، "failed": آخر مطابقة فشلت} للفترة."""
+    if period is None:
+        return {"stale": False, "failed": False}
+    last = StockLedgerJob.objects.filter(period=period).order_by("-id").values_list("status", flat=True).first()
+    return {
+        "stale": last in (StockLedgerJob.STATUS_PENDING, StockLedgerJob.STATUS_RUNNING),
+        "failed": last == StockLedgerJob.STATUS_FAILED,
+    }
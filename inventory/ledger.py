@@ -0,0 +1,365 @@
+# inventory/ledger.py
+"""
+دفتر حركة المخزون الدائم (StockMovement) وأرصدة نهاية الفترات (StockCheckpoint).
+
+المصادر (كل الكميات بوحدة التخزين):
+- purchase: سطر مشتريات (+) بتاريخ أول الفترة.
+- sales: المنصرف للمبيعات لكل مادة (-) من SalesConsumption بتاريخ آخر الفترة.
+- issue: سطر صرف لأغراض أخرى (-) بتاريخ الحركة (داخل حدود الفترة).
+- opening / closing: تسوية الجرد = الكمية المجردة - الرصيد الدفتري قبلها،
+  بأول / آخر الفترة. المادة غير المجردة لا تُسوّى (رصيدها يُرحّل كما هو).
+
+sync_stock_ledger تطابق الدفتر مع المصادر: لكل (مصدر، سطر، مادة) الفرق بين الكمية
+المطلوبة ومجموع المسجّل يُضاف كحركة جديدة (لا تعديل ولا حذف). بعدها تُعاد تسوية جرد
+الفترات التالية (رصيدها الافتتاحي تغيّر)، ويُعاد حساب balance_after للمواد المتأثرة
+من أول الفترة فقط، وتُحدّث أرصدة نهاية الفترات وتقييمها (inventory/valuation.py).
+
+الاستدعاء: schedule_ledger_sync من الإشارات (inventory/signals.py) ومن توليد استهلاك
+المبيعات (في الطابور افتراضيًا، INVENTORY_LEDGER_ASYNC و inventory/jobs.py)،
+أو python manage.py rebuild_stock_ledger.
+"""
+import threading
+from decimal import Decimal, ROUND_HALF_UP
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Sum
+
+from expenses.models import Period
+from purchases.models import PurchaseSummaryLine
+
+from .models import InventoryIssueLine, StockCheckpoint, StockCountLine, StockMovement
+from .movement import INGREDIENT, STORAGE, _Converter, _sales_consumption
+from .valuation import value_stock
+
+D0 = Decimal("0")
+Q6 = Decimal("0.000001")
+
+OPENING = StockMovement.SOURCE_OPENING
+PURCHASE = StockMovement.SOURCE_PURCHASE
+SALES = StockMovement.SOURCE_SALES
+ISSUE = StockMovement.SOURCE_ISSUE
+CLOSING = StockMovement.SOURCE_CLOSING
+
+COUNT_SOURCES = (OPENING, CLOSING)
+
+_SEQ = {OPENING: 0, CLOSING: 2}
+
+# StockCheckpoint field لكل مصدر
+_CHECKPOINT_FIELDS = {
+    OPENING: "opening_adjustment_qty",
+    PURCHASE: "purchases_qty",
+    SALES: "sales_qty",
+    ISSUE: "issues_qty",
+    CLOSING: "closing_adjustment_qty",
+}
+
+
+def _q(value):
+    # مجموع SQLite للأعمدة العشرية يرجع بدقة float: نقرّب كل ما يُقرأ من الدفتر
+    return (value or D0).quantize(Q6, rounding=ROUND_HALF_UP)
+
+
+def _clamp(day, period):
+    if day is None or day < period.start_date:
+        return period.start_date
+    return min(day, period.end_date)
+
+
+# --------------------------------------------------------
+# مطابقة فترة واحدة
+# --------------------------------------------------------
+def _posted(period):
+    """{(source, source_id, raw_id): {التاريخ: مجموع المسجّل}}."""
+    posted = {}
+    for source, source_id, raw_id, day, qty in (
+        StockMovement.objects.filter(period=period)
+        .values("source", "source_id", "raw_material_id", "movement_date")
+        .annotate(q=Sum("quantity"))
+        .values_list("source", "source_id", "raw_material_id", "movement_date", "q")
+    ):
+        qty = _q(qty)
+        if qty:
+            posted.setdefault((source, source_id, raw_id), {})[day] = qty
+    return posted
+
+
+def _balances_before(period):
+    """{raw_id: الرصيد قبل أول الفترة}."""
+    return {
+        raw_id: _q(qty)
+        for raw_id, qty in StockMovement.objects.filter(period__start_date__lt=period.start_date)
+        .values("raw_material_id")
+        .annotate(q=Sum("quantity"))
+        .values_list("raw_material_id", "q")
+    }
+
+
+def _sync_period(period, counts_only=False):
+    """
+    يضيف حركات الفرق للفترة؛ ترجع (عدد الحركات، المواد التي تغيّرت حركتها).
+    counts_only: مصادر الفترة لم تتغيّر، فقط تسوية الجرد (تغيّر الرصيد قبلها).
+    """
+    counts = list(
+        StockCountLine.objects.filter(
+            stock_count__period=period, stock_count__type__in=COUNT_SOURCES, raw_material__isnull=False,
+        ).values_list("stock_count__type", "raw_material_id", "unit_id", "quantity")
+    )
+    if counts_only:
+        purchases, issues, sales = [], [], {}
+    else:
+        purchases = list(
+            PurchaseSummaryLine.objects.filter(summary__period=period)
+            .values_list("id", "raw_material_id", "purchase_unit_id", "quantity")
+        )
+        issues = list(
+            InventoryIssueLine.objects.filter(inventory_issue__period=period)
+            .values_list("id", "raw_material_id", "unit_id", "quantity", "inventory_issue__issue_date")
+        )
+        sales = _sales_consumption(period, None)
+
+    posted = _posted(period)
+    prior = _balances_before(period)
+
+    raw_ids = (
+        {r for _, r, _, _ in counts} | {r for _, r, _, _ in purchases}
+        | {r for _, r, _, _, _ in issues} | set(sales) | {key[2] for key in posted}
+    )
+    convert = _Converter(raw_ids, STORAGE)
+
+    wanted = {}   # key -> (الكمية, التاريخ)
+    for pk, raw_id, unit_id, qty in purchases:
+        wanted[(PURCHASE, pk, raw_id)] = (_q(convert(raw_id, qty, unit_id)), period.start_date)
+    for pk, raw_id, unit_id, qty, day in issues:
+        wanted[(ISSUE, pk, raw_id)] = (-_q(convert(raw_id, qty, unit_id)), _clamp(day, period))
+    for raw_id, qty in sales.items():
+        if qty:
+            wanted[(SALES, None, raw_id)] = (-_q(convert(raw_id, qty, kind=INGREDIENT)), period.end_date)
+
+    # حركة الفترة بدون الجرد (المصادر لم تتغيّر في counts_only: المسجّل هو المطلوب)
+    flow = {}
+    if counts_only:
+        for (source, _, raw_id), days in posted.items():
+            if source not in COUNT_SOURCES:
+                flow[raw_id] = flow.get(raw_id, D0) + sum(days.values(), D0)
+    else:
+        for (_, _, raw_id), (qty, _) in wanted.items():
+            flow[raw_id] = flow.get(raw_id, D0) + qty
+
+    counted = {OPENING: {}, CLOSING: {}}
+    for count_type, raw_id, unit_id, qty in counts:
+        bucket = counted[count_type]
+        bucket[raw_id] = bucket.get(raw_id, D0) + convert(raw_id, qty, unit_id)
+
+    for raw_id, qty in counted[OPENING].items():
+        wanted[(OPENING, None, raw_id)] = (_q(qty) - prior.get(raw_id, D0), period.start_date)
+    for raw_id, qty in counted[CLOSING].items():
+        opening = prior.get(raw_id, D0) + wanted.get((OPENING, None, raw_id), (D0, None))[0]
+        wanted[(CLOSING, None, raw_id)] = (_q(qty) - opening - flow.get(raw_id, D0), period.end_date)
+
+    new = []
+
+    def post(key, qty, day):
+        source, source_id, raw_id = key
+        new.append(StockMovement(
+            raw_material_id=raw_id, period=period, movement_date=day, seq=_SEQ.get(source, 1),
+            source=source, source_id=source_id, quantity=qty,
+        ))
+
+    for key in set(wanted) | set(posted):
+        if counts_only and key[0] not in COUNT_SOURCES:
+            continue
+        qty, day = wanted.get(key, (D0, None))
+        days = posted.get(key, {})
+        # المسجّل في تاريخ آخر (تغيّر تاريخ الحركة أو حُذف المصدر) يُعكس في تاريخه
+        for posted_day, posted_qty in days.items():
+            if posted_day != day:
+                post(key, -posted_qty, posted_day)
+        delta = qty - days.get(day, D0)
+        if day is not None and delta:
+            post(key, delta, day)
+
+    StockMovement.objects.bulk_create(new, batch_size=2000)
+    return len(new), {m.raw_material_id for m in new}
+
+
+# --------------------------------------------------------
+# الأرصدة
+# --------------------------------------------------------
+def _restate_balances(raw_ids, from_date):
+    """إعادة حساب balance_after للمواد raw_ids من from_date (تحديث الفرق فقط)."""
+    if not raw_ids:
+        return 0
+    raw_ids = list(raw_ids)
+    running = {
+        raw_id: _q(qty)
+        for raw_id, qty in StockMovement.objects.filter(raw_material_id__in=raw_ids, movement_date__lt=from_date)
+        .values("raw_material_id")
+        .annotate(q=Sum("quantity"))
+        .values_list("raw_material_id", "q")
+    }
+    changed = []
+    for pk, raw_id, qty, balance in (
+        StockMovement.objects.filter(raw_material_id__in=raw_ids, movement_date__gte=from_date)
+        .order_by("raw_material_id", "movement_date", "seq", "id")
+        .values_list("id", "raw_material_id", "quantity", "balance_after")
+        .iterator(chunk_size=5000)
+    ):
+        running[raw_id] = running.get(raw_id, D0) + qty
+        if running[raw_id] != balance:
+            changed.append(StockMovement(pk=pk, balance_after=running[raw_id]))
+    StockMovement.objects.bulk_update(changed, ["balance_after"], batch_size=2000)
+    return len(changed)
+
+
+def _refresh_checkpoints(periods):
+    """
+    أرصدة نهاية الفترات periods (مرتبة، متتالية حتى آخر فترة):
+    صف لكل مادة لها حركة في الفترة أو رصيد مرحّل غير صفري.
+    """
+    if not periods:
+        return
+    running = _balances_before(periods[0])
+    sums = {}
+    for period_id, raw_id, source, qty in (
+        StockMovement.objects.filter(period__in=periods)
+        .values("period_id", "raw_material_id", "source")
+        .annotate(q=Sum("quantity"))
+        .values_list("period_id", "raw_material_id", "source", "q")
+    ):
+        sums.setdefault(period_id, {}).setdefault(raw_id, {})[source] = _q(qty)
+
+    existing = {
+        (cp.period_id, cp.raw_material_id): cp
+        for cp in StockCheckpoint.objects.filter(period__in=periods)
+    }
+    value_fields = ["opening_qty", "closing_qty", *_CHECKPOINT_FIELDS.values()]
+
+    to_create, to_update = [], []
+    for period in periods:
+        moves = sums.get(period.pk, {})
+        for raw_id in set(moves) | {r for r, q in running.items() if q}:
+            by_source = moves.get(raw_id, {})
+            before = running.get(raw_id, D0)
+            values = {field: by_source.get(source, D0) for source, field in _CHECKPOINT_FIELDS.items()}
+            values["opening_qty"] = before + values["opening_adjustment_qty"]
+            values["closing_qty"] = before + sum(by_source.values(), D0)
+            running[raw_id] = values["closing_qty"]
+
+            cp = existing.pop((period.pk, raw_id), None)
+            if cp is None:
+                to_create.append(StockCheckpoint(period=period, raw_material_id=raw_id, **values))
+            elif any(getattr(cp, f) != v for f, v in values.items()):
+                for f, v in values.items():
+                    setattr(cp, f, v)
+                to_update.append(cp)
+
+    if existing:
+        StockCheckpoint.objects.filter(pk__in=[cp.pk for cp in existing.values()]).delete()
+    StockCheckpoint.objects.bulk_update(to_update, value_fields, batch_size=2000)
+    StockCheckpoint.objects.bulk_create(to_create, batch_size=2000)
+
+
+# --------------------------------------------------------
+# نقطة الدخول
+# --------------------------------------------------------
+@transaction.atomic
+def sync_stock_ledger(periods=None):
+    """
+    مطابقة الدفتر مع المصادر للفترات periods (Period أو id؛ None = كل الفترات)
+    ثم تسوية جرد كل الفترات التالية لأقدمها. ترجع عدد الحركات المضافة.
+    """
+    timeline = Period.objects.order_by("start_date", "id")
+    if periods is None:
+        full = None
+    else:
+        full = {getattr(p, "pk", p) for p in periods}
+        first = timeline.filter(pk__in=full).first()
+        if first is None:
+            return 0
+        timeline = timeline.filter(start_date__gte=first.start_date)
+
+    # قفل الفترات بالترتيب: مطابقتان متزامنتان لا تسجّلان نفس الفرق مرتين
+    timeline = list(timeline.select_for_update())
+    if not timeline:
+        return 0
+
+    touched = set()
+    added = 0
+    for period in timeline:
+        count, raw_ids = _sync_period(period, counts_only=full is not None and period.pk not in full)
+        added += count
+        touched |= raw_ids
+
+    _restate_balances(touched, timeline[0].start_date)
+    _refresh_checkpoints(timeline)
+    # التكلفة تتغيّر أيضًا بدون حركة جديدة (تعديل سعر شراء): التقييم يُعاد دائمًا
+    value_stock(timeline)
+    return added
+
+
+def rebuild_stock_ledger():
+    """مطابقة كل الفترات من أولها (يُستخدم بعد التحميل الأولي أو تعديلات جماعية)."""
+    return sync_stock_ledger(None)
+
+
+_pending = threading.local()
+
+
+def _flush_pending(period_ids):
+    from .jobs import enqueue_ledger_sync, ledger_async_enabled
+
+    if getattr(_pending, "period_ids", None) is period_ids:
+        _pending.period_ids = None
+    if not period_ids:
+        return
+    if ledger_async_enabled():
+        enqueue_ledger_sync(period_ids)
+    else:
+        sync_stock_ledger(period_ids)
+
+
+def _queued(period_ids):
+    """مجموعة الفترات مسجّلة في on_commit للمعاملة الحالية (التراجع يحذف تسجيلها)."""
+    return any(
+        isinstance(func, partial) and func.args and func.args[0] is period_ids
+        for _, func, _ in transaction.get_connection().run_on_commit
+    )
+
+
+def schedule_ledger_sync(period_ids):
+    """
+    تسجيل فترات تغيّرت مصادرها؛ بعد commit المعاملة مرة واحدة: مهمة في الطابور
+    (الافتراضي، inventory/jobs.py) أو مطابقة مباشرة عند INVENTORY_LEDGER_ASYNC=False
+    (أو فورًا لو لا توجد معاملة مفتوحة). فترات معاملة تم التراجع عنها لا تُطابق
+    مع المعاملة التالية.
+    """
+    period_ids = {getattr(p, "pk", p) for p in period_ids if p is not None}
+    if not period_ids:
+        return
+    state = getattr(_pending, "period_ids", None)
+    if state is not None and _queued(state):
+        state.update(period_ids)
+        return
+    state = _pending.period_ids = period_ids
+    transaction.on_commit(partial(_flush_pending, state))
+
+
+# --------------------------------------------------------
+# الاستعلام
+# --------------------------------------------------------
+def on_hand(raw_material, at=None):
+    """
+    رصيد المادة بوحدة التخزين في نهاية يوم at (افتراضيًا آخر حركة):
+    آخر حركة حتى التاريخ من فهرس inv_move_raw_date_idx مباشرة.
+    """
+    qs = StockMovement.objects.filter(raw_material=raw_material)
+    if at is not None:
+        qs = qs.filter(movement_date__lte=at)
+    balance = qs.order_by("-movement_date", "-seq", "-id").values_list("balance_after", flat=True).first()
+    return balance if balance is not None else D0
+
+
+def period_balances(period):
+    """{raw_id: StockCheckpoint} لنهاية الفترة."""
+    return {cp.raw_material_id: cp for cp in StockCheckpoint.objects.filter(period=period)}
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from expenses.models import Period
+from inventory.ledger import sync_stock_ledger
+
+
+class Command(BaseCommand):
+    help = (
+        "مطابقة دفتر حركة المخزون (StockMovement) مع المشتريات والاستهلاك والصرف والجرد "
+        "وتحديث أرصدة نهاية الفترات."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--from-period", type=int, default=None,
+            help="id الفترة: مطابقة هذه الفترة وكل ما بعدها فقط (افتراضيًا كل الفترات).",
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        periods = None
+        if options["from_period"]:
+            start = Period.objects.get(pk=options["from_period"]).start_date
+            periods = list(Period.objects.filter(start_date__gte=start).values_list("id", flat=True))
+
+        added = sync_stock_ledger(periods)
+        self.stdout.write(self.style.SUCCESS(
+            f"حركات مضافة: {added} | {time.perf_counter() - started:.2f} ث"
+        ))
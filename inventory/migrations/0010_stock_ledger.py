@@ -0,0 +1,57 @@
+# Generated by Django 5.2.9 on 2026-10-18 02:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('costing', '0013_bom_paths'),
+        ('expenses', '0008_period_allow_opening_stock_and_more'),
+        ('inventory', '0009_remove_stockcount_is_submitted_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('opening_adjustment_qty', models.DecimalField(decimal_places=6, default=0, max_digits=20, verbose_name='تسوية جرد أول الفترة')),
+                ('opening_qty', models.DecimalField(decimal_places=6, default=0, max_digits=20, verbose_name='رصيد أول الفترة')),
+                ('purchases_qty', models.DecimalField(decimal_places=6, default=0, max_digits=20, verbose_name='المشتريات')),
+                ('sales_qty', models.DecimalField(decimal_places=6, default=0, max_digits=20, verbose_name='المنصرف للمبيعات')),
+                ('issues_qty', models.DecimalField(decimal_places=6, default=0, max_digits=20, verbose_name='المنصرف لأغراض أخرى')),
+                ('closing_adjustment_qty', models.DecimalField(decimal_places=6, default=0, max_digits=20, verbose_name='تسوية جرد آخر الفترة')),
+                ('closing_qty', models.DecimalField(decimal_places=6, default=0, max_digits=20, verbose_name='رصيد آخر الفترة')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='تاريخ التحديث')),
+                ('period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_checkpoints', to='expenses.period', verbose_name='الفترة')),
+                ('raw_material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_checkpoints', to='costing.rawmaterial', verbose_name='مادة خام')),
+            ],
+            options={
+                'verbose_name': 'رصيد مادة في نهاية فترة',
+                'verbose_name_plural': 'أرصدة المواد في نهاية الفترات',
+                'unique_together': {('period', 'raw_material')},
+            },
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('movement_date', models.DateField(verbose_name='تاريخ الحركة')),
+                ('seq', models.PositiveSmallIntegerField(default=1, verbose_name='الترتيب')),
+                ('source', models.CharField(choices=[('opening', 'تسوية جرد أول الفترة'), ('purchase', 'مشتريات'), ('sales', 'منصرف للمبيعات'), ('issue', 'منصرف لأغراض أخرى'), ('closing', 'تسوية جرد آخر الفترة')], max_length=20, verbose_name='المصدر')),
+                ('source_id', models.PositiveBigIntegerField(blank=True, null=True, verbose_name='رقم السطر المصدر')),
+                ('quantity', models.DecimalField(decimal_places=6, max_digits=20, verbose_name='الكمية (وحدة التخزين)')),
+                ('balance_after', models.DecimalField(decimal_places=6, default=0, max_digits=20, verbose_name='الرصيد بعد الحركة')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاريخ التسجيل')),
+                ('period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='expenses.period', verbose_name='الفترة')),
+                ('raw_material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='costing.rawmaterial', verbose_name='مادة خام')),
+            ],
+            options={
+                'verbose_name': 'حركة مخزون',
+                'verbose_name_plural': 'دفتر حركة المخزون',
+                'indexes': [models.Index(fields=['raw_material', 'movement_date', 'seq', 'id', 'balance_after'], name='inv_move_raw_date_idx'), models.Index(fields=['period', 'source', 'source_id', 'raw_material', 'quantity'], name='inv_move_source_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.9 on 2026-10-18 02:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('costing', '0013_bom_paths'),
+        ('expenses', '0008_period_allow_opening_stock_and_more'),
+        ('inventory', '0010_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockCostLayer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('method', models.CharField(choices=[('wac', 'متوسط مرجّح دوري'), ('fifo', 'الوارد أولًا صادر أولًا (FIFO)')], max_length=10, verbose_name='طريقة التقييم')),
+                ('position', models.PositiveIntegerField(default=0, verbose_name='الترتيب')),
+                ('quantity', models.DecimalField(decimal_places=6, max_digits=20, verbose_name='الكمية (وحدة التخزين)')),
+                ('unit_cost', models.DecimalField(decimal_places=6, max_digits=20, verbose_name='تكلفة وحدة التخزين')),
+                ('period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_cost_layers', to='expenses.period', verbose_name='الفترة')),
+                ('raw_material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_cost_layers', to='costing.rawmaterial', verbose_name='مادة خام')),
+            ],
+            options={
+                'verbose_name': 'طبقة تكلفة مخزون',
+                'verbose_name_plural': 'طبقات تكلفة المخزون',
+                'unique_together': {('period', 'method', 'raw_material', 'position')},
+            },
+        ),
+        migrations.CreateModel(
+            name='StockValuation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('method', models.CharField(choices=[('wac', 'متوسط مرجّح دوري'), ('fifo', 'الوارد أولًا صادر أولًا (FIFO)')], max_length=10, verbose_name='طريقة التقييم')),
+                ('opening_qty', models.DecimalField(decimal_places=6, default=0, max_digits=20, verbose_name='كمية أول الفترة')),
+                ('opening_value', models.DecimalField(decimal_places=4, default=0, max_digits=20, verbose_name='قيمة أول الفترة')),
+                ('purchases_qty', models.DecimalField(decimal_places=6, default=0, max_digits=20, verbose_name='كمية المشتريات')),
+                ('purchases_value', models.DecimalField(decimal_places=4, default=0, max_digits=20, verbose_name='قيمة المشتريات')),
+                ('sales_qty', models.DecimalField(decimal_places=6, default=0, max_digits=20, verbose_name='المنصرف للمبيعات')),
+                ('sales_value', models.DecimalField(decimal_places=4, default=0, max_digits=20, verbose_name='تكلفة المبيعات')),
+                ('issues_qty', models.DecimalField(decimal_places=6, default=0, max_digits=20, verbose_name='المنصرف لأغراض أخرى')),
+                ('issues_value', models.DecimalField(decimal_places=4, default=0, max_digits=20, verbose_name='قيمة المنصرف لأغراض أخرى')),
+                ('adjustment_qty', models.DecimalField(decimal_places=6, default=0, max_digits=20, verbose_name='تسويات الجرد')),
+                ('adjustment_value', models.DecimalField(decimal_places=4, default=0, max_digits=20, verbose_name='قيمة تسويات الجرد')),
+                ('closing_qty', models.DecimalField(decimal_places=6, default=0, max_digits=20, verbose_name='كمية آخر الفترة')),
+                ('closing_value', models.DecimalField(decimal_places=4, default=0, max_digits=20, verbose_name='قيمة آخر الفترة')),
+                ('period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_valuations', to='expenses.period', verbose_name='الفترة')),
+                ('raw_material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_valuations', to='costing.rawmaterial', verbose_name='مادة خام')),
+            ],
+            options={
+                'verbose_name': 'تقييم مخزون مادة',
+                'verbose_name_plural': 'تقييم المخزون',
+                'indexes': [models.Index(fields=['period', 'method', 'raw_material'], name='inv_valuation_period_idx')],
+                'unique_together': {('period', 'raw_material', 'method')},
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.9 on 2026-10-18 03:00
+
+from decimal import ROUND_HALF_UP, Decimal
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_totals(apps, schema_editor):
+    StockCount = apps.get_model("inventory", "StockCount")
+    StockCountLine = apps.get_model("inventory", "StockCountLine")
+    q3 = Decimal("0.001")
+    rows = (
+        StockCountLine.objects.values("stock_count_id")
+        .annotate(q=Sum("quantity"), c=Sum("saved_total_cost"))
+        .values_list("stock_count_id", "q", "c")
+    )
+    for sc_id, qty, cost in rows:
+        StockCount.objects.filter(pk=sc_id).update(
+            lines_total_quantity=Decimal(str(qty or 0)).quantize(q3, rounding=ROUND_HALF_UP),
+            lines_total_cost=Decimal(str(cost or 0)).quantize(q3, rounding=ROUND_HALF_UP),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0011_stock_valuation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockcount',
+            name='lines_total_cost',
+            field=models.DecimalField(decimal_places=4, default=Decimal('0'), editable=False, max_digits=20, verbose_name='إجمالي تكلفة الجرد'),
+        ),
+        migrations.AddField(
+            model_name='stockcount',
+            name='lines_total_quantity',
+            field=models.DecimalField(decimal_places=4, default=Decimal('0'), editable=False, max_digits=20, verbose_name='إجمالي الكمية'),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.9 on 2026-10-18 03:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('costing', '0013_bom_paths'),
+        ('inventory', '0012_stock_count_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockCountLineTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('line_id', models.BigIntegerField(verbose_name='رقم البند المحذوف')),
+                ('revision', models.BigIntegerField(verbose_name='رقم المراجعة')),
+                ('deleted_at', models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الحذف')),
+            ],
+            options={
+                'verbose_name': 'بند جرد محذوف',
+                'verbose_name_plural': 'بنود جرد محذوفة',
+            },
+        ),
+        migrations.AddField(
+            model_name='stockcount',
+            name='revision',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='آخر رقم مراجعة للبنود'),
+        ),
+        migrations.AddField(
+            model_name='stockcountline',
+            name='revision',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='رقم المراجعة'),
+        ),
+        migrations.AddIndex(
+            model_name='stockcountline',
+            index=models.Index(fields=['stock_count', 'revision'], name='inv_scline_revision_idx'),
+        ),
+        migrations.AddField(
+            model_name='stockcountlinetombstone',
+            name='stock_count',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deleted_lines', to='inventory.stockcount', verbose_name='الجرد'),
+        ),
+        migrations.AddIndex(
+            model_name='stockcountlinetombstone',
+            index=models.Index(fields=['stock_count', 'revision'], name='inv_sc_tombstone_rev_idx'),
+        ),
+    ]
@@ -1,25 +1,18 @@
-from django.db import models
+from django.db import models, transaction
 from decimal import Decimal
 from costing.models import RawMaterial, Product, Unit
 from expenses.models import Period
 from decimal import Decimal
 from costing.models import round3
+from costing.cache import cost_cache
+from costing.cost_index import RawCostIndex
+from costing.snapshots import frozen_cost_index
 from functools import cached_property
-from django.db.models import Q, CheckConstraint
+from django.db.models import F, Q, CheckConstraint, Sum
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 
-from decimal import Decimal, ROUND_HALF_UP
-
-def round3(value):
-    """تقريب إلى 3 منازل عشرية مع دعم None."""
-    if value is None:
-        return None
-    if not isinstance(value, Decimal):
-        value = Decimal(str(value))
-    return value.quantize(Decimal("0.000"), rounding=ROUND_HALF_UP)
-
-
+from decimal import Decimal
 
 
 class TimeStampedModel(models.Model):
@@ -54,6 +47,17 @@ class StockCount(TimeStampedModel):
     is_committed = models.BooleanField("تم اعتماد الجرد", default=False)
     committed_at = models.DateTimeField("تاريخ الاعتماد", null=True, blank=True)
 
+    # ✅ إجماليات البنود مخزنة على الرأس (تُحدّث من refresh_totals عند تغيير البنود)
+    lines_total_quantity = models.DecimalField(
+        "إجمالي الكمية", max_digits=20, decimal_places=4, default=Decimal("0"), editable=False
+    )
+    lines_total_cost = models.DecimalField(
+        "إجمالي تكلفة الجرد", max_digits=20, decimal_places=4, default=Decimal("0"), editable=False
+    )
+
+    # ✅ عدّاد مراجعات البنود (مزامنة تفاضلية لشاشة الجرد): يزيد مع كل تعديل/حذف بند
+    revision = models.BigIntegerField("آخر رقم مراجعة للبنود", default=0, editable=False)
+
     def commit(self):
         if not self.is_committed:
             self.is_committed = True
@@ -69,19 +73,112 @@ class StockCount(TimeStampedModel):
     def __str__(self):
         return f"{self.get_type_display()} - {self.period}"
 
+    def _line_totals(self):
+        """(إجمالي الكمية، إجمالي saved_total_cost) باستعلام تجميعي واحد."""
+        agg = self.lines.aggregate(q=Sum("quantity"), c=Sum("saved_total_cost"))
+        return round3(agg["q"] or Decimal("0")), round3(agg["c"] or Decimal("0"))
+
     def total_quantity(self):
-        total = Decimal("0")
-        for line in self.lines.all():
-            total += (line.quantity or Decimal("0"))
-        return round3(total)
+        return self._line_totals()[0]
 
     def total_cost(self):
-        total = Decimal("0")
-        for line in self.lines.all():
-            line_cost = line.line_total_cost()
-            if line_cost is not None:
-                total += line_cost
-        return round3(total)
+        return self._line_totals()[1]
+
+    @classmethod
+    def next_revision(cls, stock_count_id):
+        """
+        حجز رقم المراجعة التالي للجرد (update ذري على الرأس). قفل صف الرأس يبقى حتى
+        نهاية الـ transaction، فلا يرى القارئ رقمًا أحدث من البنود المكتوبة به.
+        """
+        cls.objects.filter(pk=stock_count_id).update(revision=F("revision") + 1)
+        return cls.objects.filter(pk=stock_count_id).values_list("revision", flat=True).get()
+
+    @classmethod
+    def refresh_totals(cls, stock_count_ids):
+        """
+        إعادة حساب lines_total_quantity / lines_total_cost لعدة رؤوس جرد:
+        استعلام تجميعي واحد مجمّع حسب الجرد + update للرأس الذي تغيّرت إجمالياته فقط.
+        يُستدعى من إشارات بنود الجرد (inventory/signals.py) ومن recost_lines.
+        """
+        ids = {i for i in stock_count_ids if i}
+        if not ids:
+            return
+        sums = {
+            sc_id: (round3(q or Decimal("0")), round3(c or Decimal("0")))
+            for sc_id, q, c in StockCountLine.objects.filter(stock_count_id__in=ids)
+            .values("stock_count_id")
+            .annotate(q=Sum("quantity"), c=Sum("saved_total_cost"))
+            .values_list("stock_count_id", "q", "c")
+        }
+        zero = (round3(Decimal("0")), round3(Decimal("0")))
+        for sc_id, qty, cost in cls.objects.filter(id__in=ids).values_list(
+            "id", "lines_total_quantity", "lines_total_cost"
+        ):
+            new_qty, new_cost = sums.get(sc_id, zero)
+            if (round3(qty), round3(cost)) != (new_qty, new_cost):
+                cls.objects.filter(id=sc_id).update(lines_total_quantity=new_qty, lines_total_cost=new_cost)
+
+    def recost_lines(self, cost_index=None, lines=None, fields=()):
+        """
+        إعادة حساب saved_unit_cost / saved_total_cost لكل بنود الجرد دفعة واحدة
+        (نفس قواعد StockCountLine.save بدون save لكل بند):
+        - Opening + تكلفة يدوية => التكلفة اليدوية.
+        - مادة خام => تكلفة المشتريات من RawCostIndex مع تحويل الوحدة.
+        - نصف مصنع => تكلفة الوحدة من costing/rollup.py (مرة واحدة لكل المنتجات).
+        التحقق (clean) في الذاكرة قبل أي كتابة، ثم bulk_update برقم مراجعة واحد. ترجع عدد البنود.
+
+        lines (اختياري): بنود محددة من هذا الجرد (معدلة في الذاكرة، مع raw_material)
+        بدل كل البنود، و fields: حقول إضافية تُكتب معها (مثل quantity / unit).
+        """
+        from costing.rollup import compute_unit_costs
+        from .ledger import schedule_ledger_sync
+
+        period = self.period if self.period_id else None
+        if cost_index is None:
+            cost_index = frozen_cost_index(period) or RawCostIndex(period)
+
+        lines = list(self.lines.select_related("raw_material")) if lines is None else list(lines)
+        semi_ids = {ln.semi_finished_product_id for ln in lines if ln.semi_finished_product_id}
+        semi_costs = compute_unit_costs(period=period, product_ids=semi_ids, cost_index=cost_index) if semi_ids else {}
+
+        errors = []
+        for ln in lines:
+            try:
+                ln.clean_in_count(self)
+            except ValidationError as exc:
+                errors.append(f"{ln}: {'، '.join(exc.messages)}")
+                continue
+
+            if self.type == "opening" and ln.unit_cost_value is not None:
+                unit_cost = round3(ln.unit_cost_value)
+            elif ln.raw_material_id:
+                unit_cost = ln.raw_unit_cost(cost_index)
+            elif ln.semi_finished_product_id:
+                unit_cost = round3(semi_costs.get(ln.semi_finished_product_id))
+            else:
+                unit_cost = None
+
+            ln.saved_unit_cost = unit_cost
+            ln.saved_total_cost = (
+                round3(unit_cost * ln.quantity) if unit_cost is not None and ln.quantity is not None else None
+            )
+
+        if errors:
+            raise ValidationError(errors)
+
+        now = timezone.now()
+        with transaction.atomic():
+            revision = StockCount.next_revision(self.pk)
+            for ln in lines:
+                ln.updated_at = now
+                ln.revision = revision
+            StockCountLine.objects.bulk_update(
+                lines, [*fields, "saved_unit_cost", "saved_total_cost", "updated_at", "revision"], batch_size=1000
+            )
+        # bulk_update لا يرسل post_save → نطابق دفتر المخزون وإجماليات الرأس يدويًا
+        StockCount.refresh_totals([self.pk])
+        schedule_ledger_sync([self.period_id])
+        return len(lines)
 
 
 class StockCountLine(TimeStampedModel):
@@ -141,9 +238,15 @@ class StockCountLine(TimeStampedModel):
         blank=True,
     )
 
+    # رقم مراجعة الجرد عند آخر تعديل للبند (StockCount.next_revision)
+    revision = models.BigIntegerField("رقم المراجعة", default=0, editable=False)
+
     class Meta:
         verbose_name = "بند جرد"
         verbose_name_plural = "بنود الجرد"
+        indexes = [
+            models.Index(fields=["stock_count", "revision"], name="inv_scline_revision_idx"),
+        ]
         constraints = [
             # ✅ لازم يكون أحدهما فقط موجود
             CheckConstraint(
@@ -175,6 +278,15 @@ class StockCountLine(TimeStampedModel):
         if self.stock_count_id and self.stock_count.type == "closing" and self.unit_cost_value is not None:
             raise ValidationError("تكلفة الوحدة اليدوية مسموحة في جرد أول الفترة فقط.")
 
+    def clean_in_count(self, stock_count):
+        """full_clean في الذاكرة لبند من stock_count: حقول FK والقيود تُتحقق في clean بدون استعلامات."""
+        self.stock_count = stock_count
+        self.full_clean(
+            exclude=["stock_count", "raw_material", "semi_finished_product", "unit"],
+            validate_unique=False,
+            validate_constraints=False,
+        )
+
     def save(self, *args, **kwargs):
         # ✅ شغّل clean (خصوصًا مع bulk_create لن يعمل تلقائيًا، لكن في التعديلات العادية نعم)
         if kwargs.pop("validate", True):
@@ -184,15 +296,23 @@ class StockCountLine(TimeStampedModel):
                 # لو لا تريد كسر عمليات داخلية، احذف try/except
                 raise
 
+        cost_index = kwargs.pop("cost_index", None)
+
         # ✅ Opening + تكلفة يدوية => نعتمدها
         if self.stock_count_id and self.stock_count.type == "opening" and self.unit_cost_value is not None:
             self.saved_unit_cost = round3(self.unit_cost_value)
             self.saved_total_cost = round3(self.saved_unit_cost * (self.quantity or Decimal("0")))
         else:
-            self.saved_unit_cost = self.unit_cost()
-            self.saved_total_cost = self.line_total_cost()
+            # التكلفة المحفوظة لا تُقرأ من كاش العملية (قد يكون قديمًا في عملية أخرى)
+            with cost_cache.bypass():
+                self.saved_unit_cost = self.unit_cost(cost_index=cost_index)
+                self.saved_total_cost = self.line_total_cost(cost_index=cost_index)
 
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            self.revision = StockCount.next_revision(self.stock_count_id)
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = {*kwargs["update_fields"], "revision"}
+            super().save(*args, **kwargs)
 
     @cached_property
     def unit_cost_cached(self):
@@ -202,47 +322,89 @@ class StockCountLine(TimeStampedModel):
     def line_total_cost_cached(self):
         return self.line_total_cost()
 
-    def unit_cost(self):
+    def unit_cost(self, cost_index=None):
+        """
+        cost_index (اختياري): RawCostIndex لفترة الجرد، لتفادي استعلام مشتريات لكل بند.
+        """
         period = self.stock_count.period if self.stock_count_id else None
 
+        # ✅ الفترة المقفلة: التكاليف من لقطة الإقفال
+        if cost_index is None:
+            cost_index = frozen_cost_index(period)
+
         # ✅ Opening يدوي
         if self.stock_count_id and self.stock_count.type == "opening" and self.unit_cost_value is not None:
             return round3(self.unit_cost_value)
 
         if self.raw_material:
-            raw = self.raw_material
+            if cost_index is not None:
+                return self.raw_unit_cost(cost_index)
 
+            raw = self.raw_material
             cost = raw.get_cost_from_purchases(period=period)
             if cost is None:
                 cost = raw.get_cost_per_ingredient_unit(period=None)
-            if cost is None:
-                return None
-
-            if self.unit_id:
-                if raw.ingredient_unit_id == self.unit_id:
-                    return round3(cost)
-
-                if raw.storage_unit_id == self.unit_id:
-                    if raw.storage_to_ingredient_factor:
-                        return round3(cost * raw.storage_to_ingredient_factor)
-                    if raw.purchase_price_per_storage_unit:
-                        return round3(raw.purchase_price_per_storage_unit)
-
-            return round3(cost)
+            return self._in_count_unit(cost)
 
         if self.semi_finished_product:
             product = self.semi_finished_product
-            cost = product.compute_unit_cost(period=period)
+            cost = product.compute_unit_cost(period=period, cost_index=cost_index)
             return round3(cost) if cost is not None else None
 
         return None
 
-    def line_total_cost(self):
-        cost = self.unit_cost()
+    def raw_unit_cost(self, cost_index):
+        """تكلفة وحدة الجرد للمادة الخام من RawCostIndex (بدون استعلامات)."""
+        raw_id = self.raw_material_id
+        cost = cost_index.from_purchases(raw_id)
+        if cost is None:
+            cost = cost_index.unfiltered().per_ingredient_unit(raw_id)
+        return self._in_count_unit(cost)
+
+    def _in_count_unit(self, cost):
+        """تكلفة وحدة الاستخدام → وحدة الجرد."""
+        if cost is None:
+            return None
+        raw = self.raw_material
+        if self.unit_id:
+            if raw.ingredient_unit_id == self.unit_id:
+                return round3(cost)
+
+            if raw.storage_unit_id == self.unit_id:
+                if raw.storage_to_ingredient_factor:
+                    return round3(cost * raw.storage_to_ingredient_factor)
+                if raw.purchase_price_per_storage_unit:
+                    return round3(raw.purchase_price_per_storage_unit)
+
+        return round3(cost)
+
+    def line_total_cost(self, cost_index=None):
+        cost = self.unit_cost(cost_index=cost_index)
         if cost is None or self.quantity is None:
             return None
         return round3(cost * self.quantity)
 
+class StockCountLineTombstone(models.Model):
+    """أثر بند جرد محذوف: يُرسل للعميل في المزامنة التفاضلية حتى يحذفه من الشاشة."""
+
+    stock_count = models.ForeignKey(
+        StockCount, on_delete=models.CASCADE, related_name="deleted_lines", verbose_name="الجرد"
+    )
+    line_id = models.BigIntegerField("رقم البند المحذوف")
+    revision = models.BigIntegerField("رقم المراجعة")
+    deleted_at = models.DateTimeField("تاريخ الحذف", auto_now_add=True)
+
+    class Meta:
+        verbose_name = "بند جرد محذوف"
+        verbose_name_plural = "بنود جرد محذوفة"
+        indexes = [
+            models.Index(fields=["stock_count", "revision"], name="inv_sc_tombstone_rev_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.stock_count} - #{self.line_id} (r{self.revision})"
+
+
 class InventoryIssueType(models.TextChoices):
     NON_SALES = "NON_SALES", "منصرف لأغراض غير المبيعات"
     ADJUSTMENT = "ADJUSTMENT", "تسوية/فاقد/هالك"
@@ -309,6 +471,260 @@ class InventoryIssueLine(TimeStampedModel):
 
 
 
+# =========================================================
+# دفتر حركة المخزون (inventory/ledger.py)
+# =========================================================
+class StockMovement(models.Model):
+    """
+    دفتر حركة المخزون الدائم (إضافة فقط) لكل مادة خام بوحدة التخزين.
+
+    الحركة لا تُعدّل ولا تُحذف: تعديل المصدر (سطر مشتريات، صرف، استهلاك، جرد)
+    يُسجّل كحركة فرق جديدة. balance_after = الرصيد بعد الحركة بترتيب
+    (movement_date, seq, id)، فالرصيد في أي تاريخ = آخر حركة حتى هذا التاريخ.
+    """
+
+    SOURCE_OPENING = "opening"
+    SOURCE_PURCHASE = "purchase"
+    SOURCE_SALES = "sales"
+    SOURCE_ISSUE = "issue"
+    SOURCE_CLOSING = "closing"
+    SOURCE_CHOICES = (
+        (SOURCE_OPENING, "تسوية جرد أول الفترة"),
+        (SOURCE_PURCHASE, "مشتريات"),
+        (SOURCE_SALES, "منصرف للمبيعات"),
+        (SOURCE_ISSUE, "منصرف لأغراض أخرى"),
+        (SOURCE_CLOSING, "تسوية جرد آخر الفترة"),
+    )
+
+    raw_material = models.ForeignKey(
+        RawMaterial,
+        on_delete=models.CASCADE,
+        related_name="stock_movements",
+        verbose_name="مادة خام",
+    )
+    period = models.ForeignKey(
+        Period,
+        on_delete=models.CASCADE,
+        related_name="stock_movements",
+        verbose_name="الفترة",
+    )
+    movement_date = models.DateField("تاريخ الحركة")
+    # ترتيب داخل اليوم: 0 جرد أول الفترة، 1 الحركات، 2 جرد آخر الفترة
+    seq = models.PositiveSmallIntegerField("الترتيب", default=1)
+    source = models.CharField("المصدر", max_length=20, choices=SOURCE_CHOICES)
+    # سطر المشتريات / سطر الصرف (فارغ للاستهلاك والجرد: مجمّع لكل مادة)
+    source_id = models.PositiveBigIntegerField("رقم السطر المصدر", null=True, blank=True)
+
+    quantity = models.DecimalField("الكمية (وحدة التخزين)", max_digits=20, decimal_places=6)
+    balance_after = models.DecimalField("الرصيد بعد الحركة", max_digits=20, decimal_places=6, default=0)
+    created_at = models.DateTimeField("تاريخ التسجيل", auto_now_add=True)
+
+    class Meta:
+        verbose_name = "حركة مخزون"
+        verbose_name_plural = "دفتر حركة المخزون"
+        indexes = [
+            # الرصيد في تاريخ: آخر حركة للمادة حتى التاريخ (من الفهرس فقط)
+            models.Index(
+                fields=["raw_material", "movement_date", "seq", "id", "balance_after"],
+                name="inv_move_raw_date_idx",
+            ),
+            # المطابقة مع المصادر لكل فترة
+            models.Index(
+                fields=["period", "source", "source_id", "raw_material", "quantity"],
+                name="inv_move_source_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_source_display()} - {self.raw_material_id} - {self.quantity}"
+
+
+class StockCheckpoint(models.Model):
+    """
+    رصيد كل مادة خام في نهاية الفترة مع تفصيل حركتها (مشتق من StockMovement).
+    opening_qty = الرصيد بعد تسوية جرد أول الفترة، closing_qty = الرصيد في نهايتها.
+    """
+
+    period = models.ForeignKey(
+        Period,
+        on_delete=models.CASCADE,
+        related_name="stock_checkpoints",
+        verbose_name="الفترة",
+    )
+    raw_material = models.ForeignKey(
+        RawMaterial,
+        on_delete=models.CASCADE,
+        related_name="stock_checkpoints",
+        verbose_name="مادة خام",
+    )
+
+    opening_adjustment_qty = models.DecimalField("تسوية جرد أول الفترة", max_digits=20, decimal_places=6, default=0)
+    opening_qty = models.DecimalField("رصيد أول الفترة", max_digits=20, decimal_places=6, default=0)
+    purchases_qty = models.DecimalField("المشتريات", max_digits=20, decimal_places=6, default=0)
+    sales_qty = models.DecimalField("المنصرف للمبيعات", max_digits=20, decimal_places=6, default=0)
+    issues_qty = models.DecimalField("المنصرف لأغراض أخرى", max_digits=20, decimal_places=6, default=0)
+    closing_adjustment_qty = models.DecimalField("تسوية جرد آخر الفترة", max_digits=20, decimal_places=6, default=0)
+    closing_qty = models.DecimalField("رصيد آخر الفترة", max_digits=20, decimal_places=6, default=0)
+    updated_at = models.DateTimeField("تاريخ التحديث", auto_now=True)
+
+    class Meta:
+        verbose_name = "رصيد مادة في نهاية فترة"
+        verbose_name_plural = "أرصدة المواد في نهاية الفترات"
+        unique_together = ("period", "raw_material")
+
+    def __str__(self):
+        return f"{self.raw_material_id} - {self.period} - {self.closing_qty}"
+
+    @property
+    def theoretical_qty(self):
+        """الرصيد الدفتري قبل تسوية جرد آخر الفترة."""
+        return self.closing_qty - self.closing_adjustment_qty
+
+
+
+# =========================================================
+# تقييم المخزون (inventory/valuation.py)
+# =========================================================
+VALUATION_WAC = "wac"
+VALUATION_FIFO = "fifo"
+VALUATION_METHODS = (
+    (VALUATION_WAC, "متوسط مرجّح دوري"),
+    (VALUATION_FIFO, "الوارد أولًا صادر أولًا (FIFO)"),
+)
+
+
+class StockValuation(models.Model):
+    """
+    قيمة حركة كل مادة خام في الفترة بطريقة تقييم (بوحدة التخزين).
+    closing = opening + purchases - sales - issues + adjustment (تسويات الجرد).
+    """
+
+    period = models.ForeignKey(
+        Period,
+        on_delete=models.CASCADE,
+        related_name="stock_valuations",
+        verbose_name="الفترة",
+    )
+    raw_material = models.ForeignKey(
+        RawMaterial,
+        on_delete=models.CASCADE,
+        related_name="stock_valuations",
+        verbose_name="مادة خام",
+    )
+    method = models.CharField("طريقة التقييم", max_length=10, choices=VALUATION_METHODS)
+
+    opening_qty = models.DecimalField("كمية أول الفترة", max_digits=20, decimal_places=6, default=0)
+    opening_value = models.DecimalField("قيمة أول الفترة", max_digits=20, decimal_places=4, default=0)
+    purchases_qty = models.DecimalField("كمية المشتريات", max_digits=20, decimal_places=6, default=0)
+    purchases_value = models.DecimalField("قيمة المشتريات", max_digits=20, decimal_places=4, default=0)
+    sales_qty = models.DecimalField("المنصرف للمبيعات", max_digits=20, decimal_places=6, default=0)
+    sales_value = models.DecimalField("تكلفة المبيعات", max_digits=20, decimal_places=4, default=0)
+    issues_qty = models.DecimalField("المنصرف لأغراض أخرى", max_digits=20, decimal_places=6, default=0)
+    issues_value = models.DecimalField("قيمة المنصرف لأغراض أخرى", max_digits=20, decimal_places=4, default=0)
+    adjustment_qty = models.DecimalField("تسويات الجرد", max_digits=20, decimal_places=6, default=0)
+    adjustment_value = models.DecimalField("قيمة تسويات الجرد", max_digits=20, decimal_places=4, default=0)
+    closing_qty = models.DecimalField("كمية آخر الفترة", max_digits=20, decimal_places=6, default=0)
+    closing_value = models.DecimalField("قيمة آخر الفترة", max_digits=20, decimal_places=4, default=0)
+
+    class Meta:
+        verbose_name = "تقييم مخزون مادة"
+        verbose_name_plural = "تقييم المخزون"
+        unique_together = ("period", "raw_material", "method")
+        indexes = [
+            models.Index(fields=["period", "method", "raw_material"], name="inv_valuation_period_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.raw_material_id} - {self.period} - {self.method}: {self.closing_value}"
+
+    @property
+    def closing_unit_cost(self):
+        if self.closing_qty:
+            return self.closing_value / self.closing_qty
+        return None
+
+
+class StockCostLayer(models.Model):
+    """
+    طبقات التكلفة المتبقية في نهاية الفترة (FIFO: طبقة لكل دفعة بالترتيب،
+    المتوسط المرجّح: طبقة واحدة). تقييم الفترة التالية يبدأ منها مباشرة.
+    """
+
+    period = models.ForeignKey(
+        Period,
+        on_delete=models.CASCADE,
+        related_name="stock_cost_layers",
+        verbose_name="الفترة",
+    )
+    raw_material = models.ForeignKey(
+        RawMaterial,
+        on_delete=models.CASCADE,
+        related_name="stock_cost_layers",
+        verbose_name="مادة خام",
+    )
+    method = models.CharField("طريقة التقييم", max_length=10, choices=VALUATION_METHODS)
+    position = models.PositiveIntegerField("الترتيب", default=0)
+    quantity = models.DecimalField("الكمية (وحدة التخزين)", max_digits=20, decimal_places=6)
+    unit_cost = models.DecimalField("تكلفة وحدة التخزين", max_digits=20, decimal_places=6)
+
+    class Meta:
+        verbose_name = "طبقة تكلفة مخزون"
+        verbose_name_plural = "طبقات تكلفة المخزون"
+        unique_together = ("period", "method", "raw_material", "position")
+
+    def __str__(self):
+        return f"{self.raw_material_id} - {self.method} #{self.position}: {self.quantity} × {self.unit_cost}"
+
+
+class StockLedgerJob(models.Model):
+    """
+    طلب مطابقة دفتر حركة المخزون لفترة (طابور في قاعدة البيانات مثل sales.ConsumptionJob).
+
+    - الطلبات المتكررة لنفس الفترة تُدمج في طلب واحد منتظر (requests_count).
+    - ينفّذها أمر run_consumption_worker مع مهام الاستهلاك (inventory/jobs.py):
+      كل الفترات المنتظرة في مطابقة واحدة.
+    """
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "بالانتظار"),
+        (STATUS_RUNNING, "قيد التنفيذ"),
+        (STATUS_DONE, "تم"),
+        (STATUS_FAILED, "فشل"),
+    ]
+
+    period = models.ForeignKey(
+        Period,
+        on_delete=models.CASCADE,
+        related_name="stock_ledger_jobs",
+        verbose_name="الفترة",
+    )
+    status = models.CharField(
+        "الحالة", max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True,
+    )
+    requests_count = models.PositiveIntegerField("عدد الطلبات المدمجة", default=1)
+    movements_added = models.PositiveIntegerField("عدد الحركات المضافة", null=True, blank=True)
+    error = models.TextField("الخطأ", blank=True, default="")
+
+    requested_at = models.DateTimeField("وقت آخر طلب", auto_now_add=True)
+    started_at = models.DateTimeField("بدء التنفيذ", null=True, blank=True)
+    # يحدّثه العامل أثناء التنفيذ؛ توقفه يعني أن العامل توقف (requeue)
+    heartbeat_at = models.DateTimeField("آخر نبضة من العامل", null=True, blank=True)
+    finished_at = models.DateTimeField("انتهاء التنفيذ", null=True, blank=True)
+
+    class Meta:
+        verbose_name = "مهمة مطابقة دفتر المخزون"
+        verbose_name_plural = "مهام مطابقة دفتر المخزون"
+        ordering = ["-id"]
+        indexes = [models.Index(fields=["period", "status"])]
+
+    def __str__(self):
+        return f"{self.period} - {self.get_status_display()}"
+
+
+
 from django.db import models
 
 class BomTreeReport(models.Model):
@@ -0,0 +1,144 @@
+# inventory/movement.py
+"""
+حركة المخزون لكل المواد الخام في فترة (أول المدة، المشتريات، المنصرف للمبيعات،
+المنصرف لأغراض أخرى، آخر المدة، الفرق) بعدد ثابت من الاستعلامات المجمّعة:
+
+1) بنود الجرد (أول/آخر الفترة) مجمّعة حسب (النوع، المادة، الوحدة).
+2) المشتريات مجمّعة حسب (المادة، وحدة الشراء).
+3) المنصرف لأغراض أخرى مجمّع حسب (المادة، الوحدة).
+4) المنصرف للمبيعات من SalesConsumption (مجمّع حسب المادة)؛ الفترة التي لم يُولّد
+   لها استهلاك تُفكك مبيعاتها في الذاكرة (نفس تفكيك الوصفات متعدد المستويات).
+5) بيانات تحويل الوحدات للمواد.
+
+كل الكميات بأساس وحدة واحدة: basis="storage" (وحدة التخزين، افتراضي) أو "ingredient".
+التحويل: وحدة الاستخدام ÷ storage_to_ingredient_factor = وحدة التخزين،
+وأي وحدة أخرى تُعامل كوحدة تخزين.
+"""
+from decimal import Decimal
+
+from django.db.models import Sum
+
+from costing.models import RawMaterial
+from purchases.models import PurchaseSummaryLine
+from sales.models import SalesConsumption, SalesConsumptionSummary, build_consumption_rows
+
+from .models import InventoryIssueLine, StockCountLine
+
+STORAGE = "storage"
+INGREDIENT = "ingredient"
+
+D0 = Decimal("0")
+
+MOVEMENT_FIELDS = (
+    "opening_qty",
+    "purchases_qty",
+    "sales_consumption_qty",
+    "non_sales_consumption_qty",
+    "closing_qty",
+)
+
+
+class _Converter:
+    def __init__(self, raw_ids, basis):
+        self.basis = basis
+        self.raws = {
+            raw_id: (storage_unit_id, ingredient_unit_id, factor or Decimal("1"))
+            for raw_id, storage_unit_id, ingredient_unit_id, factor in RawMaterial.objects.filter(
+                id__in=list(raw_ids)
+            ).values_list("id", "storage_unit_id", "ingredient_unit_id", "storage_to_ingredient_factor")
+        }
+
+    def __call__(self, raw_id, qty, unit_id=None, kind=None):
+        """kind: STORAGE / INGREDIENT صراحةً، وإلا يُستنتج من unit_id."""
+        storage_unit_id, ingredient_unit_id, factor = self.raws.get(raw_id, (None, None, Decimal("1")))
+        if kind is None:
+            if unit_id is not None and unit_id == storage_unit_id:
+                kind = STORAGE
+            elif unit_id is not None and unit_id == ingredient_unit_id:
+                kind = INGREDIENT
+            else:
+                kind = STORAGE
+        qty = qty or D0
+        if kind == self.basis:
+            return qty
+        return qty / factor if self.basis == STORAGE else qty * factor
+
+
+def _sales_consumption(period, raw_ids):
+    """{raw_id: الكمية بوحدة الاستخدام} من جدول الاستهلاك أو بالتفكيك في الذاكرة."""
+    if SalesConsumptionSummary.objects.filter(period=period).exists():
+        qs = SalesConsumption.objects.filter(period=period, raw_material__isnull=False)
+        if raw_ids is not None:
+            qs = qs.filter(raw_material_id__in=raw_ids)
+        return dict(qs.values("raw_material_id").annotate(q=Sum("quantity_consumed")).values_list("raw_material_id", "q"))
+
+    totals = {}
+    for row in build_consumption_rows(period):
+        if row.raw_material_id is None or (raw_ids is not None and row.raw_material_id not in raw_ids):
+            continue
+        totals[row.raw_material_id] = totals.get(row.raw_material_id, D0) + row.quantity_consumed
+    return totals
+
+
+def period_movements(period, basis=STORAGE, raw_ids=None):
+    """
+    {raw_id: {"opening_qty", "purchases_qty", "sales_consumption_qty",
+              "non_sales_consumption_qty", "closing_qty", "theoretical_qty", "difference_qty"}}
+    لكل مادة لها أي حركة في الفترة (أو raw_ids فقط).
+
+    theoretical_qty = أول + مشتريات - منصرف للمبيعات - منصرف لأغراض أخرى
+    difference_qty = theoretical_qty - آخر المدة (موجب = عجز)
+    """
+    if raw_ids is not None:
+        raw_ids = set(raw_ids)
+
+    def only(qs, field="raw_material_id"):
+        return qs.filter(**{f"{field}__in": raw_ids}) if raw_ids is not None else qs
+
+    counts = list(
+        only(StockCountLine.objects.filter(
+            stock_count__period=period, stock_count__type__in=("opening", "closing"), raw_material__isnull=False,
+        ))
+        .values("stock_count__type", "raw_material_id", "unit_id")
+        .annotate(q=Sum("quantity"))
+        .values_list("stock_count__type", "raw_material_id", "unit_id", "q")
+    )
+    purchases = list(
+        only(PurchaseSummaryLine.objects.filter(summary__period=period))
+        .values("raw_material_id", "purchase_unit_id")
+        .annotate(q=Sum("quantity"))
+        .values_list("raw_material_id", "purchase_unit_id", "q")
+    )
+    issues = list(
+        only(InventoryIssueLine.objects.filter(inventory_issue__period=period))
+        .values("raw_material_id", "unit_id")
+        .annotate(q=Sum("quantity"))
+        .values_list("raw_material_id", "unit_id", "q")
+    )
+    sales = _sales_consumption(period, raw_ids)
+
+    material_ids = (
+        {r for _, r, _, _ in counts} | {r for r, _, _ in purchases} | {r for r, _, _ in issues} | set(sales)
+    )
+    if raw_ids is not None:
+        material_ids |= raw_ids
+    convert = _Converter(material_ids, basis)
+
+    result = {raw_id: dict.fromkeys(MOVEMENT_FIELDS, D0) for raw_id in material_ids}
+    for count_type, raw_id, unit_id, qty in counts:
+        field = "opening_qty" if count_type == "opening" else "closing_qty"
+        result[raw_id][field] += convert(raw_id, qty, unit_id)
+    for raw_id, unit_id, qty in purchases:
+        result[raw_id]["purchases_qty"] += convert(raw_id, qty, unit_id)
+    for raw_id, unit_id, qty in issues:
+        result[raw_id]["non_sales_consumption_qty"] += convert(raw_id, qty, unit_id)
+    for raw_id, qty in sales.items():
+        result[raw_id]["sales_consumption_qty"] += convert(raw_id, qty, kind=INGREDIENT)
+
+    for row in result.values():
+        row["theoretical_qty"] = (
+            row["opening_qty"] + row["purchases_qty"]
+            - row["sales_consumption_qty"] - row["non_sales_consumption_qty"]
+        )
+        row["difference_qty"] = row["theoretical_qty"] - row["closing_qty"]
+    return result
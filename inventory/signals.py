@@ -0,0 +1,74 @@
+# inventory/signals.py
+"""
+مطابقة دفتر حركة المخزون (inventory/ledger.py) عند تعديل مصادره:
+سطور وملخصات المشتريات، حركات وبنود الصرف، الجرد وبنوده.
+تعديل بنود الجرد يحدّث أيضًا إجماليات رأس الجرد (StockCount.refresh_totals).
+المطابقة تُجمّع لكل فترة وتتم مرة واحدة بعد الـ commit.
+
+توليد استهلاك المبيعات يجدول المطابقة بنفسه (sales/models.py).
+ملاحظة: bulk_create و QuerySet.update لا يرسلان إشارات؛ في هذه الحالات
+نستدعي schedule_ledger_sync مباشرة (أو rebuild_stock_ledger).
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from purchases.models import PurchaseSummary, PurchaseSummaryLine
+
+from .ledger import schedule_ledger_sync
+from .models import InventoryIssue, InventoryIssueLine, StockCount, StockCountLine, StockCountLineTombstone
+
+
+def _period_id(model, pk):
+    if pk is None:
+        return None
+    return model.objects.filter(pk=pk).values_list("period_id", flat=True).first()
+
+
+@receiver(post_save, sender=PurchaseSummaryLine)
+@receiver(post_delete, sender=PurchaseSummaryLine)
+def purchase_line_changed(sender, instance, **kwargs):
+    if kwargs.get("raw"):
+        return
+    schedule_ledger_sync([_period_id(PurchaseSummary, instance.summary_id)])
+
+
+@receiver(post_save, sender=InventoryIssueLine)
+@receiver(post_delete, sender=InventoryIssueLine)
+def issue_line_changed(sender, instance, **kwargs):
+    if kwargs.get("raw"):
+        return
+    schedule_ledger_sync([_period_id(InventoryIssue, instance.inventory_issue_id)])
+
+
+@receiver(post_save, sender=StockCountLine)
+@receiver(post_delete, sender=StockCountLine)
+def stock_count_line_changed(sender, instance, **kwargs):
+    if kwargs.get("raw"):
+        return
+    if kwargs.get("signal") is post_delete:
+        origin = kwargs.get("origin")
+        if isinstance(origin, StockCount) or getattr(origin, "model", None) is StockCount:
+            # حذف الرأس نفسه: البنود والآثار تُحذف معه، والمطابقة من header_changed
+            return
+        # أثر للحذف حتى تصل المزامنة التفاضلية لشاشة الجرد (StockCountLine.save يرقّم التعديلات)
+        StockCountLineTombstone.objects.create(
+            stock_count_id=instance.stock_count_id,
+            line_id=instance.pk,
+            revision=StockCount.next_revision(instance.stock_count_id),
+        )
+    # إجماليات الرأس فورًا (تُقرأ في نفس الطلب)، والدفتر بعد الـ commit
+    StockCount.refresh_totals([instance.stock_count_id])
+    schedule_ledger_sync([_period_id(StockCount, instance.stock_count_id)])
+
+
+@receiver(post_save, sender=PurchaseSummary)
+@receiver(post_delete, sender=PurchaseSummary)
+@receiver(post_save, sender=InventoryIssue)
+@receiver(post_delete, sender=InventoryIssue)
+@receiver(post_save, sender=StockCount)
+@receiver(post_delete, sender=StockCount)
+def header_changed(sender, instance, **kwargs):
+    # تغيير الفترة / تاريخ الحركة / نوع الجرد، أو حذف الرأس بكل بنوده
+    if kwargs.get("raw"):
+        return
+    schedule_ledger_sync([instance.period_id])
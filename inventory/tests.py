@@ -1,3 +1,308 @@
-from django.test import TestCase
+import datetime
+from datetime import timedelta
+from decimal import Decimal as D
 
-# Create your tests here.
+from django.db import IntegrityError, transaction
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from costing.cache import cost_cache
+from costing.explosion import rebuild_explosion
+from costing.models import BillOfMaterial, BOMItem, Product, RawMaterial, Unit, round3
+from costing.tests import CatalogMixin
+from expenses.models import Period
+from purchases.models import PurchaseSummary, PurchaseSummaryLine
+from sales.models import SalesSummary, SalesSummaryLine, generate_sales_consumption
+
+from .jobs import claim_ledger_jobs, requeue_stuck_ledger_jobs, run_ledger_jobs, run_pending_ledger
+from .ledger import on_hand, period_balances, schedule_ledger_sync, sync_stock_ledger
+from .models import (
+    VALUATION_FIFO, VALUATION_WAC, InventoryIssue, InventoryIssueLine, StockCount, StockCountLine,
+    StockLedgerJob, StockMovement,
+)
+from .valuation import period_valuation
+
+
+class StockFixtureMixin:
+    """
+    مادة خام واحدة (دقيق: كيلو للتخزين، جرام للاستخدام، 1000) على فترتين:
+
+        يناير: جرد أول 10 كيلو بتكلفة 2 + مشتريات 20 بسعر 3 - صرف 5، جرد آخر 24 (تسوية -1)
+        فبراير: مشتريات 10 بسعر 4 - مبيعات 30 خبز × 500 جرام = 15 كيلو → 19
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cost_cache.clear()
+        # on_commit ينفّذ كما بعد اعتماد المعاملة: لا يبقى تسجيل منتظر يدخل في معاملات الاختبارات
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.g = Unit.objects.create(name="جرام", abbreviation="g")
+            cls.kg = Unit.objects.create(name="كيلو", abbreviation="kg")
+            cls.jan, cls.feb = [
+                Period.objects.create(
+                    year=2025, month=month, name=f"P{month}",
+                    start_date=datetime.date(2025, month, 1), end_date=datetime.date(2025, month, 28),
+                )
+                for month in (1, 2)
+            ]
+            cls.flour = RawMaterial.objects.create(
+                sku="flour", name="flour", storage_unit=cls.kg, ingredient_unit=cls.g,
+                storage_to_ingredient_factor=D("1000"), purchase_price_per_storage_unit=D("3"),
+            )
+
+            cls.jan_purchase = cls.purchase(cls.jan, "20", "3")
+            cls.purchase(cls.feb, "10", "4")
+
+            cls.count(cls.jan, "opening", "10", unit_cost="2")
+            cls.count(cls.jan, "closing", "24")
+
+            issue = InventoryIssue.objects.create(period=cls.jan, issue_date=datetime.date(2025, 1, 15))
+            InventoryIssueLine.objects.create(inventory_issue=issue, raw_material=cls.flour, unit=cls.kg, quantity=D("5"))
+
+            bread = Product.objects.create(code="bread", name="bread", base_unit=cls.g)
+            bom = BillOfMaterial.objects.create(product=bread, batch_output_quantity=D("1"))
+            BOMItem.objects.create(bom=bom, raw_material=cls.flour, quantity=D("500"))
+            summary = SalesSummary.objects.create(period=cls.feb)
+            SalesSummaryLine.objects.create(summary=summary, product=bread, unit=cls.g, quantity=D("30"), unit_price=D("5"))
+            rebuild_explosion()
+            generate_sales_consumption(cls.feb)
+
+        sync_stock_ledger(None)
+        StockLedgerJob.objects.all().delete()
+
+    @classmethod
+    def purchase(cls, period, qty, cost):
+        summary = PurchaseSummary.objects.create(period=period)
+        return PurchaseSummaryLine.objects.create(
+            summary=summary, raw_material=cls.flour, purchase_unit=cls.kg, quantity=D(qty), unit_cost=D(cost),
+        )
+
+    @classmethod
+    def count(cls, period, count_type, qty, unit_cost=None):
+        stock_count = StockCount.objects.create(
+            period=period, type=count_type, count_type=count_type,
+            count_date=period.start_date if count_type == "opening" else period.end_date,
+        )
+        StockCountLine.objects.create(
+            stock_count=stock_count, raw_material=cls.flour, unit=cls.kg, quantity=D(qty),
+            unit_cost_value=D(unit_cost) if unit_cost is not None else None,
+        )
+        return stock_count
+
+
+class StockLedgerTests(StockFixtureMixin, TestCase):
+    def test_period_balances(self):
+        jan = period_balances(self.jan)[self.flour.pk]
+        self.assertEqual(
+            (jan.opening_qty, jan.purchases_qty, jan.issues_qty, jan.closing_adjustment_qty, jan.closing_qty),
+            (D("10"), D("20"), D("-5"), D("-1"), D("24")),
+        )
+        feb = period_balances(self.feb)[self.flour.pk]
+        self.assertEqual(
+            (feb.opening_qty, feb.purchases_qty, feb.sales_qty, feb.closing_qty),
+            (D("24"), D("10"), D("-15"), D("19")),
+        )
+
+    def test_running_balances(self):
+        running = D("0")
+        for qty, balance in StockMovement.objects.filter(raw_material=self.flour).order_by(
+            "movement_date", "seq", "id"
+        ).values_list("quantity", "balance_after"):
+            running += qty
+            self.assertEqual(balance, running)
+        self.assertEqual(on_hand(self.flour), D("19"))
+        self.assertEqual(on_hand(self.flour, at=self.jan.end_date), D("24"))
+        self.assertEqual(on_hand(self.flour, at=datetime.date(2025, 1, 20)), D("25"))
+
+    def test_sync_is_idempotent(self):
+        self.assertEqual(sync_stock_ledger(None), 0)
+
+    def test_changed_source_posts_difference(self):
+        self.jan_purchase.quantity = D("22")
+        self.jan_purchase.save()
+        count = StockMovement.objects.count()
+        sync_stock_ledger([self.jan])
+
+        # فرق المشتريات + تسوية جرد آخر الفترة؛ الجرد يبقى 24 فلا يتغيّر فبراير
+        self.assertEqual(StockMovement.objects.count(), count + 2)
+        jan = period_balances(self.jan)[self.flour.pk]
+        self.assertEqual((jan.purchases_qty, jan.closing_adjustment_qty, jan.closing_qty), (D("22"), D("-3"), D("24")))
+        self.assertEqual(period_balances(self.feb)[self.flour.pk].closing_qty, D("19"))
+        self.assertEqual(on_hand(self.flour), D("19"))
+
+    def edit_purchase(self):
+        count = StockMovement.objects.count()
+        self.jan_purchase.quantity = D("22")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.jan_purchase.save()
+        return count
+
+    def test_save_queues_sync_by_default(self):
+        count = self.edit_purchase()
+        # الحفظ لا يطابق داخل الطلب: مهمة منتظرة فقط
+        self.assertEqual(StockMovement.objects.count(), count)
+        job = StockLedgerJob.objects.get(period=self.jan)
+        self.assertEqual((job.period_id, job.status), (self.jan.pk, StockLedgerJob.STATUS_PENDING))
+
+        run_pending_ledger()
+        self.assertEqual(StockMovement.objects.count(), count + 2)
+        self.assertEqual(period_balances(self.jan)[self.flour.pk].purchases_qty, D("22"))
+
+    def test_rolled_back_save_is_not_queued(self):
+        # تفريغ ما سجّله تجهيز البيانات (معاملة الاختبار لم تُعتمد بعد)
+        with self.captureOnCommitCallbacks(execute=True):
+            schedule_ledger_sync([self.feb])
+        StockLedgerJob.objects.all().delete()
+
+        try:
+            with transaction.atomic():
+                self.jan_purchase.quantity = D("22")
+                self.jan_purchase.save()
+                raise IntegrityError
+        except IntegrityError:
+            pass
+        feb_line = PurchaseSummaryLine.objects.get(summary__period=self.feb)
+        with self.captureOnCommitCallbacks(execute=True):
+            feb_line.save()
+        self.assertEqual(list(StockLedgerJob.objects.values_list("period_id", flat=True)), [self.feb.pk])
+
+    def test_requeue_only_jobs_without_heartbeat(self):
+        self.edit_purchase()
+        jobs = claim_ledger_jobs()
+        self.assertEqual(requeue_stuck_ledger_jobs(timeout=60), 0)
+
+        StockLedgerJob.objects.update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(requeue_stuck_ledger_jobs(timeout=60), 1)
+        # العامل القديم لا يكتب نتيجة مهمة أعيدت للانتظار
+        run_ledger_jobs(jobs)
+        self.assertEqual(StockLedgerJob.objects.get().status, StockLedgerJob.STATUS_PENDING)
+
+    @override_settings(INVENTORY_LEDGER_ASYNC=False)
+    def test_save_syncs_directly_when_async_disabled(self):
+        count = self.edit_purchase()
+        self.assertEqual(StockMovement.objects.count(), count + 2)
+        self.assertFalse(StockLedgerJob.objects.exists())
+
+
+class StockValuationTests(StockFixtureMixin, TestCase):
+    def closing(self, period, method):
+        row = period_valuation(period, method)[self.flour.pk]
+        # closing = opening + purchases - sales - issues + adjustment
+        self.assertEqual(
+            row.closing_value,
+            row.opening_value + row.purchases_value - row.sales_value - row.issues_value + row.adjustment_value,
+        )
+        return row.closing_qty, row.closing_value
+
+    def test_fifo(self):
+        # يناير: [10@2, 20@3] - 5 - 1 من الأقدم → [4@2, 20@3]
+        self.assertEqual(self.closing(self.jan, VALUATION_FIFO), (D("24"), D("68")))
+        # فبراير: + 10@4، المبيعات 15 = 4@2 + 11@3 → [9@3, 10@4]
+        self.assertEqual(self.closing(self.feb, VALUATION_FIFO), (D("19"), D("67")))
+        self.assertEqual(period_valuation(self.feb, VALUATION_FIFO)[self.flour.pk].sales_value, D("41"))
+
+    def test_weighted_average(self):
+        # يناير: (10×2 + 20×3) ÷ 30 = 2.666667 → 24 × 2.666667
+        self.assertEqual(self.closing(self.jan, VALUATION_WAC), (D("24"), D("64.0000")))
+        # فبراير: (64.000008 + 40) ÷ 34 = 3.058824 → 19 × 3.058824
+        self.assertEqual(self.closing(self.feb, VALUATION_WAC), (D("19"), D("58.1177")))
+
+
+class StockCountCostMixin(CatalogMixin):
+    """
+    جردا يناير على كتالوج الاختبارات (costing/tests.py): مواد خام بوحدة التخزين
+    ووحدة الاستخدام، ملح بدون معامل تحويل، سكر بدون مشتريات في يناير، ونصف مصنع.
+    جرد أول الفترة فيه تكلفة يدوية لبند واحد.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.opening, cls.closing = [
+                StockCount.objects.create(
+                    period=cls.jan, type=count_type, count_type=count_type, count_date=date,
+                )
+                for count_type, date in (("opening", cls.jan.start_date), ("closing", cls.jan.end_date))
+            ]
+            for stock_count in (cls.opening, cls.closing):
+                for item, unit, qty in (
+                    (cls.flour, cls.kg, "12.5"),
+                    (cls.oil, cls.g, "750"),
+                    (cls.salt, cls.kg, "2"),
+                    (cls.sugar, cls.kg, "1.25"),
+                    (cls.dough, cls.g, "4000"),
+                    (cls.sauce, cls.g, "33.3"),
+                ):
+                    field = "raw_material" if isinstance(item, RawMaterial) else "semi_finished_product"
+                    StockCountLine.objects.create(
+                        stock_count=stock_count, unit=unit, quantity=D(qty), **{field: item},
+                        unit_cost_value=D("2.5") if stock_count.type == "opening" and item == cls.flour else None,
+                    )
+
+    def saved_costs(self, stock_count):
+        return {
+            pk: (unit_cost, total_cost)
+            for pk, unit_cost, total_cost in stock_count.lines.values_list("id", "saved_unit_cost", "saved_total_cost")
+        }
+
+
+class StockCountRecostTests(StockCountCostMixin, TestCase):
+    def test_recost_lines_matches_line_save(self):
+        # أسعار يناير تتغيّر بدون إشارات: التكاليف المحفوظة أصبحت قديمة
+        PurchaseSummaryLine.objects.filter(summary__period=self.jan, raw_material=self.oil).update(unit_cost=D("80"))
+        PurchaseSummaryLine.objects.filter(summary__period=self.jan, raw_material=self.flour).update(unit_cost=D("30"))
+
+        for stock_count in (self.opening, self.closing):
+            with self.subTest(type=stock_count.type):
+                stale = self.saved_costs(stock_count)
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.assertEqual(stock_count.recost_lines(), 6)
+                bulk = self.saved_costs(stock_count)
+                self.assertNotEqual(bulk, stale)
+
+                StockCountLine.objects.filter(stock_count=stock_count).update(
+                    saved_unit_cost=None, saved_total_cost=None
+                )
+                with self.captureOnCommitCallbacks(execute=True):
+                    for line in stock_count.lines.all():
+                        line.save()
+                self.assertEqual(self.saved_costs(stock_count), bulk)
+
+        # التكلفة اليدوية لجرد أول الفترة تبقى كما هي
+        flour = self.opening.lines.get(raw_material=self.flour)
+        self.assertEqual((flour.saved_unit_cost, flour.saved_total_cost), (D("2.5"), D("31.25")))
+        self.assertNotIn(None, [cost for pair in self.saved_costs(self.closing).values() for cost in pair])
+
+
+class StockCountTotalsTests(StockCountCostMixin, TestCase):
+    def assertHeaderMatchesLines(self, stock_count):
+        header = StockCount.objects.values_list("lines_total_quantity", "lines_total_cost").get(pk=stock_count.pk)
+        agg = StockCountLine.objects.filter(stock_count=stock_count).aggregate(
+            q=Sum("quantity"), c=Sum("saved_total_cost")
+        )
+        expected = (round3(agg["q"] or D("0")), round3(agg["c"] or D("0")))
+        self.assertEqual(header, expected)
+        self.assertEqual((stock_count.total_quantity(), stock_count.total_cost()), expected)
+        return header
+
+    def test_header_totals_follow_line_changes(self):
+        before = self.assertHeaderMatchesLines(self.closing)
+        self.assertGreater(before[1], 0)
+
+        line = self.closing.lines.get(raw_material=self.flour)
+        line.quantity = D("20")
+        with self.captureOnCommitCallbacks(execute=True):
+            line.save()
+        edited = self.assertHeaderMatchesLines(self.closing)
+        self.assertEqual(edited[0], before[0] + D("7.5"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.closing.lines.get(semi_finished_product=self.dough).delete()
+        deleted = self.assertHeaderMatchesLines(self.closing)
+        self.assertEqual(deleted[0], edited[0] - D("4000"))
+        self.assertLess(deleted[1], edited[1])
+
+        # الجرد الآخر لم يتغيّر
+        self.assertHeaderMatchesLines(self.opening)
@@ -1,106 +1,18 @@
 from decimal import Decimal
 
 from costing.models import BillOfMaterial, Product
-from purchases.models import PurchaseSummaryLine
-from sales.models import SalesSummaryLine  # عدّل الاسم حسب مشروعك
-from .models import StockCount, StockCountType, InventoryIssue
 from costing.models import BillOfMaterial, BOMItem, Product, RawMaterial
 
-def _get_stock_count_qty(raw_material, period, count_type):
-    from costing.models import Unit
-
-    qs = StockCount.objects.filter(period=period, count_type=count_type)
-    total = Decimal("0")
-    for sc in qs:
-        for line in sc.lines.filter(raw_material=raw_material):
-            total += line.quantity
-    return total
-
-
-def _get_purchases_qty(raw_material, period):
-    """الكمية المشتراة بوحدة الاستخدام (ingredient_unit)."""
-    from costing.models import RawMaterial as RM
-
-    rm = raw_material
-    qs = PurchaseSummaryLine.objects.filter(
-        raw_material=rm,
-        summary__period=period,
-    )
-
-    total_storage_qty = Decimal("0")
-    for line in qs:
-        if line.quantity:
-            total_storage_qty += line.quantity
-
-    if total_storage_qty <= 0:
-        return Decimal("0")
-
-    # تحويل من وحدة التخزين إلى وحدة الاستخدام
-    if rm.storage_to_ingredient_factor:
-        return total_storage_qty * rm.storage_to_ingredient_factor
-
-    return total_storage_qty
-
-
-def _get_sales_consumption_qty(raw_material, period):
-    """
-    الكمية المنصرفة للمبيعات من هذه المادة الخام
-    عن طريق تفكيك المبيعات إلى مواد خام باستخدام الـ BOM.
-    (نسخة مبسطة: مستوى واحد من الـ BOM).
-    """
-    total = Decimal("0")
-
-    # نفترض أن SalesSummaryLine فيها product و quantity
-    lines = SalesSummaryLine.objects.filter(summary__period=period)
-
-    for line in lines:
-        product = line.product
-        qty_sold = line.quantity or Decimal("0")
-        if qty_sold <= 0:
-            continue
-
-        # نجيب الـ BOM الفعّال
-        bom = product.boms.filter(is_active=True).first()
-        if not bom:
-            continue
-
-        for item in bom.items.filter(raw_material=raw_material):
-            # الكمية المطلوبة من الخام = كمية مبيعات المنتج × كمية الخام في الوصفة
-            total += qty_sold * (item.quantity or Decimal("0"))
-
-    return total
-
-
-def _get_non_sales_issue_qty(raw_material, period):
-    total = Decimal("0")
-    issues = InventoryIssue.objects.filter(period=period)
-    for issue in issues:
-        for line in issue.lines.filter(raw_material=raw_material):
-            total += line.quantity or Decimal("0")
-    return total
-
-
 def calculate_inventory_movement(raw_material, period):
     """
-    ترجع قاموس يحوي كل مكونات معادلة المخزون لهذه المادة في فترة معيّنة.
+    ترجع قاموس يحوي كل مكونات معادلة المخزون لهذه المادة في فترة معيّنة
+    (بوحدة الاستخدام). لكل المواد مرة واحدة: inventory.movement.period_movements.
     """
-    opening = _get_stock_count_qty(raw_material, period, StockCountType.OPENING)
-    closing = _get_stock_count_qty(raw_material, period, StockCountType.CLOSING)
-    purchases = _get_purchases_qty(raw_material, period)
-    sales_cons = _get_sales_consumption_qty(raw_material, period)
-    non_sales_cons = _get_non_sales_issue_qty(raw_material, period)
-
-    # معادلة المخزون
-    difference = opening + purchases - sales_cons - non_sales_cons - closing
-
-    return {
-        "opening_qty": opening,
-        "purchases_qty": purchases,
-        "sales_consumption_qty": sales_cons,
-        "non_sales_consumption_qty": non_sales_cons,
-        "closing_qty": closing,
-        "difference_qty": difference,
-    }
+    from .movement import INGREDIENT, period_movements
+
+    movement = period_movements(period, basis=INGREDIENT, raw_ids=[raw_material.pk])[raw_material.pk]
+    movement.pop("theoretical_qty")
+    return movement
 
 
 
@@ -0,0 +1,345 @@
+# inventory/valuation.py
+"""
+تقييم مخزون المواد الخام بطريقتين: متوسط مرجّح دوري (wac) و FIFO.
+
+كل الكميات بوحدة التخزين من دفتر الحركة (inventory/ledger.py). لكل فترة:
+1) البداية = طبقات آخر الفترة السابقة (StockCostLayer)، بدون إعادة تشغيل التاريخ.
+2) تسوية جرد أول الفترة: الزيادة بتكلفة الجرد اليدوية (unit_cost_value) إن وُجدت،
+   وإلا بمتوسط الطبقات الحالية / آخر تكلفة مشتريات؛ النقص يُسحب من الطبقات.
+3) المشتريات: طبقة لكل سطر بتكلفة (قيمة السطر ÷ الكمية بوحدة التخزين).
+   المتوسط المرجّح: الطبقات تُدمج في طبقة واحدة بمتوسط (أول الفترة + المشتريات).
+4) المنصرف للمبيعات ثم لأغراض أخرى ثم تسوية جرد آخر الفترة تُسحب من الطبقات
+   (FIFO من الأقدم).
+
+الرصيد السالب (منصرف أكبر من المتاح) يُسحب بآخر تكلفة ويبقى طبقة سالبة تغطيها أول
+إضافة لاحقة؛ adjustment_value هو الرقم الموازن فتبقى
+closing = opening + purchases - sales - issues + adjustment دائمًا.
+
+value_stock تُستدعى من sync_stock_ledger بعد تحديث الدفتر (نفس المعاملة).
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+
+from expenses.models import Period
+from purchases.models import PurchaseSummaryLine
+
+from .models import (
+    VALUATION_FIFO, VALUATION_WAC, StockCheckpoint, StockCostLayer, StockCountLine, StockMovement,
+    StockValuation,
+)
+from .movement import STORAGE, _Converter
+
+D0 = Decimal("0")
+Q4 = Decimal("0.0001")
+Q6 = Decimal("0.000001")
+
+METHODS = (VALUATION_WAC, VALUATION_FIFO)
+
+
+def _q6(value):
+    return (value or D0).quantize(Q6, rounding=ROUND_HALF_UP)
+
+
+def _q4(value):
+    return (value or D0).quantize(Q4, rounding=ROUND_HALF_UP)
+
+
+def valuation_method():
+    """طريقة التقييم المعتمدة في التقارير (INVENTORY_VALUATION_METHOD)."""
+    method = getattr(settings, "INVENTORY_VALUATION_METHOD", VALUATION_WAC)
+    return method if method in METHODS else VALUATION_WAC
+
+
+# --------------------------------------------------------
+# طبقات التكلفة
+# --------------------------------------------------------
+class _Layers:
+    """طبقات [الكمية, تكلفة الوحدة] من الأقدم للأحدث."""
+
+    def __init__(self, layers, last_cost=None):
+        self.layers = [list(layer) for layer in layers]
+        self.last_cost = self.layers[-1][1] if self.layers else last_cost
+
+    @property
+    def quantity(self):
+        return sum((qty for qty, _ in self.layers), D0)
+
+    @property
+    def value(self):
+        return sum((qty * cost for qty, cost in self.layers), D0)
+
+    def average_cost(self):
+        quantity = self.quantity
+        if quantity > 0:
+            return self.value / quantity
+        return self.last_cost
+
+    def add(self, qty, cost):
+        if qty <= 0:
+            return
+        cost = cost or D0
+        self.last_cost = cost
+        # تغطية الرصيد السالب أولًا
+        while qty and self.layers and self.layers[0][0] < 0:
+            layer = self.layers[0]
+            covered = min(qty, -layer[0])
+            layer[0] += covered
+            qty -= covered
+            if not layer[0]:
+                self.layers.pop(0)
+        if qty:
+            self.layers.append([qty, cost])
+
+    def take(self, qty):
+        """سحب qty (موجبة) من الأقدم؛ ترجع قيمتها."""
+        value = D0
+        while qty > 0 and self.layers and self.layers[0][0] > 0:
+            layer = self.layers[0]
+            used = min(qty, layer[0])
+            value += used * layer[1]
+            self.last_cost = layer[1]
+            layer[0] -= used
+            qty -= used
+            if not layer[0]:
+                self.layers.pop(0)
+        if qty > 0:
+            if self.layers and self.layers[0][0] < 0:
+                self.layers[0][0] -= qty
+                cost = self.layers[0][1]
+            else:
+                cost = self.last_cost or D0
+                self.layers.insert(0, [-qty, cost])
+            value += qty * cost
+        return value
+
+    def average(self):
+        """المتوسط المرجّح: طبقة واحدة بمتوسط التكلفة."""
+        quantity = self.quantity
+        if len(self.layers) > 1 or (quantity > 0 and self.layers):
+            cost = self.average_cost()
+            self.layers = [[quantity, cost]] if quantity else []
+            self.last_cost = cost
+
+    def rounded(self):
+        return [(_q6(qty), _q6(cost)) for qty, cost in self.layers if _q6(qty)]
+
+
+# --------------------------------------------------------
+# تقييم فترة
+# --------------------------------------------------------
+def _period_inputs(period):
+    """حركة الفترة من الدفتر لكل مادة + قيم سطور المشتريات."""
+    moves = {}
+    for raw_id, source, source_id, qty in (
+        StockMovement.objects.filter(period=period)
+        .values("raw_material_id", "source", "source_id")
+        .annotate(q=Sum("quantity"))
+        .values_list("raw_material_id", "source", "source_id", "q")
+    ):
+        qty = _q6(qty)
+        if not qty:
+            continue
+        entry = moves.setdefault(raw_id, {"purchases": []})
+        if source == StockMovement.SOURCE_PURCHASE:
+            entry["purchases"].append((source_id, qty))
+        else:
+            entry[source] = entry.get(source, D0) + qty
+
+    amounts = {
+        pk: (quantity or D0) * (unit_cost or D0)
+        for pk, quantity, unit_cost in PurchaseSummaryLine.objects.filter(summary__period=period)
+        .values_list("id", "quantity", "unit_cost")
+    }
+    return moves, amounts
+
+
+def _opening_costs(period, convert):
+    """{raw_id: تكلفة وحدة التخزين} من التكلفة اليدوية في جرد أول الفترة."""
+    totals = {}
+    for raw_id, unit_id, qty, cost in StockCountLine.objects.filter(
+        stock_count__period=period, stock_count__type="opening",
+        raw_material__isnull=False, unit_cost_value__isnull=False,
+    ).values_list("raw_material_id", "unit_id", "quantity", "unit_cost_value"):
+        storage_qty = convert(raw_id, qty, unit_id)
+        entry = totals.setdefault(raw_id, [D0, D0])
+        entry[0] += storage_qty
+        entry[1] += (qty or D0) * cost
+    return {raw_id: value / qty for raw_id, (qty, value) in totals.items() if qty > 0}
+
+
+class _FallbackCost:
+    """تكلفة وحدة التخزين من RawCostIndex (نفس تقرير حركة المواد) عند عدم وجود طبقات."""
+
+    def __init__(self, period, convert):
+        self.period = period
+        self.convert = convert
+        self._index = None
+
+    def __call__(self, raw_id):
+        if self._index is None:
+            from costing.cost_index import RawCostIndex
+
+            self._index = RawCostIndex(self.period)
+        cost = self._index.from_purchases(raw_id) or self._index.per_ingredient_unit(raw_id)
+        if cost is None:
+            return D0
+        # تكلفة وحدة الاستخدام → وحدة التخزين
+        return Decimal(cost) * self.convert.raws.get(raw_id, (None, None, Decimal("1")))[2]
+
+
+def _value_period(period, prior):
+    """
+    prior: {(method, raw_id): [(qty, cost), ...]} طبقات آخر الفترة السابقة.
+    يحفظ StockValuation / StockCostLayer للفترة ويرجع طبقات آخرها.
+    """
+    moves, amounts = _period_inputs(period)
+    raw_ids = set(moves) | {raw_id for _, raw_id in prior}
+    convert = _Converter(raw_ids, STORAGE)
+    opening_costs = _opening_costs(period, convert)
+    fallback = _FallbackCost(period, convert)
+
+    valuations, layer_rows, closing = [], [], {}
+    for method in METHODS:
+        for raw_id in raw_ids:
+            entry = moves.get(raw_id, {"purchases": []})
+            layers = _Layers(prior.get((method, raw_id), []))
+            opening_qty, opening_value = layers.quantity, layers.value
+
+            def cost_now():
+                cost = layers.average_cost()
+                return cost if cost is not None else fallback(raw_id)
+
+            found = entry.get(StockMovement.SOURCE_OPENING, D0)
+            if found > 0:
+                layers.add(found, opening_costs.get(raw_id) or cost_now())
+            elif found < 0:
+                layers.take(-found)
+
+            purchases_qty = purchases_value = D0
+            for line_id, qty in sorted(entry["purchases"], key=lambda p: p[0] or 0):
+                if qty > 0:
+                    amount = amounts.get(line_id, D0)
+                    layers.add(qty, amount / qty)
+                    purchases_qty += qty
+                    purchases_value += amount
+                else:
+                    layers.take(-qty)
+
+            if method == VALUATION_WAC:
+                layers.average()
+
+            sales_qty = -entry.get(StockMovement.SOURCE_SALES, D0)
+            issues_qty = -entry.get(StockMovement.SOURCE_ISSUE, D0)
+            if layers.last_cost is None and (sales_qty > 0 or issues_qty > 0):
+                layers.last_cost = fallback(raw_id)
+            sales_value = layers.take(sales_qty) if sales_qty > 0 else D0
+            issues_value = layers.take(issues_qty) if issues_qty > 0 else D0
+
+            counted = entry.get(StockMovement.SOURCE_CLOSING, D0)
+            if counted > 0:
+                layers.add(counted, cost_now())
+            elif counted < 0:
+                layers.take(-counted)
+
+            kept = layers.rounded()
+            closing[(method, raw_id)] = kept
+            closing_qty = sum((qty for qty, _ in kept), D0)
+            closing_value = _q4(sum((qty * cost for qty, cost in kept), D0))
+
+            if not (opening_qty or closing_qty or entry.get("purchases") or len(entry) > 1):
+                continue
+
+            opening_value = _q4(opening_value)
+            purchases_value, sales_value, issues_value = _q4(purchases_value), _q4(sales_value), _q4(issues_value)
+            valuations.append(StockValuation(
+                period=period, raw_material_id=raw_id, method=method,
+                opening_qty=opening_qty, opening_value=opening_value,
+                purchases_qty=purchases_qty, purchases_value=purchases_value,
+                sales_qty=sales_qty, sales_value=sales_value,
+                issues_qty=issues_qty, issues_value=issues_value,
+                adjustment_qty=found + counted,
+                adjustment_value=closing_value - opening_value - purchases_value + sales_value + issues_value,
+                closing_qty=closing_qty, closing_value=closing_value,
+            ))
+            layer_rows.extend(
+                StockCostLayer(
+                    period=period, raw_material_id=raw_id, method=method,
+                    position=position, quantity=qty, unit_cost=cost,
+                )
+                for position, (qty, cost) in enumerate(kept)
+            )
+
+    StockValuation.objects.filter(period=period).delete()
+    StockCostLayer.objects.filter(period=period).delete()
+    StockValuation.objects.bulk_create(valuations, batch_size=2000)
+    StockCostLayer.objects.bulk_create(layer_rows, batch_size=2000)
+    return closing
+
+
+def _load_layers(period):
+    layers = {}
+    for method, raw_id, qty, cost in (
+        StockCostLayer.objects.filter(period=period)
+        .order_by("method", "raw_material_id", "position")
+        .values_list("method", "raw_material_id", "quantity", "unit_cost")
+    ):
+        layers.setdefault((method, raw_id), []).append((qty, cost))
+    return layers
+
+
+# --------------------------------------------------------
+# نقطة الدخول
+# --------------------------------------------------------
+@transaction.atomic
+def value_stock(periods=None):
+    """
+    تقييم الفترات من أقدم periods حتى آخر فترة (periods=None: كل الفترات).
+    الفترات السابقة التي لها أرصدة ولم تُقيّم بعد تُقيّم أولًا.
+    """
+    timeline = list(Period.objects.order_by("start_date", "id"))
+    if not timeline:
+        return 0
+
+    index = 0
+    if periods:
+        ids = {getattr(p, "pk", p) for p in periods}
+        index = next((i for i, p in enumerate(timeline) if p.pk in ids), None)
+        if index is None:
+            return 0
+        valued = set(StockValuation.objects.values_list("period_id", flat=True).distinct())
+        stocked = set(StockCheckpoint.objects.values_list("period_id", flat=True).distinct())
+        while index > 0 and timeline[index - 1].pk not in valued and timeline[index - 1].pk in stocked:
+            index -= 1
+
+    layers = _load_layers(timeline[index - 1]) if index > 0 else {}
+    for period in timeline[index:]:
+        layers = _value_period(period, layers)
+    return len(timeline) - index
+
+
+# --------------------------------------------------------
+# الاستعلام
+# --------------------------------------------------------
+def period_valuation(period, method=None):
+    """{raw_id: StockValuation} للفترة بطريقة التقييم (افتراضيًا المعتمدة)."""
+    return {
+        v.raw_material_id: v
+        for v in StockValuation.objects.filter(period=period, method=method or valuation_method())
+    }
+
+
+def cogs_by_material(period, method=None):
+    """
+    {raw_id: تكلفة المنصرف للمبيعات} من التقييم، أو None لو الفترة لم تُقيّم بعد
+    (التقارير ترجع حينها لتكلفة SalesConsumption).
+    """
+    rows = list(
+        StockValuation.objects.filter(period=period, method=method or valuation_method())
+        .values_list("raw_material_id", "sales_value")
+    )
+    if not rows:
+        return None
+    return dict(rows)
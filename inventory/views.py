@@ -5,9 +5,11 @@ from django.shortcuts import render, get_object_or_404
 
 from expenses.models import Period
 from costing.models import RawMaterial
-from purchases.models import PurchaseSummaryLine
-from inventory.models import StockCount, StockCountLine, InventoryIssueLine
-from sales.models import SalesConsumptionSummary, SalesConsumption
+from costing.cost_index import RawCostIndex
+from sales.jobs import consumption_status
+from .jobs import ledger_status
+from .ledger import period_balances
+from .valuation import period_valuation
 # inventory/views.py
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.decorators import login_required
@@ -20,30 +22,6 @@ from .utils import get_bom_tree, flatten_bom_tree
 
 
 
-def _to_storage_qty(raw, qty, unit):
-    """
-    تحويل الكمية إلى *وحدة التخزين* للمادة الخام.
-    لو:
-      - الوحدة = وحدة التخزين => نرجع الكمية كما هي
-      - الوحدة = وحدة الاستخدام => نقسم على معامل التحويل
-      - غير ذلك => نرجع الكمية كما هي (حالة استثنائية)
-    """
-    if qty is None:
-        return Decimal("0")
-
-    qty = Decimal(qty)
-    factor = raw.storage_to_ingredient_factor or Decimal("1")
-
-    if raw.storage_unit_id and unit and unit.id == raw.storage_unit_id:
-        return qty
-
-    if raw.ingredient_unit_id and unit and unit.id == raw.ingredient_unit_id and factor:
-        return qty / factor
-
-    # fallback
-    return qty
-
-
 def materials_period_report(request):
     # كل الفترات للاختيار من القائمة
     periods = Period.objects.order_by("-start_date")
@@ -55,110 +33,39 @@ def materials_period_report(request):
     if period_id:
         period = get_object_or_404(Period, id=period_id)
 
-        # قواميس تجميع لكل مادة خام بالوحدة الكبيرة
-        opening = {}          # رصيد أول الفترة
-        closing = {}          # رصيد آخر الفترة
-        purchases = {}        # مشتريات الفترة
-        issue_sales = {}      # المنصرف للمبيعات
-        issue_others = {}     # المنصرف لأغراض أخرى
-
-        # ---------- 1) جرد أول الفترة ----------
-        sc_opening = StockCount.objects.filter(period=period, type="opening").first()
-        if sc_opening:
-            lines = (
-                StockCountLine.objects
-                .filter(stock_count=sc_opening, raw_material__isnull=False)
-                .select_related("raw_material", "unit")
-            )
-            for line in lines:
-                raw = line.raw_material
-                qty_storage = _to_storage_qty(raw, line.quantity, line.unit)
-                opening[raw.id] = opening.get(raw.id, Decimal("0")) + qty_storage
-
-        # ---------- 2) جرد آخر الفترة ----------
-        sc_closing = StockCount.objects.filter(period=period, type="closing").first()
-        if sc_closing:
-            lines = (
-                StockCountLine.objects
-                .filter(stock_count=sc_closing, raw_material__isnull=False)
-                .select_related("raw_material", "unit")
-            )
-            for line in lines:
-                raw = line.raw_material
-                qty_storage = _to_storage_qty(raw, line.quantity, line.unit)
-                closing[raw.id] = closing.get(raw.id, Decimal("0")) + qty_storage
-
-        # ---------- 3) مشتريات الفترة ----------
-        purchase_lines = (
-            PurchaseSummaryLine.objects
-            .filter(summary__period=period)
-            .select_related("raw_material", "purchase_unit")
-        )
-        for line in purchase_lines:
-            raw = line.raw_material
-            if not raw:
-                continue
-            # نفترض أن كمية الشراء بالفعل بوحدة التخزين
-            qty_storage = Decimal(line.quantity or 0)
-            purchases[raw.id] = purchases.get(raw.id, Decimal("0")) + qty_storage
-
-        # ---------- 4) المنصرف لأغراض أخرى ----------
-        issue_lines = (
-            InventoryIssueLine.objects
-            .filter(inventory_issue__period=period)
-            .select_related("raw_material", "unit", "inventory_issue")
-        )
-        for line in issue_lines:
-            raw = line.raw_material
-            if not raw:
-                continue
-            qty_storage = _to_storage_qty(raw, line.quantity, line.unit)
-            issue_others[raw.id] = issue_others.get(raw.id, Decimal("0")) + qty_storage
-
-        # ---------- 5) المنصرف للمبيعات (من جدول الاستهلاك) ----------
-        cons_lines = (
-            SalesConsumption.objects
-            .filter(summary__period=period)
-            .select_related("raw_material")
-        )
-        for line in cons_lines:
-            raw = line.raw_material
-            if not raw:
-                continue
-            # quantity_consumed هنا بالوحدة الصغيرة -> نحول للوحدة الكبيرة
-            qty_storage = _to_storage_qty(raw, line.quantity_consumed, raw.ingredient_unit)
-            issue_sales[raw.id] = issue_sales.get(raw.id, Decimal("0")) + qty_storage
-
-        # ---------- 6) بناء الصفوف ----------
-        # كل المواد التي ظهر لها أي حركة
-        material_ids = set(
-            list(opening.keys())
-            + list(closing.keys())
-            + list(purchases.keys())
-            + list(issue_sales.keys())
-            + list(issue_others.keys())
-        )
-
-        materials = RawMaterial.objects.filter(id__in=material_ids).select_related("storage_unit")
+        # أرصدة نهاية الفترة من دفتر حركة المخزون (صف لكل مادة، بالوحدة الكبيرة).
+        # التقرير قراءة فقط: الدفتر تبنيه المطابقة بعد التعديلات أو rebuild_stock_ledger
+        balances = period_balances(period)
+
+        materials = RawMaterial.objects.filter(id__in=list(balances)).select_related("storage_unit", "ingredient_unit")
+
+        # ✅ تكلفة كل المواد للفترة مرة واحدة: تكلفة مخزون آخر الفترة من التقييم،
+        # وإلا آخر تكلفة مشتريات
+        valuations = period_valuation(period)
+        cost_index = RawCostIndex(period)
 
         for raw in materials:
-            open_qty = opening.get(raw.id, Decimal("0"))
-            close_qty = closing.get(raw.id, Decimal("0"))
-            purch_qty = purchases.get(raw.id, Decimal("0"))
-            sales_qty = issue_sales.get(raw.id, Decimal("0"))
-            other_qty = issue_others.get(raw.id, Decimal("0"))
+            balance = balances[raw.id]
+            open_qty = balance.opening_qty
+            close_qty = balance.closing_qty
+            purch_qty = balance.purchases_qty
+            sales_qty = -balance.sales_qty
+            other_qty = -balance.issues_qty
 
             # المعادلة النظرية = أول + مشتريات - (مبيعات + أغراض أخرى)
-            theoretical = open_qty + purch_qty - (sales_qty + other_qty)
+            theoretical = balance.theoretical_qty
 
-            # فرق الكمية = جرد آخر الفترة - المعادلة النظرية
+            # فرق الكمية = جرد آخر الفترة - المعادلة النظرية (= تسوية جرد آخر الفترة)
             diff_qty = close_qty - theoretical
 
             # تكلفة الوحدة من المشتريات/المخزون (أنت عندك دوال جاهزة في RawMaterial)
-            unit_cost = raw.get_cost_from_purchases(period=period) or raw.get_cost_per_ingredient_unit(period=period)
-            # نحولها إلى تكلفة وحدة التخزين إن كانت بوحدة الاستخدام
-            if unit_cost and raw.storage_to_ingredient_factor:
-                unit_cost = unit_cost * raw.storage_to_ingredient_factor
+            valuation = valuations.get(raw.id)
+            unit_cost = valuation.closing_unit_cost if valuation is not None else None
+            if unit_cost is None:
+                unit_cost = cost_index.from_purchases(raw.id) or cost_index.per_ingredient_unit(raw.id)
+                # نحولها إلى تكلفة وحدة التخزين إن كانت بوحدة الاستخدام
+                if unit_cost and raw.storage_to_ingredient_factor:
+                    unit_cost = unit_cost * raw.storage_to_ingredient_factor
 
             diff_value = None
             if unit_cost is not None:
@@ -181,6 +88,9 @@ def materials_period_report(request):
     context = {
         "periods": periods,
         "selected_period": period,
+        "consumption_status": consumption_status(period),
+        "ledger_status": ledger_status(period),
+        "ledger_missing": period is not None and not rows,
         "rows": rows,
     }
     return render(request, "admin/inventory/materials_period_report.html", context)
@@ -2,13 +2,15 @@
 import json
 from decimal import Decimal
 
-from django.http import JsonResponse
+from django.http import HttpResponseNotModified, JsonResponse
 from django.views.decorators.http import require_GET, require_POST, require_http_methods
 from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import ValidationError
 from django.db import transaction
 from django.db.models import Q, Sum
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
+from django.utils.http import parse_etags, quote_etag
 
 from expenses.models import (
     Period,
@@ -16,9 +18,16 @@ from expenses.models import (
     ExpenseBatch
 )
 
-from costing.models import Unit, Product, RawMaterial, BillOfMaterial, BOMItem
+from costing.models import Unit, Product, RawMaterial, BillOfMaterial, BOMItem, round3
+from costing.cache import cost_cache, invalidate_raw_materials
+from costing.cost_index import RawCostIndex
+from costing.graph import schedule_recost
+from costing.snapshots import frozen_cost_index
+from costing.validation import validate_component
+from inventory.ledger import schedule_ledger_sync
 from inventory.models import StockCount, StockCountLine
 from sales.models import SalesSummary, SalesSummaryLine
+from sales.versioning import bump_revision, data_version
 
 # اختياري: مشتريات لو موجودة
 try:
@@ -45,6 +54,12 @@ def _d(v, default="0") -> Decimal:
 def _s(v):
     return "" if v is None else str(v)
 
+def _int(v):
+    try:
+        return int(str(v).strip())
+    except (TypeError, ValueError):
+        return None
+
 def _dec(v) -> Decimal:
     try:
         return Decimal(str(v or "0"))
@@ -801,6 +816,12 @@ def bom_save(request, bom_id: int):
         cp = Product.objects.filter(pk=line.get("item_id")).first()
         if not cp:
             continue
+        # منع الدوران: المكوّن لا يستخدم هذا المنتج (بأي مستوى)
+        try:
+            validate_component(bom.product_id, cp.pk)
+        except ValidationError as exc:
+            transaction.set_rollback(True)
+            return _bad(" ".join(exc.messages))
         BOMItem.objects.create(
             bom=bom,
             raw_material=None,
@@ -857,15 +878,21 @@ def inv_next_period_has_movements(period: Period) -> bool:
     return False
 
 def _ensure_count(period: Period, count_type: str) -> StockCount:
-    count, _ = StockCount.objects.get_or_create(
-        period=period,
-        type=count_type,
-        defaults={
-            "count_type": count_type,
-            "count_date": getattr(period, "start_date", None) or getattr(period, "end_date", None),
-            "notes": "",
-        },
-    )
+    with transaction.atomic():
+        count, created = StockCount.objects.get_or_create(
+            period=period,
+            type=count_type,
+            defaults={
+                "count_type": count_type,
+                "count_date": getattr(period, "start_date", None) or getattr(period, "end_date", None),
+                "notes": "",
+            },
+        )
+        count.period = period
+        # ✅ تعبئة البنود الناقصة فقط (مواد / منتجات أُضيفت بعد إنشاء الجرد):
+        # استعلامان بدون تحميل البنود الموجودة، ولا كتابة لو لا شيء ناقص
+        if _prefill_stockcount_lines(count):
+            count.refresh_from_db(fields=["revision"])
     if getattr(count, "count_type", None) != count_type:
         count.count_type = count_type
         count.save(update_fields=["count_type"])
@@ -875,18 +902,14 @@ def _prefill_stockcount_lines(count: StockCount) -> int:
     if inv_is_locked(count):
         return 0
 
-    existing_raw = set(
-        count.lines.filter(raw_material_id__isnull=False).values_list("raw_material_id", flat=True)
-    )
-    existing_semi = set(
-        count.lines.filter(semi_finished_product_id__isnull=False).values_list("semi_finished_product_id", flat=True)
-    )
+    existing_raw = count.lines.filter(raw_material_id__isnull=False).values("raw_material_id")
+    existing_semi = count.lines.filter(semi_finished_product_id__isnull=False).values("semi_finished_product_id")
 
     to_create = []
 
-    for rid, storage_unit_id, ingredient_unit_id in RawMaterial.objects.values_list("id", "storage_unit_id", "ingredient_unit_id"):
-        if rid in existing_raw:
-            continue
+    for rid, storage_unit_id, ingredient_unit_id in RawMaterial.objects.exclude(pk__in=existing_raw).values_list(
+        "id", "storage_unit_id", "ingredient_unit_id"
+    ):
         default_unit = storage_unit_id or ingredient_unit_id
         if not default_unit:
             continue
@@ -900,9 +923,9 @@ def _prefill_stockcount_lines(count: StockCount) -> int:
             )
         )
 
-    for pid, base_unit_id in Product.objects.filter(is_semi_finished=True).values_list("id", "base_unit_id"):
-        if pid in existing_semi:
-            continue
+    for pid, base_unit_id in (
+        Product.objects.filter(is_semi_finished=True).exclude(pk__in=existing_semi).values_list("id", "base_unit_id")
+    ):
         if not base_unit_id:
             continue
         to_create.append(
@@ -916,7 +939,13 @@ def _prefill_stockcount_lines(count: StockCount) -> int:
         )
 
     if to_create:
-        StockCountLine.objects.bulk_create(to_create, batch_size=1000)
+        with transaction.atomic():
+            revision = StockCount.next_revision(count.pk)
+            for ln in to_create:
+                ln.revision = revision
+            StockCountLine.objects.bulk_create(to_create, batch_size=1000)
+        # bulk_create لا يرسل post_save → نطابق دفتر المخزون يدويًا
+        schedule_ledger_sync([count.period_id])
 
     return len(to_create)
 
@@ -937,10 +966,34 @@ def inv_stockcount_state(request):
     count = _ensure_count(period, req_type)
     locked = inv_is_locked(count)
 
-    _prefill_stockcount_lines(count)
+    # تكلفة البنود غير المحفوظة تُحسب من المشتريات / بيانات المواد (أو لقطة الإقفال)
+    cost_version = data_version(period, only=("materials",))["materials"]
+
+    # ✅ ETag = (الجرد، رقم المراجعة، القفل، نسخة التكلفة): لو العميل عنده نفس النسخة → 304 بدون أي عمل
+    etag = quote_etag(f"sc{count.id}-r{count.revision}-{int(locked)}-c{cost_version}")
+    if etag in parse_etags(request.headers.get("If-None-Match", "")):
+        resp = HttpResponseNotModified()
+        resp["ETag"] = etag
+        return resp
+
+    # ✅ مزامنة تفاضلية: since = آخر رقم مراجعة عند العميل → البنود المعدلة والمحذوفة بعده فقط
+    # (تغيّر نسخة التكلفة يغيّر تكلفة بنود لم تتغيّر مراجعتها → قائمة كاملة)
+    since = _int(request.GET.get("since"))
+    full = (
+        since is None or since < 0 or since > count.revision
+        or request.GET.get("cost_version") != cost_version
+    )
+    lines_qs = count.lines.select_related("raw_material", "semi_finished_product", "unit").order_by("id")
+    deleted = []
+    if not full:
+        lines_qs = lines_qs.filter(revision__gt=since)
+        deleted = sorted(set(
+            count.deleted_lines.filter(revision__gt=since).values_list("line_id", flat=True)
+        ))
 
     lines = []
-    for ln in count.lines.select_related("raw_material", "semi_finished_product", "unit").order_by("id"):
+    cost_index = None
+    for ln in lines_qs:
         item = ln.raw_material or ln.semi_finished_product
         item_type = "raw" if ln.raw_material_id else "semi"
 
@@ -949,12 +1002,20 @@ def inv_stockcount_state(request):
             tc = (uc * (ln.quantity or Decimal("0"))) if uc is not None else None
             unit_cost = uc
             total_cost = tc
+        elif ln.saved_unit_cost is not None:
+            unit_cost = ln.saved_unit_cost
+            total_cost = ln.saved_total_cost
         else:
-            unit_cost = ln.saved_unit_cost if ln.saved_unit_cost is not None else ln.unit_cost()
-            total_cost = ln.saved_total_cost if ln.saved_total_cost is not None else ln.line_total_cost()
+            # بند لم تُحسب تكلفته بعد: فهرس تكلفة واحد لكل الطلب
+            if cost_index is None:
+                cost_index = frozen_cost_index(period) or RawCostIndex(period)
+            ln.stock_count = count
+            unit_cost = ln.unit_cost(cost_index=cost_index)
+            total_cost = ln.line_total_cost(cost_index=cost_index)
 
         lines.append({
             "id": ln.id,
+            "revision": ln.revision,
             "item_type": item_type,
             "item_id": item.id if item else None,
             "item_label": str(item) if item else "",
@@ -965,17 +1026,24 @@ def inv_stockcount_state(request):
             "total_cost": _s(total_cost),
         })
 
-    return JsonResponse({
+    resp = JsonResponse({
         "ok": True,
         "requested_type": req_type,
         "effective_type": req_type,
         "locked": locked,
         "count_id": count.id,
+        "revision": count.revision,
+        "cost_version": cost_version,
+        "full": full,
         "period": {"id": period.id, "label": str(period), "is_closed": bool(getattr(period, "is_closed", False))},
         "count_type": req_type,
-        "totals": {"total_qty": _s(count.total_quantity()), "total_cost": _s(count.total_cost())},
+        "totals": {"total_qty": _s(round3(count.lines_total_quantity)), "total_cost": _s(round3(count.lines_total_cost))},
         "lines": lines,
+        "deleted": deleted,
     })
+    resp["ETag"] = etag
+    resp["Cache-Control"] = "private, no-cache"
+    return resp
 
 @staff_member_required
 @require_POST
@@ -1033,8 +1101,7 @@ def inv_stockcount_clear_all(request):
     if count.type == "opening":
         qs.update(unit_cost_value=None)
 
-    for ln in count.lines.all():
-        ln.save()
+    count.recost_lines()
 
     return JsonResponse({"ok": True})
 
@@ -1306,6 +1373,105 @@ def inv_stockcount_update_line(request):
     return JsonResponse({"ok": True})
 
 
+def _strict_decimal(v):
+    """Decimal من قيمة العميل، أو None لو غير صالحة (بدون تحويل صامت إلى 0)."""
+    try:
+        d = Decimal(str(v).strip())
+    except Exception:
+        return None
+    return d if d.is_finite() else None
+
+
+@staff_member_required
+@require_POST
+@transaction.atomic
+def inv_stockcount_batch_update(request):
+    """
+    ✅ تعديل بنود كثيرة من الجرد في طلب واحد (مزامنة ممر كامل من الموبايل):
+    count_id + rows_json = [{"line_id", "qty"?, "unit_id"?, "unit_cost_value"?}, ...]
+
+    - قفل رأس الجرد مرة واحدة (select_for_update) والتحقق من القفل مرة واحدة.
+    - التحقق من كل البنود في الذاكرة (نفس قواعد StockCountLine.clean حسب نوع الجرد).
+    - البنود السليمة: تكلفة من فهرس تكلفة مشترك + bulk_update برقم مراجعة واحد (recost_lines).
+    - البنود المرفوضة ترجع في errors ولا تمنع حفظ الباقي.
+    """
+    count = get_object_or_404(StockCount.objects.select_for_update().select_related("period"), id=request.POST.get("count_id"))
+
+    if inv_is_locked(count):
+        return _bad("❌ ممنوع التعديل: الفترة مقفولة أو يوجد حركة.", 400)
+
+    try:
+        rows = json.loads(request.POST.get("rows_json") or "[]")
+        if not isinstance(rows, list):
+            return _bad("rows_json لازم يكون List")
+    except Exception:
+        return _bad("rows_json غير صالح")
+
+    errors = []
+    changes = {}
+    for r in rows:
+        line_id = _int(r.get("line_id")) if isinstance(r, dict) else None
+        if line_id is None:
+            errors.append({"line_id": r.get("line_id") if isinstance(r, dict) else None, "error": "line_id غير صالح."})
+            continue
+        changes[line_id] = r  # نفس البند مكرر → آخر تعديل هو المعتمد
+
+    lines = {ln.id: ln for ln in count.lines.select_related("raw_material").filter(id__in=list(changes))}
+    unit_ids = {_int(r["unit_id"]) for r in changes.values() if r.get("unit_id") not in (None, "")}
+    known_units = set(Unit.objects.filter(id__in=unit_ids - {None}).values_list("id", flat=True))
+
+    valid = []
+    for line_id, r in changes.items():
+        ln = lines.get(line_id)
+        if ln is None:
+            errors.append({"line_id": line_id, "error": "البند غير موجود في هذا الجرد."})
+            continue
+
+        if r.get("unit_id") not in (None, ""):
+            unit_id = _int(r["unit_id"])
+            if unit_id not in known_units:
+                errors.append({"line_id": line_id, "error": "الوحدة غير موجودة."})
+                continue
+            ln.unit_id = unit_id
+
+        if r.get("qty") is not None:
+            q = _strict_decimal(r["qty"])
+            if q is None:
+                errors.append({"line_id": line_id, "error": "الكمية غير صحيحة."})
+                continue
+            ln.quantity = q
+
+        if "unit_cost_value" in r and r["unit_cost_value"] is not None:
+            if count.type != "opening":
+                errors.append({"line_id": line_id, "error": "❌ تكلفة الوحدة اليدوية مسموحة في جرد أول المدة فقط."})
+                continue
+            v = str(r["unit_cost_value"]).strip()
+            c = None if v == "" else _strict_decimal(v)
+            if v != "" and c is None:
+                errors.append({"line_id": line_id, "error": "التكلفة غير صحيحة."})
+                continue
+            ln.unit_cost_value = c
+
+        try:
+            ln.clean_in_count(count)
+        except ValidationError as exc:
+            errors.append({"line_id": line_id, "error": "، ".join(exc.messages)})
+            continue
+        valid.append(ln)
+
+    if valid:
+        count.recost_lines(lines=valid, fields=("quantity", "unit", "unit_cost_value"))
+        count.refresh_from_db(fields=["revision", "lines_total_quantity", "lines_total_cost"])
+
+    return JsonResponse({
+        "ok": True,
+        "saved_count": len(valid),
+        "errors": errors,
+        "revision": count.revision,
+        "totals": {"total_qty": _s(round3(count.lines_total_quantity)), "total_cost": _s(round3(count.lines_total_cost))},
+    })
+
+
 @staff_member_required
 @require_POST
 @transaction.atomic
@@ -1334,8 +1500,7 @@ def inv_stockcount_recalc(request):
         return JsonResponse({"ok": False, "error": "❌ ممنوع: الفترة مقفولة أو يوجد حركة."}, status=400)
 
     _prefill_stockcount_lines(count)
-    for ln in count.lines.all():
-        ln.save()
+    count.recost_lines()
 
     return JsonResponse({"ok": True})
 
@@ -1358,8 +1523,7 @@ def inv_stockcount_clear_all(request):
     if count.type == "opening":
         qs.update(unit_cost_value=None)
 
-    for ln in count.lines.all():
-        ln.save()
+    count.recost_lines()
 
     return JsonResponse({"ok": True})
 
@@ -1413,6 +1577,7 @@ from django.db import transaction
 from expenses.models import Period
 from costing.models import Product, Unit
 from sales.models import SalesSummary, SalesSummaryLine
+from sales.jobs import consumption_status
 
 
 def _d(v, default="0"):
@@ -1499,6 +1664,7 @@ def portal_sales_grid_get(request):
         "is_locked": is_period_locked(period),
         "summary_id": summary.id,
         "rows": rows,
+        "consumption": consumption_status(period),
     })
 
 
@@ -1566,8 +1732,18 @@ def portal_sales_grid_save(request):
         line.save()  # يحسب line_total من الموديل
         saved += 1
 
-    summary.save()
-    return JsonResponse({"ok": True, "saved_count": saved})
+    summary.save()  # يسجّل مهمة توليد الاستهلاك (أو ينفّذها مباشرة لو غير مفعّل)
+    return JsonResponse({"ok": True, "saved_count": saved, "consumption": consumption_status(period)})
+
+
+@staff_member_required
+@require_GET
+def portal_sales_consumption_status(request):
+    """حالة استهلاك المواد للفترة: stale=True أثناء انتظار/تنفيذ مهمة إعادة الحساب."""
+    period = Period.objects.filter(id=request.GET.get("period_id") or None).first()
+    if not period:
+        return JsonResponse({"ok": False, "error": "الفترة غير موجودة"}, status=404)
+    return JsonResponse({"ok": True, "consumption": consumption_status(period)})
 
 
 # =========================
@@ -1595,9 +1771,10 @@ from inventory.models import StockCount, StockCountLine
 D0 = Decimal("0")
 
 
-def _d(v):
+def _d(v, default="0"):
+    # يحل محل تعريفات _d السابقة في الوحدة: نفس التوقيع (bom_save يمرر default)
     try:
-        return Decimal(str(v if v not in (None, "") else "0"))
+        return Decimal(str(v if v not in (None, "") else default))
     except Exception:
         return D0
 
@@ -1712,6 +1889,13 @@ def portal_purchases_grid_get(request):
 
     if to_create:
         PurchaseSummaryLine.objects.bulk_create(to_create)
+        # bulk_create لا يرسل post_save → نبطل كاش التكلفة يدويًا
+        invalidate_raw_materials(
+            [ln.raw_material_id for ln in to_create],
+            from_date=getattr(summary.period, "start_date", None),
+        )
+        schedule_recost(raw_ids=[ln.raw_material_id for ln in to_create])
+        bump_revision("purchases", [summary.period_id])
 
     # ✅ Build rows
     rows = []
@@ -1797,3 +1981,20 @@ def portal_purchases_grid_save(request):
             summary.recalculate_totals()
 
     return JsonResponse({"ok": True, "saved_count": saved})
+
+
+# =========================
+# Costing cache stats
+# =========================
+@staff_member_required
+@require_GET
+def costing_cache_stats(request):
+    """
+    عدادات كاش التكاليف للعملية الحالية (hits / misses / evictions ...).
+    ?reset=1 لتصفير العدادات، ?clear=1 لتفريغ الكاش.
+    """
+    if request.GET.get("clear") == "1":
+        cost_cache.clear()
+    if request.GET.get("reset") == "1":
+        cost_cache.reset_stats()
+    return JsonResponse({"ok": True, "stats": cost_cache.stats()})
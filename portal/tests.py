@@ -1,3 +1,248 @@
+import json
+from decimal import Decimal as D
+
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from django.urls import reverse
+
+from costing.models import BOMItem, Product, RawMaterial
+from costing.tests import CatalogMixin
+from expenses.models import Period
+from inventory.models import StockCount
+from purchases.models import PurchaseSummaryLine
+
+
+class StockCountGridMixin(CatalogMixin):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create_user("staff", password="x", is_staff=True)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def state(self, count_type="closing", **params):
+        headers = {}
+        if "etag" in params:
+            headers["HTTP_IF_NONE_MATCH"] = params.pop("etag")
+        return self.client.get(
+            reverse("portal:inv_stockcount_state"),
+            {"period_id": self.jan.pk, "type": count_type, **params},
+            **headers,
+        )
+
+    def line(self, count, item):
+        field = "raw_material" if isinstance(item, RawMaterial) else "semi_finished_product"
+        return count.lines.get(**{field: item})
+
+
+class StockCountDeltaSyncTests(StockCountGridMixin, TestCase):
+    def test_full_then_delta(self):
+        first = self.state()
+        data = first.json()
+        self.assertTrue(data["full"])
+        # تعبئة البنود عند الإنشاء: كل المواد الخام والمنتجات نصف المصنعة
+        self.assertEqual(len(data["lines"]), 4 + 2)
+        revision, cost_version = data["revision"], data["cost_version"]
+
+        count = StockCount.objects.get(pk=data["count_id"])
+        edited = self.line(count, self.flour)
+        edited.quantity = D("12.5")
+        edited.save()
+        removed = self.line(count, self.dough)
+        removed_id = removed.pk
+        removed.delete()
+
+        delta = self.state(since=revision, cost_version=cost_version).json()
+        self.assertFalse(delta["full"])
+        self.assertGreater(delta["revision"], revision)
+        # البند المحذوف يُعاد تعبئته (كل المواد تظهر دائمًا في الجرد) ببند جديد
+        refilled = self.line(count, self.dough)
+        self.assertEqual([ln["id"] for ln in delta["lines"]], [edited.pk, refilled.pk])
+        self.assertEqual((delta["lines"][0]["qty"], delta["lines"][1]["qty"]), ("12.5000", "0.0000"))
+        self.assertEqual(delta["deleted"], [removed_id])
+
+        # لا شيء بعد آخر رقم مراجعة
+        latest = self.state(since=delta["revision"], cost_version=cost_version).json()
+        self.assertEqual((latest["lines"], latest["deleted"]), ([], []))
+
+    def test_invalid_or_future_revision_returns_full_list(self):
+        first = self.state().json()
+        revision, cost_version = first["revision"], first["cost_version"]
+        for since, version in (
+            ("abc", cost_version), ("-1", cost_version), (str(revision + 1), cost_version),
+            # نسخة تكلفة مختلفة أو غير مرسلة
+            (str(revision), "other"), (str(revision), None),
+        ):
+            with self.subTest(since=since, cost_version=version):
+                params = {"since": since}
+                if version is not None:
+                    params["cost_version"] = version
+                data = self.state(**params).json()
+                self.assertTrue(data["full"])
+                self.assertEqual(len(data["lines"]), 6)
+
+    def test_etag(self):
+        first = self.state()
+        self.assertEqual(self.state(etag=first["ETag"]).status_code, 304)
+
+        count = StockCount.objects.get(pk=first.json()["count_id"])
+        line = self.line(count, self.oil)
+        line.quantity = D("3")
+        line.save()
+        second = self.state(etag=first["ETag"])
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second["ETag"], first["ETag"])
+
+    def test_purchase_change_invalidates_etag_and_delta(self):
+        first = self.state()
+        data = first.json()
+        purchase = PurchaseSummaryLine.objects.get(summary__period=self.jan, raw_material=self.flour)
+        purchase.unit_cost = D("30")
+        with self.captureOnCommitCallbacks(execute=True):
+            purchase.save()
+
+        # رقم مراجعة الجرد لم يتغيّر، لكن تكلفة البنود غير المحفوظة تغيّرت
+        second = self.state(etag=first["ETag"], since=data["revision"], cost_version=data["cost_version"])
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second["ETag"], first["ETag"])
+        changed = second.json()
+        self.assertEqual(changed["revision"], data["revision"])
+        self.assertTrue(changed["full"])
+        flour = lambda d: next(ln for ln in d["lines"] if ln["item_type"] == "raw" and ln["item_id"] == self.flour.pk)
+        self.assertNotEqual(flour(changed)["unit_cost"], flour(data)["unit_cost"])
+
+    def test_items_added_after_creation_are_prefilled(self):
+        data = self.state().json()
+        yeast = RawMaterial.objects.create(
+            sku="yeast", name="yeast", storage_unit=self.kg, ingredient_unit=self.g,
+            storage_to_ingredient_factor=D("1000"), purchase_price_per_storage_unit=D("1"),
+        )
+        glaze = Product.objects.create(code="glaze", name="glaze", base_unit=self.g, is_semi_finished=True)
+
+        delta = self.state(since=data["revision"], cost_version=data["cost_version"]).json()
+        self.assertFalse(delta["full"])
+        self.assertEqual(
+            {(ln["item_type"], ln["item_id"]) for ln in delta["lines"]}, {("raw", yeast.pk), ("semi", glaze.pk)},
+        )
+        # لا بنود مكررة في القراءات التالية
+        count = StockCount.objects.get(pk=data["count_id"])
+        self.assertEqual(count.lines.count(), 8)
+        self.state()
+        self.assertEqual(count.lines.count(), 8)
+
+
+class StockCountBatchUpdateTests(StockCountGridMixin, TestCase):
+    def batch(self, count, rows):
+        return self.client.post(
+            reverse("portal:inv_stockcount_batch_update"),
+            {"count_id": count.pk, "rows_json": json.dumps(rows)},
+        ).json()
+
+    def count(self, count_type):
+        if count_type == "opening":
+            Period.objects.filter(pk=self.jan.pk).update(inv_opening_enabled=True)
+        return StockCount.objects.get(pk=self.state(count_type).json()["count_id"])
+
+    def test_valid_rows_saved_and_rejected_rows_reported(self):
+        count = self.count("closing")
+        other = self.line(self.count("opening"), self.flour)
+        flour, oil, salt, sugar, dough, sauce = (
+            self.line(count, item)
+            for item in (self.flour, self.oil, self.salt, self.sugar, self.dough, self.sauce)
+        )
+        revision = count.revision
+
+        data = self.batch(count, [
+            {"line_id": flour.pk, "qty": "7.25"},
+            {"line_id": oil.pk, "qty": "abc"},
+            {"line_id": salt.pk, "qty": "-1"},
+            {"line_id": sugar.pk, "unit_id": 999999},
+            {"line_id": sauce.pk, "qty": "2", "unit_cost_value": "5"},
+            {"line_id": dough.pk, "qty": "2"},
+            {"line_id": other.pk, "qty": "1"},
+            {"line_id": "x"},
+            {"line_id": dough.pk, "qty": "3", "unit_id": self.kg.pk},
+        ])
+
+        self.assertTrue(data["ok"])
+        # البند المكرر: آخر تعديل هو المعتمد
+        self.assertEqual(data["saved_count"], 2)
+        self.assertEqual(
+            sorted(str(e["line_id"]) for e in data["errors"]),
+            sorted(str(pk) for pk in (oil.pk, salt.pk, sugar.pk, sauce.pk, other.pk, "x")),
+        )
+        self.assertGreater(data["revision"], revision)
+
+        flour.refresh_from_db()
+        dough.refresh_from_db()
+        self.assertEqual(flour.quantity, D("7.25"))
+        self.assertEqual(flour.revision, data["revision"])
+        self.assertIsNotNone(flour.saved_unit_cost)
+        self.assertEqual((dough.quantity, dough.unit_id), (D("3"), self.kg.pk))
+        for line in (oil, salt, sugar, sauce, other):
+            line.refresh_from_db()
+            self.assertEqual(line.quantity, D("0"))
+
+        # البنود المحفوظة فقط تظهر في المزامنة التفاضلية
+        delta = self.state(since=revision, cost_version=self.state().json()["cost_version"]).json()
+        self.assertEqual(sorted(ln["id"] for ln in delta["lines"]), sorted([flour.pk, dough.pk]))
+        self.assertEqual(delta["totals"], data["totals"])
+
+    def test_manual_cost_on_opening_count(self):
+        count = self.count("opening")
+        flour = self.line(count, self.flour)
+
+        data = self.batch(count, [{"line_id": flour.pk, "qty": "4", "unit_cost_value": "2.5"}])
+        self.assertEqual((data["saved_count"], data["errors"]), (1, []))
+        flour.refresh_from_db()
+        self.assertEqual((flour.quantity, flour.unit_cost_value), (D("4"), D("2.5")))
+        self.assertEqual(D(data["totals"]["total_qty"]), D("4"))
+
+    def test_closed_period_rejects_batch(self):
+        count = self.count("closing")
+        Period.objects.filter(pk=self.jan.pk).update(is_closed=True)
+        response = self.client.post(
+            reverse("portal:inv_stockcount_batch_update"),
+            {"count_id": count.pk, "rows_json": json.dumps([{"line_id": count.lines.first().pk, "qty": "1"}])},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(count.lines.exclude(quantity=0).exists())
+
+
+class BOMSaveTests(StockCountGridMixin, TestCase):
+    def save(self, product, semi_lines):
+        bom = product.get_active_bom()
+        return self.client.post(
+            reverse("portal:api_bom_save", args=[bom.pk]),
+            json.dumps({
+                "name": "edited",
+                "batch_output_quantity": "1",
+                "raw_lines": [{"item_id": self.salt.pk, "qty": "1"}],
+                "semi_lines": [{"item_id": p.pk, "qty": "1"} for p in semi_lines],
+            }),
+            content_type="application/json",
+        )
+
+    def test_cycle_rejected_and_rolled_back(self):
+        bom = self.dough.get_active_bom()
+        before = set(BOMItem.objects.filter(bom=bom).values_list("raw_material_id", "component_product_id", "quantity"))
+
+        response = self.save(self.dough, [self.pizza])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("دورانًا", response.json()["error"])
+        bom.refresh_from_db()
+        self.assertNotEqual(bom.name, "edited")
+        self.assertEqual(
+            set(BOMItem.objects.filter(bom=bom).values_list("raw_material_id", "component_product_id", "quantity")),
+            before,
+        )
 
-# Create your tests here.
+    def test_valid_component_saved(self):
+        response = self.save(self.pie, [self.dough])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            set(BOMItem.objects.filter(bom=self.pie.get_active_bom()).values_list("raw_material_id", "component_product_id")),
+            {(self.salt.pk, None), (None, self.dough.pk)},
+        )
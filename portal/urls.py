@@ -93,6 +93,7 @@ urlpatterns = [
 
     path("api/inventory/stockcount/add-line/", api.inv_stockcount_add_line, name="inv_stockcount_add_line"),
     path("api/inventory/stockcount/update-line/", api.inv_stockcount_update_line, name="inv_stockcount_update_line"),
+    path("api/inventory/stockcount/batch-update/", api.inv_stockcount_batch_update, name="inv_stockcount_batch_update"),
     path("api/inventory/stockcount/delete-line/", api.inv_stockcount_delete_line, name="inv_stockcount_delete_line"),
     path("api/inventory/stockcount/recalc/", api.inv_stockcount_recalc, name="inv_stockcount_recalc"),
     path("api/inventory/stockcount/clear-all/", api.inv_stockcount_clear_all, name="inv_stockcount_clear_all"),
@@ -104,6 +105,7 @@ urlpatterns = [
     # API
     path("api/sales/grid/", api.portal_sales_grid_get, name="portal_sales_grid_get"),
     path("api/sales/grid/save/", api.portal_sales_grid_save, name="portal_sales_grid_save"),
+    path("api/sales/consumption/status/", api.portal_sales_consumption_status, name="portal_sales_consumption_status"),
     path("sales/entry/", views.sales_entry, name="sales_entry"),
 
 
@@ -114,6 +116,9 @@ urlpatterns = [
     path("api/purchases/grid/", api.portal_purchases_grid_get, name="portal_purchases_grid_get"),
     path("api/purchases/grid/save/", api.portal_purchases_grid_save, name="portal_purchases_grid_save"),
 
+    # ✅ Costing cache
+    path("api/costing/cache-stats/", api.costing_cache_stats, name="costing_cache_stats"),
+
 
 
 
@@ -5,6 +5,7 @@ from django.shortcuts import render
 from django.db.models import Q
 
 from costing.models import Product, Unit, BillOfMaterial, BOMItem, RawMaterial
+from costing.rollup import compute_unit_costs
 
 from django.http import JsonResponse
 
@@ -157,12 +158,16 @@ def products_list(request):
     if q:
         qs = qs.filter(code__icontains=q) | qs.filter(name__icontains=q) | qs.filter(name_en__icontains=q)
 
+    products = list(qs[:2000])
+
+    # ✅ تكلفة الوحدة من BOM لكل المنتجات مرة واحدة
+    unit_costs = compute_unit_costs(period=None, product_ids=[p.id for p in products])
+
     rows = []
-    for p in qs[:2000]:
+    for p in products:
         locked = product_locked(p)
 
-        # ✅ تكلفة الوحدة من BOM (لو موجود)
-        unit_cost = p.compute_unit_cost(period=None)  # ممكن تبعت period لاحقًا
+        unit_cost = unit_costs.get(p.id)  # ممكن تبعت period لاحقًا
 
         rows.append({
             "id": p.id,
@@ -426,16 +431,17 @@ def products_list(request):
             Q(code__icontains=q) | Q(name__icontains=q) | Q(name_en__icontains=q)
         )
 
+    products = list(qs[:2000])
+
+    # ✅ تكلفة كل المنتجات في تمريرة واحدة (الوصفات الدائرية ترجع None)
+    unit_costs = compute_unit_costs(period=None, product_ids=[p.id for p in products])
+
     rows = []
-    for p in qs[:2000]:
+    for p in products:
         locked = product_locked(p)
 
-        unit_cost = ""
-        try:
-            v = p.compute_unit_cost(period=None)
-            unit_cost = str(v) if v is not None else ""
-        except Exception:
-            unit_cost = ""
+        v = unit_costs.get(p.id)
+        unit_cost = str(v) if v is not None else ""
 
         rows.append({
             "id": p.id,
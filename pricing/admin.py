@@ -8,6 +8,8 @@ from django.urls import path
 
 from expenses.models import Period
 
+from costing.rollup import compute_unit_costs
+
 from .models import PricingRun, PricingLine, PricingPolicy, PricingResult
 
 from .services.pricing_engine import calculate_price
@@ -143,7 +145,8 @@ class PricingPolicyAdmin(admin.ModelAdmin):
             return redirect("..")
 
         # ✅ 1) احسب تكلفة الوحدة
-        cost_per_unit = policy.product.compute_unit_cost(period=policy.period) or Decimal("0")
+        unit_costs = compute_unit_costs(period=policy.period, product_ids=[policy.product_id])
+        cost_per_unit = unit_costs.get(policy.product_id) or Decimal("0")
 
         # ✅ 2) احسب السعر والربح حسب السياسة
         result = calculate_price(cost_per_unit, policy)
@@ -1,11 +1,15 @@
 # pricing/api.py
+import json
 from decimal import Decimal, ROUND_HALF_UP
 from django.http import JsonResponse
 from django.contrib.admin.views.decorators import staff_member_required
 from django.views.decorators.http import require_http_methods, require_GET
 from django.db.models import Q
 
-from costing.models import Product
+from costing.cost_index import RawCostIndex
+from costing.models import Product, round3
+from costing.rollup import CostRollup, effective_unit_costs
+from costing.snapshots import get_snapshot
 from expenses.models import Period
 
 # =========================
@@ -45,6 +49,19 @@ def get_period(period_id):
     return Period.objects.order_by("year", "month").last()
 
 
+def effective_unit_cost(product, period):
+    """
+    BOM.unit_cost_final إن وجدت، وإلا التكلفة المحسوبة حسب الفترة.
+    الفترة المقفلة: القيمتان من لقطة الإقفال.
+    """
+    snapshot = get_snapshot(period)
+    if snapshot is not None and product.pk in snapshot.product_costs:
+        return snapshot.unit_cost_final(product.pk) or snapshot.unit_cost(product.pk)
+
+    bom = product.get_active_bom()
+    return (getattr(bom, "unit_cost_final", None) if bom else None) or product.compute_unit_cost(period=period)
+
+
 # =========================
 # 1) Dashboard Data (All Products)
 # =========================
@@ -100,10 +117,12 @@ def pricing_dashboard_data(request):
     total_current_gross_for_margin = D0
     total_suggested_gross_for_margin = D0
 
+    # ✅ تكلفة كل المنتجات مرة واحدة (بدل compute_unit_cost لكل منتج)
+    products = list(products)
+    unit_costs = effective_unit_costs(period=period, product_ids=[p.id for p in products])
+
     for p in products:
-        bom = p.get_active_bom()
-        cost = (getattr(bom, "unit_cost_final", None) if bom else None) or p.compute_unit_cost(period=period)
-        cost = d(cost)
+        cost = d(unit_costs.get(p.id))
 
         current_price = d(p.selling_price_per_unit)
 
@@ -254,8 +273,7 @@ def pricing_product_calc(request):
     fixed_cost_total = d(request.GET.get("fixed_cost_total") or "0")
 
     # COST
-    bom = p.get_active_bom()
-    cost = (getattr(bom, "unit_cost_final", None) if bom else None) or p.compute_unit_cost(period=period)
+    cost = effective_unit_cost(p, period)
     cost = d(cost)
 
     current_price = d(p.selling_price_per_unit)
@@ -389,8 +407,7 @@ def pricing_product_pnl(request):
     prod_qty, prod_sales, total_qty, total_sales = d(prod_qty), d(prod_sales), d(total_qty), d(total_sales)
 
     # cogs
-    bom = product.get_active_bom()
-    unit_cost = (getattr(bom, "unit_cost_final", None) if bom else None) or product.compute_unit_cost(period=period)
+    unit_cost = effective_unit_cost(product, period)
     unit_cost = d(unit_cost)
     cogs = unit_cost * prod_qty
 
@@ -468,3 +485,198 @@ def pricing_save_scenario(request):
 @require_http_methods(["GET"])
 def pricing_load_scenario(request, scenario_id: int):
     return JsonResponse({"ok": False, "error": "pricing_load_scenario not implemented yet", "scenario_id": scenario_id}, status=501)
+
+
+# =========================
+# 5) What-if: Raw Material Price Simulation
+# =========================
+class OverrideError(ValueError):
+    """بند أسعار معدّلة غير صالح؛ item/index للرد على العميل."""
+
+    def __init__(self, message, item=None, index=None):
+        super().__init__(message)
+        self.item = item
+        self.index = index
+
+
+def _override_number(item, field):
+    value = item.get(field)
+    if isinstance(value, bool):
+        raise ValueError(f"{field} غير صالح.")
+    try:
+        number = Decimal(str(value).strip())
+    except Exception:
+        raise ValueError(f"{field} غير صالح.")
+    if not number.is_finite():
+        raise ValueError(f"{field} غير صالح.")
+    return number
+
+
+def _parse_overrides(items, cost_index):
+    """
+    items: [{"raw_material_id": 5, "percent": 8} | {"raw_material_id": 5, "price": "12.5"}]
+    percent: نسبة تغيير على تكلفة وحدة الاستخدام الحالية للفترة (أكبر من -100)؛
+             المادة بدون تكلفة حالية → OverrideError (لا يوجد أساس للنسبة).
+    price:   سعر جديد لوحدة التخزين (يُحوّل بمعامل التحويل مثل المشتريات)، غير سالب.
+    ترجع {raw_id: تكلفة وحدة الاستخدام الجديدة}؛ أي بند غير صالح → OverrideError
+    (بدون تحويل القيمة غير الصالحة إلى 0 = مادة مجانية).
+    """
+    if items is None:
+        return {}
+    if not isinstance(items, list):
+        raise OverrideError("overrides لازم يكون List.")
+
+    overrides = {}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise OverrideError("كل بند في overrides لازم يكون JSON object.", item, index)
+        try:
+            raw_id = item.get("raw_material_id")
+            if isinstance(raw_id, bool):
+                raise ValueError
+            raw_id = int(raw_id)
+        except (TypeError, ValueError):
+            raise OverrideError("raw_material_id غير صالح.", item, index)
+
+        try:
+            if item.get("price") not in (None, ""):
+                price = _override_number(item, "price")
+                if price < 0:
+                    raise ValueError("price لا يمكن أن يكون سالبًا.")
+                overrides[raw_id] = cost_index.from_storage_price(raw_id, price)
+            elif item.get("percent") not in (None, ""):
+                percent = _override_number(item, "percent")
+                if percent <= -HUND:
+                    raise ValueError("percent لازم يكون أكبر من -100.")
+                current = cost_index.per_ingredient_unit(raw_id)
+                if current is None:
+                    raise ValueError("لا توجد تكلفة حالية لهذه المادة في الفترة؛ استخدم price.")
+                overrides[raw_id] = round3(current * (Decimal("1") + percent / HUND))
+            else:
+                raise ValueError("مطلوب price أو percent.")
+        except ValueError as exc:
+            raise OverrideError(str(exc), item, index)
+    return overrides
+
+
+@staff_member_required
+@require_http_methods(["POST"])
+def pricing_simulate(request):
+    """
+    محاكاة تغيير أسعار مواد خام بدون حفظ أي شيء:
+    تجميع تكلفة الكتالوج مرة بالأسعار الحالية ومرة بالأسعار المعدّلة (نفس هيكل الوصفات)،
+    ثم التكلفة / الهامش / السعر اللازم للحفاظ على الهامش لكل منتج.
+
+    body (JSON):
+        {"period": 3, "overrides": [...], "product_ids": [..] (اختياري), "changed_only": true}
+    """
+    try:
+        payload = json.loads(request.body.decode("utf-8") or "{}")
+    except Exception:
+        return JsonResponse({"ok": False, "error": "بيانات غير صالحة."}, status=400)
+    if not isinstance(payload, dict):
+        return JsonResponse({"ok": False, "error": "البيانات لازم تكون JSON object."}, status=400)
+
+    period_id = payload.get("period")
+    if period_id not in (None, ""):
+        try:
+            period_id = int(period_id)
+        except (TypeError, ValueError):
+            return JsonResponse({"ok": False, "error": "period غير صالحة."}, status=400)
+    period = get_period(period_id)
+    cost_index = RawCostIndex(period)
+    try:
+        overrides = _parse_overrides(payload.get("overrides"), cost_index)
+    except OverrideError as exc:
+        return JsonResponse(
+            {"ok": False, "error": str(exc), "index": exc.index, "item": exc.item}, status=400
+        )
+    if not overrides:
+        return JsonResponse({"ok": False, "error": "لا توجد أسعار معدّلة صالحة."}, status=400)
+
+    try:
+        product_ids = payload.get("product_ids") or []
+        if not isinstance(product_ids, list):
+            raise TypeError
+        product_ids = [int(x) for x in product_ids] or None
+    except (TypeError, ValueError):
+        return JsonResponse({"ok": False, "error": "product_ids غير صالحة."}, status=400)
+    changed_only = bool(payload.get("changed_only", False))
+
+    # التكلفة الحالية كما في شاشات التسعير (unit_cost_final إن وجدت)؛
+    # الجديدة = الحالية + فرق التجميع بالأسعار المعدّلة عن التجميع بنفس الهيكل الحالي
+    # (وليس من لقطة الفترة المقفلة) حتى يكون الفرق للمحاكاة فقط
+    old_costs = effective_unit_costs(period=period, product_ids=product_ids, cost_index=cost_index)
+    base = CostRollup(period=period, cost_index=cost_index)
+    live_costs = base.with_raw_costs({}).compute(product_ids=product_ids)
+    simulated = base.with_raw_costs(overrides).compute(product_ids=product_ids)
+    new_costs = {}
+    for pid, old_cost in old_costs.items():
+        live, new = live_costs.get(pid), simulated.get(pid)
+        if old_cost is not None and live is not None and new is not None:
+            new = old_cost + (new - live)
+        elif live == new:
+            new = old_cost
+        new_costs[pid] = new
+
+    ids = product_ids if product_ids is not None else old_costs.keys()
+    products = Product.objects.filter(pk__in=list(ids)).only(
+        "id", "code", "name", "is_semi_finished", "selling_price_per_unit"
+    ).order_by("code")
+
+    rows = []
+    totals = {"count": 0, "changed": 0, "sum_old_cost": D0, "sum_new_cost": D0}
+
+    for p in products:
+        old_cost = old_costs.get(p.id)
+        new_cost = new_costs.get(p.id)
+        changed = old_cost != new_cost
+        if changed_only and not changed:
+            continue
+
+        old_cost, new_cost = d(old_cost), d(new_cost)
+        price = d(p.selling_price_per_unit)
+
+        old_margin = pct(price - old_cost, price)
+        new_margin = pct(price - new_cost, price)
+
+        # السعر الذي يحافظ على نفس نسبة الهامش بالتكلفة الجديدة
+        price_keep_margin = (price * new_cost / old_cost) if (price > 0 and old_cost > 0) else None
+
+        rows.append({
+            "product_id": p.id,
+            "code": p.code,
+            "name": p.name,
+            "type": "SEMI" if p.is_semi_finished else "FINISHED",
+            "changed": changed,
+
+            "old_cost": float(money(old_cost)),
+            "new_cost": float(money(new_cost)),
+            "delta_cost": float(money(new_cost - old_cost)),
+            "delta_cost_pct": float(money(pct(new_cost - old_cost, old_cost))) if old_cost > 0 else None,
+
+            "price": float(money(price)),
+            "old_margin_percent": float(money(old_margin)) if old_margin is not None else None,
+            "new_margin_percent": float(money(new_margin)) if new_margin is not None else None,
+            "delta_margin_percent": (
+                float(money(new_margin - old_margin)) if old_margin is not None else None
+            ),
+
+            "price_keep_margin": float(money(price_keep_margin)) if price_keep_margin is not None else None,
+            "delta_price": float(money(price_keep_margin - price)) if price_keep_margin is not None else None,
+        })
+
+        totals["count"] += 1
+        totals["changed"] += 1 if changed else 0
+        totals["sum_old_cost"] += old_cost
+        totals["sum_new_cost"] += new_cost
+
+    totals["sum_delta_cost"] = totals["sum_new_cost"] - totals["sum_old_cost"]
+
+    return JsonResponse({
+        "ok": True,
+        "period": {"id": period.id if period else None, "label": str(period) if period else ""},
+        "overrides": {str(k): float(v) for k, v in overrides.items()},
+        "rows": rows,
+        "totals": {k: (float(money(v)) if isinstance(v, Decimal) else v) for k, v in totals.items()},
+    })
@@ -1,3 +1,65 @@
+import json
+from decimal import Decimal as D
+
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from django.urls import reverse
+
+from costing.models import BillOfMaterial
+from costing.rollup import CostRollup, effective_unit_costs
+from costing.tests import CatalogMixin
+
+
+class PricingSimulateTests(CatalogMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create_user("staff", password="x", is_staff=True)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def simulate(self, overrides, **payload):
+        return self.client.post(
+            reverse("pricing_simulate"),
+            json.dumps({"period": self.jan.pk, "overrides": overrides, **payload}),
+            content_type="application/json",
+        )
+
+    def rows(self, response):
+        self.assertEqual(response.status_code, 200, response.content)
+        return {row["product_id"]: row for row in response.json()["rows"]}
+
+    def test_old_cost_uses_stored_final_cost(self):
+        # تكلفة محفوظة يدويًا للبيتزا تختلف عن التجميع الحي
+        BillOfMaterial.objects.filter(product=self.pizza, is_active=True).update(unit_cost_final=D("9.5"))
+        live = CostRollup(period=self.jan).compute()
+        simulated = CostRollup(period=self.jan).with_raw_costs({self.flour.pk: D("0.025")}).compute()
+
+        rows = self.rows(self.simulate([{"raw_material_id": self.flour.pk, "price": "25"}]))
+        pizza = rows[self.pizza.pk]
+        self.assertEqual(D(str(pizza["old_cost"])), D("9.50"))
+        self.assertEqual(
+            D(str(pizza["delta_cost"])),
+            (simulated[self.pizza.pk] - live[self.pizza.pk]).quantize(D("0.01")),
+        )
+        # بقية المنتجات: نفس تكلفة شاشات التسعير
+        effective = effective_unit_costs(period=self.jan)
+        self.assertEqual(D(str(rows[self.pie.pk]["old_cost"])), effective[self.pie.pk].quantize(D("0.01")))
+
+    def test_percent_without_current_cost_is_rejected(self):
+        # السكر بدون مشتريات في يناير ومعامل تحويل 0: لا توجد تكلفة حالية
+        response = self.simulate([
+            {"raw_material_id": self.flour.pk, "percent": 8},
+            {"raw_material_id": self.sugar.pk, "percent": 8},
+        ])
+        self.assertEqual(response.status_code, 400)
+        body = response.json()
+        self.assertEqual((body["ok"], body["index"]), (False, 1))
+        self.assertEqual(body["item"], {"raw_material_id": self.sugar.pk, "percent": 8})
 
-# Create your tests here.
+    def test_price_without_current_cost_is_accepted(self):
+        rows = self.rows(self.simulate([{"raw_material_id": self.sugar.pk, "price": "7"}], changed_only=True))
+        self.assertIn(self.sauce.pk, rows)
+        self.assertTrue(all(row["delta_cost"] > 0 for row in rows.values()))
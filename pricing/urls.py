@@ -6,6 +6,7 @@ from .api import (
     pricing_product_pnl,
     pricing_save_scenario,
     pricing_load_scenario,
+    pricing_simulate,
 )
 
 urlpatterns = [
@@ -19,4 +20,5 @@ urlpatterns = [
     path("api/product-pnl/", pricing_product_pnl, name="pricing_product_pnl"),
     path("api/scenario/save/", pricing_save_scenario, name="pricing_save_scenario"),
     path("api/scenario/load/<int:scenario_id>/", pricing_load_scenario, name="pricing_load_scenario"),
+    path("api/simulate/", pricing_simulate, name="pricing_simulate"),
 ]
@@ -1,3 +1,49 @@
+from decimal import Decimal as D
+
 from django.test import TestCase
 
-# Create your tests here.
+from costing.models import BOMItem
+from costing.snapshots import get_snapshot
+from costing.tests import CatalogMixin
+from purchases.models import PurchaseSummaryLine
+
+from .views import build_product_cost_report
+
+
+class ClosedPeriodReportTests(CatalogMixin, TestCase):
+    def report(self, product, period):
+        report = build_product_cost_report(product, period, D("3"))
+        rows = [
+            (row["level"], row["type"], row.get("total_cost"))
+            for row in report["level1_lines"] + report["level2_lines"]
+        ]
+        return report["product_total_cost"], rows, dict(report["final_raw_totals"])
+
+    def close(self, period, closed=True):
+        period.is_closed = closed
+        with self.captureOnCommitCallbacks(execute=True):
+            period.save()
+
+    def edit_after_close(self):
+        item = BOMItem.objects.get(bom__product=self.dough, raw_material=self.flour)
+        item.quantity = D("6000")
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+            line = PurchaseSummaryLine.objects.get(summary__period=self.jan, raw_material=self.oil)
+            line.unit_cost = D("80")
+            line.save()
+
+    def test_closed_period_reads_snapshot(self):
+        self.close(self.jan)
+        self.assertIsNotNone(get_snapshot(self.jan))
+        closed = self.report(self.pizza, self.jan)
+        self.assertTrue(closed[1])
+
+        self.edit_after_close()
+        # الوصفة وسعر الزيت تغيّرا بعد الإقفال: التقرير ثابت من اللقطة
+        self.assertEqual(self.report(self.pizza, self.jan), closed)
+
+        self.close(self.jan, closed=False)
+        self.assertIsNone(get_snapshot(self.jan))
+        reopened = self.report(self.pizza, self.jan)
+        self.assertGreater(reopened[0], closed[0])
@@ -4,14 +4,19 @@ from __future__ import annotations
 from collections import OrderedDict
 from decimal import Decimal
 from django.db.models.functions import Coalesce
-from django.db.models import Sum
+from django.db.models import Prefetch, Sum
 from django.http import HttpResponse
 from django.shortcuts import render
 from django.template.loader import get_template
 
-from costing.models import BOMItem, Product, RawMaterial
+from costing.models import BillOfMaterial, Product, RawMaterial
+from costing.cost_index import RawCostIndex
+from costing.explosion import exploded_requirements
+from costing.rollup import BOMStructure
+from costing.snapshots import get_snapshot
 from expenses.models import Period
-from sales.models import SalesConsumption, get_quantity_sold
+from sales.models import SalesConsumption, SalesConsumptionPath, get_quantity_sold
+from sales.jobs import consumption_status
 from django.db.models import Sum
 from django.db.models import Sum as DJSum
 
@@ -27,6 +32,14 @@ MONEY = Decimal("0.01")
 def money(x):
     return (x or Decimal("0")).quantize(MONEY, rounding=ROUND_HALF_UP)
 
+
+def _int_param(value):
+    """قيمة رقمية صحيحة من الـ query string أو None إن كانت فارغة/غير صالحة."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
 # ─────────────────────────────
 # الصفحة الموحدة للتقارير
 # ─────────────────────────────
@@ -65,9 +78,9 @@ def raw_material_consumption_summary(request):
     else:
         current_period = get_default_period()
 
-    qs = SalesConsumption.objects.select_related("summary__period", "raw_material")
+    qs = SalesConsumption.objects.select_related("period", "raw_material")
     if current_period:
-        qs = qs.filter(summary__period=current_period)
+        qs = qs.filter(period=current_period)
 
     # تجميع حسب المادة الخام
     base_rows = (
@@ -117,6 +130,7 @@ def raw_material_consumption_summary(request):
     context = {
         "periods": periods,
         "current_period": current_period,
+        "consumption_status": consumption_status(current_period),
         "rows": rows,
         "grand_total_cost": grand_total_cost,
     }
@@ -135,14 +149,27 @@ def raw_material_consumption_detail(request):
     else:
         current_period = get_default_period()
 
+    # تصفية اختيارية حسب المصدر (نصف مصنع) والمستوى عبر مسارات الوصفات (BOMPath)
+    # قيم غير رقمية تُتجاهل (بدل خطأ 500)
+    source_id = _int_param(request.GET.get("source"))
+    level = _int_param(request.GET.get("level"))
+
+    paths_qs = SalesConsumptionPath.objects.select_related("path__source_product").order_by("path__level", "path__key")
+    if source_id:
+        paths_qs = paths_qs.filter(path__source_product_id=source_id)
+    if level:
+        paths_qs = paths_qs.filter(path__level=level)
+
     qs = SalesConsumption.objects.select_related(
-        "summary__period",
+        "period",
         "product",
         "raw_material",
         "source_product",
-    )
+    ).prefetch_related(Prefetch("paths", queryset=paths_qs))
     if current_period:
-        qs = qs.filter(summary__period=current_period)
+        qs = qs.filter(period=current_period)
+    if source_id or level:
+        qs = qs.filter(pk__in=paths_qs.values("consumption_id"))
 
     products_map = OrderedDict()
     grand_total_cost = Decimal("0")
@@ -158,24 +185,37 @@ def raw_material_consumption_detail(request):
             }
 
         line_orders_sold = line.quantity_sold or Decimal("0")
-        line_cost = line.total_cost or Decimal("0")
 
-        per_order_qty = None
-        cost_per_order = None
-        if line_orders_sold:
-            per_order_qty = (line.quantity_consumed or Decimal("0")) / line_orders_sold
-            cost_per_order = line_cost / line_orders_sold
-
-        products_map[pid]["lines"].append({
-            "line": line,
-            "orders_sold": line_orders_sold,
-            "per_order_qty": per_order_qty,
-            "cost_per_order": cost_per_order,
-        })
+        # سطر لكل مسار (المصدر والمستوى)؛ السطور القديمة بدون مسارات تظهر كما هي
+        entries = [
+            (p.path.level, p.path.source_product, p.quantity_consumed, p.total_cost)
+            for p in line.paths.all()
+        ] or [(line.level, line.source_product, line.quantity_consumed, line.total_cost)]
+
+        for entry_level, source, quantity, cost in entries:
+            cost = cost or Decimal("0")
+
+            per_order_qty = None
+            cost_per_order = None
+            if line_orders_sold:
+                per_order_qty = (quantity or Decimal("0")) / line_orders_sold
+                cost_per_order = cost / line_orders_sold
+
+            products_map[pid]["lines"].append({
+                "line": line,
+                "level": entry_level,
+                "source": source,
+                "quantity": quantity,
+                "cost": cost,
+                "orders_sold": line_orders_sold,
+                "per_order_qty": per_order_qty,
+                "cost_per_order": cost_per_order,
+            })
+
+            products_map[pid]["total_cost"] += cost
+            grand_total_cost += cost
 
         products_map[pid]["quantity_sold"] += line_orders_sold
-        products_map[pid]["total_cost"] += line_cost
-        grand_total_cost += line_cost
 
     # تكلفة الطلب الواحد لكل منتج
     for _, data in products_map.items():
@@ -187,6 +227,9 @@ def raw_material_consumption_detail(request):
     context = {
         "periods": periods,
         "current_period": current_period,
+        "consumption_status": consumption_status(current_period),
+        "source_id": source_id,
+        "level": level,
         "products_data": products_map.values(),
         "grand_total_cost": grand_total_cost,
     }
@@ -209,12 +252,12 @@ def raw_material_usage_by_product(request):
         current_period = get_default_period()
 
     qs = SalesConsumption.objects.select_related(
-        "summary__period",
+        "period",
         "product",
         "raw_material",
     )
     if current_period:
-        qs = qs.filter(summary__period=current_period)
+        qs = qs.filter(period=current_period)
 
     selected_material = None
     if raw_material_id:
@@ -223,7 +266,7 @@ def raw_material_usage_by_product(request):
 
     rows = []
     if selected_material:
-        agg = (
+        agg = list(
             qs.values("product_id", "product__code", "product__name")
             .annotate(
                 total_qty_sold=Sum("quantity_sold"),
@@ -233,24 +276,17 @@ def raw_material_usage_by_product(request):
             .order_by("product__name")
         )
 
-        for r in agg:
-            product_id = r["product_id"]
-
-            bom_item = BOMItem.objects.filter(
-                bom__product_id=product_id,
-                raw_material_id=selected_material.id,
-                bom__is_active=True,
-            ).select_related("raw_material", "bom__product").first()
-
-            per_order_qty = None
-            per_order_unit = None
+        # الكمية لكل طلب من جدول التفكيك (كل المستويات ÷ كمية الإنتاج) باستعلام واحد
+        requirements = exploded_requirements(
+            product_ids=[r["product_id"] for r in agg],
+            only_semi_path=True,
+            period=current_period,
+            raw_ids=[selected_material.id],
+        )
+        per_order_unit = selected_material.ingredient_unit or selected_material.storage_unit
 
-            if bom_item:
-                per_order_qty = bom_item.quantity
-                if bom_item.raw_material.ingredient_unit:
-                    per_order_unit = bom_item.raw_material.ingredient_unit
-                elif bom_item.raw_material.storage_unit:
-                    per_order_unit = bom_item.raw_material.storage_unit
+        for r in agg:
+            per_order_qty = requirements.get((r["product_id"], selected_material.id))
 
             rows.append({
                 "product_code": r["product__code"],
@@ -259,12 +295,13 @@ def raw_material_usage_by_product(request):
                 "total_qty_consumed": r["total_qty_consumed"] or Decimal("0"),
                 "total_cost": r["total_cost"] or Decimal("0"),
                 "per_order_qty": per_order_qty,
-                "per_order_unit": per_order_unit,
+                "per_order_unit": per_order_unit if per_order_qty is not None else None,
             })
 
     context = {
         "periods": periods,
         "current_period": current_period,
+        "consumption_status": consumption_status(current_period),
         "materials": materials,
         "selected_material": selected_material,
         "rows": rows,
@@ -285,6 +322,44 @@ def _raw_label(rm: RawMaterial) -> str:
     return rm.name
 
 
+def _load_bom_lines(product_ids, period):
+    """
+    {product_id: (الوصفة الحية أو None، batch_output_quantity، [(منتج مكوَّن، مادة خام، الكمية)])}
+    للوصفة الفعّالة للمنتجات product_ids وكل مكوّناتها بكل المستويات؛ المنتج بلا وصفة غير موجود.
+    التحميل مرة واحدة (BOMStructure: استعلامان لكل مستوى) بدل استعلامين لكل عقدة في الشجرة.
+    الفترة المقفلة تُقرأ من بنود لقطة الإقفال (لا من BOMItem الحالية) فتبقى الشجرة
+    والكميات كما كانت وقت الإقفال؛ اللقطات القديمة بلا بنود ترجع للوصفات الحالية.
+    """
+    snapshot = get_snapshot(period)
+    found = {}
+    if snapshot is not None and snapshot.has_bom_items():
+        frontier = set(product_ids)
+        while frontier:
+            components = set()
+            for product_id in frontier:
+                frozen = snapshot.bom_items(product_id)
+                if frozen is not None:
+                    found[product_id] = (None, *frozen)
+                    components |= {c for _, c, _ in frozen[1] if c is not None}
+            frontier = components - set(found)
+    else:
+        structure = BOMStructure(product_ids=product_ids)
+        boms = BillOfMaterial.objects.in_bulk(list(structure.active_bom.values()))
+        for product_id, bom_id in structure.active_bom.items():
+            found[product_id] = (boms[bom_id], boms[bom_id].batch_output_quantity, structure.items[bom_id])
+
+    rows = [row for _, _, items in found.values() for row in items]
+    products = Product.objects.in_bulk({c for _, c, _ in rows if c is not None})
+    raws = RawMaterial.objects.in_bulk({r for r, _, _ in rows if r is not None})
+    return {
+        product_id: (bom, batch, [
+            (products.get(component_id), raws.get(raw_id), qty)
+            for raw_id, component_id, qty in items
+        ])
+        for product_id, (bom, batch, items) in found.items()
+    }
+
+
 def _collect_bom_tree(
     product,
     multiplier,
@@ -294,14 +369,21 @@ def _collect_bom_tree(
     final_raw_totals,
     period,
     root_sold_qty,
+    cost_index=None,
+    bom_tree=None,
 ):
     """
     بناء شجرة المواد + حساب التكلفة
     - يعتمد على BOM.unit_cost_final (تكلفة الوحدة المحفوظة) للمنتجات المصنعة
     - ويستخدم get_cost_per_ingredient_unit للمواد الخام حسب الفترة
+      (أو cost_index لو مبني مسبقًا للفترة)
+    - الفترة المقفلة: الهيكل والكميات والتكاليف من لقطة الإقفال (_load_bom_lines)
+    bom_tree (اختياري): نتيجة _load_bom_lines لو حُمّلت مسبقًا لعدة منتجات.
     """
-    bom = product.get_active_bom()
-    if not bom:
+    if bom_tree is None:
+        bom_tree = _load_bom_lines([product.pk], period)
+    bom_lines = bom_tree.get(product.pk)
+    if not bom_lines:
         return
 
     parent_label = (
@@ -309,8 +391,9 @@ def _collect_bom_tree(
         else _raw_label(parent_obj)
     )
 
-    for item in bom.items.all():
-        base_qty = item.quantity or Decimal("0")
+    snapshot = get_snapshot(period)
+    for semi, rm, base_qty in bom_lines[2]:
+        base_qty = base_qty or Decimal("0")
         qty_total = base_qty * multiplier
 
         per_order_qty = None
@@ -318,12 +401,14 @@ def _collect_bom_tree(
             per_order_qty = qty_total / root_sold_qty
 
         # 1) منتج نصف مصنع
-        if item.component_product:
-            semi = item.component_product
-
-            semi_bom = semi.get_active_bom()
+        if semi:
+            semi_lines = bom_tree.get(semi.pk)
+            semi_bom = semi_lines[0] if semi_lines else None
             unit_cost = None
-            if semi_bom:
+            if snapshot is not None and semi.pk in snapshot.product_costs:
+                # الفترة المقفلة: التكلفة من لقطة الإقفال
+                unit_cost = snapshot.unit_cost_final(semi.pk) or snapshot.unit_cost(semi.pk)
+            elif semi_bom:
                 unit_cost = semi_bom.unit_cost_final or semi_bom.unit_cost
 
             total_cost = unit_cost * qty_total if unit_cost is not None else None
@@ -341,7 +426,7 @@ def _collect_bom_tree(
                 "total_cost": total_cost,
             })
 
-            batch_qty = semi_bom.batch_output_quantity or Decimal("1") if semi_bom else Decimal("1")
+            batch_qty = (semi_lines[1] or Decimal("1")) if semi_lines else Decimal("1")
             semi_units_needed = qty_total / batch_qty
 
             _collect_bom_tree(
@@ -353,13 +438,13 @@ def _collect_bom_tree(
                 final_raw_totals=final_raw_totals,
                 period=period,
                 root_sold_qty=root_sold_qty,
+                cost_index=cost_index,
+                bom_tree=bom_tree,
             )
 
         # 2) مادة خام
-        elif item.raw_material:
-            rm = item.raw_material
-
-            unit_cost = rm.get_cost_per_ingredient_unit(period=period)
+        elif rm:
+            unit_cost = rm.get_cost_per_ingredient_unit(period=period, cost_index=cost_index)
             total_cost = unit_cost * qty_total if unit_cost is not None else None
 
             lines.append({
@@ -405,10 +490,14 @@ def raw_material_consumption_with_manufactured_detail(request):
     grand_total_cost = Decimal("0")
 
     if current_period:
-        for product in Product.objects.filter(is_sellable=True).order_by("name"):
-            sold_qty = get_quantity_sold(product, current_period)
-            if sold_qty <= 0:
-                continue
+        cost_index = RawCostIndex(current_period)
+        sold = [
+            (product, get_quantity_sold(product, current_period))
+            for product in Product.objects.filter(is_sellable=True).order_by("name")
+        ]
+        sold = [(product, qty) for product, qty in sold if qty > 0]
+        bom_tree = _load_bom_lines([product.pk for product, _ in sold], current_period)
+        for product, sold_qty in sold:
 
             lines = []
             final_raw_totals = {}
@@ -423,6 +512,8 @@ def raw_material_consumption_with_manufactured_detail(request):
                 final_raw_totals=final_raw_totals,
                 period=current_period,
                 root_sold_qty=sold_qty,
+                cost_index=cost_index,
+                bom_tree=bom_tree,
             )
 
             for row in lines:
@@ -451,9 +542,11 @@ def raw_material_consumption_with_manufactured_detail(request):
 # ───────────────────────────────────────────────
 # بناء تقرير تكلفة منتج واحد
 # ───────────────────────────────────────────────
-def build_product_cost_report(product, period, qty: Decimal):
+def build_product_cost_report(product, period, qty: Decimal, cost_index=None, bom_tree=None):
     """
     ترجع كل البيانات اللازمة لتقرير تكلفة منتج واحد.
+    cost_index / bom_tree (اختياري): RawCostIndex و _load_bom_lines للفترة
+    عند بناء تقارير لعدة منتجات.
     """
     lines = []
     final_raw_totals = OrderedDict()
@@ -475,6 +568,8 @@ def build_product_cost_report(product, period, qty: Decimal):
         final_raw_totals=final_raw_totals,
         period=period,
         root_sold_qty=qty,
+        cost_index=cost_index,
+        bom_tree=bom_tree,
     )
 
     for row in lines:
@@ -628,8 +723,10 @@ def product_cost_breakdown_all_pdf(request):
     except Exception:
         qty = Decimal("1")
 
-    products = Product.objects.filter(is_sellable=True).order_by("name")
-    reports = [build_product_cost_report(p, period, qty) for p in products]
+    products = list(Product.objects.filter(is_sellable=True).order_by("name"))
+    cost_index = RawCostIndex(period)
+    bom_tree = _load_bom_lines([p.pk for p in products], period)
+    reports = [build_product_cost_report(p, period, qty, cost_index, bom_tree) for p in products]
 
     template = get_template("reports/product_cost_breakdown_pdf.html")
     html_string = template.render({
@@ -770,9 +867,15 @@ def product_cost_flat(request):
 # تقرير مساعد: وحدة كبيرة/صغيرة للصف
 # ───────────────────────────────────────────────
 from costing.models import round3  # لو عندك الدالة في costing.models
+from costing.rollup import compute_unit_costs
 
 
-def _enrich_row_with_big_unit(row, period):
+def _enrich_row_with_big_unit(row, period, unit_costs=None, cost_index=None):
+    """
+    unit_costs (اختياري): {product_id: unit_cost} محسوبة مسبقًا من costing.rollup
+    cost_index (اختياري): RawCostIndex للفترة
+    لتفادي الاستعلام لكل صف في التقارير المجمعة.
+    """
     big_unit_price = None
     big_unit_name = ""
     big_unit_size = ""
@@ -799,9 +902,14 @@ def _enrich_row_with_big_unit(row, period):
             big_unit_qty = factor
             big_unit_size = f"{factor} {small_unit_name}"
 
-        cost_small = raw_obj.get_cost_from_purchases(period=period)
-        if cost_small is None:
-            cost_small = raw_obj.get_cost_per_ingredient_unit(period=None)
+        if cost_index is not None:
+            cost_small = cost_index.from_purchases(raw_obj.id)
+            if cost_small is None:
+                cost_small = cost_index.unfiltered().per_ingredient_unit(raw_obj.id)
+        else:
+            cost_small = raw_obj.get_cost_from_purchases(period=period)
+            if cost_small is None:
+                cost_small = raw_obj.get_cost_per_ingredient_unit(period=None)
 
         if cost_small is not None:
             if factor:
@@ -825,10 +933,14 @@ def _enrich_row_with_big_unit(row, period):
             big_unit_qty = Decimal("1")
             big_unit_size = f"1 {big_unit_name}"
 
-        if hasattr(prod_obj, "compute_unit_cost"):
+        if unit_costs is not None:
+            unit_cost = unit_costs.get(prod_obj.id)
+        elif hasattr(prod_obj, "compute_unit_cost"):
             unit_cost = prod_obj.compute_unit_cost(period=period)
-            if unit_cost is not None:
-                big_unit_price = round3(unit_cost)
+        else:
+            unit_cost = None
+        if unit_cost is not None:
+            big_unit_price = round3(unit_cost)
 
     new_row = dict(row)
     new_row.update({
@@ -985,13 +1097,18 @@ def product_cost_with_big_units_all_pdf(request):
         qty = Decimal("1")
 
     reports = []
-    products = Product.objects.filter(is_sellable=True).order_by("name")
+    products = list(Product.objects.filter(is_sellable=True).order_by("name"))
+
+    # ✅ تكلفة كل المواد الخام والمنتجات (والنصف مصنعة) ووصفاتها مرة واحدة للفترة
+    cost_index = RawCostIndex(period)
+    unit_costs = compute_unit_costs(period=period, cost_index=cost_index)
+    bom_tree = _load_bom_lines([p.pk for p in products], period)
 
     for product in products:
-        base_report = build_product_cost_report(product, period, qty)
+        base_report = build_product_cost_report(product, period, qty, cost_index, bom_tree)
 
-        level1_rows = [_enrich_row_with_big_unit(r, period) for r in base_report["level1_lines"]]
-        level2_rows = [_enrich_row_with_big_unit(r, period) for r in base_report["level2_lines"]]
+        level1_rows = [_enrich_row_with_big_unit(r, period, unit_costs, cost_index) for r in base_report["level1_lines"]]
+        level2_rows = [_enrich_row_with_big_unit(r, period, unit_costs, cost_index) for r in base_report["level2_lines"]]
 
         reports.append({
             "product": product,
@@ -1025,6 +1142,7 @@ from django.shortcuts import render
 
 from expenses.models import Period, ExpenseBatch, ExpenseLine
 from sales.models import SalesSummaryLine, SalesConsumption
+from inventory.valuation import cogs_by_material
 
 def income_statement(request):
     period_id = request.GET.get("period")
@@ -1043,14 +1161,20 @@ def income_statement(request):
         )
 
     # 2) COGS: تكلفة المواد الخام للمبيعات
+    # من تقييم المخزون (inventory/valuation.py) حتى تتفق مع قيمة مخزون آخر الفترة،
+    # أو من SalesConsumption لو الفترة لم تُقيّم بعد
     cogs = Decimal("0")
     if current_period:
-        cogs = (
-            SalesConsumption.objects
-            .filter(summary__period=current_period)
-            .aggregate(t=Sum("total_cost"))["t"]
-            or Decimal("0")
-        )
+        valued = cogs_by_material(current_period)
+        if valued is not None:
+            cogs = sum(valued.values(), Decimal("0"))
+        else:
+            cogs = (
+                SalesConsumption.objects
+                .filter(period=current_period)
+                .aggregate(t=Sum("total_cost"))["t"]
+                or Decimal("0")
+            )
 
     gross_profit = revenue - cogs
 
@@ -1081,6 +1205,7 @@ def income_statement(request):
     context = {
         "periods": periods,
         "current_period": current_period,
+        "consumption_status": consumption_status(current_period),
         "revenue": revenue,
         "cogs": cogs,
         "gross_profit": gross_profit,
@@ -1129,13 +1254,17 @@ def income_statement_drilldown(request):
         summaries = SalesSummary.objects.filter(period=current_period)
         revenue = sum((s.total_amount() for s in summaries), Decimal("0"))
 
-        # ✅ COGS
-        cogs = (
-            SalesConsumption.objects
-            .filter(summary__period=current_period)
-            .aggregate(t=DJSum("total_cost"))["t"]
-            or Decimal("0")
-        )
+        # ✅ COGS (من تقييم المخزون إن وُجد، مثل قائمة الدخل)
+        valued = cogs_by_material(current_period)
+        if valued is not None:
+            cogs = sum(valued.values(), Decimal("0"))
+        else:
+            cogs = (
+                SalesConsumption.objects
+                .filter(period=current_period)
+                .aggregate(t=DJSum("total_cost"))["t"]
+                or Decimal("0")
+            )
 
         gross_profit = revenue - cogs
 
@@ -1147,8 +1276,9 @@ def income_statement_drilldown(request):
 
     cogs_rows = list(
         SalesConsumption.objects
-        .filter(summary__period=current_period, raw_material__isnull=False)
+        .filter(period=current_period, raw_material__isnull=False)
         .values(
+            "raw_material_id",
             "raw_material__sku",
             "raw_material__name",
             "raw_material__ingredient_unit__name",
@@ -1161,6 +1291,13 @@ def income_statement_drilldown(request):
         .order_by("-total")
     )
 
+    # ✅ تكلفة كل مادة من تقييم المخزون (مجموعها = COGS أعلاه)
+    valued = cogs_by_material(current_period) if current_period else None
+    if valued is not None:
+        for r in cogs_rows:
+            r["total"] = valued.get(r["raw_material_id"], D0)
+        cogs_rows.sort(key=lambda r: r["total"], reverse=True)
+
     # ✅ حساب تكلفة الوحدة الواحدة بشكل آمن
     for r in cogs_rows:
         qty_used = r.get("qty_used") or D0
@@ -1218,6 +1355,7 @@ def income_statement_drilldown(request):
         "title": "قائمة الدخل التفصيلية",
         "periods": periods,
         "current_period": current_period,
+        "consumption_status": consumption_status(current_period),
 
         "revenue": revenue,
         "cogs": cogs,
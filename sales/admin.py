@@ -6,12 +6,9 @@ from django.urls import path
 from django.shortcuts import render, redirect
 import pandas as pd
 
-from decimal import Decimal, ROUND_HALF_UP
+from decimal import Decimal
 
-def round3(value):
-    if value is None:
-        return None
-    return Decimal(value).quantize(Decimal("0.001"), rounding=ROUND_HALF_UP)
+from costing.fixedpoint import round3
 
 
 from .models import SalesSummary, SalesSummaryLine,SalesConsumption
@@ -19,7 +16,9 @@ from .forms import SalesSummaryImportForm
 from costing.models import Product, Unit
 
 from django.contrib import admin, messages
-from .models import SalesConsumptionSummary, SalesConsumption, generate_sales_consumption
+from .models import SalesConsumptionSummary, SalesConsumption, ConsumptionJob, PosTicketLine
+from .jobs import async_enabled, schedule_consumption_update
+from .versioning import is_consumption_current
 
 class SalesSummaryLineInline(admin.TabularInline):
     model = SalesSummaryLine
@@ -43,6 +42,12 @@ class SalesSummaryAdmin(admin.ModelAdmin):
         return obj.total_amount()
     display_total_amount.short_description = "إجمالي قيمة المبيعات"
 
+    def save_related(self, request, form, formsets, change):
+        # البنود تُحفظ بعد الملخص → نحدّث الاستهلاك للمنتجات التي تغيّرت بعدها
+        super().save_related(request, form, formsets, change)
+        if form.instance.period:
+            schedule_consumption_update(form.instance.period)
+
     def get_urls(self):
         urls = super().get_urls()
         custom_urls = [
@@ -130,6 +135,8 @@ class SalesSummaryAdmin(admin.ModelAdmin):
                             line_total=line_total,
                         )
 
+                    schedule_consumption_update(period)
+
                     messages.success(request, "تم استيراد ملخص المبيعات من ملف الإكسل بنجاح.")
                     return redirect("admin:sales_salessummary_change", summary.pk)
 
@@ -173,7 +180,7 @@ class SalesConsumptionInline(admin.TabularInline):
 
 @admin.register(SalesConsumptionSummary)
 class SalesConsumptionSummaryAdmin(admin.ModelAdmin):
-    list_display = ("period", "total_quantity_consumed", "total_cost_consumed")
+    list_display = ("period", "total_quantity_consumed", "total_cost_consumed", "versioned_at")
     search_fields = ("period__name",)
     inlines = [SalesConsumptionInline]
 
@@ -192,17 +199,56 @@ class SalesConsumptionSummaryAdmin(admin.ModelAdmin):
     total_cost_consumed.short_description = "إجمالي تكلفة الاستهلاك"
 
     # زر / أكشن لإعادة التوليد من المبيعات و الـ BOM
+    # (لعدد كبير من الفترات: python manage.py rebuild_sales_consumption --from/--to)
     def regenerate_consumption(self, request, queryset):
-        count = 0
-        for summary in queryset:
-            # نحذف القديم ونولّد من جديد
-            generate_sales_consumption(summary.period)
+        count = skipped = 0
+        for summary in queryset.select_related("period"):
+            # بيانات الفترة لم تتغيّر منذ آخر توليد → لا داعي لإعادة التوليد
+            if is_consumption_current(summary.period) and not summary.period.sales_consumption_changes.exists():
+                skipped += 1
+                continue
+            # نحذف القديم ونولّد من جديد (في الطابور لو التوليد في الخلفية مفعّل)
+            schedule_consumption_update(summary.period, full=True)
             count += 1
 
-        self.message_user(
-            request,
-            f"تم إعادة توليد استهلاك المواد لـ {count} فترة.",
-            level=messages.SUCCESS,
-        )
+        if async_enabled():
+            message = f"تمت جدولة إعادة توليد استهلاك المواد لـ {count} فترة."
+        else:
+            message = f"تم إعادة توليد استهلاك المواد لـ {count} فترة."
+        if skipped:
+            message += f" ({skipped} فترة محدّثة بالفعل — تم تخطيها)"
+        self.message_user(request, message, level=messages.SUCCESS)
+
+    regenerate_consumption.short_description = "إعادة توليد استهلاك المواد للفترات المختارة"
+
+@admin.register(ConsumptionJob)
+class ConsumptionJobAdmin(admin.ModelAdmin):
+    list_display = (
+        "id", "period", "status", "full", "requests_count", "products_updated",
+        "requested_at", "started_at", "finished_at",
+    )
+    list_filter = ("status", "full", "period")
+    readonly_fields = (
+        "period", "status", "full", "requests_count", "products_updated", "error",
+        "requested_at", "started_at", "heartbeat_at", "finished_at",
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(PosTicketLine)
+class PosTicketLineAdmin(admin.ModelAdmin):
+    list_display = (
+        "ticket_id", "line_no", "product_code", "quantity", "unit_price", "sold_at",
+        "status", "error", "folded_at",
+    )
+    list_filter = ("status",)
+    search_fields = ("ticket_id", "product_code")
+    readonly_fields = (
+        "ticket_id", "line_no", "product_code", "quantity", "unit_price", "sold_at",
+        "status", "error", "received_at", "folded_at",
+    )
 
-    regenerate_consumption.short_description = "إعادة توليد استهلاك المواد للفترات المختارة"
\ No newline at end of file
+    def has_add_permission(self, request):
+        return False
@@ -5,3 +5,7 @@ class SalesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'sales'
     verbose_name = '🧾 المبيعات'
+
+    def ready(self):
+        # عدادات مدخلات الاستهلاك عند تعديل المشتريات/الوصفات/المواد الخام
+        from . import signals  # noqa: F401
@@ -0,0 +1,253 @@
+# sales/jobs.py
+"""
+طابور مهام توليد استهلاك المواد (بدون وسيط خارجي).
+
+- schedule_consumption_update: نقطة الدخول من حفظ المبيعات؛
+  مع SALES_CONSUMPTION_ASYNC=True (الافتراضي) يسجّل مهمة ويعود فورًا،
+  وإلا ينفّذ التحديث مباشرة.
+  الطابور يتطلب تشغيل run_consumption_worker دائمًا، وإلا لا يُنفّذ شيء.
+- enqueue_consumption_job: الطلبات المتكررة لنفس الفترة تُدمج في مهمة منتظرة واحدة.
+- claim_next_job / run_job / run_pending: يستخدمها أمر run_consumption_worker.
+- heartbeat / requeue_stuck_jobs: العامل يحدّث heartbeat_at أثناء التنفيذ؛ مهمة توقفت
+  نبضتها (العامل توقف) تعود للانتظار، أما المهمة الطويلة لعامل حي فلا تُمس.
+  started_at هو رقم الاستلام: عامل فقد مهمته (أعيدت للانتظار) لا يكتب نتيجتها.
+- consumption_status: حالة الاستهلاك للفترة (قيد إعادة الحساب / غير محدّث) للبوابة والتقارير.
+
+إعادة التوليد الكاملة (full) تُتخطى لو نسخ مدخلات الفترة لم تتغيّر (sales/versioning.py).
+"""
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connection, connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import (
+    ConsumptionJob, SalesConsumptionChange, generate_sales_consumption, update_sales_consumption,
+)
+from .versioning import consumption_version
+
+
+def async_enabled():
+    # الافتراضي الطابور: حفظ المبيعات (الشبكة / استيراد Excel) لا ينتظر إعادة التفكيك
+    return getattr(settings, "SALES_CONSUMPTION_ASYNC", True)
+
+
+def _for_update(qs):
+    # SQLite لا يدعم SKIP LOCKED (وقفل الصفوف فيه بلا أثر أصلًا)
+    return qs.select_for_update(skip_locked=connection.features.has_select_for_update_skip_locked)
+
+
+# --------------------------------------------------------
+# التسجيل
+# --------------------------------------------------------
+@transaction.atomic
+def enqueue_consumption_job(period, full=False):
+    """
+    مهمة منتظرة واحدة لكل فترة: لو موجودة يزيد عدد الطلبات فقط
+    (full يبقى True لو طُلب مرة واحدة على الأقل). ترجع ConsumptionJob.
+    """
+    job = (
+        ConsumptionJob.objects.select_for_update()
+        .filter(period=period, status=ConsumptionJob.STATUS_PENDING)
+        .order_by("id")
+        .first()
+    )
+    if job is None:
+        return ConsumptionJob.objects.create(period=period, full=full)
+
+    ConsumptionJob.objects.filter(pk=job.pk).update(
+        requests_count=F("requests_count") + 1,
+        full=job.full or full,
+        requested_at=timezone.now(),
+    )
+    job.refresh_from_db()
+    return job
+
+
+def schedule_consumption_update(period, full=False):
+    """تحديث استهلاك الفترة: في الطابور أو مباشرة حسب SALES_CONSUMPTION_ASYNC."""
+    if async_enabled():
+        return enqueue_consumption_job(period, full=full)
+    if full:
+        generate_sales_consumption(period, skip_current=True)
+    else:
+        update_sales_consumption(period)
+    return None
+
+
+# --------------------------------------------------------
+# التنفيذ
+# --------------------------------------------------------
+@transaction.atomic
+def claim_next_job():
+    """
+    أقدم مهمة منتظرة لفترة ليس لها مهمة قيد التنفيذ (عامل واحد لكل فترة).
+    المهام المنتظرة الأخرى لنفس الفترة (لو سُجّلت بالتوازي) تُدمج فيها.
+
+    الاستلام UPDATE مشروط (status=pending ولا مهمة قيد التنفيذ للفترة) في جملة واحدة:
+    على SQLite (بدون قفل صفوف) يستلم المهمة عامل واحد فقط، ومن يخسر يجرّب التالية.
+    """
+    skipped = []
+    while True:
+        running = ConsumptionJob.objects.filter(status=ConsumptionJob.STATUS_RUNNING).values("period_id")
+        job = (
+            _for_update(ConsumptionJob.objects.filter(status=ConsumptionJob.STATUS_PENDING))
+            .exclude(period_id__in=running)
+            .exclude(pk__in=skipped)
+            .order_by("id")
+            .first()
+        )
+        if job is None:
+            return None
+
+        now = timezone.now()
+        claimed = (
+            ConsumptionJob.objects.filter(pk=job.pk, status=ConsumptionJob.STATUS_PENDING)
+            .exclude(period_id__in=ConsumptionJob.objects.filter(
+                status=ConsumptionJob.STATUS_RUNNING).values("period_id"))
+            .update(status=ConsumptionJob.STATUS_RUNNING, started_at=now, heartbeat_at=now)
+        )
+        if claimed:
+            break
+        skipped.append(job.pk)  # استلمها (أو استلم فترتها) عامل آخر
+
+    job.status = ConsumptionJob.STATUS_RUNNING
+    job.started_at = job.heartbeat_at = now
+    duplicates = list(
+        ConsumptionJob.objects.select_for_update()
+        .filter(period_id=job.period_id, status=ConsumptionJob.STATUS_PENDING)
+        .exclude(pk=job.pk)
+    )
+    for dup in duplicates:
+        job.requests_count += dup.requests_count
+        job.full = job.full or dup.full
+    if duplicates:
+        ConsumptionJob.objects.filter(pk__in=[d.pk for d in duplicates]).delete()
+        job.save(update_fields=["requests_count", "full"])
+    return job
+
+
+@contextmanager
+def heartbeat(queryset, interval=None):
+    """
+    تحديث heartbeat_at لمهام queryset كل interval ثانية (thread منفصل) حتى ينتهي التنفيذ.
+    فشل التحديث (انقطاع مؤقت) لا يوقف التنفيذ: النبضة التالية تعيد المحاولة.
+    """
+    if interval is None:
+        interval = getattr(settings, "SALES_CONSUMPTION_JOB_HEARTBEAT", 30)
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(interval):
+                try:
+                    queryset.update(heartbeat_at=timezone.now())
+                except DatabaseError:
+                    pass
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=beat, name="job-heartbeat", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_job(job):
+    """
+    تنفيذ مهمة مستلمة؛ الخطأ يُحفظ في المهمة ولا يوقف العامل.
+    النتيجة تُكتب فقط لو المهمة ما زالت مستلمة من هذا العامل (نفس started_at).
+    """
+    claimed = ConsumptionJob.objects.filter(
+        pk=job.pk, status=ConsumptionJob.STATUS_RUNNING, started_at=job.started_at
+    )
+    with heartbeat(claimed):
+        try:
+            if job.full:
+                generate_sales_consumption(job.period, skip_current=True)
+                job.products_updated = None
+            else:
+                job.products_updated = update_sales_consumption(job.period)
+            job.status = ConsumptionJob.STATUS_DONE
+            job.error = ""
+        except Exception:
+            job.status = ConsumptionJob.STATUS_FAILED
+            job.error = traceback.format_exc()
+
+    job.finished_at = timezone.now()
+    claimed.update(
+        status=job.status, products_updated=job.products_updated, error=job.error, finished_at=job.finished_at,
+    )
+    return job
+
+
+def run_pending(max_jobs=None):
+    """تنفيذ المهام المنتظرة حتى يفرغ الطابور (أو max_jobs)؛ ترجع المهام المنفّذة."""
+    done = []
+    while max_jobs is None or len(done) < max_jobs:
+        job = claim_next_job()
+        if job is None:
+            break
+        done.append(run_job(job))
+    return done
+
+
+def stuck_filter(timeout=None):
+    """مهام "قيد التنفيذ" بدون نبضة منذ timeout ثانية (العامل توقف فجأة)."""
+    if timeout is None:
+        timeout = getattr(settings, "SALES_CONSUMPTION_JOB_TIMEOUT", 180)
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    # heartbeat_at فارغ: مهمة استُلمت قبل إضافة النبضة
+    return Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+
+
+def requeue_stuck_jobs(timeout=None):
+    """مهام توقفت نبضتها تعود للانتظار؛ ترجع عددها."""
+    return ConsumptionJob.objects.filter(stuck_filter(timeout), status=ConsumptionJob.STATUS_RUNNING).update(
+        status=ConsumptionJob.STATUS_PENDING, started_at=None, heartbeat_at=None,
+    )
+
+
+# --------------------------------------------------------
+# الحالة
+# --------------------------------------------------------
+def consumption_status(period):
+    """
+    {"stale": bool, "outdated": bool, "status": ..., ...} لعرضها في البوابة والتقارير.
+    stale=True: توجد مهمة منتظرة/قيد التنفيذ أو تغييرات لم تُحسب بعد.
+    outdated=True: لا شيء قيد الحساب لكن مدخلات الفترة تغيّرت منذ آخر توليد
+    (changed_labels: ما الذي تغيّر) → يحتاج إعادة توليد.
+    """
+    if period is None:
+        return {"stale": False, "outdated": False, "status": None, "job_id": None}
+
+    job = ConsumptionJob.objects.filter(period=period).order_by("-id").first()
+    active = ConsumptionJob.objects.filter(
+        period=period,
+        status__in=[ConsumptionJob.STATUS_PENDING, ConsumptionJob.STATUS_RUNNING],
+    ).exists()
+    pending_changes = SalesConsumptionChange.objects.filter(period=period).count()
+    stale = bool(active or pending_changes)
+    # مقارنة النسخ (عدادات محفوظة، بدون قراءة البيانات) فقط عندما لا يوجد حساب جارٍ
+    version = consumption_version(period) if not stale else {"current": False, "changed_labels": []}
+
+    return {
+        "stale": stale,
+        "outdated": not stale and not version["current"],
+        "changed": version["changed_labels"],
+        "status": job.status if job else None,
+        "status_label": job.get_status_display() if job else None,
+        "job_id": job.pk if job else None,
+        "requested_at": job.requested_at.isoformat() if job else None,
+        "finished_at": job.finished_at.isoformat() if job and job.finished_at else None,
+        "failed": bool(job and job.status == ConsumptionJob.STATUS_FAILED),
+        "pending_changes": pending_changes,
+        "versioned_at": version.get("versioned_at"),
+    }
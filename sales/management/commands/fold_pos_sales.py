@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from sales.pos import fold_pos_lines
+
+
+class Command(BaseCommand):
+    help = "ترحيل سطور تذاكر نقاط البيع المنتظرة (PosTicketLine) إلى ملخص المبيعات."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="ترحيل المنتظر ثم الخروج.")
+        parser.add_argument("--sleep", type=float, default=5.0, help="ثواني الانتظار عندما لا يوجد منتظر.")
+        parser.add_argument("--batch-size", type=int, default=None, help="عدد السطور لكل معاملة ترحيل.")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            result = fold_pos_lines(options["batch_size"])
+            if result["folded"] or result["rejected"]:
+                self.stdout.write(self.style.SUCCESS(
+                    f"مُرحّل: {result['folded']} | مرفوض: {result['rejected']} | "
+                    f"فترات: {result['periods']} | منتجات: {result['products']} | "
+                    f"{time.perf_counter() - started:.2f} ث"
+                ))
+                continue
+
+            if options["once"]:
+                break
+            time.sleep(options["sleep"])
@@ -0,0 +1,167 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Q
+
+from expenses.models import Period
+from sales.models import (
+    build_consumption_rows, last_consumption_change_id, skip_if_current, update_sales_consumption,
+    write_consumption_rows,
+)
+from sales.versioning import data_version
+
+
+# --------------------------------------------------------
+# التنفيذ داخل عملية فرعية
+# --------------------------------------------------------
+# العمليات الفرعية تحسب السطور فقط (قراءة)؛ الكتابة في العملية الرئيسية
+# فترةً فترة (معاملة مستقلة لكل فترة) لأن SQLite لا يقبل أكثر من كاتب واحد.
+def _init_worker():
+    # العملية الفرعية لا تشارك اتصالات قاعدة البيانات مع الأب
+    import django
+    django.setup()
+    connections.close_all()
+
+
+def _build_period(period_id, force=False):
+    """
+    حساب سطور فترة واحدة. الخطأ لا يوقف باقي الفترات.
+    ترجع (period_id, الاسم, الزمن, السطور, النسخ, آخر علامة تغيير, الخطأ)؛
+    السطور None بدون خطأ = الفترة محدّثة (تُتخطى إلا مع force).
+    آخر علامة تغيير تُلتقط قبل البناء: الكتابة (ربما بعد دقائق) لا تحذف علامات أحدث منها.
+    """
+    started = time.perf_counter()
+    label = str(period_id)
+    try:
+        period = Period.objects.get(pk=period_id)
+        label = str(period)
+        changes_upto = last_consumption_change_id(period)
+        version = data_version(period)
+        if not force and skip_if_current(period, version, changes_upto):
+            return period_id, label, time.perf_counter() - started, None, version, changes_upto, None
+        rows = build_consumption_rows(period)
+        return period_id, label, time.perf_counter() - started, rows, version, changes_upto, None
+    except Exception as exc:
+        return period_id, label, time.perf_counter() - started, None, None, None, f"{type(exc).__name__}: {exc}"
+
+
+def _parse_year_month(value):
+    try:
+        year, month = value.split("-")
+        return int(year), int(month)
+    except ValueError:
+        raise CommandError(f"صيغة الفترة غير صحيحة: {value} (المطلوب YYYY-MM)")
+
+
+class Command(BaseCommand):
+    help = (
+        "إعادة توليد استهلاك المواد من المبيعات بالكامل لعدة فترات بالتوازي "
+        "(أو تحديث المنتجات المتغيّرة فقط بـ --changed-only)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--period", type=int, action="append", dest="periods",
+            help="رقم فترة (يمكن تكراره). بدون هذا الخيار ولا --from/--to: كل الفترات التي لها مبيعات.",
+        )
+        parser.add_argument("--from", dest="date_from", help="أول فترة في النطاق (YYYY-MM).")
+        parser.add_argument("--to", dest="date_to", help="آخر فترة في النطاق (YYYY-MM).")
+        parser.add_argument(
+            "--workers", type=int, default=None,
+            help="عدد العمليات المتوازية للحساب (افتراضي: عدد المعالجات).",
+        )
+        parser.add_argument(
+            "--changed-only", action="store_true",
+            help="تحديث المنتجات التي تغيّرت بنود مبيعاتها فقط بدل إعادة التوليد الكاملة.",
+        )
+        parser.add_argument(
+            "--force", action="store_true",
+            help="إعادة التوليد حتى للفترات التي لم تتغيّر بياناتها منذ آخر توليد.",
+        )
+
+    def _periods(self, options):
+        if options["periods"]:
+            return Period.objects.filter(pk__in=options["periods"])
+
+        periods = Period.objects.filter(sales_summaries__isnull=False).distinct()
+        if options["date_from"]:
+            year, month = _parse_year_month(options["date_from"])
+            periods = periods.filter(Q(year__gt=year) | Q(year=year, month__gte=month))
+        if options["date_to"]:
+            year, month = _parse_year_month(options["date_to"])
+            periods = periods.filter(Q(year__lt=year) | Q(year=year, month__lte=month))
+        return periods
+
+    def handle(self, *args, **options):
+        period_ids = list(self._periods(options).order_by("year", "month").values_list("id", flat=True))
+        if not period_ids:
+            self.stdout.write("لا توجد فترات.")
+            return
+
+        workers = options["workers"] or os.cpu_count() or 1
+        workers = max(1, min(workers, len(period_ids)))
+
+        total = len(period_ids)
+        self.stdout.write(f"الفترات: {total} | العمليات: {workers}")
+        started = time.perf_counter()
+
+        if options["changed_only"]:
+            failures = self._run_changed_only(period_ids)
+        elif workers == 1:
+            failures = self._write_all((_build_period(pid, options["force"]) for pid in period_ids), total)
+        else:
+            # الاتصال المفتوح لا يُورّث للعمليات الفرعية
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+                futures = [pool.submit(_build_period, pid, options["force"]) for pid in period_ids]
+                failures = self._write_all((f.result() for f in as_completed(futures)), total)
+
+        elapsed = time.perf_counter() - started
+        summary = f"انتهى: {total - len(failures)}/{total} فترة في {elapsed:.2f} ث"
+        if failures:
+            raise CommandError(f"{summary} | فشل: {', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS(summary))
+
+    def _write_all(self, results, total):
+        """كتابة كل فترة فور انتهاء حسابها (معاملة لكل فترة)."""
+        failures = []
+        for done, (period_id, label, seconds, rows, version, changes_upto, error) in enumerate(results, start=1):
+            prefix = f"[{done}/{total}] {label}"
+            if error is None and rows is None:
+                self.stdout.write(f"{prefix}: محدّثة (لم تتغيّر البيانات) — تخطي")
+                continue
+            if error is None:
+                write_started = time.perf_counter()
+                try:
+                    write_consumption_rows(Period.objects.get(pk=period_id), rows, version, changes_upto)
+                except Exception as exc:
+                    error = f"{type(exc).__name__}: {exc}"
+                write_seconds = time.perf_counter() - write_started
+
+            if error:
+                failures.append(label)
+                self.stdout.write(self.style.ERROR(f"{prefix}: فشل — {error}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(
+                    f"{prefix}: {len(rows)} سطر | حساب {seconds:.2f} ث | كتابة {write_seconds:.2f} ث"
+                ))
+        return failures
+
+    def _run_changed_only(self, period_ids):
+        failures = []
+        total = len(period_ids)
+        for done, period in enumerate(Period.objects.filter(pk__in=period_ids).order_by("year", "month"), start=1):
+            prefix = f"[{done}/{total}] {period}"
+            started = time.perf_counter()
+            try:
+                count = update_sales_consumption(period)
+            except Exception as exc:
+                failures.append(str(period))
+                self.stdout.write(self.style.ERROR(f"{prefix}: فشل — {type(exc).__name__}: {exc}"))
+                continue
+            detail = "توليد كامل" if count is None else f"{count} منتج"
+            self.stdout.write(self.style.SUCCESS(f"{prefix}: {detail} في {time.perf_counter() - started:.2f} ث"))
+        return failures
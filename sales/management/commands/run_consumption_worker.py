@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from inventory.jobs import requeue_stuck_ledger_jobs, run_pending_ledger
+from sales.jobs import requeue_stuck_jobs, run_pending
+
+
+class Command(BaseCommand):
+    help = (
+        "عامل تنفيذ مهام توليد استهلاك المواد (ConsumptionJob) ومطابقة دفتر المخزون "
+        "(StockLedgerJob) من الطابور. مطلوب تشغيله دائمًا مع الإعدادات الافتراضية "
+        "(SALES_CONSUMPTION_ASYNC=True و INVENTORY_LEDGER_ASYNC=True)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="تنفيذ المهام المنتظرة ثم الخروج.")
+        parser.add_argument("--sleep", type=float, default=2.0, help="ثواني الانتظار عندما يكون الطابور فارغًا.")
+        parser.add_argument("--max-jobs", type=int, default=None, help="الخروج بعد تنفيذ هذا العدد من المهام.")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            # كل دورة (وليس عند البدء فقط): مهام عامل آخر توقف أثناء عمل هذا العامل
+            requeued = requeue_stuck_jobs() + requeue_stuck_ledger_jobs()
+            if requeued:
+                self.stdout.write(self.style.WARNING(f"أعيدت {requeued} مهمة متوقفة إلى الانتظار."))
+
+            remaining = None if options["max_jobs"] is None else options["max_jobs"] - total
+            for job in run_pending(max_jobs=remaining):
+                total += 1
+                if job.status == job.STATUS_FAILED:
+                    self.stdout.write(self.style.ERROR(f"[{job.pk}] {job.period}: فشل\n{job.error}"))
+                else:
+                    self.stdout.write(self.style.SUCCESS(
+                        f"[{job.pk}] {job.period}: تم ({job.requests_count} طلب مدمج)"
+                    ))
+
+            # الدفتر بعد الاستهلاك: توليد الاستهلاك نفسه يطلب مطابقة فترته
+            for job in run_pending_ledger():
+                if job.status == job.STATUS_FAILED:
+                    self.stdout.write(self.style.ERROR(f"[دفتر {job.pk}] {job.period}: فشل\n{job.error}"))
+                else:
+                    self.stdout.write(self.style.SUCCESS(
+                        f"[دفتر {job.pk}] {job.period}: تم ({job.movements_added} حركة)"
+                    ))
+
+            if options["once"] or (options["max_jobs"] is not None and total >= options["max_jobs"]):
+                break
+            time.sleep(options["sleep"])
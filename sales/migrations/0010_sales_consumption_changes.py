@@ -0,0 +1,30 @@
+# Generated by Django 5.2.9 on 2026-10-18 01:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('costing', '0012_period_cost_snapshots'),
+        ('expenses', '0008_period_allow_opening_stock_and_more'),
+        ('sales', '0009_alter_salesconsumption_quantity_consumed_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesConsumptionChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_consumption_changes', to='expenses.period', verbose_name='الفترة')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='costing.product', verbose_name='المنتج النهائي')),
+            ],
+            options={
+                'verbose_name': 'تغيير مبيعات بانتظار تحديث الاستهلاك',
+                'verbose_name_plural': 'تغييرات مبيعات بانتظار تحديث الاستهلاك',
+                'unique_together': {('period', 'product')},
+            },
+        ),
+    ]
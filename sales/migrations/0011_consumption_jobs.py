@@ -0,0 +1,36 @@
+# Generated by Django 5.2.9 on 2026-10-18 01:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0008_period_allow_opening_stock_and_more'),
+        ('sales', '0010_sales_consumption_changes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsumptionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'بالانتظار'), ('running', 'قيد التنفيذ'), ('done', 'تم'), ('failed', 'فشل')], db_index=True, default='pending', max_length=10, verbose_name='الحالة')),
+                ('full', models.BooleanField(default=False, verbose_name='إعادة توليد كاملة')),
+                ('requests_count', models.PositiveIntegerField(default=1, verbose_name='عدد الطلبات المدمجة')),
+                ('products_updated', models.PositiveIntegerField(blank=True, null=True, verbose_name='عدد المنتجات المحدّثة')),
+                ('error', models.TextField(blank=True, default='', verbose_name='الخطأ')),
+                ('requested_at', models.DateTimeField(auto_now_add=True, verbose_name='وقت آخر طلب')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='بدء التنفيذ')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='انتهاء التنفيذ')),
+                ('period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='consumption_jobs', to='expenses.period', verbose_name='الفترة')),
+            ],
+            options={
+                'verbose_name': 'مهمة توليد استهلاك',
+                'verbose_name_plural': 'مهام توليد الاستهلاك',
+                'ordering': ['-id'],
+                'indexes': [models.Index(fields=['period', 'status'], name='sales_consu_period__4a800f_idx')],
+            },
+        ),
+    ]
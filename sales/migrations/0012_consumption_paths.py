@@ -0,0 +1,30 @@
+# Generated by Django 5.2.9 on 2026-10-18 02:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('costing', '0013_bom_paths'),
+        ('sales', '0011_consumption_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesConsumptionPath',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity_consumed', models.DecimalField(decimal_places=6, max_digits=18, verbose_name='الكمية المستهلكة (وحدة الاستخدام)')),
+                ('total_cost', models.DecimalField(blank=True, decimal_places=6, max_digits=18, null=True, verbose_name='إجمالي التكلفة')),
+                ('consumption', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='paths', to='sales.salesconsumption', verbose_name='سطر الاستهلاك')),
+                ('path', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='consumptions', to='costing.bompath', verbose_name='المسار')),
+            ],
+            options={
+                'verbose_name': 'مصدر استهلاك',
+                'verbose_name_plural': 'مصادر الاستهلاك',
+                'unique_together': {('consumption', 'path')},
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.9 on 2026-10-18 09:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_period(apps, schema_editor):
+    SalesConsumption = apps.get_model("sales", "SalesConsumption")
+    SalesConsumptionSummary = apps.get_model("sales", "SalesConsumptionSummary")
+    SalesConsumption.objects.update(
+        period_id=Subquery(
+            SalesConsumptionSummary.objects.filter(pk=OuterRef("summary_id")).values("period_id")[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0008_period_allow_opening_stock_and_more'),
+        ('sales', '0012_consumption_paths'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='salesconsumption',
+            name='period',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sales_consumptions', to='expenses.period', verbose_name='الفترة'),
+        ),
+        migrations.RunPython(fill_period, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,127 @@
+# Generated by Django 5.2.9 on 2026-10-18 09:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# SQL التحويل منسوخ هنا (وليس من sales/partitioning.py) حتى يبقى الـ migration
+# كما هو مهما تغيّر الكود لاحقًا
+TABLE = "sales_salesconsumption"
+
+
+def _table_definitions(cursor, table):
+    """
+    (الفهارس، المفاتيح الأجنبية) للجدول من كتالوج PostgreSQL بأسمائها الحالية:
+    indexes = [(name, is_unique, "btree (col, ...)")]، fks = [(name, "FOREIGN KEY (...) REFERENCES ...")].
+    المفتاح الأساسي مستبعد (يُعاد بناؤه حسب نوع الجدول).
+    """
+    cursor.execute(
+        """
+        SELECT c.relname, i.indisunique, pg_get_indexdef(i.indexrelid)
+        FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = %s::regclass AND NOT i.indisprimary
+        ORDER BY c.relname
+        """,
+        [table],
+    )
+    indexes = [(name, unique, indexdef.split(" USING ", 1)[1]) for name, unique, indexdef in cursor.fetchall()]
+    cursor.execute(
+        """
+        SELECT conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype = 'f'
+        ORDER BY conname
+        """,
+        [table],
+    )
+    return indexes, cursor.fetchall()
+
+
+def _rebuild_table(schema_editor, partitioned):
+    """
+    إعادة إنشاء sales_salesconsumption (مقسّم حسب الفترة أو عادي) مع الاحتفاظ بالصفوف
+    والأرقام (id) والفهارس والمفاتيح الأجنبية بنفس أسمائها.
+    المقسّم: المفتاح الأساسي (id, period_id) لأن PostgreSQL يشترط مفتاح التقسيم فيه،
+    بقسم لكل فترة موجودة + قسم افتراضي.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != "postgresql":
+        return
+
+    q = schema_editor.quote_name
+    old = f"{TABLE}_old"
+
+    with connection.cursor() as cursor:
+        indexes, fks = _table_definitions(cursor, TABLE)
+
+    schema_editor.execute(f"ALTER TABLE {q(TABLE)} RENAME TO {q(old)}")
+    schema_editor.execute(
+        f"CREATE TABLE {q(TABLE)} (LIKE {q(old)} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS)"
+        + (f" PARTITION BY RANGE ({q('period_id')})" if partitioned else "")
+    )
+    if partitioned:
+        schema_editor.execute(f"CREATE TABLE {q(TABLE + '_default')} PARTITION OF {q(TABLE)} DEFAULT")
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT DISTINCT {q('period_id')} FROM {q(old)}")
+            period_ids = [int(row[0]) for row in cursor.fetchall()]
+        for period_id in period_ids:
+            schema_editor.execute(
+                f"CREATE TABLE {q(f'{TABLE}_p{period_id}')} PARTITION OF {q(TABLE)} "
+                f"FOR VALUES FROM ({period_id}) TO ({period_id + 1})"
+            )
+
+    schema_editor.execute(f"INSERT INTO {q(TABLE)} SELECT * FROM {q(old)}")
+    # أسماء المفتاح والفهارس القديمة تتحرر بحذف الجدول القديم (مع أقسامه لو كان مقسّمًا)
+    schema_editor.execute(f"DROP TABLE {q(old)}")
+
+    primary_key = f"{q('id')}, {q('period_id')}" if partitioned else q("id")
+    schema_editor.execute(f"ALTER TABLE {q(TABLE)} ADD PRIMARY KEY ({primary_key})")
+    schema_editor.execute(
+        f"SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE((SELECT MAX({q('id')}) FROM {q(TABLE)}), 1))",
+        [TABLE],
+    )
+
+    for name, unique, definition in indexes:
+        schema_editor.execute(
+            f"CREATE {'UNIQUE ' if unique else ''}INDEX {q(name)} ON {q(TABLE)} USING {definition}"
+        )
+    for name, definition in fks:
+        schema_editor.execute(f"ALTER TABLE {q(TABLE)} ADD CONSTRAINT {q(name)} {definition}")
+
+
+def partition_table(apps, schema_editor):
+    _rebuild_table(schema_editor, partitioned=True)
+
+
+def unpartition_table(apps, schema_editor):
+    _rebuild_table(schema_editor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0008_period_allow_opening_stock_and_more'),
+        ('sales', '0013_salesconsumption_period'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='salesconsumption',
+            name='period',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_consumptions', to='expenses.period', verbose_name='الفترة'),
+        ),
+        migrations.AlterField(
+            model_name='salesconsumptionpath',
+            name='consumption',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='paths', to='sales.salesconsumption', verbose_name='سطر الاستهلاك'),
+        ),
+        migrations.AddIndex(
+            model_name='salesconsumption',
+            index=models.Index(fields=['period', 'raw_material', 'quantity_consumed', 'total_cost'], name='sales_cons_period_raw_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='salesconsumption',
+            index=models.Index(fields=['period', 'product', 'quantity_sold', 'quantity_consumed', 'total_cost'], name='sales_cons_period_prod_idx'),
+        ),
+        # PostgreSQL فقط: تقسيم الجدول حسب الفترة (والعكس عند الرجوع)
+        migrations.RunPython(partition_table, unpartition_table),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.9 on 2026-10-18 02:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0014_consumption_period_partitions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PosTicketLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ticket_id', models.CharField(max_length=64, verbose_name='رقم التذكرة')),
+                ('line_no', models.PositiveIntegerField(verbose_name='رقم السطر')),
+                ('product_code', models.CharField(max_length=50, verbose_name='كود المنتج')),
+                ('quantity', models.DecimalField(decimal_places=4, max_digits=18, verbose_name='الكمية')),
+                ('unit_price', models.DecimalField(decimal_places=4, max_digits=18, verbose_name='سعر الوحدة')),
+                ('sold_at', models.DateTimeField(verbose_name='وقت البيع')),
+                ('status', models.CharField(choices=[('pending', 'بالانتظار'), ('folded', 'مُرحّل'), ('rejected', 'مرفوض')], default='pending', max_length=10, verbose_name='الحالة')),
+                ('error', models.CharField(blank=True, default='', max_length=200, verbose_name='سبب الرفض')),
+                ('received_at', models.DateTimeField(auto_now_add=True, verbose_name='وقت الاستلام')),
+                ('folded_at', models.DateTimeField(blank=True, null=True, verbose_name='وقت الترحيل')),
+            ],
+            options={
+                'verbose_name': 'سطر تذكرة نقطة بيع',
+                'verbose_name_plural': 'سطور تذاكر نقاط البيع',
+                'indexes': [models.Index(fields=['status', 'id'], name='sales_pos_status_idx')],
+                'unique_together': {('ticket_id', 'line_no')},
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.9 on 2026-10-18 02:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0015_pos_ticket_lines'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='salesconsumptionsummary',
+            name='bom_fingerprint',
+            field=models.CharField(blank=True, default='', max_length=40, verbose_name='بصمة الوصفات'),
+        ),
+        migrations.AddField(
+            model_name='salesconsumptionsummary',
+            name='cost_fingerprint',
+            field=models.CharField(blank=True, default='', max_length=40, verbose_name='بصمة التكاليف'),
+        ),
+        migrations.AddField(
+            model_name='salesconsumptionsummary',
+            name='purchases_fingerprint',
+            field=models.CharField(blank=True, default='', max_length=40, verbose_name='بصمة المشتريات'),
+        ),
+        migrations.AddField(
+            model_name='salesconsumptionsummary',
+            name='sales_fingerprint',
+            field=models.CharField(blank=True, default='', max_length=40, verbose_name='بصمة المبيعات'),
+        ),
+        migrations.AddField(
+            model_name='salesconsumptionsummary',
+            name='versioned_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='وقت آخر توليد'),
+        ),
+    ]
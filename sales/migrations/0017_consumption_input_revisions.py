@@ -0,0 +1,37 @@
+# Generated by Django 5.2.9 on 2026-10-18 03:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_global_revisions(apps, schema_editor):
+    # عدادات بدون فترة تُنشأ مرة واحدة هنا (NULL لا يمنع التكرار في unique_together)
+    ConsumptionInputRevision = apps.get_model("sales", "ConsumptionInputRevision")
+    for name in ("bom", "cost"):
+        ConsumptionInputRevision.objects.get_or_create(name=name, period=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0008_period_allow_opening_stock_and_more'),
+        ('sales', '0016_consumption_fingerprints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsumptionInputRevision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=20, verbose_name='المُدخل')),
+                ('revision', models.PositiveBigIntegerField(default=0, verbose_name='رقم المراجعة')),
+                ('period', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='expenses.period', verbose_name='الفترة')),
+            ],
+            options={
+                'verbose_name': 'مراجعة مدخلات الاستهلاك',
+                'verbose_name_plural': 'مراجعات مدخلات الاستهلاك',
+                'unique_together': {('name', 'period')},
+            },
+        ),
+        migrations.RunPython(create_global_revisions, migrations.RunPython.noop),
+    ]
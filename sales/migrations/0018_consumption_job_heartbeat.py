@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-18 04:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0017_consumption_input_revisions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='consumptionjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='آخر نبضة من العامل'),
+        ),
+    ]
@@ -0,0 +1,91 @@
+from django.db import migrations, models
+
+
+def scope_revisions(apps, schema_editor):
+    """
+    bom / cost أصبحا لكل فترة، و materials عدادًا عامًا جديدًا.
+    النسخ المحفوظة التي تطابق العدادات العامة الحالية تُحوّل لقيمة البداية (r0)
+    حتى لا تظهر كل الفترات غير محدّثة بعد الترحيل.
+    """
+    ConsumptionInputRevision = apps.get_model("sales", "ConsumptionInputRevision")
+    SalesConsumptionSummary = apps.get_model("sales", "SalesConsumptionSummary")
+
+    current = dict(
+        ConsumptionInputRevision.objects.filter(period__isnull=True, name__in=["bom", "cost"]).values_list(
+            "name", "revision"
+        )
+    )
+    bom, cost = f"r{current.get('bom', 0)}", f"r{current.get('cost', 0)}."
+    for summary in SalesConsumptionSummary.objects.exclude(bom_version="", cost_version=""):
+        fields = []
+        if summary.bom_version == bom:
+            summary.bom_version = "r0"
+            fields.append("bom_version")
+        if summary.cost_version.startswith(cost):
+            summary.cost_version = "r0." + summary.cost_version[len(cost):]
+            fields.append("cost_version")
+        if fields:
+            summary.save(update_fields=fields)
+
+    ConsumptionInputRevision.objects.filter(period__isnull=True, name__in=["bom", "cost"]).delete()
+    # عدادات بدون فترة تُنشأ مرة واحدة هنا (NULL لا يمنع التكرار في unique_together)
+    ConsumptionInputRevision.objects.get_or_create(name="materials", period=None)
+
+
+def unscope_revisions(apps, schema_editor):
+    ConsumptionInputRevision = apps.get_model("sales", "ConsumptionInputRevision")
+    ConsumptionInputRevision.objects.filter(name__in=["bom", "cost", "materials"]).delete()
+    for name in ("bom", "cost"):
+        ConsumptionInputRevision.objects.get_or_create(name=name, period=None)
+    # النسخ المحفوظة لم تعد تطابق: الفترات تظهر غير محدّثة حتى إعادة التوليد
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0018_consumption_job_heartbeat'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='salesconsumptionsummary',
+            old_name='sales_fingerprint',
+            new_name='sales_version',
+        ),
+        migrations.RenameField(
+            model_name='salesconsumptionsummary',
+            old_name='purchases_fingerprint',
+            new_name='purchases_version',
+        ),
+        migrations.RenameField(
+            model_name='salesconsumptionsummary',
+            old_name='bom_fingerprint',
+            new_name='bom_version',
+        ),
+        migrations.RenameField(
+            model_name='salesconsumptionsummary',
+            old_name='cost_fingerprint',
+            new_name='cost_version',
+        ),
+        migrations.AlterField(
+            model_name='salesconsumptionsummary',
+            name='sales_version',
+            field=models.CharField(blank=True, default='', max_length=40, verbose_name='نسخة المبيعات'),
+        ),
+        migrations.AlterField(
+            model_name='salesconsumptionsummary',
+            name='purchases_version',
+            field=models.CharField(blank=True, default='', max_length=40, verbose_name='نسخة المشتريات'),
+        ),
+        migrations.AlterField(
+            model_name='salesconsumptionsummary',
+            name='bom_version',
+            field=models.CharField(blank=True, default='', max_length=40, verbose_name='نسخة الوصفات'),
+        ),
+        migrations.AlterField(
+            model_name='salesconsumptionsummary',
+            name='cost_version',
+            field=models.CharField(blank=True, default='', max_length=40, verbose_name='نسخة التكاليف'),
+        ),
+        migrations.RunPython(scope_revisions, unscope_revisions),
+    ]
@@ -1,20 +1,17 @@
 # sales/models.py
-from django.db import models
-from decimal import Decimal, ROUND_HALF_UP
+from django.db import models, transaction
+from django.db.models import DEFERRED
+from decimal import Decimal
 
 from costing.models import Product, Unit, RawMaterial
+from costing.cost_index import RawCostIndex
+from costing.fixedpoint import MICRO, QTY12, div_round, to_decimal, to_scaled
 from expenses.models import Period
 
+from .partitioning import ensure_consumption_partition
 
-# -------------------- أدوات مساعدة عامة --------------------
 
-def round3(value):
-    """
-    تقريب أي Decimal إلى ثلاث منازل عشرية.
-    """
-    if value is None:
-        return None
-    return Decimal(value).quantize(Decimal("0.000"), rounding=ROUND_HALF_UP)
+# -------------------- أدوات مساعدة عامة --------------------
 
 
 class TimeStampedModel(models.Model):
@@ -27,6 +24,13 @@ class TimeStampedModel(models.Model):
 
 # -------------------- ملخص المبيعات --------------------
 
+class SalesSummaryQuerySet(models.QuerySet):
+    def delete(self):
+        # الحذف الجماعي لا يمر على SalesSummary.delete؛ بنوده المحذوفة تُعلَّم هنا
+        SalesSummaryLine.objects.filter(summary__in=self)._mark_changed()
+        return super().delete()
+
+
 class SalesSummary(models.Model):
     period = models.ForeignKey(
         Period,
@@ -37,6 +41,8 @@ class SalesSummary(models.Model):
         blank=True,
     )
 
+    objects = SalesSummaryQuerySet.as_manager()
+
     class Meta:
         verbose_name = "ملخص مبيعات"
         verbose_name_plural = "ملخصات المبيعات"
@@ -52,16 +58,81 @@ class SalesSummary(models.Model):
         return total
     total_amount.short_description = "إجمالي قيمة المبيعات"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # period مؤجَّل (only/defer): القيمة الأصلية تُقرأ عند الحفظ
+        instance._loaded_period_id = instance.__dict__.get("period_id", DEFERRED)
+        return instance
+
     def save(self, *args, **kwargs):
         """
         عند حفظ ملخص المبيعات:
         1) نحفظ السجل.
-        2) نعيد توليد استهلاك المواد لهذه الفترة.
+        2) نحدّث استهلاك المواد لهذه الفترة للمنتجات التي تغيّرت بنودها فقط
+           (إعادة التوليد الكاملة: generate_sales_consumption).
+           مع SALES_CONSUMPTION_ASYNC يُسجَّل طلب في الطابور ويعود الحفظ فورًا.
         """
+        from .jobs import schedule_consumption_update
+
+        old_period_id = getattr(self, "_loaded_period_id", None)
+        if old_period_id is DEFERRED:
+            old_period_id = (
+                SalesSummary.objects.filter(pk=self.pk).values_list("period_id", flat=True).first()
+                if "period_id" in self.__dict__ else self.period_id
+            )
         super().save(*args, **kwargs)
-        from .models import generate_sales_consumption
+        self._loaded_period_id = self.period_id
+
+        if old_period_id != self.period_id:
+            # نقل الملخص لفترة أخرى: كل منتجاته تغيّرت في الفترتين
+            product_ids = set(self.lines.values_list("product_id", flat=True))
+            for period_id in (old_period_id, self.period_id):
+                if period_id:
+                    mark_consumption_changed(period_id, product_ids)
+            if old_period_id:
+                schedule_consumption_update(Period.objects.get(pk=old_period_id))
+
         if self.period:
-            generate_sales_consumption(self.period)
+            schedule_consumption_update(self.period)
+
+    def delete(self, *args, **kwargs):
+        if self.period_id:
+            mark_consumption_changed(self.period_id, self.lines.values_list("product_id", flat=True))
+        return super().delete(*args, **kwargs)
+
+
+class SalesSummaryLineQuerySet(models.QuerySet):
+    """
+    المسارات الجماعية تسجّل علامات التغيير مثل حفظ/حذف السطر الواحد:
+    - delete(): يعلّم منتجات الأسطر المحذوفة.
+    - update() (ومعه bulk_update) على حقل من CONSUMPTION_FIELDS: يعلّم الأسطر قبل وبعد التعديل.
+    bulk_create لا يمر هنا: من يستدعيه يسجّل mark_consumption_changed بنفسه (كما في sales/pos.py).
+    """
+
+    def _mark_changed(self):
+        by_period = {}
+        for period_id, product_id in self.values_list("summary__period_id", "product_id"):
+            if period_id:
+                by_period.setdefault(period_id, set()).add(product_id)
+        for period_id, product_ids in by_period.items():
+            mark_consumption_changed(period_id, product_ids)
+
+    def delete(self):
+        self._mark_changed()
+        return super().delete()
+
+    def update(self, **kwargs):
+        fields = {name.removesuffix("_id") for name in SalesSummaryLine.CONSUMPTION_FIELDS}
+        if not fields.intersection(name.removesuffix("_id") for name in kwargs):
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db):
+            # التصفية قد تعتمد على الحقل المعدَّل: الأسطر تُحدد بأرقامها قبل التعديل
+            pks = list(self.values_list("pk", flat=True))
+            self._mark_changed()
+            rows = super().update(**kwargs)
+            self.model.objects.filter(pk__in=pks)._mark_changed()
+        return rows
 
 
 class SalesSummaryLine(models.Model):
@@ -99,6 +170,8 @@ class SalesSummaryLine(models.Model):
         default=0,
     )
 
+    objects = SalesSummaryLineQuerySet.as_manager()
+
     class Meta:
         verbose_name = "بند في ملخص المبيعات"
         verbose_name_plural = "بنود ملخص المبيعات"
@@ -106,12 +179,118 @@ class SalesSummaryLine(models.Model):
     def __str__(self):
         return f"{self.product} ({self.summary})"
 
+    # الحقول التي تؤثر على استهلاك المواد (السعر لا يؤثر)
+    CONSUMPTION_FIELDS = ("summary_id", "product_id", "unit_id", "quantity")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # الحقول المؤجلة (only/defer) لا تدخل الحالة؛ تُقرأ من القاعدة عند الحفظ إن لزم
+        instance._consumption_state = {
+            f: instance.__dict__[f] for f in cls.CONSUMPTION_FIELDS if f in instance.__dict__
+        }
+        return instance
+
+    def _consumption_key(self, old=None):
+        # حقل مؤجل لم يُسنَد له شيء لم يتغير: قيمته هي القديمة
+        old = old or {}
+        return tuple(self.__dict__.get(f, old.get(f)) for f in self.CONSUMPTION_FIELDS)
+
+    def _load_deferred_state(self, old):
+        """
+        يكمل الحالة القديمة بالحقول المؤجلة من القاعدة (استعلام واحد) قبل الحفظ،
+        فقط إن تغيّر حقل استهلاك: لمعرفة الملخص/المنتج القديمين وتعليمهما.
+        """
+        missing = [f for f in self.CONSUMPTION_FIELDS if f not in old]
+        if not missing or not self.pk:
+            return old
+        changed = any(f in self.__dict__ for f in missing) or any(
+            self.__dict__.get(f) != value for f, value in old.items()
+        )
+        if changed:
+            row = SalesSummaryLine.objects.filter(pk=self.pk).values(*missing).first()
+            if row:
+                old = {**old, **row}
+        return old
+
+    def _mark_changed(self, summary_id, product_id):
+        if not summary_id or not product_id:
+            return
+        summary = self._state.fields_cache.get("summary")
+        if summary is not None and summary.pk == summary_id:
+            period_id = summary.period_id
+        else:
+            period_id = SalesSummary.objects.filter(pk=summary_id).values_list("period_id", flat=True).first()
+        if period_id:
+            mark_consumption_changed(period_id, [product_id])
+
     def save(self, *args, **kwargs):
         qty = self.quantity or Decimal("0")
         price = self.unit_price or Decimal("0")
         self.line_total = qty * price
+
+        old = getattr(self, "_consumption_state", None)
+        if old is not None:
+            old = self._load_deferred_state(old)
         super().save(*args, **kwargs)
 
+        known = old or {}
+        new = self._consumption_key(known)
+        if old is None or tuple(old.get(f) for f in self.CONSUMPTION_FIELDS) != new:
+            if old is not None and (old.get("summary_id"), old.get("product_id")) != new[:2]:
+                self._mark_changed(old.get("summary_id"), old.get("product_id"))
+            self._mark_changed(new[0], new[1])
+        self._consumption_state = {
+            f: value for f, value in zip(self.CONSUMPTION_FIELDS, new) if f in self.__dict__ or f in known
+        }
+
+    def delete(self, *args, **kwargs):
+        self._mark_changed(self.summary_id, self.product_id)
+        return super().delete(*args, **kwargs)
+
+
+# -------------------- مبيعات نقاط البيع (POS) --------------------
+
+class PosTicketLine(models.Model):
+    """
+    سطر تذكرة من نقطة البيع كما وصل (جدول مرحلي).
+
+    - الإدخال إضافة فقط؛ (ticket_id, line_no) فريد فإعادة إرسال التذكرة لا تكرّرها.
+    - fold_pos_lines (sales/pos.py) يجمّعها دوريًا في SalesSummaryLine
+      ويعلّمها "مُرحّل" أو "مرفوض" (كود غير معروف / لا فترة / فترة مقفلة).
+    """
+    STATUS_PENDING = "pending"
+    STATUS_FOLDED = "folded"
+    STATUS_REJECTED = "rejected"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "بالانتظار"),
+        (STATUS_FOLDED, "مُرحّل"),
+        (STATUS_REJECTED, "مرفوض"),
+    ]
+
+    ticket_id = models.CharField("رقم التذكرة", max_length=64)
+    line_no = models.PositiveIntegerField("رقم السطر")
+    product_code = models.CharField("كود المنتج", max_length=50)
+    quantity = models.DecimalField("الكمية", max_digits=18, decimal_places=4)
+    unit_price = models.DecimalField("سعر الوحدة", max_digits=18, decimal_places=4)
+    sold_at = models.DateTimeField("وقت البيع")
+
+    status = models.CharField("الحالة", max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    error = models.CharField("سبب الرفض", max_length=200, blank=True, default="")
+    received_at = models.DateTimeField("وقت الاستلام", auto_now_add=True)
+    folded_at = models.DateTimeField("وقت الترحيل", null=True, blank=True)
+
+    class Meta:
+        verbose_name = "سطر تذكرة نقطة بيع"
+        verbose_name_plural = "سطور تذاكر نقاط البيع"
+        unique_together = ("ticket_id", "line_no")
+        indexes = [
+            models.Index(fields=["status", "id"], name="sales_pos_status_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.ticket_id}/{self.line_no} - {self.product_code} × {self.quantity}"
+
 
 # -------------------- تجميع استهلاك المواد --------------------
 
@@ -123,6 +302,13 @@ class SalesConsumptionSummary(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # نسخ المدخلات وقت آخر توليد (sales/versioning.py)؛ الفارغة = غير معروفة
+    sales_version = models.CharField("نسخة المبيعات", max_length=40, blank=True, default="")
+    purchases_version = models.CharField("نسخة المشتريات", max_length=40, blank=True, default="")
+    bom_version = models.CharField("نسخة الوصفات", max_length=40, blank=True, default="")
+    cost_version = models.CharField("نسخة التكاليف", max_length=40, blank=True, default="")
+    versioned_at = models.DateTimeField("وقت آخر توليد", null=True, blank=True)
+
     class Meta:
         verbose_name = "تجميع استهلاك المواد"
         verbose_name_plural = "تجميعات استهلاك المواد"
@@ -144,6 +330,13 @@ class SalesConsumption(models.Model):
         related_name="lines",
         verbose_name="تجميع",
     )
+    # نسخة من summary.period: تقارير الفترة تصفّي وتجمّع بدون join مع التجميع
+    period = models.ForeignKey(
+        Period,
+        on_delete=models.CASCADE,
+        related_name="sales_consumptions",
+        verbose_name="الفترة",
+    )
     product = models.ForeignKey(
         Product,
         on_delete=models.CASCADE,
@@ -215,6 +408,19 @@ class SalesConsumption(models.Model):
     class Meta:
         verbose_name = "استهلاك مادة خام"
         verbose_name_plural = "استهلاك المواد الخام"
+        # فهارس تغطي تجميعات التقارير (الأعمدة المجمّعة داخل الفهرس نفسه
+        # لأن SQLite لا يدعم INCLUDE)؛ على PostgreSQL الجدول مقسّم حسب الفترة
+        # (sales/partitioning.py)
+        indexes = [
+            models.Index(
+                fields=["period", "raw_material", "quantity_consumed", "total_cost"],
+                name="sales_cons_period_raw_idx",
+            ),
+            models.Index(
+                fields=["period", "product", "quantity_sold", "quantity_consumed", "total_cost"],
+                name="sales_cons_period_prod_idx",
+            ),
+        ]
 
     def __str__(self):
         component = self.raw_material or self.source_product
@@ -233,6 +439,155 @@ class SalesConsumption(models.Model):
     quantity_consumed_storage.short_description = "الكمية بوحدة التخزين"
 
 
+class SalesConsumptionPath(models.Model):
+    """
+    مصدر سطر استهلاك: كم من الكمية جاء عبر كل مسار في شجرة الوصفات.
+
+    المسار نفسه مُخزّن مرة واحدة (costing.BOMPath: سلسلة نصف المصنع، المستوى،
+    الوصفة المصدر) ومشترك بين المنتجات والفترات؛ هنا فقط رقم المسار والكمية.
+    السطر الأصلي يبقى واحدًا لكل (منتج، مادة) فلا تتكرر الكمية المباعة في التقارير.
+    """
+    consumption = models.ForeignKey(
+        SalesConsumption,
+        on_delete=models.CASCADE,
+        related_name="paths",
+        verbose_name="سطر الاستهلاك",
+        # بدون قيد في قاعدة البيانات: جدول الاستهلاك المقسّم على PostgreSQL
+        # مفتاحه (id, period_id) فلا يمكن الإشارة إليه بـ id وحده؛ الحذف المتتالي من Django
+        db_constraint=False,
+    )
+    path = models.ForeignKey(
+        "costing.BOMPath",
+        on_delete=models.CASCADE,
+        related_name="consumptions",
+        verbose_name="المسار",
+    )
+    quantity_consumed = models.DecimalField(
+        "الكمية المستهلكة (وحدة الاستخدام)",
+        max_digits=18,
+        decimal_places=6,
+    )
+    total_cost = models.DecimalField(
+        "إجمالي التكلفة",
+        max_digits=18,
+        decimal_places=6,
+        null=True,
+        blank=True,
+    )
+
+    class Meta:
+        verbose_name = "مصدر استهلاك"
+        verbose_name_plural = "مصادر الاستهلاك"
+        unique_together = ("consumption", "path")
+
+    def __str__(self):
+        return f"{self.consumption_id} ← {self.path} ({self.quantity_consumed})"
+
+
+class ConsumptionInputRevision(models.Model):
+    """
+    عدّاد تعديلات أحد مدخلات الاستهلاك لكل فترة (sales/versioning.py)؛
+    بدون فترة: materials (كل تعديل على المواد الخام).
+    يزيد بعد commit كل تعديل، فمقارنة نسخة الاستهلاك لا تعيد قراءة البيانات.
+    """
+    name = models.CharField("المُدخل", max_length=20)
+    period = models.ForeignKey(
+        Period,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="+",
+        verbose_name="الفترة",
+    )
+    revision = models.PositiveBigIntegerField("رقم المراجعة", default=0)
+
+    class Meta:
+        verbose_name = "مراجعة مدخلات الاستهلاك"
+        verbose_name_plural = "مراجعات مدخلات الاستهلاك"
+        unique_together = ("name", "period")
+
+    def __str__(self):
+        return f"{self.name} ({self.period_id or '-'}) r{self.revision}"
+
+
+class SalesConsumptionChange(models.Model):
+    """
+    منتج نهائي تغيّرت بنود مبيعاته (الكمية / الوحدة / الحذف) منذ آخر توليد
+    للاستهلاك في الفترة؛ update_sales_consumption يعيد حساب هذه المنتجات فقط
+    ثم يحذف السطر.
+    """
+    period = models.ForeignKey(
+        Period,
+        on_delete=models.CASCADE,
+        related_name="sales_consumption_changes",
+        verbose_name="الفترة",
+    )
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name="+",
+        verbose_name="المنتج النهائي",
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "تغيير مبيعات بانتظار تحديث الاستهلاك"
+        verbose_name_plural = "تغييرات مبيعات بانتظار تحديث الاستهلاك"
+        unique_together = ("period", "product")
+
+    def __str__(self):
+        return f"{self.product} ({self.period})"
+
+
+class ConsumptionJob(models.Model):
+    """
+    طلب إعادة توليد استهلاك المواد لفترة (طابور في قاعدة البيانات بدون وسيط خارجي).
+
+    - الطلبات المتكررة لنفس الفترة تُدمج في طلب واحد منتظر (requests_count).
+    - ينفّذها أمر run_consumption_worker (sales/jobs.py).
+    - full=True: إعادة توليد كاملة، وإلا تحديث المنتجات المتغيّرة فقط.
+    """
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "بالانتظار"),
+        (STATUS_RUNNING, "قيد التنفيذ"),
+        (STATUS_DONE, "تم"),
+        (STATUS_FAILED, "فشل"),
+    ]
+
+    period = models.ForeignKey(
+        Period,
+        on_delete=models.CASCADE,
+        related_name="consumption_jobs",
+        verbose_name="الفترة",
+    )
+    status = models.CharField(
+        "الحالة", max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True,
+    )
+    full = models.BooleanField("إعادة توليد كاملة", default=False)
+    requests_count = models.PositiveIntegerField("عدد الطلبات المدمجة", default=1)
+    products_updated = models.PositiveIntegerField("عدد المنتجات المحدّثة", null=True, blank=True)
+    error = models.TextField("الخطأ", blank=True, default="")
+
+    requested_at = models.DateTimeField("وقت آخر طلب", auto_now_add=True)
+    started_at = models.DateTimeField("بدء التنفيذ", null=True, blank=True)
+    # يحدّثه العامل أثناء التنفيذ؛ توقفه يعني أن العامل توقف (requeue)
+    heartbeat_at = models.DateTimeField("آخر نبضة من العامل", null=True, blank=True)
+    finished_at = models.DateTimeField("انتهاء التنفيذ", null=True, blank=True)
+
+    class Meta:
+        verbose_name = "مهمة توليد استهلاك"
+        verbose_name_plural = "مهام توليد الاستهلاك"
+        ordering = ["-id"]
+        indexes = [models.Index(fields=["period", "status"])]
+
+    def __str__(self):
+        return f"{self.period} - {self.get_status_display()}"
+
+
 # -------------------- دوال مساعدة / منطق التوليد --------------------
 
 def get_quantity_sold(product, period):
@@ -248,123 +603,266 @@ def get_quantity_sold(product, period):
     return total_qty
 
 
-from decimal import Decimal
-from django.db import transaction
+def get_quantities_sold(period, product_ids=None):
+    """
+    نفس get_quantity_sold لكل المنتجات باستعلام واحد: {product_id: الكمية}.
+    product_ids (اختياري) يحدد المنتجات المطلوبة فقط.
+    """
+    qs = SalesSummaryLine.objects.filter(summary__period=period)
+    if product_ids is not None:
+        qs = qs.filter(product_id__in=list(product_ids))
+    return {
+        row["product_id"]: row["total"] or Decimal("0")
+        for row in qs.values("product_id").annotate(total=models.Sum("quantity"))
+    }
 
-def generate_sales_consumption(period):
+
+def mark_consumption_changed(period_id, product_ids):
     """
-    (مرحلة 1 - حل بسيط)
-    - نفك BOM لكل منتج مصنع (نهائي + نصف مصنع)
-    - نجمع الاستهلاك على مستوى (المنتج النهائي + المادة الخام) فقط
-    - كل شيء يُحسب على أصغر وحدة (ingredient_unit) للمادة الخام
+    تسجيل منتجات تغيّرت مبيعاتها في الفترة (سطر واحد لكل منتج).
+    السطر الموجود يُستبدل برقم (id) جديد: إعادة التوليد التي بدأت قبل التعديل تحذف
+    فقط العلامات حتى آخر id رأته (last_consumption_change_id)، فلا تضيع علامة هذا التعديل.
     """
-    summary, _ = SalesConsumptionSummary.objects.get_or_create(period=period)
+    from .versioning import bump_revision
+
+    product_ids = set(product_ids)
+    SalesConsumptionChange.objects.filter(period_id=period_id, product_id__in=product_ids).delete()
+    SalesConsumptionChange.objects.bulk_create(
+        [SalesConsumptionChange(period_id=period_id, product_id=pid) for pid in product_ids],
+        ignore_conflicts=True,
+    )
+    bump_revision("sales", [period_id])
+
+
+def last_consumption_change_id(period):
+    """أكبر id لعلامات التغيير في الفترة الآن (0 لو لا يوجد)؛ يُلتقط قبل بناء السطور."""
+    return SalesConsumptionChange.objects.filter(period=period).aggregate(m=models.Max("id"))["m"] or 0
+
+
+def _clear_consumption_changes(period, changes_upto):
+    # العلامات التي سُجلت بعد بدء البناء (id أكبر) تبقى لتحديث لاحق
+    qs = SalesConsumptionChange.objects.filter(period=period)
+    if changes_upto is not None:
+        qs = qs.filter(id__lte=changes_upto)
+    qs.delete()
 
-    # حذف القديم
-    summary.lines.all().delete()
+
+def build_consumption_rows(period, summary=None, product_ids=None):
+    """
+    سطور SalesConsumption (غير محفوظة) للفترة، أو لمنتجات نهائية معيّنة فقط.
+    summary=None: بدون ربط بالتجميع (يُربط عند الكتابة في write_consumption_rows).
+
+    التنفيذ دفعة واحدة (عدد ثابت من الاستعلامات مهما كان عدد المنتجات):
+    الكميات المباعة باستعلام مجمّع واحد، مسارات التفكيك من جدول BOMExplosion
+    (costing.explosion.consumption_paths: ضرب في الكمية بدل التفكيك)،
+    تكلفة المواد من RawCostIndex.
+    """
+    from costing.explosion import consumption_paths
 
     # هنا نجمع الاستهلاك بدل إنشاء سطور أثناء التفكيك
-    # key = (final_product_id, raw_material_id)
+    # key = (final_product_id, raw_material_id) -> {سلسلة نصف المصنع: الكمية بمقياس QTY12}
     acc = {}
 
-    def add_raw(final_product, raw, sales_qty, qty_consumed):
-        if qty_consumed is None:
-            return
-        qty_consumed = Decimal(qty_consumed)
-
-        unit_cost = raw.get_cost_per_ingredient_unit(period=period)
-        total_cost = (unit_cost * qty_consumed) if unit_cost is not None else None
-
-        key = (final_product.id, raw.id)
-        if key not in acc:
-            acc[key] = {
-                "final_product": final_product,
-                "raw": raw,
-                "sales_qty": Decimal(sales_qty or 0),
-                "qty": Decimal("0"),
-                "unit_cost": unit_cost,   # غالبًا ثابت للفترة
-            }
-
-        acc[key]["qty"] += qty_consumed
-        # لو unit_cost موجود نعيد حساب الإجمالي في النهاية (أوضح وأضمن)
-        # (خصوصًا لو كان None في بعض الحالات)
-
-    def collect(final_product, current_product, sales_qty, required_qty, visited=None):
-        """
-        required_qty: الكمية المطلوبة من current_product لإنتاج المطلوب (بوحدة المنتج نفسه)
-        """
-        if visited is None:
-            visited = set()
+    sold = get_quantities_sold(period, product_ids)
+    # نفس ترتيب المرور على المنتجات القابلة للبيع (ترتيب الأسطر الناتجة)
+    product_ids = [
+        pid for pid in Product.objects.filter(is_sellable=True, id__in=list(sold)).values_list("id", flat=True)
+        if sold[pid] > 0
+    ]
+    if not product_ids:
+        return []
+
+    # ✅ تكلفة كل المواد الخام للفترة مرة واحدة (بدل استعلام لكل مادة)
+    cost_index = RawCostIndex(period)
+    required = {product_id: to_scaled(sold[product_id], QTY12) for product_id in product_ids}
+
+    for product_id, raw_id, semis, per_unit in consumption_paths(product_ids):
+        qty = div_round(required[product_id] * to_scaled(per_unit, QTY12), QTY12)
+        paths = acc.setdefault((product_id, raw_id), {})
+        paths[semis] = paths.get(semis, 0) + qty
+
+    def to_fields(qty, unit_cost):
+        # التحويل إلى Decimal (6 منازل مثل الحقول) هنا فقط
+        total_cost = (
+            to_decimal(div_round(to_scaled(unit_cost, MICRO) * qty, QTY12), MICRO)
+            if unit_cost is not None else None
+        )
+        return to_decimal(div_round(qty, QTY12 // MICRO), MICRO), total_cost
+
+    # إنشاء السطور النهائية (سطر واحد لكل مادة خام داخل كل منتج نهائي)
+    # + مصدرها في row.lineage: [(سلسلة نصف المصنع, الكمية, التكلفة)] لكل مسار
+    rows = []
+    for (product_id, raw_id), paths in acc.items():
+        unit_cost = cost_index.per_ingredient_unit(raw_id)
+        quantity_consumed, total_cost = to_fields(sum(paths.values()), unit_cost)
+
+        row = SalesConsumption(
+            summary=summary,
+            period=period,
+            product_id=product_id,
+            raw_material_id=raw_id,
+            quantity_sold=sold[product_id],
+            quantity_consumed=quantity_consumed,     # أصغر وحدة
+            unit_cost=unit_cost,
+            total_cost=total_cost,
+            # سطر واحد لكل (منتج، مادة) لتجنب التكرارات؛ المصدر/المستوى في SalesConsumptionPath
+            source_product=None,
+            source_type="final",
+            level=1,
+        )
+        row.lineage = [(semis, *to_fields(qty, unit_cost)) for semis, qty in paths.items()]
+        rows.append(row)
+    return rows
+
+
+def save_consumption_lineage(rows):
+    """
+    كتابة مصدر كل سطر (SalesConsumptionPath) من row.lineage؛ السطور محفوظة مسبقًا.
+    المسارات نفسها مشتركة (costing.BOMPath) فلا تتكرر بين المنتجات والفترات.
+    """
+    from costing.explosion import intern_paths
+
+    rows = [row for row in rows if getattr(row, "lineage", None)]
+    path_ids = intern_paths(semis for row in rows for semis, _, _ in row.lineage)
+    SalesConsumptionPath.objects.bulk_create(
+        [
+            SalesConsumptionPath(
+                consumption_id=row.pk,
+                path_id=path_ids[semis],
+                quantity_consumed=quantity_consumed,
+                total_cost=total_cost,
+            )
+            for row in rows
+            for semis, quantity_consumed, total_cost in row.lineage
+        ],
+        batch_size=2000,
+    )
 
-        if current_product.id in visited:
-            return
-        visited.add(current_product.id)
 
-        bom = current_product.get_active_bom()
-        if not bom:
-            visited.remove(current_product.id)
-            return
+def _schedule_stock_ledger(period):
+    # المنصرف للمبيعات مصدر لدفتر حركة المخزون (inventory/ledger.py)
+    from inventory.ledger import schedule_ledger_sync
 
-        bom_output_qty = bom.batch_output_quantity or Decimal("1")
+    schedule_ledger_sync([period])
 
-        for item in bom.items.all():
-            base_qty = item.quantity or Decimal("0")
 
-            # كمية البند لكل 1 وحدة من current_product
-            qty_per_unit = base_qty / bom_output_qty
+def write_consumption_rows(period, rows, version=None, changes_upto=None):
+    """
+    استبدال كل سطور استهلاك الفترة بـ rows (معاملة واحدة)؛ ترجع عدد الأسطر.
+    version: نسخ المدخلات مقروءة قبل بناء rows (sales.versioning.data_version).
+    changes_upto: last_consumption_change_id قبل بناء rows؛ تُحذف العلامات حتى هذا الرقم
+    فقط (تعديلات المبيعات أثناء البناء تبقى علاماتها). None = كل العلامات.
+    """
+    from .versioning import store_version
 
-            # الكمية الإجمالية المطلوبة من هذا البند
-            qty_total = Decimal(required_qty) * qty_per_unit
+    with transaction.atomic():
+        ensure_consumption_partition(period)
+        summary, _ = SalesConsumptionSummary.objects.get_or_create(period=period)
+        for row in rows:
+            row.summary = summary
+
+        # حذف القديم
+        summary.lines.all().delete()
+        SalesConsumption.objects.bulk_create(rows, batch_size=2000)
+        save_consumption_lineage(rows)
+        _clear_consumption_changes(period, changes_upto)
+        if version is not None:
+            store_version(summary, version)
+        _schedule_stock_ledger(period)
+    return len(rows)
+
+
+def skip_if_current(period, version, changes_upto=None):
+    """
+    لو نسخ مدخلات الفترة المحفوظة = version: لا تعديل منذ آخر توليد، والعلامات المتبقية
+    تُمسح (حتى changes_upto) وترجع True؛ وإلا False.
+    """
+    summary = SalesConsumptionSummary.objects.filter(period=period).first()
+    if summary is None or any(getattr(summary, f"{name}_version") != value for name, value in version.items()):
+        return False
+    _clear_consumption_changes(period, changes_upto)
+    return True
 
-            # 1) مادة خام مباشرة (حتى لو ليست "تصنيع" — طالما موجودة في BOM للمنتج النهائي)
-            if item.raw_material:
-                add_raw(final_product, item.raw_material, sales_qty, qty_total)
 
-            # 2) منتج نصف مصنع -> نفك BOM له
-            elif item.component_product and item.component_product.is_semi_finished:
-                collect(
-                    final_product=final_product,
-                    current_product=item.component_product,
-                    sales_qty=sales_qty,
-                    required_qty=qty_total,
-                    visited=visited
-                )
+def generate_sales_consumption(period, skip_current=False):
+    """
+    (مرحلة 1 - حل بسيط)
+    - نفك BOM لكل منتج مصنع (نهائي + نصف مصنع)
+    - نجمع الاستهلاك على مستوى (المنتج النهائي + المادة الخام) فقط
+    - كل شيء يُحسب على أصغر وحدة (ingredient_unit) للمادة الخام
 
-        visited.remove(current_product.id)
+    إعادة توليد كاملة للفترة (تلتقط أيضًا تعديلات الوصفات وتكاليف المواد)؛
+    الحفظ العادي للمبيعات يستخدم update_sales_consumption.
+    ترجع عدد الأسطر، أو None لو skip_current والبيانات لم تتغيّر منذ آخر توليد.
+    """
+    from .versioning import data_version
 
-    # تنفيذ
-    with transaction.atomic():
-        for final_product in Product.objects.filter(is_sellable=True):
-            sales_qty = get_quantity_sold(final_product, period)
-            if sales_qty and Decimal(sales_qty) > 0:
-                collect(
-                    final_product=final_product,
-                    current_product=final_product,
-                    sales_qty=sales_qty,
-                    required_qty=sales_qty,
-                    visited=set()
-                )
-
-        # إنشاء السطور النهائية (سطر واحد لكل مادة خام داخل كل منتج نهائي)
-        rows = []
-        for (_, _), v in acc.items():
-            raw = v["raw"]
-            qty = v["qty"]
-            unit_cost = raw.get_cost_per_ingredient_unit(period=period)
-            total_cost = (unit_cost * qty) if unit_cost is not None else None
-
-            rows.append(SalesConsumption(
-                summary=summary,
-                product=v["final_product"],
-                raw_material=raw,
-                quantity_sold=v["sales_qty"],
-                quantity_consumed=qty,     # أصغر وحدة
-                unit_cost=unit_cost,
-                total_cost=total_cost,
-                # مرحلة أولى: بدون تتبع المصدر/المستوى لتجنب التكرارات
-                source_product=None,
-                source_type="final",
-                level=1,
-            ))
+    # العلامات والنسخ قبل القراءة: أي تعديل أثناء البناء يبقى علامة / يظهر كبيانات غير محدّثة
+    changes_upto = last_consumption_change_id(period)
+    version = data_version(period)
+    if skip_current and skip_if_current(period, version, changes_upto):
+        return None
+    return write_consumption_rows(period, build_consumption_rows(period), version, changes_upto)
 
-        SalesConsumption.objects.bulk_create(rows)
+
+_CONSUMPTION_VALUE_FIELDS = ("quantity_sold", "quantity_consumed", "unit_cost", "total_cost")
+
+
+@transaction.atomic
+def update_sales_consumption(period):
+    """
+    تحديث جزئي: يعيد حساب المنتجات المسجّلة في SalesConsumptionChange فقط
+    ويحدّث سطورها (تعديل الموجود / إضافة الجديد / حذف ما لم يعد مستهلكًا).
+    الفترة التي لم يُولّد لها استهلاك من قبل تُولّد بالكامل.
+    ترجع عدد المنتجات التي أعيد حسابها.
+    """
+    summary = SalesConsumptionSummary.objects.filter(period=period).first()
+    if summary is None:
+        generate_sales_consumption(period)
+        return None
+
+    from .versioning import data_version, store_version
+
+    # تحديث المبيعات فقط: باقي النسخ (الوصفات/التكاليف) تبقى كما هي.
+    # تُقرأ قبل العلامات: تعديل يصل بينهما يبقى علامة ولا يدخل في النسخة المحفوظة
+    sales_version = data_version(period, only=("sales",))
+
+    changes = list(
+        SalesConsumptionChange.objects.select_for_update()
+        .filter(period=period).values_list("id", "product_id")
+    )
+    if not changes:
+        return 0
+    product_ids = {product_id for _, product_id in changes}
+
+    existing = {
+        (line.product_id, line.raw_material_id): line
+        for line in summary.lines.filter(product_id__in=product_ids)
+    }
+
+    rows = build_consumption_rows(period, summary, product_ids)
+    to_create, to_update = [], []
+    for row in rows:
+        line = existing.pop((row.product_id, row.raw_material_id), None)
+        if line is None:
+            to_create.append(row)
+            continue
+        row.pk = line.pk     # لإعادة كتابة المصدر على نفس السطر
+        if any(getattr(line, f) != getattr(row, f) for f in _CONSUMPTION_VALUE_FIELDS):
+            for f in _CONSUMPTION_VALUE_FIELDS:
+                setattr(line, f, getattr(row, f))
+            to_update.append(line)
+
+    if existing:
+        SalesConsumption.objects.filter(pk__in=[line.pk for line in existing.values()]).delete()
+    SalesConsumption.objects.bulk_update(to_update, _CONSUMPTION_VALUE_FIELDS, batch_size=2000)
+    if to_create:
+        ensure_consumption_partition(period)
+    SalesConsumption.objects.bulk_create(to_create, batch_size=2000)
+
+    SalesConsumptionPath.objects.filter(consumption__in=[row.pk for row in rows if row.pk]).delete()
+    save_consumption_lineage(rows)
+    SalesConsumptionChange.objects.filter(pk__in=[pk for pk, _ in changes]).delete()
+    store_version(summary, sales_version)
+    _schedule_stock_ledger(period)
+    return len(product_ids)
@@ -0,0 +1,68 @@
+# sales/partitioning.py
+"""
+تقسيم جدول استهلاك المواد (SalesConsumption) حسب الفترة على PostgreSQL.
+
+- PostgreSQL: الجدول PARTITION BY RANGE (period_id) بقسم لكل فترة + قسم افتراضي؛
+  تقارير الفترة تقرأ قسمها فقط مهما زادت سنوات البيانات.
+- غير PostgreSQL (SQLite): لا شيء؛ الفهارس المركّبة (period, ...) تكفي.
+
+تحويل الجدول الموجود: sales/migrations/0014_consumption_period_partitions.py.
+ensure_consumption_partition: إنشاء قسم الفترة قبل الكتابة فيها.
+"""
+from django.db import connection as default_connection, transaction
+
+TABLE = "sales_salesconsumption"
+
+# الأقسام المعروفة في هذه العملية (لتجنب الاستعلام عنها مع كل كتابة)
+_known_partitions = set()
+
+
+def partitioning_supported(connection=None):
+    return (connection or default_connection).vendor == "postgresql"
+
+
+def partition_name(period_id):
+    return f"{TABLE}_p{int(period_id)}"
+
+
+def _create_partition_sql(quote_name, period_id):
+    period_id = int(period_id)
+    return (
+        f"CREATE TABLE IF NOT EXISTS {quote_name(partition_name(period_id))} "
+        f"PARTITION OF {quote_name(TABLE)} FOR VALUES FROM ({period_id}) TO ({period_id + 1})"
+    )
+
+
+def ensure_consumption_partition(period, connection=None):
+    """قسم الفترة (period أو رقمها)؛ بدون أثر على غير PostgreSQL."""
+    connection = connection or default_connection
+    if not partitioning_supported(connection):
+        return
+    period_id = int(getattr(period, "pk", period))
+    if period_id in _known_partitions:
+        return
+
+    q = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        # القفل على الجدول الأب فقط لو القسم غير موجود فعلًا
+        cursor.execute("SELECT to_regclass(%s)", [partition_name(period_id)])
+        if cursor.fetchone()[0] is None:
+            cursor.execute(f"SELECT 1 FROM {q(TABLE + '_default')} WHERE {q('period_id')} = %s LIMIT 1", [period_id])
+            if cursor.fetchone() is None:
+                cursor.execute(_create_partition_sql(q, period_id))
+            else:
+                # صفوف الفترة في القسم الافتراضي (كُتبت قبل إنشاء قسمها): CREATE PARTITION
+                # يرفضها، فننقلها لجدول جديد ثم نلحقه كقسم
+                part = q(partition_name(period_id))
+                cursor.execute(f"CREATE TABLE {part} (LIKE {q(TABLE)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+                cursor.execute(
+                    f"WITH moved AS (DELETE FROM {q(TABLE + '_default')} WHERE {q('period_id')} = %s RETURNING *) "
+                    f"INSERT INTO {part} SELECT * FROM moved",
+                    [period_id],
+                )
+                cursor.execute(
+                    f"ALTER TABLE {q(TABLE)} ATTACH PARTITION {part} FOR VALUES FROM ({period_id}) TO ({period_id + 1})"
+                )
+    # القسم يُعتبر موجودًا بعد الـ commit فقط: لو رجعت الـ transaction يُعاد إنشاؤه في المرة القادمة
+    transaction.on_commit(lambda: _known_partitions.add(period_id), using=connection.alias)
+
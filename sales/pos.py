@@ -0,0 +1,316 @@
+# sales/pos.py
+"""
+استقبال مبيعات نقاط البيع (POS) وترحيلها إلى ملخص المبيعات.
+
+- parse_ndjson: سطور JSON (سطر لكل بند تذكرة) → PosTicketLine غير محفوظة + الأخطاء.
+  line_no مطلوب: رقم البند ثابت داخل التذكرة حتى لو قُسّمت على أكثر من طلب.
+- ingest_ticket_lines: إضافة للجدول المرحلي دفعات؛ (ticket_id, line_no) الموجود يُتجاهل
+  فإعادة إرسال نفس التذاكر آمنة.
+- fold_pos_lines: يجمّع السطور المنتظرة حسب (الفترة، المنتج) ويضيفها إلى
+  SalesSummaryLine بتحديث/إنشاء جماعي، ثم يسجّل المنتجات المتغيّرة لتوليد الاستهلاك.
+  يشغّله دوريًا: python manage.py fold_pos_sales
+"""
+import json
+from bisect import bisect_right
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from costing.models import Product, Unit
+from expenses.models import Period
+
+from .jobs import schedule_consumption_update
+from .models import PosTicketLine, SalesSummary, SalesSummaryLine, mark_consumption_changed
+
+Q4 = Decimal("0.0001")
+Q2 = Decimal("0.01")
+
+# أسماء بديلة مقبولة لحقول السطر
+_ALIASES = {
+    "qty": "quantity",
+    "price": "unit_price",
+    "timestamp": "sold_at",
+    "code": "product_code",
+}
+
+# حدود حقول PosTicketLine
+_MAX_DECIMAL = Decimal("1e14")
+
+
+# --------------------------------------------------------
+# القراءة
+# --------------------------------------------------------
+def _decimal(value, field):
+    try:
+        number = Decimal(str(value)).quantize(Q4, rounding=ROUND_HALF_UP)
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"{field} غير صالح")
+    if not number.is_finite() or abs(number) >= _MAX_DECIMAL:
+        raise ValueError(f"{field} خارج الحدود")
+    return number
+
+
+class TooManyLines(Exception):
+    """الطلب فيه سطور أكثر من الحد؛ القراءة تتوقف عند تجاوزه."""
+
+    def __init__(self, max_lines):
+        super().__init__(f"عدد السطور أكبر من الحد ({max_lines}) - قسّم الإرسال")
+        self.max_lines = max_lines
+
+
+def _datetime(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            return datetime.fromtimestamp(value, tz=dt_timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            raise ValueError("sold_at خارج الحدود (ثواني Unix)")
+    parsed = parse_datetime(str(value)) if value else None
+    if parsed is None:
+        raise ValueError("sold_at غير صالح (ISO 8601 أو ثواني Unix)")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def _record(data):
+    if not isinstance(data, dict):
+        raise ValueError("السطر لازم يكون JSON object")
+    data = {_ALIASES.get(k, k): v for k, v in data.items()}
+
+    ticket_id = str(data.get("ticket_id") or "").strip()
+    product_code = str(data.get("product_code") or "").strip()
+    if not ticket_id or len(ticket_id) > 64:
+        raise ValueError("ticket_id مطلوب (حتى 64 حرف)")
+    if not product_code or len(product_code) > 50:
+        raise ValueError("product_code مطلوب (حتى 50 حرف)")
+
+    # لا يُستنتج من ترتيب السطر في الطلب: تقسيم التذكرة على طلبين يكسر منع التكرار
+    line_no = data.get("line_no")
+    if line_no is None or isinstance(line_no, bool):
+        raise ValueError("line_no مطلوب")
+    try:
+        line_no = int(line_no)
+    except (TypeError, ValueError):
+        raise ValueError("line_no غير صالح")
+    if line_no < 1:
+        raise ValueError("line_no لازم يكون 1 أو أكبر")
+
+    return PosTicketLine(
+        ticket_id=ticket_id,
+        line_no=line_no,
+        product_code=product_code,
+        quantity=_decimal(data.get("quantity"), "quantity"),
+        unit_price=_decimal(data.get("unit_price", 0), "unit_price"),
+        sold_at=_datetime(data.get("sold_at")),
+    )
+
+
+def parse_ndjson(lines, max_lines=None):
+    """
+    lines: سطور bytes أو str (ملف/طلب HTTP). ترجع (records, errors)
+    حيث errors = [{"line": رقم السطر, "error": ...}]؛ السطور الفارغة تُتجاهل.
+    max_lines: أقصى عدد سطور غير فارغة؛ تجاوزه يوقف القراءة فورًا ويرفع TooManyLines.
+    """
+    records, errors = [], []
+    for number, raw in enumerate(lines, start=1):
+        if isinstance(raw, bytes):
+            raw = raw.decode("utf-8", errors="replace")
+        raw = raw.strip()
+        if not raw:
+            continue
+        if max_lines is not None and len(records) + len(errors) >= max_lines:
+            raise TooManyLines(max_lines)
+        try:
+            records.append(_record(json.loads(raw)))
+        except (ValueError, TypeError) as exc:
+            errors.append({"line": number, "error": str(exc)})
+    return records, errors
+
+
+# --------------------------------------------------------
+# الإدخال
+# --------------------------------------------------------
+def ingest_ticket_lines(records, batch_size=5000):
+    """
+    حفظ السطور في الجدول المرحلي (معاملة لكل دفعة).
+    ترجع {"accepted": عدد الجديد, "duplicates": المكرر (في الطلب أو محفوظ سابقًا)}.
+    """
+    accepted = duplicates = 0
+    for start in range(0, len(records), batch_size):
+        chunk = records[start:start + batch_size]
+
+        unique = {}
+        for record in chunk:
+            unique.setdefault((record.ticket_id, record.line_no), record)
+        duplicates += len(chunk) - len(unique)
+
+        with transaction.atomic():
+            existing = set(
+                PosTicketLine.objects.filter(ticket_id__in={key[0] for key in unique})
+                .values_list("ticket_id", "line_no")
+            )
+            new = [record for key, record in unique.items() if key not in existing]
+            # ignore_conflicts: إرسالان متزامنان لنفس التذكرة لا يفشلان
+            PosTicketLine.objects.bulk_create(new, ignore_conflicts=True)
+
+        accepted += len(new)
+        duplicates += len(unique) - len(new)
+    return {"accepted": accepted, "duplicates": duplicates}
+
+
+# --------------------------------------------------------
+# الترحيل إلى ملخص المبيعات
+# --------------------------------------------------------
+def _update_status(ids, **values):
+    ids = list(ids)
+    for start in range(0, len(ids), 2000):
+        PosTicketLine.objects.filter(pk__in=ids[start:start + 2000]).update(**values)
+
+
+class _PeriodLookup:
+    """الفترة التي يقع فيها تاريخ البيع (الفترات مرتبة بتاريخ البداية)."""
+
+    def __init__(self):
+        self.periods = list(Period.objects.order_by("start_date", "id"))
+        self.starts = [p.start_date for p in self.periods]
+
+    def get(self, day):
+        index = bisect_right(self.starts, day) - 1
+        while index >= 0:
+            period = self.periods[index]
+            if period.end_date >= day:
+                return period
+            index -= 1
+        return None
+
+
+@transaction.atomic
+def fold_pos_lines(batch_size=None):
+    """
+    ترحيل حتى batch_size سطر منتظر (الأقدم أولًا) في معاملة واحدة.
+
+    الكمية والقيمة تُضافان لسطر المنتج في ملخص الفترة (أو يُنشأ سطر جديد بوحدة المنتج
+    الأساسية)؛ سعر الوحدة = متوسط مرجّح (إجمالي ÷ كمية). السطر الذي تصبح كميته صفرًا
+    أو أقل (مرتجعات) يُحذف مثل شاشة إدخال المبيعات.
+    ترجع {"folded", "rejected", "periods", "products"}.
+    """
+    if batch_size is None:
+        batch_size = getattr(settings, "SALES_POS_FOLD_BATCH", 20000)
+
+    # الأسطر المقروءة هنا هي نفسها التي تُعلَّم في النهاية (مقفلة على PostgreSQL)
+    rows = list(
+        PosTicketLine.objects.select_for_update()
+        .filter(status=PosTicketLine.STATUS_PENDING)
+        .order_by("id")
+        .values_list("id", "product_code", "quantity", "unit_price", "sold_at")[:batch_size]
+    )
+    result = {"folded": 0, "rejected": 0, "periods": 0, "products": 0}
+    if not rows:
+        return result
+
+    products = {
+        code: (pid, unit_id)
+        for code, pid, unit_id in Product.objects.filter(code__in={r[1] for r in rows})
+        .values_list("code", "id", "base_unit_id")
+    }
+    base_units = dict(products.values())
+    periods = _PeriodLookup()
+    current_tz = timezone.get_current_timezone()
+
+    totals = {}       # (period_id, product_id) -> [الكمية, القيمة]
+    by_period = {}
+    folded, rejected = [], {}
+    for pk, code, quantity, unit_price, sold_at in rows:
+        product = products.get(code)
+        period = periods.get(timezone.localtime(sold_at, current_tz).date())
+        if product is None:
+            rejected.setdefault("كود المنتج غير معروف", []).append(pk)
+            continue
+        if period is None:
+            rejected.setdefault("لا توجد فترة لتاريخ البيع", []).append(pk)
+            continue
+        if period.is_closed:
+            rejected.setdefault("الفترة مقفلة", []).append(pk)
+            continue
+
+        entry = totals.setdefault((period.pk, product[0]), [Decimal("0"), Decimal("0")])
+        entry[0] += quantity
+        entry[1] += quantity * unit_price
+        by_period[period.pk] = period
+        folded.append(pk)
+
+    fallback_unit = None
+    for period_id, period in by_period.items():
+        summary, _ = SalesSummary.objects.get_or_create(period=period)
+        product_ids = {pid for (per_id, pid) in totals if per_id == period_id}
+
+        existing = {}
+        for line in SalesSummaryLine.objects.filter(summary=summary, product_id__in=product_ids).order_by("id"):
+            existing.setdefault(line.product_id, line)
+
+        to_create, to_update, to_delete = [], [], []
+        for product_id in product_ids:
+            quantity, amount = totals[(period_id, product_id)]
+            line = existing.get(product_id)
+            if line is not None:
+                quantity += line.quantity or 0
+                amount += line.line_total or 0
+            elif quantity <= 0:
+                continue
+
+            if quantity <= 0:
+                to_delete.append(line.pk)
+                continue
+
+            unit_price = (amount / quantity).quantize(Q4, rounding=ROUND_HALF_UP)
+            line_total = amount.quantize(Q2, rounding=ROUND_HALF_UP)
+            if line is None:
+                unit_id = base_units[product_id]
+                if unit_id is None:
+                    if fallback_unit is None:
+                        fallback_unit, _ = Unit.objects.get_or_create(
+                            name="وحدة", defaults={"abbreviation": "وحدة"}
+                        )
+                    unit_id = fallback_unit.pk
+                to_create.append(SalesSummaryLine(
+                    summary=summary, product_id=product_id, unit_id=unit_id,
+                    quantity=quantity, unit_price=unit_price, line_total=line_total,
+                ))
+            else:
+                line.quantity = quantity
+                line.unit_price = unit_price
+                line.line_total = line_total
+                to_update.append(line)
+
+        # الحفظ الجماعي لا يمر على SalesSummaryLine.save → نسجّل التغيير يدويًا
+        SalesSummaryLine.objects.filter(pk__in=to_delete).delete()
+        SalesSummaryLine.objects.bulk_update(to_update, ["quantity", "unit_price", "line_total"], batch_size=2000)
+        SalesSummaryLine.objects.bulk_create(to_create, batch_size=2000)
+        mark_consumption_changed(period_id, product_ids)
+        schedule_consumption_update(period)
+        result["products"] += len(product_ids)
+
+    now = timezone.now()
+    _update_status(folded, status=PosTicketLine.STATUS_FOLDED, folded_at=now, error="")
+    for error, ids in rejected.items():
+        _update_status(ids, status=PosTicketLine.STATUS_REJECTED, folded_at=now, error=error)
+
+    result["folded"] = len(folded)
+    result["rejected"] = sum(len(ids) for ids in rejected.values())
+    result["periods"] = len(by_period)
+    return result
+
+
+def fold_all_pending(batch_size=None):
+    """ترحيل كل المنتظر على دفعات؛ ترجع الإجماليات."""
+    total = {"folded": 0, "rejected": 0, "periods": 0, "products": 0}
+    while True:
+        result = fold_pos_lines(batch_size)
+        for key in total:
+            total[key] += result[key]
+        if not (result["folded"] or result["rejected"]):
+            return total
@@ -0,0 +1,97 @@
+# sales/signals.py
+"""
+عدادات مدخلات استهلاك المواد (sales/versioning.py) عند تعديل مصادرها:
+- سطور وملخصات المشتريات → purchases للفترة (والفترة السابقة عند نقل الملخص).
+- المواد الخام                → cost للفترات التي تستهلكها (+ materials).
+- الوصفات وبنودها، وتصنيف المنتجات (نصف مصنع / قابل للبيع) → bom للفترات
+  التي تبيع منتجًا يستخدم المنتج المعدّل.
+
+بنود المبيعات تزيد عدادها من mark_consumption_changed (sales/models.py).
+ملاحظة: bulk_create و QuerySet.update لا يرسلان إشارات؛ في هذه الحالات
+نستدعي bump_revision مباشرة.
+"""
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from costing.models import BillOfMaterial, BOMItem, Product, RawMaterial
+from purchases.models import PurchaseSummary, PurchaseSummaryLine
+
+from .versioning import bump_bom_revision, bump_cost_revision, bump_revision
+
+
+@receiver(post_save, sender=PurchaseSummaryLine)
+@receiver(post_delete, sender=PurchaseSummaryLine)
+def purchase_line_changed(sender, instance, **kwargs):
+    if kwargs.get("raw"):
+        return
+    period_id = (
+        PurchaseSummary.objects.filter(pk=instance.summary_id).values_list("period_id", flat=True).first()
+    )
+    bump_revision("purchases", [period_id])
+
+
+@receiver(pre_save, sender=PurchaseSummary)
+def purchase_summary_saving(sender, instance, **kwargs):
+    # الفترة القديمة تفقد سطور الملخص لو نُقل لفترة أخرى
+    if kwargs.get("raw") or instance.pk is None:
+        return
+    instance._old_period_id = (
+        PurchaseSummary.objects.filter(pk=instance.pk).values_list("period_id", flat=True).first()
+    )
+
+
+@receiver(post_save, sender=PurchaseSummary)
+@receiver(post_delete, sender=PurchaseSummary)
+def purchase_summary_changed(sender, instance, **kwargs):
+    if kwargs.get("raw"):
+        return
+    old_period_id = getattr(instance, "_old_period_id", instance.period_id)
+    bump_revision("purchases", {old_period_id, instance.period_id})
+
+
+@receiver(post_save, sender=RawMaterial)
+@receiver(post_delete, sender=RawMaterial)
+def raw_material_changed(sender, instance, **kwargs):
+    if kwargs.get("raw"):
+        return
+    bump_cost_revision([instance.pk])
+
+
+@receiver(post_save, sender=BillOfMaterial)
+@receiver(post_delete, sender=BillOfMaterial)
+def bom_changed(sender, instance, **kwargs):
+    if kwargs.get("raw"):
+        return
+    bump_bom_revision([instance.product_id])
+
+
+@receiver(post_save, sender=BOMItem)
+@receiver(post_delete, sender=BOMItem)
+def bom_item_changed(sender, instance, **kwargs):
+    if kwargs.get("raw"):
+        return
+    # حذف الوصفة نفسها (cascade): منتجها يصل من bom_changed
+    bump_bom_revision(
+        BillOfMaterial.objects.filter(pk=instance.bom_id).values_list("product_id", flat=True)
+    )
+
+
+@receiver(pre_save, sender=Product)
+def product_saving(sender, instance, **kwargs):
+    if kwargs.get("raw") or instance.pk is None:
+        return
+    instance._old_classification = (
+        Product.objects.filter(pk=instance.pk).values_list("is_semi_finished", "is_sellable").first()
+    )
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, instance, **kwargs):
+    # التصنيف فقط يغيّر نطاق التفكيك؛ الاسم والكود وغيرهما لا
+    if kwargs.get("raw"):
+        return
+    old = getattr(instance, "_old_classification", None)
+    if kwargs.get("signal") is post_save and old == (instance.is_semi_finished, instance.is_sellable):
+        return
+    bump_bom_revision([instance.pk])
@@ -1,3 +1,363 @@
-from django.test import TestCase
+import datetime
+import json
+import time
+from datetime import timedelta
+from decimal import ROUND_HALF_UP, Decimal as D
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from costing.models import BOMItem, Product
+from costing.tests import CatalogMixin
+from expenses.models import Period
+
+from .jobs import claim_next_job, heartbeat, requeue_stuck_jobs, run_job, run_pending
+from .versioning import consumption_version
+from .models import (
+    ConsumptionJob,
+    PosTicketLine,
+    SalesConsumption,
+    SalesConsumptionChange,
+    SalesConsumptionPath,
+    SalesSummary,
+    SalesSummaryLine,
+    build_consumption_rows,
+    generate_sales_consumption,
+    get_quantity_sold,
+    update_sales_consumption,
+)
+
+def nested_consumption(period):
+    """
+    generate_sales_consumption الأصلية (قبل جدول التفكيك) منقولة كما هي كمرجع:
+    تفكيك متداخل بـ get_active_bom و bom.items بدقة Decimal الكاملة بدون تقريب
+    وسيط، ثم التقريب لدقة الحقول المحفوظة فقط.
+    {(المنتج، المادة الخام): (الكمية المباعة، الكمية المستهلكة، تكلفة الوحدة، الإجمالي)}.
+    """
+    acc = {}
+
+    def add_raw(final_product, raw, sales_qty, qty_consumed):
+        if qty_consumed is None:
+            return
+        qty_consumed = D(qty_consumed)
+
+        unit_cost = raw.get_cost_per_ingredient_unit(period=period)
+
+        key = (final_product.id, raw.id)
+        if key not in acc:
+            acc[key] = {
+                "final_product": final_product,
+                "raw": raw,
+                "sales_qty": D(sales_qty or 0),
+                "qty": D("0"),
+                "unit_cost": unit_cost,
+            }
+
+        acc[key]["qty"] += qty_consumed
+
+    def collect(final_product, current_product, sales_qty, required_qty, visited=None):
+        if visited is None:
+            visited = set()
+
+        if current_product.id in visited:
+            return
+        visited.add(current_product.id)
+
+        bom = current_product.get_active_bom()
+        if not bom:
+            visited.remove(current_product.id)
+            return
+
+        bom_output_qty = bom.batch_output_quantity or D("1")
+
+        for item in bom.items.all():
+            base_qty = item.quantity or D("0")
+
+            # كمية البند لكل 1 وحدة من current_product
+            qty_per_unit = base_qty / bom_output_qty
+
+            # الكمية الإجمالية المطلوبة من هذا البند
+            qty_total = D(required_qty) * qty_per_unit
+
+            if item.raw_material:
+                add_raw(final_product, item.raw_material, sales_qty, qty_total)
+
+            elif item.component_product and item.component_product.is_semi_finished:
+                collect(
+                    final_product=final_product,
+                    current_product=item.component_product,
+                    sales_qty=sales_qty,
+                    required_qty=qty_total,
+                    visited=visited
+                )
+
+        visited.remove(current_product.id)
+
+    for final_product in Product.objects.filter(is_sellable=True):
+        sales_qty = get_quantity_sold(final_product, period)
+        if sales_qty and D(sales_qty) > 0:
+            collect(
+                final_product=final_product,
+                current_product=final_product,
+                sales_qty=sales_qty,
+                required_qty=sales_qty,
+                visited=set()
+            )
+
+    result = {}
+    for key, v in acc.items():
+        qty = v["qty"]
+        unit_cost = v["raw"].get_cost_per_ingredient_unit(period=period)
+        total_cost = (unit_cost * qty) if unit_cost is not None else None
+        result[key] = tuple(
+            stored(name, value)
+            for name, value in (
+                ("quantity_sold", v["sales_qty"]),
+                ("quantity_consumed", qty),
+                ("unit_cost", unit_cost),
+                ("total_cost", total_cost),
+            )
+        )
+    return result
+
+
+def stored(name, value):
+    """القيمة كما تُحفظ في حقل SalesConsumption (numeric يقرّب half-up)."""
+    if value is None:
+        return None
+    places = SalesConsumption._meta.get_field(name).decimal_places
+    return D(value).quantize(D(1).scaleb(-places), rounding=ROUND_HALF_UP)
+
+
+def consumption_values(rows):
+    return {
+        (row.product_id, row.raw_material_id): tuple(
+            stored(name, getattr(row, name))
+            for name in ("quantity_sold", "quantity_consumed", "unit_cost", "total_cost")
+        )
+        for row in rows
+    }
+
+
+class SalesFixtureMixin(CatalogMixin):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.summary = SalesSummary.objects.create(period=cls.jan)
+            for product, qty in (
+                (cls.pizza, "12.5"), (cls.pizza, "7.3333"), (cls.pie, "3"), (cls.drink, "4"),
+            ):
+                SalesSummaryLine.objects.create(
+                    summary=cls.summary, product=product, unit=cls.g, quantity=D(qty), unit_price=D("10"),
+                )
+
+
+class ConsumptionBuildTests(SalesFixtureMixin, TestCase):
+    def test_rows_match_nested_explosion(self):
+        expected = nested_consumption(self.jan)
+        self.assertIn((self.pizza.pk, self.flour.pk), expected)
+
+        rows = build_consumption_rows(self.jan)
+        self.assertEqual(len(rows), len(expected))
+        self.assertEqual(consumption_values(rows), expected)
+
+    def test_generated_rows_match_nested_explosion(self):
+        generate_sales_consumption(self.jan)
+        saved = SalesConsumption.objects.filter(period=self.jan)
+        self.assertEqual(consumption_values(saved), nested_consumption(self.jan))
+
+
+class ConsumptionDeltaTests(SalesFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        generate_sales_consumption(self.jan)
+
+    def saved_state(self):
+        rows = consumption_values(SalesConsumption.objects.filter(period=self.jan))
+        paths = set(
+            SalesConsumptionPath.objects.filter(consumption__period=self.jan).values_list(
+                "consumption__product_id", "consumption__raw_material_id", "path_id",
+                "quantity_consumed", "total_cost",
+            )
+        )
+        return rows, paths
+
+    def assert_delta_matches_full(self):
+        self.assertTrue(SalesConsumptionChange.objects.filter(period=self.jan).exists())
+        update_sales_consumption(self.jan)
+        self.assertFalse(SalesConsumptionChange.objects.filter(period=self.jan).exists())
+        delta = self.saved_state()
+
+        generate_sales_consumption(self.jan)
+        self.assertEqual(delta, self.saved_state())
+        self.assertEqual(delta[0], nested_consumption(self.jan))
+
+    def test_edit_add_and_delete_lines(self):
+        line = SalesSummaryLine.objects.filter(product=self.pizza).first()
+        line.quantity = D("40.125")
+        line.save()
+        SalesSummaryLine.objects.filter(product=self.pie).delete()
+        SalesSummaryLine.objects.create(
+            summary=self.summary, product=self.pie, unit=self.g, quantity=D("0.5"), unit_price=D("10"),
+        )
+        SalesSummaryLine.objects.filter(product=self.drink).delete()
+        self.assert_delta_matches_full()
+
+    def test_product_sold_out(self):
+        SalesSummaryLine.objects.filter(product=self.pie).delete()
+        self.assert_delta_matches_full()
+        self.assertFalse(SalesConsumption.objects.filter(period=self.jan, product=self.pie).exists())
+
+    def test_bulk_update(self):
+        SalesSummaryLine.objects.filter(product=self.pizza).update(quantity=D("2.2222"))
+        self.assert_delta_matches_full()
+
+
+class ConsumptionVersionTests(SalesFixtureMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        with cls.captureOnCommitCallbacks(execute=True):
+            # فبراير: مشروب فقط (بدون وصفة)
+            summary = SalesSummary.objects.create(period=cls.feb)
+            SalesSummaryLine.objects.create(
+                summary=summary, product=cls.drink, unit=cls.g, quantity=D("2"), unit_price=D("10"),
+            )
+        for period in (cls.jan, cls.feb):
+            generate_sales_consumption(period)
+
+    def changed(self):
+        return {period.month: consumption_version(period)["changed"] for period in (self.jan, self.feb)}
+
+    def test_bom_edit_marks_only_periods_selling_affected_products(self):
+        self.assertEqual(self.changed(), {1: [], 2: []})
+        item = BOMItem.objects.get(bom__product=self.dough, raw_material=self.salt)
+        item.quantity = D("31")
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+        self.assertEqual(self.changed(), {1: ["bom"], 2: []})
+
+    def test_raw_material_edit_marks_only_periods_consuming_it(self):
+        self.sugar.purchase_price_per_storage_unit = D("8")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sugar.save()
+        self.assertEqual(self.changed(), {1: ["cost"], 2: []})
+
+        generate_sales_consumption(self.jan)
+        self.assertEqual(self.changed(), {1: [], 2: []})
+
+
+class ConsumptionJobTests(SalesFixtureMixin, TestCase):
+    def test_save_queues_by_default(self):
+        ConsumptionJob.objects.all().delete()
+        self.summary.save()
+        job = ConsumptionJob.objects.get()
+        self.assertEqual((job.period_id, job.status), (self.jan.pk, ConsumptionJob.STATUS_PENDING))
+        self.assertFalse(SalesConsumption.objects.filter(period=self.jan).exists())
+
+        [job] = run_pending()
+        self.assertEqual(job.status, ConsumptionJob.STATUS_DONE, job.error)
+        self.assertEqual(
+            consumption_values(SalesConsumption.objects.filter(period=self.jan)), nested_consumption(self.jan)
+        )
+
+    @override_settings(SALES_CONSUMPTION_ASYNC=False)
+    def test_save_updates_directly_when_async_disabled(self):
+        ConsumptionJob.objects.all().delete()
+        self.summary.save()
+        self.assertFalse(ConsumptionJob.objects.exists())
+        self.assertTrue(SalesConsumption.objects.filter(period=self.jan).exists())
+
+    def test_requeue_only_jobs_without_heartbeat(self):
+        ConsumptionJob.objects.create(period=self.feb)
+        dead, alive = claim_next_job(), claim_next_job()
+        old = timezone.now() - timedelta(hours=1)
+        ConsumptionJob.objects.filter(pk=dead.pk).update(heartbeat_at=old)
+        # بدأت منذ ساعة لكن العامل ما زال ينبض
+        ConsumptionJob.objects.filter(pk=alive.pk).update(started_at=old)
+
+        self.assertEqual(requeue_stuck_jobs(timeout=60), 1)
+        dead.refresh_from_db()
+        alive.refresh_from_db()
+        self.assertEqual(
+            (dead.status, dead.started_at, alive.status),
+            (ConsumptionJob.STATUS_PENDING, None, ConsumptionJob.STATUS_RUNNING),
+        )
+
+    def test_requeued_job_result_not_written_by_old_worker(self):
+        job = claim_next_job()
+        ConsumptionJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        requeue_stuck_jobs(timeout=60)
+
+        run_job(job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.finished_at), (ConsumptionJob.STATUS_PENDING, None))
+
+
+class JobHeartbeatTests(TransactionTestCase):
+    def test_heartbeat_updates_running_job(self):
+        period = Period.objects.create(
+            year=2025, month=1, name="P1",
+            start_date=datetime.date(2025, 1, 1), end_date=datetime.date(2025, 1, 28),
+        )
+        started = timezone.now() - timedelta(hours=1)
+        job = ConsumptionJob.objects.create(
+            period=period, status=ConsumptionJob.STATUS_RUNNING, started_at=started, heartbeat_at=started,
+        )
+        with heartbeat(ConsumptionJob.objects.filter(pk=job.pk), interval=0.05):
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline:
+                job.refresh_from_db()
+                if job.heartbeat_at > started:
+                    break
+                time.sleep(0.05)
+        self.assertGreater(job.heartbeat_at, started)
+        self.assertEqual(requeue_stuck_jobs(timeout=60), 0)
+
+
+@override_settings(SALES_POS_INGEST_TOKEN="pos-token")
+class PosIngestTests(TestCase):
+    def send(self, *lines, token="pos-token"):
+        headers = {"HTTP_AUTHORIZATION": f"Bearer {token}"} if token else {}
+        return self.client.post(
+            reverse("sales_pos_ingest"),
+            "\n".join(json.dumps(line) for line in lines),
+            content_type="text/plain",
+            **headers,
+        )
+
+    def line(self, line_no=None, **extra):
+        data = {"ticket_id": "T1", "product_code": "pizza", "quantity": 1, "sold_at": "2025-01-05T12:00:00+00:00"}
+        if line_no is not None:
+            data["line_no"] = line_no
+        return {**data, **extra}
+
+    def test_staff_session_without_token_rejected(self):
+        staff = get_user_model().objects.create_user("staff", password="x", is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.send(self.line(1), token=None).status_code, 401)
+        self.assertEqual(self.send(self.line(1), token="wrong").status_code, 401)
+        self.assertFalse(PosTicketLine.objects.exists())
+
+    @override_settings(SALES_POS_INGEST_TOKEN="")
+    def test_empty_token_disables_endpoint(self):
+        self.assertEqual(self.send(self.line(1), token="").status_code, 401)
+
+    def test_missing_line_no_rejected(self):
+        data = self.send(self.line(1), self.line(), self.line(True)).json()
+        self.assertEqual((data["accepted"], data["invalid"]), (1, 2))
+        self.assertEqual([e["line"] for e in data["errors"]], [2, 3])
+        self.assertEqual(self.send(self.line()).status_code, 400)
+
+    def test_ticket_split_across_requests_is_idempotent(self):
+        first = self.send(self.line(1), self.line(2, quantity=2)).json()
+        second = self.send(self.line(2, quantity=2), self.line(3, quantity=3)).json()
+        self.assertEqual((first["accepted"], first["duplicates"]), (2, 0))
+        self.assertEqual((second["accepted"], second["duplicates"]), (1, 1))
+        self.assertEqual(
+            list(PosTicketLine.objects.order_by("line_no").values_list("line_no", "quantity")),
+            [(1, D("1")), (2, D("2")), (3, D("3"))],
+        )
@@ -0,0 +1,8 @@
+# sales/urls.py
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    # استقبال تذاكر نقاط البيع (NDJSON)
+    path("api/pos/ingest/", views.pos_ingest, name="sales_pos_ingest"),
+]
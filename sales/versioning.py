@@ -0,0 +1,226 @@
+# sales/versioning.py
+"""
+نسخة بيانات استهلاك المواد لكل فترة (هل SalesConsumption محدّث؟).
+
+كل مُدخل له عدّاد مراجعات لكل فترة (ConsumptionInputRevision) يزيد بعد commit
+أي تعديل عليه يمس الفترة:
+- sales: بنود مبيعات الفترة (mark_consumption_changed).
+- purchases: سطور وملخصات المشتريات؛ نسخة الفترة = مجموع عدادات
+  الفترات التي تبدأ قبلها أو معها (نفس نطاق RawCostIndex).
+- bom: الوصفات وبنودها وتصنيف المنتجات (نصف مصنع / قابل للبيع)؛ فقط الفترات
+  التي فيها مبيعات لمنتج يستخدم المنتج المعدّل بأي مستوى (bump_bom_revision).
+- cost: بيانات المواد الخام (معاملات التحويل / الأسعار المخزنة)؛ فقط الفترات التي
+  فيها مبيعات لمنتج في تفكيكه المادة المعدّلة (bump_cost_revision) + مشتريات الفترة.
+  الفترة المقفلة تعتمد على لقطة الإقفال فقط.
+- materials (عام، خارج نسخة الاستهلاك): أي تعديل على المواد الخام؛ لتكلفة بنود
+  الجرد (كل المواد) في portal/api.py.
+
+الإشارات في sales/signals.py تزيد العدادات؛ المسارات الجماعية التي لا ترسل إشارات
+تستدعي bump_revision بنفسها. تحديد الفترات المتأثرة بالوصفات / المواد يتم بعد
+الـ commit مرة واحدة لكل المعاملة.
+
+عند التوليد تُحفظ النسخ في SalesConsumptionSummary (حقول <name>_version)؛
+consumption_version(period) تقارنها بالعدادات الحالية باستعلامين بدون قراءة البيانات.
+"""
+import threading
+from functools import partial
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+
+# المدخلات المحفوظة مع كل توليد (حقول <name>_version)
+INPUTS = ("sales", "purchases", "bom", "cost")
+
+LABELS = {
+    "sales": "المبيعات",
+    "purchases": "المشتريات",
+    "bom": "الوصفات",
+    "cost": "تكاليف المواد",
+}
+
+
+# --------------------------------------------------------
+# العدادات
+# --------------------------------------------------------
+_pending = threading.local()
+
+
+def _periods_selling(product_ids):
+    """الفترات التي فيها مبيعات لأي من product_ids."""
+    from .models import SalesSummaryLine
+
+    if not product_ids:
+        return set()
+    return set(
+        SalesSummaryLine.objects.filter(product_id__in=list(product_ids))
+        .values_list("summary__period_id", flat=True).distinct()
+    )
+
+
+def _products_using(product_ids):
+    """product_ids + المنتجات التي تستخدمها بأي مستوى (عبر الوصفات الفعّالة)."""
+    from costing.graph import affected_boms
+    from costing.models import BillOfMaterial
+
+    boms = affected_boms(product_ids=product_ids)
+    return set(product_ids) | set(
+        BillOfMaterial.objects.filter(pk__in=list(boms)).values_list("product_id", flat=True)
+    )
+
+
+def _products_consuming(raw_ids):
+    """المنتجات التي في تفكيك استهلاكها raw_ids (جدول BOMExplosion)."""
+    from costing.models import BOMExplosion
+
+    return set(
+        BOMExplosion.objects.filter(raw_material_id__in=list(raw_ids), only_semi_path=True)
+        .values_list("product_id", flat=True).distinct()
+    )
+
+
+def _flush_pending(state):
+    from .models import ConsumptionInputRevision
+
+    if getattr(_pending, "state", None) is state:
+        _pending.state = None
+    keys = set(state["keys"])
+    if state["products"]:
+        keys |= {("bom", period_id) for period_id in _periods_selling(_products_using(state["products"]))}
+    if state["raws"]:
+        keys |= {("cost", period_id) for period_id in _periods_selling(_products_consuming(state["raws"]))}
+
+    for name, period_id in sorted(keys, key=lambda k: (k[0], k[1] or 0)):
+        qs = ConsumptionInputRevision.objects.filter(name=name, period_id=period_id)
+        if qs.update(revision=F("revision") + 1):
+            continue
+        try:
+            with transaction.atomic():
+                ConsumptionInputRevision.objects.create(name=name, period_id=period_id, revision=1)
+        except IntegrityError:
+            # أنشأه طلب آخر في نفس اللحظة
+            qs.update(revision=F("revision") + 1)
+
+
+def _pending_state():
+    """
+    التعديلات المنتظرة للمعاملة الحالية: تُجمع وتُنفّذ مرة واحدة بعد الـ commit
+    (أو فورًا بدون معاملة).
+    """
+    state = getattr(_pending, "state", None)
+    if state is not None and _queued(state):
+        return state
+    # أول تعديل في المعاملة، أو التي قبلها تم التراجع عنها (وحُذف تسجيلها معها)
+    state = _pending.state = {"keys": set(), "products": set(), "raws": set()}
+    transaction.on_commit(partial(_flush_pending, state))
+    return state
+
+
+def _queued(state):
+    """الحالة مسجّلة في on_commit للمعاملة الحالية."""
+    return any(
+        isinstance(func, partial) and func.args and func.args[0] is state
+        for _, func, _ in transaction.get_connection().run_on_commit
+    )
+
+
+def bump_revision(name, period_ids=(None,)):
+    """تسجيل تعديل على مُدخل لفترات معيّنة (أو None للعداد العام)؛ مرة واحدة لكل مفتاح."""
+    state = _pending_state()
+    state["keys"].update((name, period_id) for period_id in period_ids)
+
+
+def bump_bom_revision(product_ids):
+    """تعديل وصفة / تصنيف منتجات product_ids: الفترات المتأثرة تُحدد بعد الـ commit."""
+    _pending_state()["products"].update(pid for pid in product_ids if pid is not None)
+
+
+def bump_cost_revision(raw_ids):
+    """تعديل بيانات مواد خام: الفترات المتأثرة تُحدد بعد الـ commit."""
+    state = _pending_state()
+    state["raws"].update(raw_id for raw_id in raw_ids if raw_id is not None)
+    state["keys"].add(("materials", None))
+
+
+def _revisions(period):
+    """{(name, period_id): revision} لكل العدادات التي تدخل في نسخة الفترة (استعلام واحد)."""
+    from .models import ConsumptionInputRevision
+
+    scope = Q(period__isnull=True) | Q(period_id=period.pk)
+    if getattr(period, "start_date", None):
+        scope |= Q(name="purchases", period__start_date__lte=period.start_date)
+    return {
+        (name, period_id): revision
+        for name, period_id, revision in ConsumptionInputRevision.objects.filter(scope).values_list(
+            "name", "period_id", "revision"
+        )
+    }
+
+
+def data_version(period, only=INPUTS):
+    """
+    {"sales": ..., "purchases": ..., "bom": ..., "cost": ...} (أو المطلوب فقط).
+    "materials": نسخة تكلفة كل المواد الخام للفترة (ليست ضمن INPUTS).
+    """
+    from costing.snapshots import get_snapshot
+
+    revisions = _revisions(period)
+    purchases = sum(rev for (name, _), rev in revisions.items() if name == "purchases")
+    snapshot = get_snapshot(period)
+
+    compute = {
+        "sales": lambda: f"r{revisions.get(('sales', period.pk), 0)}",
+        "purchases": lambda: f"r{purchases}",
+        "bom": lambda: f"r{revisions.get(('bom', period.pk), 0)}",
+        "cost": lambda: (
+            f"s{snapshot.pk}" if snapshot is not None
+            else f"r{revisions.get(('cost', period.pk), 0)}.{purchases}"
+        ),
+        "materials": lambda: (
+            f"s{snapshot.pk}" if snapshot is not None
+            else f"r{revisions.get(('materials', None), 0)}.{purchases}"
+        ),
+    }
+    return {name: compute[name]() for name in only}
+
+
+# --------------------------------------------------------
+# الحفظ والمقارنة
+# --------------------------------------------------------
+def store_version(summary, version):
+    """حفظ النسخ (كلها أو بعضها) على SalesConsumptionSummary."""
+    from django.utils import timezone
+
+    fields = []
+    for name, value in version.items():
+        setattr(summary, f"{name}_version", value)
+        fields.append(f"{name}_version")
+    summary.versioned_at = timezone.now()
+    summary.save(update_fields=fields + ["versioned_at"])
+
+
+def consumption_version(period):
+    """
+    {"current": bool, "changed": [أسماء المدخلات المختلفة], "changed_labels": [...],
+     "versioned_at": ...}
+    الفترة بدون استهلاك مولّد: محدّثة فقط لو ليس لها مبيعات.
+    """
+    from .models import SalesConsumptionSummary, SalesSummaryLine
+
+    summary = SalesConsumptionSummary.objects.filter(period=period).first()
+    if summary is None:
+        has_sales = SalesSummaryLine.objects.filter(summary__period=period).exists()
+        changed = list(INPUTS) if has_sales else []
+    else:
+        current = data_version(period)
+        changed = [name for name in INPUTS if getattr(summary, f"{name}_version") != current[name]]
+
+    return {
+        "current": not changed,
+        "changed": changed,
+        "changed_labels": [LABELS[name] for name in changed],
+        "versioned_at": summary.versioned_at.isoformat() if summary and summary.versioned_at else None,
+    }
+
+
+def is_consumption_current(period):
+    return consumption_version(period)["current"]
@@ -0,0 +1,53 @@
+# sales/views.py
+import hmac
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from .pos import TooManyLines, ingest_ticket_lines, parse_ndjson
+
+
+def _pos_authorized(request):
+    """
+    Authorization: Bearer <SALES_POS_INGEST_TOKEN> فقط؛ بدون رمز مضبوط الواجهة مغلقة.
+    جلسة المستخدم لا تكفي: الواجهة بدون CSRF فأي صفحة خارجية تقدر ترسل بكوكيز المدير.
+    """
+    token = getattr(settings, "SALES_POS_INGEST_TOKEN", "")
+    header = request.headers.get("Authorization", "")
+    if not token or not header.startswith("Bearer "):
+        return False
+    return hmac.compare_digest(header[len("Bearer "):].strip().encode(), token.encode())
+
+
+@csrf_exempt
+@require_POST
+def pos_ingest(request):
+    """
+    استقبال سطور تذاكر نقاط البيع بصيغة NDJSON (سطر JSON لكل بند):
+    {"ticket_id": "...", "line_no": 1, "product_code": "...", "quantity": 2,
+     "unit_price": 15.5, "sold_at": "2026-01-05T13:45:00+02:00"}
+
+    الجسم يُقرأ سطرًا سطرًا (بدون تحميله كاملًا)؛ السطور تُحفظ في الجدول المرحلي فقط
+    ويرحّلها fold_pos_sales لاحقًا. إعادة الإرسال آمنة (تُحسب كمكرر)؛ line_no مطلوب لكل سطر.
+    """
+    if not _pos_authorized(request):
+        return JsonResponse({"ok": False, "error": "غير مصرح"}, status=401)
+
+    try:
+        records, errors = parse_ndjson(request, max_lines=getattr(settings, "SALES_POS_MAX_LINES", 100000))
+    except TooManyLines as exc:
+        return JsonResponse({"ok": False, "error": str(exc)}, status=413)
+    if not records and errors:
+        return JsonResponse({"ok": False, "error": "لا توجد سطور صالحة", "errors": errors[:100]}, status=400)
+
+    result = ingest_ticket_lines(records)
+    return JsonResponse({
+        "ok": True,
+        "received": len(records) + len(errors),
+        "accepted": result["accepted"],
+        "duplicates": result["duplicates"],
+        "invalid": len(errors),
+        "errors": errors[:100],
+    })